@@ -84,7 +84,7 @@ class BERTMaskedWordPieceDataset(MaskedWordPieceDataset):
             Dict[str, Union[int, numpy.ndarray]]: The
         """
         idx_beg, idx_end, target_sequence_length = self.sample_index[idx]
-        sample = [self.dataset[i] for i in range(idx_beg, idx_end)]
+        sample = self.dataset[idx_beg:idx_end]
         numpy_random_state = numpy.random.RandomState(seed=(self.config.random_seed + idx) % 2**32)
 
         assert target_sequence_length <= self.config.sequence_length
@@ -98,37 +98,41 @@ class BERTMaskedWordPieceDataset(MaskedWordPieceDataset):
             if len(sample) >= 3:
                 pivot = numpy_random_state.randint(low=1, high=len(sample))
             is_next_random = numpy_random_state.random() < 0.5
-        split_A = []
-        for sample_a in sample[:pivot]:
-            split_A.extend(sample_a)
-        split_B = []
-        for sample_b in sample[pivot:]:
-            split_B.extend(sample_b)
+        split_A = numpy.concatenate([numpy.zeros(0, dtype=numpy.int64), *sample[:pivot]])
+        split_B = numpy.concatenate([numpy.zeros(0, dtype=numpy.int64), *sample[pivot:]])
         if is_next_random:
             split_A, split_B = split_B, split_A
 
         # Trim the subsegments from either end to a desired joint length
         length_A = len(split_A)
         length_B = len(split_B)
-        if length_A + length_B <= target_sequence_length:
-            truncated = False
-        else:
-            while length_A + length_B > target_sequence_length:
-                split = split_A if length_A > length_B else split_B
-                if numpy_random_state.random() < 0.5:
-                    del split[0]
-                else:
-                    del split[-1]
-                length_A = len(split_A)
-                length_B = len(split_B)
-            truncated = True
+        n_trims = length_A + length_B - target_sequence_length
+        truncated = n_trims > 0
+        if truncated:
+            # Each trim draws once from the random state and applies to the longer subsegment, or
+            # to B on a tie. So the longer subsegment is trimmed until the lengths meet, after
+            # which the trims alternate between B and A.
+            trim_is_front = numpy_random_state.random(n_trims) < 0.5
+            n_trims_to_meet = min(abs(length_A - length_B), n_trims)
+            trim_is_A = numpy.empty(n_trims, dtype=bool)
+            trim_is_A[:n_trims_to_meet] = length_A > length_B
+            trim_is_A[n_trims_to_meet:] = numpy.arange(n_trims - n_trims_to_meet) % 2 == 1
+            trims_front_A = int(numpy.count_nonzero(trim_is_A & trim_is_front))
+            trims_back_A = int(numpy.count_nonzero(trim_is_A & ~trim_is_front))
+            trims_front_B = int(numpy.count_nonzero(~trim_is_A & trim_is_front))
+            trims_back_B = int(numpy.count_nonzero(~trim_is_A & ~trim_is_front))
+            split_A = split_A[trims_front_A : length_A - trims_back_A]
+            split_B = split_B[trims_front_B : length_B - trims_back_B]
 
         # Merge the subsegments and create the token assignment labels
-        tokens = [self.config.tokenizer.cls, *split_A, self.config.tokenizer.sep]
-        assignments = [0 for _ in range(1 + len(split_A) + 1)]
-        if split_B:
-            tokens += [*split_B, self.config.tokenizer.sep]
-            assignments += [1 for _ in range(len(split_B) + 1)]
+        cls = numpy.array([self.config.tokenizer.cls], dtype=numpy.int64)
+        sep = numpy.array([self.config.tokenizer.sep], dtype=numpy.int64)
+        tokens = [cls, split_A, sep]
+        if len(split_B) > 0:
+            tokens += [split_B, sep]
+        tokens = numpy.concatenate(tokens).astype(numpy.int64, copy=False)
+        assignments = numpy.zeros(len(tokens), dtype=numpy.int64)
+        assignments[len(split_A) + 2 :] = 1
 
         # Masking
         tokens, masked_positions, masked_labels, _, _ = self._create_masked_lm_predictions(
@@ -140,10 +144,8 @@ class BERTMaskedWordPieceDataset(MaskedWordPieceDataset):
         length_pads = self.config.sequence_length - length_toks
         assert length_pads >= 0
 
-        tokens = numpy.array(tokens, dtype=numpy.int64)
         tokens = numpy.pad(tokens, (0, length_pads), constant_values=self.config.tokenizer.pad)
 
-        assignments = numpy.array(assignments, dtype=numpy.int64)
         assignments = numpy.pad(
             assignments, (0, length_pads), constant_values=self.config.tokenizer.pad
         )
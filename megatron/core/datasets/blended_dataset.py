@@ -12,8 +12,9 @@ import numpy
 import torch
 
 from megatron.core.datasets.blended_megatron_dataset_config import BlendedMegatronDatasetConfig
+from megatron.core.datasets.indices_file import IndicesFile, write_indices_file
 from megatron.core.datasets.megatron_dataset import MegatronDataset
-from megatron.core.datasets.utils import normalize
+from megatron.core.datasets.utils import atomic_write_path, normalize
 from megatron.core.utils import log_single_rank
 
 logger = logging.getLogger(__name__)
@@ -85,16 +86,101 @@ class BlendedDataset(torch.utils.data.Dataset):
 
         self.built_anew_on_cache_miss = False
 
-        self.dataset_index, self.dataset_sample_index = self._build_indices()
+        self.closed_form_index = None
+        if self.config.closed_form_blending and self.size is not None:
+            log_single_rank(
+                logger, logging.INFO, f"Compute the {type(self).__name__} indices in closed form"
+            )
+            self.built_anew_on_cache_miss = True
+            self.closed_form_index = _ClosedFormBlendingIndex(self.weights, self.size)
+            self.dataset_index, self.dataset_sample_index = None, None
+        else:
+            self.dataset_index, self.dataset_sample_index = self._build_indices()
 
     def __len__(self) -> int:
+        if self.closed_form_index is not None:
+            return self.size
         return self.dataset_index.shape[0]
 
     def __getitem__(self, idx: int) -> Dict[str, Union[int, numpy.ndarray]]:
-        dataset_id = self.dataset_index[idx]
-        dataset_sample_id = self.dataset_sample_index[idx]
+        dataset_id, dataset_sample_id = self._get_dataset_and_sample_ids(idx)
         return {"dataset_id": dataset_id, **self.datasets[dataset_id][dataset_sample_id]}
 
+    def __getitems__(self, indices: List[int]) -> List[Dict[str, Union[int, numpy.ndarray]]]:
+        """Get a batch of samples, querying each blended dataset once for all of its samples
+
+        If the indices have an `upcoming` attribute, the samples at those indices are prefetched
+        once the batch is read, see `GPTDataset.__getitems__`.
+
+        Args:
+            indices (List[int]): The indices into the dataset
+
+        Returns:
+            List[Dict[str, Union[int, numpy.ndarray]]]: The samples, in the order of the indices
+        """
+        dataset_ids, dataset_sample_ids = self._get_dataset_and_sample_ids(indices)
+        samples = [None] * len(indices)
+        for dataset_id in numpy.unique(dataset_ids):
+            positions = numpy.flatnonzero(dataset_ids == dataset_id)
+            dataset = self.datasets[dataset_id]
+            sample_ids = dataset_sample_ids[positions].tolist()
+            if hasattr(dataset, "__getitems__"):
+                dataset_samples = dataset.__getitems__(sample_ids)
+            else:
+                dataset_samples = [dataset[sample_id] for sample_id in sample_ids]
+            for position, sample in zip(positions, dataset_samples):
+                samples[position] = {"dataset_id": dataset_ids[position], **sample}
+        upcoming = getattr(indices, "upcoming", None)
+        if upcoming:
+            self.prefetch(upcoming)
+        return samples
+
+    @property
+    def benefits_from_prefetch(self) -> bool:
+        """Whether `prefetch` hints speed up the reads of any of the datasets
+
+        Returns:
+            bool: Whether any dataset acts on the hints
+        """
+        return any(getattr(dataset, "benefits_from_prefetch", False) for dataset in self.datasets)
+
+    def prefetch(self, indices: List[int]) -> None:
+        """Hint that the samples at the given indices will be read soon
+
+        Args:
+            indices (List[int]): The indices into the dataset, in order of upcoming use
+        """
+        dataset_ids, dataset_sample_ids = self._get_dataset_and_sample_ids(indices)
+        for dataset_id in numpy.unique(dataset_ids):
+            dataset = self.datasets[dataset_id]
+            if hasattr(dataset, "prefetch"):
+                dataset.prefetch(dataset_sample_ids[dataset_ids == dataset_id].tolist())
+
+    def get_dataset_sample_counts(self) -> numpy.ndarray:
+        """Get the number of samples the blend draws from each dataset
+
+        Returns:
+            numpy.ndarray: The number of samples per dataset
+        """
+        if self.closed_form_index is not None:
+            return self.closed_form_index.get_sample_counts()
+        return numpy.bincount(self.dataset_index, minlength=len(self.datasets))
+
+    def _get_dataset_and_sample_ids(
+        self, indices: Union[int, List[int], numpy.ndarray]
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Get the dataset id and the dataset sample id at each index
+
+        Args:
+            indices (Union[int, List[int], numpy.ndarray]): The index or indices into the dataset
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray]: The dataset ids and the dataset sample ids
+        """
+        if self.closed_form_index is not None:
+            return self.closed_form_index[indices]
+        return self.dataset_index[indices], self.dataset_sample_index[indices]
+
     def _build_indices(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
         """Build and optionally cache the dataset index and the dataset sample index
 
@@ -113,18 +199,21 @@ class BlendedDataset(torch.utils.data.Dataset):
                 f"{self.unique_description_hash}-{type(self).__name__}-{self.split.name}-{suffix}",
             )
             path_to_description = get_path_to("description.txt")
+            path_to_indices = get_path_to("indices.bin")
             path_to_dataset_index = get_path_to("dataset_index.npy")
             path_to_dataset_sample_index = get_path_to("dataset_sample_index.npy")
-            cache_hit = all(
-                map(
-                    os.path.isfile,
-                    [path_to_description, path_to_dataset_index, path_to_dataset_sample_index],
-                )
-            )
+            if self.config.consolidate_cached_indices:
+                paths_to_indices = [path_to_indices]
+            else:
+                paths_to_indices = [path_to_dataset_index, path_to_dataset_sample_index]
+            cache_hit = all(map(os.path.isfile, [path_to_description] + paths_to_indices))
         else:
             cache_hit = False
 
-        if not path_to_cache or (not cache_hit and torch.distributed.get_rank() == 0):
+        if not path_to_cache or (
+            not cache_hit
+            and (not torch.distributed.is_initialized() or torch.distributed.get_rank() == 0)
+        ):
             log_single_rank(
                 logger, logging.INFO, f"Build and save the {type(self).__name__} indices"
             )
@@ -159,11 +248,24 @@ class BlendedDataset(torch.utils.data.Dataset):
             if path_to_cache:
                 os.makedirs(path_to_cache, exist_ok=True)
                 # Write the description
-                with open(path_to_description, "wt") as writer:
-                    writer.write(self.unique_description)
+                with atomic_write_path(path_to_description) as path:
+                    with open(path, "wt") as writer:
+                        writer.write(self.unique_description)
                 # Save the indexes
-                numpy.save(path_to_dataset_index, dataset_index, allow_pickle=True)
-                numpy.save(path_to_dataset_sample_index, dataset_sample_index, allow_pickle=True)
+                if self.config.consolidate_cached_indices:
+                    with atomic_write_path(path_to_indices) as path:
+                        write_indices_file(
+                            path,
+                            {
+                                "dataset_index": dataset_index,
+                                "dataset_sample_index": dataset_sample_index,
+                            },
+                        )
+                else:
+                    with atomic_write_path(path_to_dataset_index) as path:
+                        numpy.save(path, dataset_index, allow_pickle=True)
+                    with atomic_write_path(path_to_dataset_sample_index) as path:
+                        numpy.save(path, dataset_sample_index, allow_pickle=True)
             else:
                 log_single_rank(
                     logger,
@@ -178,6 +280,11 @@ class BlendedDataset(torch.utils.data.Dataset):
 
         log_single_rank(logger, logging.INFO, f"Load the {type(self).__name__} indices")
 
+        if self.config.consolidate_cached_indices:
+            log_single_rank(logger, logging.INFO, f"\tMap the indices from {path_to_indices}")
+            indices = IndicesFile(path_to_indices)
+            return indices["dataset_index"], indices["dataset_sample_index"]
+
         log_single_rank(
             logger, logging.INFO, f"\tLoad the dataset index from {path_to_dataset_index}"
         )
@@ -199,3 +306,135 @@ class BlendedDataset(torch.utils.data.Dataset):
         log_single_rank(logger, logging.DEBUG, f"\t> time elapsed: {t_end - t_beg:4f} seconds")
 
         return dataset_index, dataset_sample_index
+
+
+class _ClosedFormBlendingIndex(object):
+    """The dataset index and dataset sample index of a blend, computed on the fly
+
+    The k-th sample of dataset d is assigned the key (k + 0.5) / w_d, where w_d is the weight of
+    dataset d, and the blend draws the samples of all datasets in ascending order of (key, d). Over
+    any prefix of the blend, every dataset then contributes its weighted share of the samples to
+    within a fraction of the number of datasets, as with helpers.build_blending_indices.
+
+    The number of keys of dataset d no greater than t is about t * w_d + 0.5, so the i-th key of
+    the blend lies within a window of about the number of datasets around i / sum(w). Index i is
+    found by counting the keys before the window in closed form and ordering the few keys within
+    it. A lookup takes O(D log D) time and the object O(D) memory, for D datasets.
+
+    Args:
+        weights (List[float]): The weights of the datasets
+
+        size (int): The number of samples in the blend
+    """
+
+    def __init__(self, weights: List[float], size: int) -> None:
+        self.weights = numpy.asarray(weights, dtype=numpy.float64)
+        self.size = size
+        self.total_weight = float(self.weights.sum())
+
+        num_datasets = len(self.weights)
+        # The i-th key lies in ((i - margin) / total_weight, (i + margin) / total_weight]
+        self.margin = num_datasets / 2 + 2
+        window = 2 * self.margin / self.total_weight
+        # The number of candidate keys per dataset, enough to cover its keys in any window
+        widths = numpy.ceil(window * self.weights).astype(numpy.int64) + 2
+        self.candidate_starts = numpy.cumsum(widths) - widths
+        self.candidate_dataset_ids = numpy.repeat(numpy.arange(num_datasets), widths)
+        self.candidate_offsets = numpy.arange(widths.sum()) - numpy.repeat(
+            self.candidate_starts, widths
+        )
+
+    def __getitem__(
+        self, indices: Union[int, List[int], numpy.ndarray]
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Get the dataset id and the dataset sample id at each index
+
+        Args:
+            indices (Union[int, List[int], numpy.ndarray]): The index or indices into the blend
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray]: The dataset ids and the dataset sample ids, of
+            the shape of the indices
+        """
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        if numpy.any((indices < -self.size) | (indices >= self.size)):
+            raise IndexError(f"index out of range for a blend of size {self.size}")
+        indices = numpy.where(indices < 0, indices + self.size, indices)
+        dataset_ids, dataset_sample_ids, _ = self._locate(indices.reshape(-1))
+        return dataset_ids.reshape(indices.shape)[()], dataset_sample_ids.reshape(indices.shape)[()]
+
+    def get_sample_counts(self) -> numpy.ndarray:
+        """Get the number of samples the blend draws from each dataset
+
+        Returns:
+            numpy.ndarray: The number of samples per dataset
+        """
+        if self.size == 0:
+            return numpy.zeros(len(self.weights), dtype=numpy.int64)
+        indices = numpy.array([self.size - 1], dtype=numpy.int64)
+        _, _, counts = self._locate(indices, with_counts=True)
+        return counts[0]
+
+    def _key(self, dataset_ids: numpy.ndarray, dataset_sample_ids: numpy.ndarray) -> numpy.ndarray:
+        """Get the key of each sample
+
+        Args:
+            dataset_ids (numpy.ndarray): The dataset ids
+
+            dataset_sample_ids (numpy.ndarray): The dataset sample ids
+
+        Returns:
+            numpy.ndarray: The keys
+        """
+        return (dataset_sample_ids + 0.5) / self.weights[dataset_ids]
+
+    def _count(self, thresholds: numpy.ndarray) -> numpy.ndarray:
+        """Count the keys of each dataset no greater than each threshold
+
+        Args:
+            thresholds (numpy.ndarray): The thresholds, of shape (n,)
+
+        Returns:
+            numpy.ndarray: The counts, of shape (n, number of datasets)
+        """
+        dataset_ids = numpy.arange(len(self.weights))
+        thresholds = thresholds[:, None]
+        counts = numpy.maximum(numpy.floor(thresholds * self.weights + 0.5), 0).astype(numpy.int64)
+        # Correct for rounding, so that the counts agree with _key exactly
+        counts += self._key(dataset_ids, counts) <= thresholds
+        counts -= (counts > 0) & (self._key(dataset_ids, counts - 1) > thresholds)
+        return counts
+
+    def _locate(
+        self, indices: numpy.ndarray, with_counts: bool = False
+    ) -> Tuple[numpy.ndarray, numpy.ndarray, Optional[numpy.ndarray]]:
+        """Find the sample at each index
+
+        Args:
+            indices (numpy.ndarray): The indices into the blend, of shape (n,)
+
+            with_counts (bool): Whether to count the samples drawn from each dataset. Defaults to
+            False.
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray, Optional[numpy.ndarray]]: The dataset ids and the
+            dataset sample ids, of shape (n,), and optionally the number of samples drawn from each
+            dataset up to and including each index, of shape (n, number of datasets)
+        """
+        rows = numpy.arange(len(indices))
+        thresholds = numpy.maximum(indices - self.margin, 0) / self.total_weight
+        counts = self._count(thresholds)
+        # The first keys of each dataset past the threshold, ordered by (key, dataset id)
+        candidates = counts[:, self.candidate_dataset_ids] + self.candidate_offsets
+        order = numpy.argsort(
+            self._key(self.candidate_dataset_ids, candidates), axis=1, kind="stable"
+        )
+        ranks = indices - counts.sum(axis=1)
+        columns = order[rows, ranks]
+        if with_counts:
+            # The candidates ordered no later than each index
+            drawn = numpy.argsort(order, axis=1) <= ranks[:, None]
+            counts = counts + numpy.add.reduceat(drawn, self.candidate_starts, axis=1)
+        else:
+            counts = None
+        return self.candidate_dataset_ids[columns], candidates[rows, columns], counts
@@ -2,14 +2,17 @@
 
 import logging
 import math
+import multiprocessing
 from concurrent.futures import ThreadPoolExecutor
-from typing import Any, Callable, Iterable, List, Optional, Type, Union
+from typing import Any, Callable, Dict, Iterable, List, Optional, Type, Union
 
 import numpy
 import torch
 
 from megatron.core.datasets.blended_dataset import BlendedDataset
 from megatron.core.datasets.blended_megatron_dataset_config import BlendedMegatronDatasetConfig
+from megatron.core.datasets.data_profiler import profile_phase
+from megatron.core.datasets.indexed_dataset import set_mmap_pool_capacity
 from megatron.core.datasets.megatron_dataset import LowLevelDataset, MegatronDataset
 from megatron.core.datasets.utils import Split, normalize
 from megatron.core.parallel_state import get_virtual_pipeline_model_parallel_rank
@@ -71,6 +74,9 @@ class BlendedMegatronDatasetBuilder(object):
                         weights_are_none
                     ), f"size_is_none => weights_are_none fails for {split.name} split"
 
+        if self.config.mmap_pool_capacity is not None:
+            set_mmap_pool_capacity(self.config.mmap_pool_capacity)
+
         if torch.distributed.is_initialized():
             gb_rank = torch.distributed.get_rank()
             vp_rank = get_virtual_pipeline_model_parallel_rank()
@@ -144,9 +150,9 @@ class BlendedMegatronDatasetBuilder(object):
                         )
                         continue
                     # Check blend size
-                    assert dataset.size is None or dataset.size == dataset.dataset_index.shape[0]
+                    assert dataset.size is None or dataset.size == len(dataset)
                     # Check blend access of mid-level datasets
-                    _, sizes = numpy.unique(dataset.dataset_index, return_counts=True)
+                    sizes = dataset.get_dataset_sample_counts()
                     for i, dataset_and_size in enumerate(zip(dataset.datasets, sizes)):
                         if len(dataset_and_size[0]) < dataset_and_size[1]:
                             raise IndexError(
@@ -224,15 +230,17 @@ class BlendedMegatronDatasetBuilder(object):
                             size_i = None  # => the size will be sum(weights_i)
                     else:
                         raise RuntimeError
-                    blended_datasets[i] = self.build_generic_dataset(
-                        BlendedDataset,
-                        self.is_built_on_rank,
-                        True,  # synchronize_ranks, default behavior to build on rank-0 first
-                        megatron_datasets[i],
-                        weights_i,
-                        size_i,
-                        self.config,
-                    )
+                    with profile_phase("build_blended_indices", split=Split(i).name) as record:
+                        blended_datasets[i] = self.build_generic_dataset(
+                            BlendedDataset,
+                            self.is_built_on_rank,
+                            True,  # synchronize_ranks, default behavior to build on rank-0 first
+                            megatron_datasets[i],
+                            weights_i,
+                            size_i,
+                            self.config,
+                        )
+                        _record_cache_hit(record, blended_datasets[i])
 
             return blended_datasets
 
@@ -291,15 +299,17 @@ class BlendedMegatronDatasetBuilder(object):
                             size = None  # => the size will be sum(weights)
                     else:
                         raise RuntimeError
-                    blended_datasets[i] = self.build_generic_dataset(
-                        BlendedDataset,
-                        self.is_built_on_rank,
-                        True,  # synchronize_ranks, default behavior to build on rank-0 first
-                        megatron_datasets,
-                        weights,
-                        size,
-                        self.config,
-                    )
+                    with profile_phase("build_blended_indices", split=Split(i).name) as record:
+                        blended_datasets[i] = self.build_generic_dataset(
+                            BlendedDataset,
+                            self.is_built_on_rank,
+                            True,  # synchronize_ranks, default behavior to build on rank-0 first
+                            megatron_datasets,
+                            weights,
+                            size,
+                            self.config,
+                        )
+                        _record_cache_hit(record, blended_datasets[i])
 
             return blended_datasets
 
@@ -351,11 +361,18 @@ class BlendedMegatronDatasetBuilder(object):
 
         megatron_datasets = [[] for _ in range(len(Split))]
         num_dataset_builder_threads = self.config.num_dataset_builder_threads
+        num_dataset_builder_processes = min(
+            self.config.num_dataset_builder_processes, len(prefixes)
+        )
 
         if torch.distributed.is_initialized():
             rank = torch.distributed.get_rank()
             # First, build on rank 0
             if rank == 0:
+                if num_dataset_builder_processes > 1:
+                    self._build_megatron_dataset_caches_parallel(
+                        num_dataset_builder_processes, prefixes, split, sizes_per_dataset
+                    )
                 num_workers = num_dataset_builder_threads
                 if num_workers > 1:
                     # since only rank 0 is running, scale up the thread count
@@ -379,12 +396,74 @@ class BlendedMegatronDatasetBuilder(object):
                     sizes_per_dataset,
                 )
         else:
+            if num_dataset_builder_processes > 1:
+                self._build_megatron_dataset_caches_parallel(
+                    num_dataset_builder_processes, prefixes, split, sizes_per_dataset
+                )
             _threading_helper(
                 megatron_datasets, num_dataset_builder_threads, prefixes, split, sizes_per_dataset
             )
 
         return megatron_datasets
 
+    def _build_megatron_dataset_caches_parallel(
+        self,
+        num_processes: int,
+        prefixes: List[str],
+        split: List[float],
+        sizes_per_dataset: List[List[int]],
+    ) -> None:
+        """Build the cached indices of the megatron datasets for a list of prefixes in parallel
+        processes
+
+        Index building is mostly spent in NumPy and C++ helper calls which hold the GIL, so the
+        builder threads cannot overlap it. Instead, each forked process builds the megatron
+        datasets for every num_processes-th prefix and discards them, which leaves their indices
+        in the cache for the builder threads to load.
+
+        Args:
+            num_processes (int): The number of processes to fork
+
+            prefixes (List[str]): The list of prefix strings
+
+            split (List[float]): The dataset split ratios (must sum to 1.00)
+
+            sizes_per_dataset (List[List[int]]): The number of samples to request
+            per MegatronDataset per spilt
+
+        Raises:
+            RuntimeError: When a process fails to build its datasets
+        """
+
+        def _process_helper(prefixes: List[str], sizes_per_dataset: List[List[int]]) -> None:
+            for prefix, sizes in zip(prefixes, sizes_per_dataset):
+                self._build_megatron_dataset_splits(prefix, split, sizes, False)
+
+        log_single_rank(
+            logger,
+            logging.INFO,
+            f"Build the cached indices for {len(prefixes)} datasets with {num_processes} processes",
+        )
+
+        context = multiprocessing.get_context("fork")
+        processes = []
+        for i in range(num_processes):
+            process = context.Process(
+                target=_process_helper,
+                args=(prefixes[i::num_processes], sizes_per_dataset[i::num_processes]),
+            )
+            process.start()
+            processes.append(process)
+
+        for process in processes:
+            process.join()
+
+        num_failed = sum(process.exitcode != 0 for process in processes)
+        if num_failed > 0:
+            raise RuntimeError(
+                f"{num_failed} of {num_processes} dataset builder processes failed to build the dataset indices"
+            )
+
     def _build_megatron_dataset_splits(
         self,
         dataset_path: Optional[str],
@@ -414,7 +493,8 @@ class BlendedMegatronDatasetBuilder(object):
             return [None] * len(Split)
 
         # Build the low level dataset
-        low_level_dataset = self.cls.build_low_level_dataset(dataset_path, self.config)
+        with profile_phase("build_low_level_dataset", dataset_path):
+            low_level_dataset = self.cls.build_low_level_dataset(dataset_path, self.config)
 
         # Build the split indices for the low level dataset
         num_elements = self.cls.numel_low_level_dataset(low_level_dataset)
@@ -433,19 +513,21 @@ class BlendedMegatronDatasetBuilder(object):
             if split[i] is None:
                 mid_level_datasets.append(None)
             else:
-                mid_level_datasets.append(
-                    self.build_generic_dataset(
-                        self.cls,
-                        self.is_built_on_rank,
-                        synchronize_ranks,
-                        low_level_dataset,
-                        dataset_path,
-                        split_indices[i],
-                        sizes[i],
-                        _split,
-                        self.config,
+                with profile_phase("build_indices", dataset_path, _split.name) as record:
+                    mid_level_datasets.append(
+                        self.build_generic_dataset(
+                            self.cls,
+                            self.is_built_on_rank,
+                            synchronize_ranks,
+                            low_level_dataset,
+                            dataset_path,
+                            split_indices[i],
+                            sizes[i],
+                            _split,
+                            self.config,
+                        )
                     )
-                )
+                    _record_cache_hit(record, mid_level_datasets[-1])
 
         return mid_level_datasets
 
@@ -504,6 +586,18 @@ class BlendedMegatronDatasetBuilder(object):
         return cls(*args)
 
 
+def _record_cache_hit(record: Dict[str, Any], dataset: Optional[DistributedDataset]) -> None:
+    """Add to a data profiler record whether the dataset loaded its indices from the cache
+
+    Args:
+        record (Dict[str, Any]): The record
+
+        dataset (Optional[DistributedDataset]): The dataset, or None if not built on this rank
+    """
+    if dataset is not None and hasattr(dataset, "built_anew_on_cache_miss"):
+        record["cache_hit"] = not dataset.built_anew_on_cache_miss
+
+
 def _get_size_per_split_per_dataset(
     normalized_weights: List[float], target_size_per_split: List[int]
 ) -> List[List[int]]:
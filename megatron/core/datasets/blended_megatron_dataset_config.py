@@ -40,6 +40,13 @@ class BlendedMegatronDatasetConfig:
        comparability in the data sample order.
     """
 
+    closed_form_blending: bool = False
+    """Whether to compute the dataset index and dataset sample index of a blend on the fly, in
+       closed form, rather than build and cache them. The blend takes O(number of datasets) memory
+       regardless of its size, but the sample order differs from that of the default blending.
+       Blends built to exhaust their datasets, i.e. without a size, always use the default blending.
+    """
+
     split: Optional[str] = None
     """The split string, a comma separated weighting for the dataset splits when drawing samples
        from a single distribution. Not to be used with 'blend_per_split'.  Defaults to None.
@@ -54,12 +61,31 @@ class BlendedMegatronDatasetConfig:
     num_dataset_builder_threads: int = 1
     """The number of threads to use for dataset building."""
 
+    num_dataset_builder_processes: int = 1
+    """The number of processes to use to build the cached dataset indices of a blend. When greater
+       than 1, the rank which builds the indices forks as many processes, each of which builds the
+       indices of a subset of the blended datasets and writes them to the cache.
+    """
+
     path_to_cache: Optional[str] = None
     """Where all re-useable dataset indices are to be cached."""
 
+    consolidate_cached_indices: bool = False
+    """Whether to cache the indices of each dataset in a single page-aligned file rather than in one
+       .npy file per index. Every process maps such a file once, read-only and lazily, and shares
+       the mapping across all of the datasets which use it.
+    """
+
     mmap_bin_files: bool = True
     """Whether to mmap the .bin files or use file pointers."""
 
+    mmap_pool_capacity: Optional[int] = None
+    """The maximum number of .bin file mappings each process holds at once, or None for no limit.
+       Mappings are shared by all of the datasets in the process, created on first read, and the
+       least recently used ones are unmapped beyond this limit. Useful to stay under
+       vm.max_map_count with very large blends.
+    """
+
     mock: bool = field(init=False, default=False)
     """Whether to bypass real data loading and validation in favor of mock data generation.
        Created automatically from 'blend' and 'blend_per_split'. Not to be passed in to the
@@ -0,0 +1,215 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Dict, Iterator, List, Optional
+
+import torch
+
+from megatron.core.datasets.utils import atomic_write_path
+from megatron.core.utils import log_single_rank
+
+logger = logging.getLogger(__name__)
+
+_ACTIVE_PROFILER: Optional["DataProfiler"] = None
+
+
+class DataProfiler(object):
+    """Records the wall time of the data loading phases, per dataset and split
+
+    While active, i.e. inside its `with` block, the profiler is used by every
+    BlendedMegatronDatasetBuilder in the process, including those in dataset builder threads, to
+    time the phases of the build:
+
+        - "build_low_level_dataset": open the low-level dataset of a prefix, e.g. an IndexedDataset
+
+        - "build_indices": build or load the cached indices of a mid-level dataset split
+
+        - "build_blended_indices": build or load the cached indices of a blended dataset split
+
+    The sample throughput of the built datasets can then be measured with
+    `DataProfiler.measure_throughput`.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._records: List[Dict[str, Any]] = []
+        self._throughput: Dict[str, Dict[str, float]] = {}
+
+    def __enter__(self) -> "DataProfiler":
+        """Activate the profiler
+
+        Returns:
+            DataProfiler: The profiler
+        """
+        global _ACTIVE_PROFILER
+        assert _ACTIVE_PROFILER is None, "another DataProfiler is already active"
+        _ACTIVE_PROFILER = self
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        """Deactivate the profiler"""
+        global _ACTIVE_PROFILER
+        _ACTIVE_PROFILER = None
+
+    @contextmanager
+    def phase(
+        self, name: str, dataset: Optional[str] = None, split: Optional[str] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Time a phase
+
+        Args:
+            name (str): The name of the phase
+
+            dataset (Optional[str]): The path prefix of the dataset, or None for blends and mock data
+
+            split (Optional[str]): The name of the split, or None if the phase spans all splits
+
+        Yields:
+            Dict[str, Any]: The record of the phase, to which the caller may add fields
+        """
+        record = {"phase": name, "dataset": dataset, "split": split}
+        t_beg = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - t_beg
+            with self._lock:
+                self._records.append(record)
+
+    def measure_throughput(
+        self,
+        name: str,
+        dataset: torch.utils.data.Dataset,
+        num_samples: int,
+        num_workers: int = 0,
+        batch_size: int = 1,
+    ) -> Dict[str, float]:
+        """Measure and record the sample throughput of a dataset, see `measure_throughput`
+
+        Args:
+            name (str): The name under which to report the measurement
+
+            dataset (torch.utils.data.Dataset): The dataset
+
+            num_samples (int): The number of samples to read
+
+            num_workers (int): The number of DataLoader worker processes. Defaults to 0.
+
+            batch_size (int): The number of samples per batch. Defaults to 1.
+
+        Returns:
+            Dict[str, float]: The measurement
+        """
+        throughput = measure_throughput(dataset, num_samples, num_workers, batch_size)
+        with self._lock:
+            self._throughput[name] = throughput
+        return throughput
+
+    def report(self) -> Dict[str, Any]:
+        """Get the report
+
+        Returns:
+            Dict[str, Any]: Every phase record, in order of completion, the count and total and max
+            seconds per phase name, and the throughput measurements by name
+        """
+        with self._lock:
+            records = [dict(record) for record in self._records]
+            throughput = {name: dict(result) for name, result in self._throughput.items()}
+        phases = {}
+        for record in records:
+            phase = phases.setdefault(record["phase"], {"count": 0, "seconds": 0.0, "max": 0.0})
+            phase["count"] += 1
+            phase["seconds"] += record["seconds"]
+            phase["max"] = max(phase["max"], record["seconds"])
+        return {"phases": phases, "records": records, "throughput": throughput}
+
+    def save(self, path: str) -> None:
+        """Write the report to a JSON file
+
+        Args:
+            path (str): The path to the file
+        """
+        with atomic_write_path(path) as path_tmp:
+            with open(path_tmp, "w") as f:
+                json.dump(self.report(), f, indent=4)
+        log_single_rank(logger, logging.INFO, f"Wrote the data loading profile to {path}")
+
+
+def get_data_profiler() -> Optional[DataProfiler]:
+    """Get the active data profiler
+
+    Returns:
+        Optional[DataProfiler]: The active profiler, or None
+    """
+    return _ACTIVE_PROFILER
+
+
+def profile_phase(
+    name: str, dataset: Optional[str] = None, split: Optional[str] = None
+) -> ContextManager[Dict[str, Any]]:
+    """Time a phase with the active data profiler, if any, see `DataProfiler.phase`
+
+    Args:
+        name (str): The name of the phase
+
+        dataset (Optional[str]): The path prefix of the dataset, or None for blends and mock data
+
+        split (Optional[str]): The name of the split, or None if the phase spans all splits
+
+    Returns:
+        ContextManager[Dict[str, Any]]: A context manager which yields the record of the phase
+    """
+    profiler = _ACTIVE_PROFILER
+    if profiler is None:
+        return nullcontext({})
+    return profiler.phase(name, dataset, split)
+
+
+def measure_throughput(
+    dataset: torch.utils.data.Dataset, num_samples: int, num_workers: int = 0, batch_size: int = 1
+) -> Dict[str, float]:
+    """Measure the sample throughput of a dataset through a DataLoader
+
+    The first `num_samples` samples are read in order, as the training sampler would. The first
+    batch is timed on its own, as it includes the startup of the worker processes.
+
+    Args:
+        dataset (torch.utils.data.Dataset): The dataset
+
+        num_samples (int): The number of samples to read, capped at the length of the dataset
+
+        num_workers (int): The number of DataLoader worker processes. Defaults to 0.
+
+        batch_size (int): The number of samples per batch. Defaults to 1.
+
+    Returns:
+        Dict[str, float]: The number of samples read, the number of workers, the batch size, the
+        seconds to the first batch, the total seconds, and the samples per second after the first
+        batch
+    """
+    num_samples = min(num_samples, len(dataset))
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=batch_size, sampler=range(num_samples), num_workers=num_workers
+    )
+
+    t_beg = time.perf_counter()
+    first_batch_seconds = None
+    for i, _ in enumerate(loader):
+        if i == 0:
+            first_batch_seconds = time.perf_counter() - t_beg
+    seconds = time.perf_counter() - t_beg
+
+    steady_samples = num_samples - min(batch_size, num_samples)
+    steady_seconds = seconds - (first_batch_seconds or 0.0)
+    return {
+        "num_samples": num_samples,
+        "num_workers": num_workers,
+        "batch_size": batch_size,
+        "first_batch_seconds": first_batch_seconds,
+        "seconds": seconds,
+        "samples_per_second": steady_samples / steady_seconds if steady_seconds > 0 else None,
+    }
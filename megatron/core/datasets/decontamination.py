@@ -0,0 +1,506 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+"""Removal of benchmark n-grams from IndexedDataset token ids
+
+The n-grams of the benchmark, or task, token sequences are hashed into an NgramIndex, one sorted
+array of 64-bit hashes per n-gram length. A training dataset is then streamed in batches of whole
+documents, the hashes of every window of every indexed length are computed at once with a
+vectorized rolling hash, and the matches are found with a binary search into the sorted arrays.
+
+Every match is cut out of its document together with a margin of tokens on either side. The
+untouched documents are copied as they are, and the pieces of a cut document are written as
+separate documents, if they are long enough and if the document was not cut into too many pieces.
+The n-grams which occur in many training documents are, by construction, not evidence of
+contamination, and can be pruned from the index with a first counting pass.
+"""
+
+import logging
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy
+
+from megatron.core.datasets.deduplication import _fmix64, iterate_document_batches
+from megatron.core.datasets.indexed_dataset import (
+    IndexedDataset,
+    IndexedDatasetBuilder,
+    get_bin_path,
+    get_idx_path,
+    merge_indexed_datasets,
+)
+
+logger = logging.getLogger(__name__)
+
+_ROLLING_HASH_PRIME = numpy.uint64(0x100000001B3)
+
+_FILTER_BITS_PER_NGRAM = 16
+
+_STATISTICS = (
+    "documents",
+    "cut_documents",
+    "dropped_documents",
+    "output_documents",
+    "matches",
+    "tokens",
+    "output_tokens",
+)
+
+
+@dataclass
+class DecontaminationConfig:
+    """Configuration object for n-gram decontamination"""
+
+    min_ngram_size: int = 8
+    """Task sequences shorter than this are not indexed"""
+
+    max_ngram_size: int = 13
+    """The n-gram length to index the task sequences with. Task sequences shorter than this are
+       indexed whole.
+    """
+
+    remove_tokens_each_side: int = 50
+    """The number of tokens to remove on either side of every match"""
+
+    min_piece_tokens: int = 50
+    """The minimum length of the pieces of a cut document. Shorter pieces are dropped."""
+
+    max_pieces: int = 10
+    """The maximum number of pieces a document may be cut into. Documents cut into more pieces
+       are dropped.
+    """
+
+    max_tokens_per_batch: int = 2**22
+    """The number of tokens to read and hash at a time"""
+
+    num_workers: int = 1
+    """The number of processes to scan the training data with"""
+
+    def __post_init__(self) -> None:
+        """Do asserts post init"""
+        assert 0 < self.min_ngram_size <= self.max_ngram_size
+        assert self.remove_tokens_each_side >= 0
+        assert self.max_tokens_per_batch > 0
+        assert self.num_workers > 0
+
+
+def _iterate_rolling_hashes(
+    tokens: numpy.ndarray, lengths: Iterable[int]
+) -> Iterator[Tuple[int, numpy.ndarray]]:
+    """Hash every window of the given lengths in a token stream
+
+    The hash of a window of length n extends the hash of the window of length n - 1 at the same
+    position by one token, so all of the lengths are hashed in max(lengths) vectorized steps.
+
+    Args:
+        tokens (numpy.ndarray): The token stream
+
+        lengths (Iterable[int]): The window lengths
+
+    Yields:
+        Tuple[int, numpy.ndarray]: Each window length, in increasing order, with the uint64
+        hashes of the windows at every position at which they fit in the stream
+    """
+    lengths = set(lengths)
+    values = tokens.astype(numpy.uint64) + numpy.uint64(1)
+    hashes = numpy.zeros(tokens.shape[0], dtype=numpy.uint64)
+    for length in range(1, max(lengths, default=0) + 1):
+        num_windows = tokens.shape[0] - length + 1
+        if num_windows <= 0:
+            break
+        hashes = hashes[:num_windows]
+        hashes *= _ROLLING_HASH_PRIME
+        hashes += values[length - 1 :]
+        if length in lengths:
+            yield length, _fmix64(hashes.copy())
+
+
+class NgramIndex(object):
+    """A set of n-gram hashes, kept as one sorted array per n-gram length
+
+    Every array is fronted by a single-hash Bloom filter, a table of _FILTER_BITS_PER_NGRAM flags
+    per n-gram addressed by the top bits of the hash, so that only the few candidate windows of
+    a stream are searched for in the array.
+
+    Args:
+        hashes (Dict[int, numpy.ndarray]): The uint64 n-gram hashes, by n-gram length
+    """
+
+    def __init__(self, hashes: Dict[int, numpy.ndarray]) -> None:
+        self.hashes = {
+            length: numpy.unique(numpy.asarray(array, dtype=numpy.uint64))
+            for length, array in sorted(hashes.items())
+            if len(array) > 0
+        }
+        self.filters = {}
+        for length, array in self.hashes.items():
+            num_bits = max(int(numpy.ceil(numpy.log2(array.shape[0] * _FILTER_BITS_PER_NGRAM))), 1)
+            shift = numpy.uint64(64 - num_bits)
+            flags = numpy.zeros(2**num_bits, dtype=bool)
+            flags[array >> shift] = True
+            self.filters[length] = (flags, shift)
+
+    @classmethod
+    def build(
+        cls, sequences: Iterable[numpy.ndarray], config: DecontaminationConfig
+    ) -> "NgramIndex":
+        """Index the n-grams of the task token sequences
+
+        Args:
+            sequences (Iterable[numpy.ndarray]): The task token sequences
+
+            config (DecontaminationConfig): The config
+
+        Returns:
+            NgramIndex: The index
+        """
+        hashes = defaultdict(list)
+        for sequence in sequences:
+            if sequence.shape[0] < config.min_ngram_size:
+                continue
+            length = min(sequence.shape[0], config.max_ngram_size)
+            for length, array in _iterate_rolling_hashes(sequence, [length]):
+                hashes[length].append(array)
+        return cls({length: numpy.concatenate(arrays) for length, arrays in hashes.items()})
+
+    @classmethod
+    def load(cls, path: str) -> "NgramIndex":
+        """Load an index saved with NgramIndex.save
+
+        Args:
+            path (str): The path to the .npz file
+
+        Returns:
+            NgramIndex: The index
+        """
+        with numpy.load(path, allow_pickle=False) as arrays:
+            return cls({int(length): arrays[length] for length in arrays.files})
+
+    def save(self, path: str) -> None:
+        """Save the index
+
+        Args:
+            path (str): The path to the .npz file
+        """
+        numpy.savez(path, **{str(length): array for length, array in self.hashes.items()})
+
+    def __len__(self) -> int:
+        """Get the number of n-grams in the index
+
+        Returns:
+            int: The number of n-grams
+        """
+        return sum(array.shape[0] for array in self.hashes.values())
+
+    def match(
+        self, tokens: numpy.ndarray, window_ends: numpy.ndarray
+    ) -> Iterator[Tuple[int, numpy.ndarray, numpy.ndarray]]:
+        """Find the indexed n-grams in a token stream
+
+        Args:
+            tokens (numpy.ndarray): The token stream
+
+            window_ends (numpy.ndarray): The position past which a window starting at each token
+            may not extend, e.g. the end of the document of each token
+
+        Yields:
+            Tuple[int, numpy.ndarray, numpy.ndarray]: Each n-gram length with matches, with the
+            start position of every match and the position of its n-gram in the length's array
+        """
+        for length, hashes in _iterate_rolling_hashes(tokens, self.hashes.keys()):
+            array = self.hashes[length]
+            flags, shift = self.filters[length]
+            starts = numpy.flatnonzero(flags[hashes >> shift])
+            starts = starts[starts + length <= window_ends[starts]]
+            positions = numpy.searchsorted(array, hashes[starts])
+            found = array[numpy.minimum(positions, array.shape[0] - 1)] == hashes[starts]
+            if found.any():
+                yield length, starts[found], positions[found]
+
+    def prune(self, counts: Dict[int, numpy.ndarray], max_count: int) -> "NgramIndex":
+        """Drop the n-grams which occur too often
+
+        Args:
+            counts (Dict[int, numpy.ndarray]): The count of every n-gram, by n-gram length, as
+            returned by count_ngram_documents
+
+            max_count (int): The count from which an n-gram is dropped
+
+        Returns:
+            NgramIndex: The pruned index
+        """
+        return NgramIndex(
+            {length: array[counts[length] < max_count] for length, array in self.hashes.items()}
+        )
+
+
+def _get_document_layout(
+    sequence_lengths: numpy.ndarray, document_indices: numpy.ndarray
+) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """Get the document of every token of a batch and the token range of every document
+
+    Args:
+        sequence_lengths (numpy.ndarray): The sequence lengths of the batch
+
+        document_indices (numpy.ndarray): The document indices into the sequence lengths
+
+    Returns:
+        Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: The sequence token offsets, the
+        document token offsets, and the document of every token
+    """
+    sequence_offsets = numpy.concatenate(([0], numpy.cumsum(sequence_lengths)))
+    document_offsets = sequence_offsets[document_indices]
+    token_documents = numpy.repeat(
+        numpy.arange(document_offsets.shape[0] - 1), numpy.diff(document_offsets)
+    )
+    return sequence_offsets, document_offsets, token_documents
+
+
+def _count_ngram_documents(
+    path_prefix: str,
+    document_range: Tuple[int, int],
+    index: NgramIndex,
+    config: DecontaminationConfig,
+) -> Dict[int, numpy.ndarray]:
+    """Count the documents in which every indexed n-gram occurs, for a range of documents
+
+    Args:
+        path_prefix (str): The IndexedDataset prefix
+
+        document_range (Tuple[int, int]): The first and past-the-last documents
+
+        index (NgramIndex): The index
+
+        config (DecontaminationConfig): The config
+
+    Returns:
+        Dict[int, numpy.ndarray]: The document count of every n-gram, by n-gram length
+    """
+    dataset = IndexedDataset(path_prefix)
+    counts = {
+        length: numpy.zeros(len(array), numpy.int64) for length, array in index.hashes.items()
+    }
+    for _, tokens, sequence_lengths, document_indices in iterate_document_batches(
+        dataset, *document_range, config.max_tokens_per_batch
+    ):
+        _, document_offsets, token_documents = _get_document_layout(
+            sequence_lengths, document_indices
+        )
+        for length, starts, ngrams in index.match(tokens, document_offsets[1:][token_documents]):
+            # Count every n-gram once per document
+            pairs = numpy.unique(token_documents[starts] * len(index.hashes[length]) + ngrams)
+            counts[length] += numpy.bincount(
+                pairs % len(index.hashes[length]), minlength=len(index.hashes[length])
+            )
+    return counts
+
+
+def _decontaminate_documents(
+    path_prefix: str,
+    output_prefix: str,
+    document_range: Tuple[int, int],
+    index: NgramIndex,
+    config: DecontaminationConfig,
+) -> Dict[str, int]:
+    """Write the decontaminated documents of a range of documents to a new IndexedDataset
+
+    Args:
+        path_prefix (str): The IndexedDataset prefix
+
+        output_prefix (str): The output IndexedDataset prefix
+
+        document_range (Tuple[int, int]): The first and past-the-last documents
+
+        index (NgramIndex): The index
+
+        config (DecontaminationConfig): The config
+
+    Returns:
+        Dict[str, int]: The decontamination statistics
+    """
+    dataset = IndexedDataset(path_prefix)
+    builder = IndexedDatasetBuilder(
+        get_bin_path(output_prefix),
+        dtype=dataset.index.dtype,
+        token_nbytes=dataset.index.token_nbytes,
+    )
+    statistics = dict.fromkeys(_STATISTICS, 0)
+    for _, tokens, sequence_lengths, document_indices in iterate_document_batches(
+        dataset, *document_range, config.max_tokens_per_batch
+    ):
+        sequence_offsets, document_offsets, token_documents = _get_document_layout(
+            sequence_lengths, document_indices
+        )
+        num_tokens = tokens.shape[0]
+        num_documents = document_offsets.shape[0] - 1
+
+        # Mark the matches and their margins, clipped to their documents, for removal
+        delta = numpy.zeros(num_tokens + 1, dtype=numpy.int64)
+        for length, starts, _ in index.match(tokens, document_offsets[1:][token_documents]):
+            documents = token_documents[starts]
+            delta += numpy.bincount(
+                numpy.maximum(starts - config.remove_tokens_each_side, document_offsets[documents]),
+                minlength=num_tokens + 1,
+            )
+            delta -= numpy.bincount(
+                numpy.minimum(
+                    starts + length + config.remove_tokens_each_side,
+                    document_offsets[documents + 1],
+                ),
+                minlength=num_tokens + 1,
+            )
+            statistics["matches"] += starts.shape[0]
+        kept = numpy.cumsum(delta[:-1]) == 0
+        cut = numpy.bincount(token_documents[~kept], minlength=num_documents) > 0
+
+        # Split the kept tokens into pieces, which never span a sequence boundary
+        nonempty = sequence_lengths > 0
+        sequence_first = numpy.zeros(num_tokens, dtype=bool)
+        sequence_first[sequence_offsets[:-1][nonempty]] = True
+        sequence_last = numpy.zeros(num_tokens, dtype=bool)
+        sequence_last[sequence_offsets[1:][nonempty] - 1] = True
+        piece_starts = numpy.flatnonzero(
+            kept & (sequence_first | ~numpy.concatenate(([False], kept[:-1])))
+        )
+        piece_ends = (
+            numpy.flatnonzero(kept & (sequence_last | ~numpy.concatenate((kept[1:], [False])))) + 1
+        )
+        piece_documents = token_documents[piece_starts]
+        piece_lengths = piece_ends - piece_starts
+
+        # Keep the pieces of the untouched documents, and the long enough pieces of the cut
+        # documents which were not cut into too many of them
+        piece_cut = cut[piece_documents]
+        piece_kept = ~piece_cut | (piece_lengths >= config.min_piece_tokens)
+        num_pieces = numpy.bincount(
+            piece_documents[piece_cut & piece_kept], minlength=num_documents
+        )
+        piece_kept &= num_pieces[piece_documents] <= config.max_pieces
+        piece_starts = piece_starts[piece_kept]
+        piece_lengths = piece_lengths[piece_kept]
+        piece_documents = piece_documents[piece_kept]
+        piece_cut = piece_cut[piece_kept]
+
+        # An untouched document keeps its sequences, and every piece of a cut document becomes a
+        # document of its own
+        new_document = piece_cut.copy()
+        new_document[1:] |= piece_documents[1:] != piece_documents[:-1]
+        new_document[:1] = True
+        output_document_starts = numpy.flatnonzero(new_document)
+        output_document_lengths = numpy.diff(
+            numpy.append(output_document_starts, piece_starts.shape[0])
+        )
+        gather = numpy.arange(piece_lengths.sum(), dtype=numpy.int64) + numpy.repeat(
+            piece_starts - (numpy.cumsum(piece_lengths) - piece_lengths), piece_lengths
+        )
+        builder.add_packed_documents(tokens[gather], piece_lengths, output_document_lengths)
+
+        statistics["documents"] += num_documents
+        statistics["cut_documents"] += int(cut.sum())
+        statistics["dropped_documents"] += int(
+            (cut & (numpy.bincount(piece_documents, minlength=num_documents) == 0)).sum()
+        )
+        statistics["output_documents"] += output_document_starts.shape[0]
+        statistics["tokens"] += num_tokens
+        statistics["output_tokens"] += int(piece_lengths.sum())
+    builder.finalize(get_idx_path(output_prefix))
+    return statistics
+
+
+def _get_document_ranges(path_prefix: str, num_workers: int) -> List[Tuple[int, int]]:
+    """Split the documents of an IndexedDataset into contiguous ranges, one per worker
+
+    Args:
+        path_prefix (str): The IndexedDataset prefix
+
+        num_workers (int): The number of workers
+
+    Returns:
+        List[Tuple[int, int]]: The first and past-the-last documents of every range
+    """
+    num_documents = IndexedDataset(path_prefix).document_indices.shape[0] - 1
+    bounds = numpy.linspace(0, num_documents, num_workers + 1).astype(numpy.int64).tolist()
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def count_ngram_documents(
+    path_prefixes: List[str], index: NgramIndex, config: DecontaminationConfig
+) -> Dict[int, numpy.ndarray]:
+    """Count the training documents in which every indexed n-gram occurs
+
+    Args:
+        path_prefixes (List[str]): The IndexedDataset prefixes
+
+        index (NgramIndex): The index
+
+        config (DecontaminationConfig): The config
+
+    Returns:
+        Dict[int, numpy.ndarray]: The document count of every n-gram, by n-gram length
+    """
+    t_beg = time.time()
+    worker_args = [
+        (path_prefix, document_range, index, config)
+        for path_prefix in path_prefixes
+        for document_range in _get_document_ranges(path_prefix, config.num_workers)
+    ]
+    if config.num_workers == 1:
+        results = [_count_ngram_documents(*args) for args in worker_args]
+    else:
+        with multiprocessing.Pool(config.num_workers) as pool:
+            results = pool.starmap(_count_ngram_documents, worker_args)
+    counts = {length: sum(result[length] for result in results) for length in index.hashes}
+    t_end = time.time()
+    logger.info(f"Counted the {len(index)} n-grams in {t_end - t_beg:.2f} seconds")
+    return counts
+
+
+def decontaminate_indexed_dataset(
+    path_prefix: str, output_prefix: str, index: NgramIndex, config: DecontaminationConfig
+) -> Dict[str, int]:
+    """Write a copy of an IndexedDataset with the indexed n-grams cut out of its documents
+
+    Empty sequences are not copied.
+
+    Args:
+        path_prefix (str): The IndexedDataset prefix
+
+        output_prefix (str): The output IndexedDataset prefix
+
+        index (NgramIndex): The index
+
+        config (DecontaminationConfig): The config
+
+    Returns:
+        Dict[str, int]: The decontamination statistics
+    """
+    t_beg = time.time()
+    document_ranges = _get_document_ranges(path_prefix, config.num_workers)
+    if config.num_workers == 1:
+        statistics = _decontaminate_documents(
+            path_prefix, output_prefix, document_ranges[0], index, config
+        )
+    else:
+        part_prefixes = [f"{output_prefix}.part{w:05d}" for w in range(config.num_workers)]
+        with multiprocessing.Pool(config.num_workers) as pool:
+            results = pool.starmap(
+                _decontaminate_documents,
+                [
+                    (path_prefix, part_prefix, document_range, index, config)
+                    for part_prefix, document_range in zip(part_prefixes, document_ranges)
+                ],
+            )
+        merge_indexed_datasets(part_prefixes, output_prefix)
+        for part_prefix in part_prefixes:
+            os.remove(get_bin_path(part_prefix))
+            os.remove(get_idx_path(part_prefix))
+        statistics = {key: sum(result[key] for result in results) for key in _STATISTICS}
+    t_end = time.time()
+    logger.info(
+        f"Decontaminated {path_prefix} in {t_end - t_beg:.2f} seconds: "
+        + ", ".join(f"{key} {value}" for key, value in statistics.items())
+    )
+    return statistics
@@ -0,0 +1,516 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+"""Near-duplicate document detection over IndexedDataset token ids with MinHash-LSH
+
+The pipeline streams the documents of one or more IndexedDatasets in two passes:
+
+    1. Signatures: every document is shingled into token n-grams, and its MinHash signature is
+       computed in vectorized batches. The signature is cut into bands, and every band is hashed
+       into a 64-bit key. The (key, document) records are appended to band table partitions on
+       disk, so that no per-document state is kept in memory.
+    2. Clustering: every partition is sorted by key in turn. Documents which share a key in any
+       band are candidate duplicates and are merged with a union-find over the document ids.
+
+Every cluster keeps its first document, in the order of the datasets and their documents, and
+the resulting document keep mask is written next to each dataset, where GPTDataset picks it up
+when GPTDatasetConfig.use_document_keep_masks is set.
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Iterator, List, Tuple
+
+import numpy
+
+from megatron.core.datasets.indexed_dataset import IndexedDataset
+from megatron.core.datasets.utils import atomic_write_path
+
+logger = logging.getLogger(__name__)
+
+_BAND_RECORD_DTYPE = numpy.dtype([("key", "<u8"), ("document", "<i8")])
+
+_SHINGLE_PRIME = numpy.uint64(0x100000001B3)
+
+# The bound on the number of shingle hashes per vectorized MinHash step
+_MAX_HASHES_PER_STEP = 2**23
+
+
+@dataclass
+class DeduplicationConfig:
+    """Configuration object for MinHash-LSH document deduplication"""
+
+    ngram_size: int = 5
+    """The number of tokens per shingle. Documents shorter than this are a single shingle."""
+
+    num_bands: int = 16
+    """The number of LSH bands. Documents which agree on all of the rows of any band are
+       candidate duplicates.
+    """
+
+    rows_per_band: int = 8
+    """The number of MinHash values per LSH band. Together with num_bands, this sets the Jaccard
+       similarity at which a pair of documents is detected with probability 1/2, approximately
+       (1 / num_bands) ** (1 / rows_per_band).
+    """
+
+    num_partitions: int = 64
+    """The number of band table partitions. Each partition is sorted in memory on its own, so it
+       should be large enough that 16 * num_bands * num_documents / num_partitions bytes fit.
+    """
+
+    max_tokens_per_batch: int = 2**22
+    """The number of tokens to read and shingle at a time"""
+
+    num_workers: int = 1
+    """The number of processes to compute the signatures with"""
+
+    seed: int = 1234
+    """The seed for the MinHash permutations and band hashes"""
+
+    def __post_init__(self) -> None:
+        """Do asserts post init"""
+        assert self.ngram_size > 0
+        assert self.num_bands > 0
+        assert self.rows_per_band > 0
+        assert self.num_partitions > 0
+        assert self.max_tokens_per_batch > 0
+        assert self.num_workers > 0
+
+    @property
+    def num_permutations(self) -> int:
+        """The MinHash signature length"""
+        return self.num_bands * self.rows_per_band
+
+
+def get_document_keep_mask_path(path_prefix: str) -> str:
+    """Get the path to the document keep mask file from the prefix
+
+    Args:
+        path_prefix (str): The prefix
+
+    Returns:
+        str: The path to the document keep mask file
+    """
+    return path_prefix + ".keep.npy"
+
+
+def save_document_keep_mask(path_prefix: str, keep: numpy.ndarray) -> None:
+    """Save a document keep mask next to an IndexedDataset, as packed bits
+
+    Args:
+        path_prefix (str): The IndexedDataset prefix
+
+        keep (numpy.ndarray): Whether to keep each document
+    """
+    with atomic_write_path(get_document_keep_mask_path(path_prefix)) as path:
+        numpy.save(path, numpy.packbits(keep.astype(bool)), allow_pickle=False)
+
+
+def load_document_keep_mask(path_prefix: str, num_documents: int) -> Tuple[numpy.ndarray, str]:
+    """Load the document keep mask of an IndexedDataset
+
+    Args:
+        path_prefix (str): The IndexedDataset prefix
+
+        num_documents (int): The number of documents in the IndexedDataset
+
+    Returns:
+        Tuple[numpy.ndarray, str]: Whether to keep each document, and the MD5 hash of the mask
+    """
+    path = get_document_keep_mask_path(path_prefix)
+    assert os.path.isfile(path), f"Document keep mask not found: {path}"
+    packed = numpy.load(path, allow_pickle=False)
+    assert packed.dtype == numpy.uint8 and packed.shape == (
+        (num_documents + 7) // 8,
+    ), f"Document keep mask {path} does not match the {num_documents} documents of the dataset"
+    keep = numpy.unpackbits(packed, count=num_documents).astype(bool)
+    return keep, hashlib.md5(packed.tobytes()).hexdigest()
+
+
+def _fmix64(x: numpy.ndarray) -> numpy.ndarray:
+    """Apply the MurmurHash3 64-bit finalizer, in place
+
+    Args:
+        x (numpy.ndarray): The uint64 values to mix
+
+    Returns:
+        numpy.ndarray: The mixed values
+    """
+    x ^= x >> numpy.uint64(33)
+    x *= numpy.uint64(0xFF51AFD7ED558CCD)
+    x ^= x >> numpy.uint64(33)
+    x *= numpy.uint64(0xC4CEB9FE1A85EC53)
+    x ^= x >> numpy.uint64(33)
+    return x
+
+
+class MinHasher(object):
+    """Compute MinHash signatures and LSH band keys of token id documents
+
+    The shingles are hashed with a polynomial hash over their token ids, and the permutations are
+    multiply-shift hashes of the shingle hashes, (a * x + b) >> 32 for odd 64-bit a.
+
+    Args:
+        config (DeduplicationConfig): The config
+    """
+
+    def __init__(self, config: DeduplicationConfig) -> None:
+        self.config = config
+        numpy_random_state = numpy.random.RandomState(config.seed)
+        self.a = numpy_random_state.randint(
+            0, 2**63, size=config.num_permutations, dtype=numpy.uint64
+        ) * numpy.uint64(2) + numpy.uint64(1)
+        self.b = numpy_random_state.randint(
+            0, 2**63, size=config.num_permutations, dtype=numpy.uint64
+        )
+        self.row_coefficients = numpy_random_state.randint(
+            0, 2**63, size=config.rows_per_band, dtype=numpy.uint64
+        ) * numpy.uint64(2) + numpy.uint64(1)
+        self.band_salts = numpy_random_state.randint(
+            0, 2**63, size=config.num_bands, dtype=numpy.uint64
+        )
+
+    def shingle(
+        self, tokens: numpy.ndarray, document_lengths: numpy.ndarray
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Hash the n-gram shingles of a batch of documents
+
+        Args:
+            tokens (numpy.ndarray): The concatenated tokens of the documents
+
+            document_lengths (numpy.ndarray): The number of tokens in each document
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray]: The uint64 shingle hashes, ordered by document,
+            and the number of shingles of each document
+        """
+        n = self.config.ngram_size
+        document_lengths = document_lengths.astype(numpy.int64)
+        num_documents = document_lengths.shape[0]
+
+        # Follow every document with n - 1 zeros, which no token maps to, so that no n-gram
+        # spans two documents and a short document is a single shingle padded with zeros
+        padded_offsets = numpy.zeros(num_documents + 1, dtype=numpy.int64)
+        numpy.cumsum(document_lengths + n - 1, out=padded_offsets[1:])
+        padded = numpy.zeros(padded_offsets[-1], dtype=numpy.uint64)
+        token_positions = numpy.arange(tokens.shape[0], dtype=numpy.int64) + numpy.repeat(
+            padded_offsets[:-1] - (numpy.cumsum(document_lengths) - document_lengths),
+            document_lengths,
+        )
+        padded[token_positions] = tokens.astype(numpy.uint64) + numpy.uint64(1)
+
+        num_windows = padded.shape[0] - n + 1
+        hashes = numpy.zeros(max(num_windows, 0), dtype=numpy.uint64)
+        for j in range(n):
+            hashes *= _SHINGLE_PRIME
+            hashes += padded[j : j + num_windows]
+
+        # Keep the windows which start on a token and end in the same document, or, for a short
+        # document, the window which starts on its first token
+        num_shingles = numpy.where(
+            document_lengths > 0, numpy.maximum(document_lengths - n + 1, 1), 0
+        )
+        shingle_starts = numpy.arange(num_shingles.sum(), dtype=numpy.int64) + numpy.repeat(
+            padded_offsets[:-1] - (numpy.cumsum(num_shingles) - num_shingles), num_shingles
+        )
+        return _fmix64(hashes[shingle_starts]), num_shingles
+
+    def signatures(self, shingles: numpy.ndarray, num_shingles: numpy.ndarray) -> numpy.ndarray:
+        """Compute the MinHash signatures of a batch of documents
+
+        Args:
+            shingles (numpy.ndarray): The shingle hashes, ordered by document
+
+            num_shingles (numpy.ndarray): The number of shingles of each document
+
+        Returns:
+            numpy.ndarray: The uint32 signatures, of shape (num documents, num_permutations).
+            Documents without shingles have all-ones signatures.
+        """
+        num_permutations = self.config.num_permutations
+        signatures = numpy.full(
+            (num_shingles.shape[0], num_permutations), numpy.iinfo(numpy.uint32).max, numpy.uint32
+        )
+        shingle_documents = numpy.repeat(
+            numpy.arange(num_shingles.shape[0], dtype=numpy.int64), num_shingles
+        )
+        step = max(_MAX_HASHES_PER_STEP // num_permutations, 1)
+        for beg in range(0, shingles.shape[0], step):
+            end = min(beg + step, shingles.shape[0])
+            hashes = shingles[beg:end, None] * self.a[None, :]
+            hashes += self.b[None, :]
+            hashes >>= numpy.uint64(32)
+
+            # The documents of a step are contiguous, so each one is a single segment
+            documents = shingle_documents[beg:end]
+            segment_starts = numpy.flatnonzero(
+                numpy.concatenate(([True], documents[1:] != documents[:-1]))
+            )
+            segment_documents = documents[segment_starts]
+            minima = numpy.minimum.reduceat(hashes, segment_starts, axis=0).astype(numpy.uint32)
+            signatures[segment_documents] = numpy.minimum(signatures[segment_documents], minima)
+        return signatures
+
+    def band_keys(self, signatures: numpy.ndarray) -> numpy.ndarray:
+        """Hash every band of a batch of signatures into a 64-bit key
+
+        The band index is mixed into the key, so the keys of all of the bands share one table.
+
+        Args:
+            signatures (numpy.ndarray): The signatures, of shape (num documents, num_permutations)
+
+        Returns:
+            numpy.ndarray: The uint64 keys, of shape (num documents, num_bands)
+        """
+        bands = signatures.reshape(
+            signatures.shape[0], self.config.num_bands, self.config.rows_per_band
+        ).astype(numpy.uint64)
+        keys = (bands * self.row_coefficients).sum(axis=2, dtype=numpy.uint64)
+        keys += self.band_salts
+        return _fmix64(keys)
+
+
+def iterate_document_batches(
+    dataset: IndexedDataset, beg: int, end: int, max_tokens_per_batch: int
+) -> Iterator[Tuple[int, numpy.ndarray, numpy.ndarray, numpy.ndarray]]:
+    """Read a range of documents in batches of whole documents
+
+    Every batch holds as many documents as fit in the token budget, and at least one, and is read
+    with a single get_segments call.
+
+    Args:
+        dataset (IndexedDataset): The dataset
+
+        beg (int): The first document
+
+        end (int): The past-the-last document
+
+        max_tokens_per_batch (int): The token budget of a batch
+
+    Yields:
+        Tuple[int, numpy.ndarray, numpy.ndarray, numpy.ndarray]: The first document of the batch,
+        the concatenated tokens, the sequence lengths, and the document indices into the sequence
+        lengths
+    """
+    document_indices = dataset.document_indices
+    all_sequence_lengths = dataset.sequence_lengths.astype(numpy.int64)
+    sequence_offsets = numpy.concatenate(([0], numpy.cumsum(all_sequence_lengths)))
+    document_token_offsets = sequence_offsets[document_indices]
+    while beg < end:
+        stop = numpy.searchsorted(
+            document_token_offsets, document_token_offsets[beg] + max_tokens_per_batch, side="right"
+        )
+        stop = int(min(max(stop - 1, beg + 1), end))
+
+        sequences = numpy.arange(document_indices[beg], document_indices[stop])
+        sequence_lengths = all_sequence_lengths[sequences]
+        tokens = dataset.get_segments(sequences, numpy.zeros_like(sequences), sequence_lengths)
+        batch_document_indices = document_indices[beg : stop + 1] - document_indices[beg]
+        yield beg, tokens, sequence_lengths, batch_document_indices
+        beg = stop
+
+
+def _get_partition_path(work_dir: str, partition: int, worker: int) -> str:
+    """Get the path to the band table partition written by a worker
+
+    Args:
+        work_dir (str): The working directory
+
+        partition (int): The partition
+
+        worker (int): The worker
+
+    Returns:
+        str: The path to the band table partition
+    """
+    return os.path.join(work_dir, f"band_table_{partition:05d}_{worker:05d}.bin")
+
+
+def _write_band_tables(
+    path_prefixes: List[str],
+    document_offsets: List[int],
+    document_range: Tuple[int, int],
+    work_dir: str,
+    worker: int,
+    config: DeduplicationConfig,
+) -> None:
+    """Stream a range of documents into band table partitions
+
+    Args:
+        path_prefixes (List[str]): The IndexedDataset prefixes
+
+        document_offsets (List[int]): The global id of the first document of every dataset
+
+        document_range (Tuple[int, int]): The global ids of the first and past-the-last documents
+
+        work_dir (str): The working directory
+
+        worker (int): The worker id
+
+        config (DeduplicationConfig): The config
+    """
+    minhasher = MinHasher(config)
+    streams = [
+        open(_get_partition_path(work_dir, partition, worker), "wb")
+        for partition in range(config.num_partitions)
+    ]
+    try:
+        for i, path_prefix in enumerate(path_prefixes):
+            dataset = IndexedDataset(path_prefix)
+            num_documents = dataset.document_indices.shape[0] - 1
+            beg = max(document_range[0] - document_offsets[i], 0)
+            end = min(document_range[1] - document_offsets[i], num_documents)
+            for beg, tokens, sequence_lengths, document_indices in iterate_document_batches(
+                dataset, beg, end, config.max_tokens_per_batch
+            ):
+                sequence_offsets = numpy.concatenate(([0], numpy.cumsum(sequence_lengths)))
+                document_lengths = numpy.diff(sequence_offsets[document_indices])
+
+                shingles, num_shingles = minhasher.shingle(tokens, document_lengths)
+                keys = minhasher.band_keys(minhasher.signatures(shingles, num_shingles))
+
+                # Documents without tokens are never duplicates
+                has_shingles = num_shingles > 0
+                records = numpy.empty(keys[has_shingles].size, dtype=_BAND_RECORD_DTYPE)
+                records["key"] = keys[has_shingles].reshape(-1)
+                records["document"] = numpy.repeat(
+                    document_offsets[i] + beg + numpy.flatnonzero(has_shingles), config.num_bands
+                )
+                partitions = records["key"] % numpy.uint64(config.num_partitions)
+                order = numpy.argsort(partitions, kind="stable")
+                bounds = numpy.searchsorted(
+                    partitions[order], numpy.arange(config.num_partitions + 1, dtype=numpy.uint64)
+                )
+                records = records[order]
+                for partition in range(config.num_partitions):
+                    if bounds[partition] < bounds[partition + 1]:
+                        records[bounds[partition] : bounds[partition + 1]].tofile(
+                            streams[partition]
+                        )
+    finally:
+        for stream in streams:
+            stream.close()
+
+
+def _find(parent: numpy.ndarray, x: numpy.ndarray) -> numpy.ndarray:
+    """Find the roots of a set of elements, and point the elements at their roots
+
+    Args:
+        parent (numpy.ndarray): The union-find parent array
+
+        x (numpy.ndarray): The elements
+
+    Returns:
+        numpy.ndarray: The roots
+    """
+    roots = parent[x]
+    while True:
+        grandparents = parent[roots]
+        if numpy.array_equal(grandparents, roots):
+            break
+        roots = grandparents
+    parent[x] = roots
+    return roots
+
+
+def _union(parent: numpy.ndarray, u: numpy.ndarray, v: numpy.ndarray) -> None:
+    """Merge the sets of the pairs of elements, rooting each set at its smallest element
+
+    Args:
+        parent (numpy.ndarray): The union-find parent array
+
+        u (numpy.ndarray): The first elements of the pairs
+
+        v (numpy.ndarray): The second elements of the pairs
+    """
+    while u.shape[0] > 0:
+        u = _find(parent, u)
+        v = _find(parent, v)
+        unmerged = u != v
+        u, v = u[unmerged], v[unmerged]
+        # A root may be linked to several smaller roots, in which case the smallest wins and the
+        # other pairs are merged in the next iteration
+        numpy.minimum.at(parent, numpy.maximum(u, v), numpy.minimum(u, v))
+
+
+def deduplicate_indexed_datasets(
+    path_prefixes: List[str], work_dir: str, config: DeduplicationConfig
+) -> List[numpy.ndarray]:
+    """Find the near-duplicate documents across IndexedDatasets and save their keep masks
+
+    Duplicates are found across all of the datasets together. Of every cluster of duplicates,
+    the first document in the order of the datasets is kept. The keep mask of each dataset is
+    saved at get_document_keep_mask_path(path_prefix).
+
+    Args:
+        path_prefixes (List[str]): The IndexedDataset prefixes
+
+        work_dir (str): The directory in which to write the band tables, which take 16 bytes
+        per band per document. They are removed on completion.
+
+        config (DeduplicationConfig): The config
+
+    Returns:
+        List[numpy.ndarray]: The document keep mask of each dataset
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="deduplication-", dir=work_dir)
+
+    num_documents = [
+        IndexedDataset(path_prefix).document_indices.shape[0] - 1 for path_prefix in path_prefixes
+    ]
+    document_offsets = numpy.concatenate(([0], numpy.cumsum(num_documents))).tolist()
+    num_documents_total = document_offsets[-1]
+
+    t_beg = time.time()
+    bounds = numpy.linspace(0, num_documents_total, config.num_workers + 1).astype(numpy.int64)
+    worker_args = [
+        (path_prefixes, document_offsets, (int(bounds[w]), int(bounds[w + 1])), work_dir, w, config)
+        for w in range(config.num_workers)
+    ]
+    if config.num_workers == 1:
+        _write_band_tables(*worker_args[0])
+    else:
+        with multiprocessing.Pool(config.num_workers) as pool:
+            pool.starmap(_write_band_tables, worker_args)
+    t_end = time.time()
+    logger.info(
+        f"Wrote the band tables of {num_documents_total} documents in {t_end - t_beg:.2f} seconds"
+    )
+
+    t_beg = time.time()
+    parent = numpy.arange(num_documents_total, dtype=numpy.int64)
+    for partition in range(config.num_partitions):
+        paths = [_get_partition_path(work_dir, partition, w) for w in range(config.num_workers)]
+        records = numpy.concatenate(
+            [numpy.fromfile(path, dtype=_BAND_RECORD_DTYPE) for path in paths]
+        )
+        for path in paths:
+            os.remove(path)
+        if records.shape[0] < 2:
+            continue
+        records = records[numpy.argsort(records["key"], kind="stable")]
+        same_key = numpy.flatnonzero(records["key"][1:] == records["key"][:-1])
+        _union(parent, records["document"][same_key], records["document"][same_key + 1])
+    roots = _find(parent, numpy.arange(num_documents_total, dtype=numpy.int64))
+    keep = roots == numpy.arange(num_documents_total, dtype=numpy.int64)
+    t_end = time.time()
+    logger.info(
+        f"Clustered the band tables in {t_end - t_beg:.2f} seconds, keeping "
+        f"{keep.sum()} of {num_documents_total} documents"
+    )
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    keep_masks = []
+    for i, path_prefix in enumerate(path_prefixes):
+        keep_mask = keep[document_offsets[i] : document_offsets[i + 1]]
+        save_document_keep_mask(path_prefix, keep_mask)
+        keep_masks.append(keep_mask)
+    return keep_masks
@@ -1,19 +1,24 @@
 # Copyright (c) 2023, NVIDIA CORPORATION. All rights reserved.
 
+import hashlib
+import json
 import logging
 import os
+import shutil
 import time
 from dataclasses import dataclass
-from typing import Dict, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 import numpy
 import torch
 
 from megatron.core.datasets.blended_megatron_dataset_config import BlendedMegatronDatasetConfig
+from megatron.core.datasets.deduplication import load_document_keep_mask
 from megatron.core.datasets.indexed_dataset import IndexedDataset
+from megatron.core.datasets.indices_file import IndicesFile, write_indices_file
 from megatron.core.datasets.megatron_dataset import MegatronDataset
 from megatron.core.datasets.megatron_tokenizer import MegatronTokenizer
-from megatron.core.datasets.utils import Split
+from megatron.core.datasets.utils import Split, atomic_write_path
 from megatron.core.datasets.utils_s3 import S3Config, is_s3_path
 from megatron.core.utils import log_single_rank
 
@@ -40,6 +45,25 @@ class GPTDatasetConfig(BlendedMegatronDatasetConfig):
        generates masks by itself.
     """
 
+    create_cu_seqlens: bool = False
+    """Option to return the document boundaries of every sample as cumulative sequence lengths,
+       the compact alternative to a reset attention mask for packed sequence attention kernels.
+       The cu_seqlens are padded with -1 to a fixed length of sequence_length + 1.
+    """
+
+    sequence_packing: Optional[str] = None
+    """Option to pack whole documents into samples rather than concatenate the documents across
+       sample boundaries, with the given bin packing algorithm, "first-fit-decreasing" or
+       "best-fit". Documents longer than a sample are truncated. The samples are padded, always
+       come with cu_seqlens, and have their attention masks and position ids reset at every
+       document boundary, whatever reset_attention_mask and reset_position_ids say.
+    """
+
+    use_document_keep_masks: bool = False
+    """Option to drop the documents which are excluded by the document keep mask saved next to
+       every dataset, e.g. by tools/deduplicate_dataset.py
+    """
+
     drop_last_partial_validation_sequence: bool = True
     """Option to drop the last partial validation sequence"""
 
@@ -61,6 +85,8 @@ class GPTDatasetConfig(BlendedMegatronDatasetConfig):
         assert self.reset_attention_mask is not None
         assert self.eod_mask_loss is not None
 
+        assert self.sequence_packing in (None, "first-fit-decreasing", "best-fit")
+
 
 class GPTDataset(MegatronDataset):
     """The base GPT dataset
@@ -91,11 +117,29 @@ class GPTDataset(MegatronDataset):
         super().__init__(
             indexed_dataset, dataset_path, indexed_indices, num_samples, index_split, config
         )
+        # Only identify the options below when they are used, so the other indices keep their hash
+        if self.config.sequence_packing is not None:
+            self.unique_identifiers["sequence_packing"] = self.config.sequence_packing
+        if self.config.use_document_keep_masks and self.dataset_path is not None:
+            keep, self.unique_identifiers["document_keep_mask"] = load_document_keep_mask(
+                self.dataset_path, self.dataset.document_indices.shape[0] - 1
+            )
+            # Map the document mask onto the sequences, by which the GPT indices are split
+            keep = numpy.repeat(keep, numpy.diff(self.dataset.document_indices))
+            self.indices = self.indices[keep[self.indices]]
+        self.unique_description = json.dumps(
+            self.unique_identifiers, indent=4, default=lambda obj: obj.unique_identifiers
+        )
+        self.unique_description_hash = hashlib.md5(
+            self.unique_description.encode("utf-8")
+        ).hexdigest()
+
         self.masks_and_position_ids_are_cacheable = not any(
             [
                 self.config.reset_position_ids,
                 self.config.reset_attention_mask,
                 self.config.eod_mask_loss,
+                self.config.sequence_packing,
             ]
         )
         self.masks_and_position_ids_are_cached = False
@@ -171,7 +215,105 @@ class GPTDataset(MegatronDataset):
         else:
             text, _ = self._query_document_sample_shuffle_indices(idx)
 
-        text = torch.from_numpy(text).long()
+        document_lengths = None
+        if self.config.sequence_packing is not None:
+            document_lengths = self._get_packed_document_lengths(0 if idx is None else idx)
+
+        return self._build_sample(torch.from_numpy(text).long(), idx, document_lengths)
+
+    def __getitems__(self, indices: List[Optional[int]]) -> List[Dict[str, torch.Tensor]]:
+        """Get a batch of samples, for use by torch.utils.data.DataLoader in place of one
+        __getitem__ call per index
+
+        If the indices have an `upcoming` attribute, e.g. the batches of a Megatron sampler with a
+        prefetch lookahead, the samples at those indices are prefetched once the batch is read.
+
+        Args:
+            indices (List[Optional[int]]): The indices into the dataset
+
+        Returns:
+            List[Dict[str, torch.Tensor]]: The sample information wrapped in dictionaries, in the order of the indices
+        """
+        samples = self._get_samples(indices)
+        upcoming = getattr(indices, "upcoming", None)
+        if upcoming:
+            self.prefetch(upcoming)
+        return samples
+
+    def _get_samples(self, indices: List[Optional[int]]) -> List[Dict[str, torch.Tensor]]:
+        # Subclasses which override __getitem__ define their own sample format
+        if type(self).__getitem__ is not GPTDataset.__getitem__:
+            return [self[idx] for idx in indices]
+
+        text = self._query_document_sample_shuffle_indices_batch(
+            # Batch padding sequence so the index does not matter
+            [0 if idx is None else idx for idx in indices]
+        )
+        text = torch.from_numpy(text)
+
+        if self.config.sequence_packing is not None:
+            return [
+                self._build_sample(
+                    text[i], idx, self._get_packed_document_lengths(0 if idx is None else idx)
+                )
+                for i, idx in enumerate(indices)
+            ]
+
+        return [self._build_sample(text[i], idx) for i, idx in enumerate(indices)]
+
+    @property
+    def benefits_from_prefetch(self) -> bool:
+        """Whether `prefetch` hints speed up the reads, e.g. when streaming from S3
+
+        Returns:
+            bool: Whether the low-level dataset acts on the hints
+        """
+        return getattr(self.dataset, "benefits_from_prefetch", False)
+
+    def prefetch(self, indices: List[int]) -> None:
+        """Hint that the samples at the given indices will be read soon
+
+        The documents which make up the samples are passed on to the low-level dataset, which may
+        start fetching them in the background, e.g. when streaming from S3.
+
+        Args:
+            indices (List[int]): The indices into the dataset, in order of upcoming use
+        """
+        sample_ids = self.shuffle_index[numpy.asarray(indices, dtype=numpy.int64)].astype(
+            numpy.int64
+        )
+        if self.config.sequence_packing is not None:
+            doc_index_beg = self.sample_index[sample_ids].astype(numpy.int64)
+            doc_counts = self.sample_index[sample_ids + 1].astype(numpy.int64) - doc_index_beg
+        else:
+            doc_index_beg = self.sample_index[sample_ids, 0].astype(numpy.int64)
+            doc_index_end = self.sample_index[sample_ids + 1, 0].astype(numpy.int64)
+            doc_counts = doc_index_end - doc_index_beg + 1
+        # The document index positions from doc_index_beg to doc_index_end of every sample, in order
+        doc_positions = numpy.repeat(
+            doc_index_beg - (numpy.cumsum(doc_counts) - doc_counts), doc_counts
+        ) + numpy.arange(doc_counts.sum(), dtype=numpy.int64)
+        self.dataset.prefetch(self.document_index[doc_positions])
+
+    def _build_sample(
+        self,
+        text: torch.Tensor,
+        idx: Optional[int],
+        document_lengths: Optional[numpy.ndarray] = None,
+    ) -> Dict[str, torch.Tensor]:
+        """Build the sample dictionary from the sample text
+
+        Args:
+            text (torch.Tensor): The text (token ids) of the sample, of type torch.long
+
+            idx (Optional[int]): The index into the dataset, None for a batch padding sequence
+
+            document_lengths (Optional[numpy.ndarray]): The lengths of the whole documents which
+            make up the text of a packed sample, None for an unpacked sample
+
+        Returns:
+            Dict[str, torch.Tensor]: The sample information wrapped in a dictionary
+        """
         if self.config.add_extra_token_to_sequence:
             tokens = text[:-1].contiguous()
             labels = text[1:].contiguous()
@@ -180,7 +322,17 @@ class GPTDataset(MegatronDataset):
             labels = torch.roll(text, shifts=-1, dims=0)
             labels[-1] = self._pad_token_id
 
-        if (
+        if document_lengths is not None:
+            attention_mask, loss_mask, position_ids, cu_seqlens = (
+                _get_packed_masks_and_position_ids(
+                    tokens,
+                    document_lengths,
+                    self.config.tokenizer.eod,
+                    self.config.eod_mask_loss,
+                    self.config.create_attention_mask,
+                )
+            )
+        elif (
             not self.masks_and_position_ids_are_cacheable
             or not self.masks_and_position_ids_are_cached
         ):
@@ -202,6 +354,9 @@ class GPTDataset(MegatronDataset):
             loss_mask = self.cached_loss_mask
             position_ids = self.cached_position_ids
 
+        if self.config.create_cu_seqlens and document_lengths is None:
+            cu_seqlens = _get_cu_seqlens(tokens, self.config.tokenizer.eod)
+
         # For padded sequences, mask the loss
         loss_mask[labels == self._pad_token_id] = 0.0
 
@@ -213,21 +368,15 @@ class GPTDataset(MegatronDataset):
         if idx is None:
             loss_mask = torch.zeros_like(loss_mask)
 
+        sample = {"tokens": tokens, "labels": labels}
         if self.config.create_attention_mask:
-            return {
-                "tokens": tokens,
-                "labels": labels,
-                "attention_mask": attention_mask,
-                "loss_mask": loss_mask,
-                "position_ids": position_ids,
-            }
-        else:
-            return {
-                "tokens": tokens,
-                "labels": labels,
-                "loss_mask": loss_mask,
-                "position_ids": position_ids,
-            }
+            sample["attention_mask"] = attention_mask
+        sample["loss_mask"] = loss_mask
+        sample["position_ids"] = position_ids
+        if self.config.create_cu_seqlens or document_lengths is not None:
+            sample["cu_seqlens"] = cu_seqlens
+
+        return sample
 
     def _query_document_sample_shuffle_indices(
         self, idx: int
@@ -243,6 +392,9 @@ class GPTDataset(MegatronDataset):
         # Do the shuffle mapping
         idx = self.shuffle_index[idx]
 
+        if self.config.sequence_packing is not None:
+            return self._query_packed_sample_index(idx)
+
         # Get the beginning and end documents and offsets
         doc_index_beg, doc_index_beg_offset = self.sample_index[idx]
         doc_index_end, doc_index_end_offset = self.sample_index[idx + 1]
@@ -300,6 +452,124 @@ class GPTDataset(MegatronDataset):
             numpy.array(document_ids, dtype=numpy.int64),
         )
 
+    def _query_document_sample_shuffle_indices_batch(self, indices: List[int]) -> numpy.ndarray:
+        """Get the text (token ids) for a batch of indices
+
+        The batch counterpart to _query_document_sample_shuffle_indices: the documents spanned by
+        every sample are resolved at once and their tokens are gathered with a single call to the
+        low-level dataset.
+
+        Args:
+            indices (List[int]): The indices into the dataset
+
+        Returns:
+            numpy.ndarray: The text ids, one padded sample per row
+        """
+        sample_length = self.config.sequence_length + self.config.add_extra_token_to_sequence
+
+        if len(indices) == 0:
+            return numpy.empty((0, sample_length), dtype=numpy.int64)
+
+        # Do the shuffle mapping
+        indices = self.shuffle_index[numpy.asarray(indices, dtype=numpy.int64)].astype(numpy.int64)
+
+        if self.config.sequence_packing is not None:
+            # Every sample is made of whole documents, truncated to the sample length
+            doc_index_beg = self.sample_index[indices].astype(numpy.int64)
+            num_parts = self.sample_index[indices + 1].astype(numpy.int64) - doc_index_beg
+        else:
+            # Get the beginning and end documents and offsets
+            doc_index_beg, doc_index_beg_offset = self.sample_index[indices].astype(numpy.int64).T
+            doc_index_end, doc_index_end_offset = (
+                self.sample_index[indices + 1].astype(numpy.int64).T
+            )
+            num_parts = doc_index_end - doc_index_beg + 1
+
+        # Enumerate the sample parts, i.e. every (sample, spanned document) pair
+        part_end = numpy.cumsum(num_parts)
+        part_beg = part_end - num_parts
+        doc_index = numpy.repeat(doc_index_beg - part_beg, num_parts) + numpy.arange(
+            part_end[-1], dtype=numpy.int64
+        )
+        document_ids = self.document_index[doc_index].astype(numpy.int64)
+
+        part_offset = numpy.zeros(part_end[-1], dtype=numpy.int64)
+        if self.config.sequence_packing is not None:
+            part_length = numpy.minimum(
+                self.dataset.sequence_lengths[document_ids].astype(numpy.int64), sample_length
+            )
+        else:
+            # The first part starts at the beginning offset, the others at the start of the
+            # document
+            part_offset[part_beg] = doc_index_beg_offset
+
+            # The last part ends at the end offset, the others at the end of the document
+            part_length = (
+                self.dataset.sequence_lengths[document_ids].astype(numpy.int64) - part_offset
+            )
+            part_length[part_end - 1] = (
+                doc_index_end_offset
+                + self.config.add_extra_token_to_sequence
+                - part_offset[part_end - 1]
+            )
+
+        tokens = self.dataset.get_segments(document_ids, part_offset, part_length)
+
+        # Scatter the tokens into the rows and pad the samples if necessary
+        length = numpy.add.reduceat(part_length, part_beg)
+        row = numpy.repeat(numpy.arange(len(indices)), length)
+        column = numpy.arange(tokens.shape[0], dtype=numpy.int64) - numpy.repeat(
+            numpy.cumsum(length) - length, length
+        )
+        text = numpy.full((len(indices), sample_length), self._pad_token_id, dtype=numpy.int64)
+        text[row, column] = tokens
+
+        return text
+
+    def _query_packed_sample_index(self, sample_id: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Get the text (token ids) and document ids of a packed sample
+
+        Args:
+            sample_id (int): The index into the sample index, i.e. after the shuffle mapping
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray]: The text ids and document ids
+        """
+        sample_length = self.config.sequence_length + self.config.add_extra_token_to_sequence
+
+        document_ids = self.document_index[
+            self.sample_index[sample_id] : self.sample_index[sample_id + 1]
+        ].astype(numpy.int64)
+        lengths = numpy.minimum(
+            self.dataset.sequence_lengths[document_ids].astype(numpy.int64), sample_length
+        )
+        tokens = self.dataset.get_segments(
+            document_ids, numpy.zeros(len(document_ids), dtype=numpy.int64), lengths
+        )
+
+        text = numpy.full(sample_length, self._pad_token_id, dtype=numpy.int64)
+        text[: len(tokens)] = tokens
+
+        return text, document_ids
+
+    def _get_packed_document_lengths(self, idx: int) -> numpy.ndarray:
+        """Get the lengths of the documents which make up a packed sample
+
+        Args:
+            idx (int): The index into the dataset
+
+        Returns:
+            numpy.ndarray: The document lengths, in order, truncated to the sample length
+        """
+        sample_id = self.shuffle_index[idx]
+        document_ids = self.document_index[
+            self.sample_index[sample_id] : self.sample_index[sample_id + 1]
+        ]
+        return numpy.minimum(
+            self.dataset.sequence_lengths[document_ids].astype(numpy.int64),
+            self.config.sequence_length + self.config.add_extra_token_to_sequence,
+        )
+
     def _build_document_sample_shuffle_indices(
         self,
     ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
@@ -312,6 +582,8 @@ class GPTDataset(MegatronDataset):
         The sample index:
             -- 2-D
             -- The document indices and offsets which mark the start of every sample
+            -- 1-D when packing sequences, the document indices which mark the start of every
+               sample, every sample being made of whole documents
 
         The shuffle index:
             -- 1-D
@@ -332,23 +604,27 @@ class GPTDataset(MegatronDataset):
                 f"{self.unique_description_hash}-{type(self).__name__}-{self.index_split.name}-{suffix}",
             )
             path_to_description = get_path_to("description.txt")
+            path_to_indices = get_path_to("indices.bin")
             path_to_document_index = get_path_to("document_index.npy")
             path_to_sample_index = get_path_to("sample_index.npy")
             path_to_shuffle_index = get_path_to("shuffle_index.npy")
             cache_hit = all(
                 map(
                     os.path.isfile,
-                    [
-                        path_to_description,
-                        path_to_document_index,
-                        path_to_sample_index,
-                        path_to_shuffle_index,
-                    ],
+                    [path_to_description]
+                    + [get_path_to(suffix) for suffix in self._get_index_suffixes()],
                 )
             )
         else:
             cache_hit = False
 
+        if (
+            path_to_cache
+            and not cache_hit
+            and (not torch.distributed.is_initialized() or torch.distributed.get_rank() == 0)
+        ):
+            cache_hit = self._reuse_cached_indices(path_to_cache, get_path_to)
+
         if not path_to_cache or (
             not cache_hit
             and (not torch.distributed.is_initialized() or torch.distributed.get_rank() == 0)
@@ -362,107 +638,109 @@ class GPTDataset(MegatronDataset):
             self.built_anew_on_cache_miss = True
             t_beg = time.time()
 
-            sequence_length = self.config.sequence_length
-            num_tokens_per_epoch = self._get_num_tokens_per_epoch()
-            num_epochs = self._get_num_epochs(num_tokens_per_epoch)
-
-            if num_epochs == 1:
-                separate_final_epoch = False
+            if self.config.sequence_packing is not None:
+                document_index, sample_index, shuffle_index, num_epochs = (
+                    self._build_packed_document_sample_shuffle_indices()
+                )
             else:
-                # Get the number of samples for the last epoch
-                num_samples_sans_final_epoch = (
-                    (num_epochs - 1) * num_tokens_per_epoch
-                    - self.config.add_extra_token_to_sequence
-                ) // sequence_length
-                num_samples_from_final_epoch = self.num_samples - num_samples_sans_final_epoch
-                num_samples_per_epoch = (
-                    num_tokens_per_epoch - self.config.add_extra_token_to_sequence
-                ) // sequence_length
-
-                # num_samples_from_final_epoch should be non-negative
-                assert num_samples_from_final_epoch >= 0
-
-                # num_samples_from_final_epoch should not exceed max value
-                assert num_samples_from_final_epoch <= num_samples_per_epoch + 1
-
-                # Separate the final epoch if it falls below the threshold
-                threshold = 0.80
-                separate_final_epoch = num_samples_from_final_epoch < int(
-                    threshold * num_samples_per_epoch
+                sequence_length = self.config.sequence_length
+                num_tokens_per_epoch = self._get_num_tokens_per_epoch()
+                num_epochs = self._get_num_epochs(num_tokens_per_epoch, self.num_samples)
+                separate_final_epoch = self._get_separate_final_epoch(
+                    num_tokens_per_epoch, num_epochs, self.num_samples
                 )
 
                 log_single_rank(
-                    logger,
-                    logging.DEBUG,
-                    f"> num_samples_from_final_epoch: {num_samples_from_final_epoch}",
+                    logger, logging.DEBUG, f"> separate_final_epoch: {separate_final_epoch}"
                 )
-                log_single_rank(logger, logging.DEBUG, f"> threshold: {threshold}")
-                log_single_rank(
-                    logger, logging.DEBUG, f"> num_samples_per_epoch: {num_samples_per_epoch}"
-                )
-
-            log_single_rank(
-                logger, logging.DEBUG, f"> separate_final_epoch: {separate_final_epoch}"
-            )
 
-            numpy_random_state = numpy.random.RandomState(self.config.random_seed)
-
-            # Build the document index
-            document_index = _build_document_index(
-                self.indices, num_epochs, numpy_random_state, separate_final_epoch
-            )
+                numpy_random_state = numpy.random.RandomState(self.config.random_seed)
 
-            drop_last_partial_sequence = True
-            if self.index_split == Split.valid:
-                drop_last_partial_sequence = self.config.drop_last_partial_validation_sequence
-
-            # Build the sample index
-            from megatron.core.datasets import helpers
+                # Build the document index
+                document_index = _build_document_index(
+                    self.indices, num_epochs, numpy_random_state, separate_final_epoch
+                )
 
-            if self.index_split == Split.valid:
-                drop_last_partial_sequence = self.config.drop_last_partial_validation_sequence
-            else:
                 drop_last_partial_sequence = True
-
-            assert document_index.dtype == numpy.int32
-            assert self.dataset.sequence_lengths.dtype == numpy.int32
-            if len(document_index) * 2 > len(self.dataset.sequence_lengths):
-                # Heuristic: if "access density" of sequence_lengths is relatively high,
-                # force loading the mmap-ed array into memory by taking a copy.
-                # System performance benefits come from two aspects:
-                # 1. **sequentially** pre-loading the whole file if we're gonna read a large fraction anyways.
-                # 2. GIL is held when calling into c++ code; making the c++ func faster improves parallelism.
-                sequence_lengths_for_cpp = self.dataset.sequence_lengths.copy()
-            else:
-                sequence_lengths_for_cpp = self.dataset.sequence_lengths
-            sample_index = helpers.build_sample_idx(
-                sequence_lengths_for_cpp,
-                document_index,
-                sequence_length,
-                num_epochs,
-                num_tokens_per_epoch,
-                drop_last_partial_sequence,
-                self.config.add_extra_token_to_sequence,
-            )
-
-            # Build the shuffle index
-            if separate_final_epoch:
-                shuffle_index = _build_shuffle_index(
-                    num_samples_sans_final_epoch, sample_index.shape[0] - 1, numpy_random_state
+                if self.index_split == Split.valid:
+                    drop_last_partial_sequence = self.config.drop_last_partial_validation_sequence
+
+                # Build the sample index
+                from megatron.core.datasets import helpers
+
+                if self.index_split == Split.valid:
+                    drop_last_partial_sequence = self.config.drop_last_partial_validation_sequence
+                else:
+                    drop_last_partial_sequence = True
+
+                assert document_index.dtype == numpy.int32
+                assert self.dataset.sequence_lengths.dtype in (numpy.int32, numpy.int64)
+                if len(document_index) * 2 > len(self.dataset.sequence_lengths):
+                    # Heuristic: if "access density" of sequence_lengths is relatively high,
+                    # force loading the mmap-ed array into memory by taking a copy.
+                    # System performance benefits come from **sequentially** pre-loading the whole
+                    # file if we're gonna read a large fraction anyways.
+                    sequence_lengths_for_cpp = self.dataset.sequence_lengths.copy()
+                else:
+                    sequence_lengths_for_cpp = self.dataset.sequence_lengths
+                # Share the cores among the concurrent dataset builders
+                num_threads = max(
+                    1,
+                    (os.cpu_count() or 1)
+                    // (
+                        self.config.num_dataset_builder_threads
+                        * self.config.num_dataset_builder_processes
+                    ),
                 )
-            else:
-                shuffle_index = _build_shuffle_index(
-                    sample_index.shape[0] - 1, sample_index.shape[0] - 1, numpy_random_state
+                # The GIL is released while the sample index is built
+                sample_index = helpers.build_sample_idx_parallel(
+                    sequence_lengths_for_cpp,
+                    document_index,
+                    sequence_length,
+                    num_epochs,
+                    num_tokens_per_epoch,
+                    drop_last_partial_sequence,
+                    self.config.add_extra_token_to_sequence,
+                    num_threads,
                 )
 
+                # Build the shuffle index
+                if separate_final_epoch:
+                    num_samples_sans_final_epoch = (
+                        (num_epochs - 1) * num_tokens_per_epoch
+                        - self.config.add_extra_token_to_sequence
+                    ) // sequence_length
+                    shuffle_index = _build_shuffle_index(
+                        num_samples_sans_final_epoch, sample_index.shape[0] - 1, numpy_random_state
+                    )
+                else:
+                    shuffle_index = _build_shuffle_index(
+                        sample_index.shape[0] - 1, sample_index.shape[0] - 1, numpy_random_state
+                    )
+
             if path_to_cache:
                 os.makedirs(path_to_cache, exist_ok=True)
                 # Write the description
-                with open(path_to_description, "wt") as writer:
-                    writer.write(self.unique_description)
-                numpy.save(path_to_document_index, document_index, allow_pickle=True)
-                numpy.save(path_to_sample_index, sample_index, allow_pickle=True)
-                numpy.save(path_to_shuffle_index, shuffle_index, allow_pickle=True)
+                with atomic_write_path(path_to_description) as path:
+                    with open(path, "wt") as writer:
+                        writer.write(self.unique_description)
+                if self.config.consolidate_cached_indices:
+                    with atomic_write_path(path_to_indices) as path:
+                        write_indices_file(
+                            path,
+                            {
+                                "document_index": document_index,
+                                "sample_index": sample_index,
+                                "shuffle_index": shuffle_index,
+                            },
+                        )
+                else:
+                    with atomic_write_path(path_to_document_index) as path:
+                        numpy.save(path, document_index, allow_pickle=True)
+                    with atomic_write_path(path_to_sample_index) as path:
+                        numpy.save(path, sample_index, allow_pickle=True)
+                    with atomic_write_path(path_to_shuffle_index) as path:
+                        numpy.save(path, shuffle_index, allow_pickle=True)
             else:
                 log_single_rank(
                     logger,
@@ -484,6 +762,21 @@ class GPTDataset(MegatronDataset):
             logger, logging.INFO, f"Load the {type(self).__name__} {self.index_split.name} indices"
         )
 
+        if self.config.consolidate_cached_indices:
+            log_single_rank(
+                logger, logging.INFO, f"\tMap the indices from {os.path.basename(path_to_indices)}"
+            )
+            indices = IndicesFile(path_to_indices)
+            document_index = indices["document_index"]
+            sample_index = indices["sample_index"]
+            shuffle_index = indices["shuffle_index"]
+
+            log_single_rank(
+                logger, logging.INFO, f"> total number of samples: {sample_index.shape[0] - 1}"
+            )
+
+            return document_index, sample_index, shuffle_index
+
         log_single_rank(
             logger,
             logging.INFO,
@@ -520,36 +813,233 @@ class GPTDataset(MegatronDataset):
 
         return document_index, sample_index, shuffle_index
 
+    def _build_packed_document_sample_shuffle_indices(
+        self,
+    ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, int]:
+        """Build the document index, the sample index, and the shuffle index for packed sequences
+
+        The documents of every epoch are shuffled as usual and then packed, whole, into samples.
+        The document index is reordered so that the documents of every sample are contiguous.
+        Epochs are added until the packing yields the requested number of samples.
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, int]: The document index, the sample
+            index, the shuffle index, and the number of epochs
+        """
+        from megatron.core.datasets import helpers
+
+        sample_length = self.config.sequence_length + self.config.add_extra_token_to_sequence
+        num_epochs = self._get_num_epochs(self._get_num_tokens_per_epoch(), self.num_samples)
+
+        assert self.dataset.sequence_lengths.dtype in (numpy.int32, numpy.int64)
+        while True:
+            numpy_random_state = numpy.random.RandomState(self.config.random_seed)
+            document_index = _build_document_index(
+                self.indices, num_epochs, numpy_random_state, False
+            )
+            # The GIL is released while the documents are packed
+            document_index, sample_index = helpers.build_packed_sample_idx(
+                self.dataset.sequence_lengths,
+                document_index,
+                sample_length,
+                self.config.sequence_packing == "best-fit",
+            )
+            num_samples = sample_index.shape[0] - 1
+            if self.num_samples is None or num_samples >= self.num_samples:
+                break
+            num_epochs += 1
+
+        num_tokens = int(
+            numpy.minimum(self.dataset.sequence_lengths[document_index], sample_length).sum()
+        )
+        log_single_rank(
+            logger,
+            logging.INFO,
+            f"> packed token utilization: {num_tokens / max(num_samples * sample_length, 1):.4f}",
+        )
+
+        shuffle_index = _build_shuffle_index(num_samples, num_samples, numpy_random_state)
+
+        return document_index, sample_index, shuffle_index, num_epochs
+
+    def _reuse_cached_indices(self, path_to_cache: str, get_path_to: Callable[[str], str]) -> bool:
+        """Reuse the cached indices of a dataset which differs from this one in num_samples only
+
+        The indices depend on num_samples only through the number of epochs and whether the final
+        epoch is shuffled separately. When a cache built for another num_samples agrees on both,
+        its indices are identical to those this dataset would build, so they are linked (or copied)
+        under this dataset's description hash rather than built anew.
+
+        Args:
+            path_to_cache (str): The cache directory
+
+            get_path_to (Callable[[str], str]): The cache path getter for this dataset
+
+        Returns:
+            bool: Whether reusable indices were found and linked
+        """
+        # The number of epochs of packed indices is only known once the documents are packed
+        if not os.path.isdir(path_to_cache) or self.config.sequence_packing is not None:
+            return False
+
+        suffix = f"-{type(self).__name__}-{self.index_split.name}-description.txt"
+        unique_identifiers = json.loads(self.unique_description)
+        num_samples = unique_identifiers.pop("num_samples")
+        index_suffixes = self._get_index_suffixes()
+
+        num_tokens_per_epoch = None
+        for filename in sorted(os.listdir(path_to_cache)):
+            if not filename.endswith(suffix) or filename.startswith("."):
+                continue
+            try:
+                with open(os.path.join(path_to_cache, filename), "rt") as reader:
+                    cached_unique_identifiers = json.load(reader)
+            except (OSError, json.JSONDecodeError):
+                continue
+            if "num_samples" not in cached_unique_identifiers:
+                continue
+            cached_num_samples = cached_unique_identifiers.pop("num_samples")
+            if cached_unique_identifiers != unique_identifiers:
+                continue
+
+            cached_unique_description_hash = filename[: -len(suffix)]
+            get_cached_path_to = lambda suffix: os.path.join(
+                path_to_cache,
+                f"{cached_unique_description_hash}-{type(self).__name__}-{self.index_split.name}-{suffix}",
+            )
+            if not all(os.path.isfile(get_cached_path_to(suffix)) for suffix in index_suffixes):
+                continue
+
+            if num_tokens_per_epoch is None:
+                num_tokens_per_epoch = self._get_num_tokens_per_epoch()
+                num_epochs = self._get_num_epochs(num_tokens_per_epoch, num_samples)
+                separate_final_epoch = self._get_separate_final_epoch(
+                    num_tokens_per_epoch, num_epochs, num_samples
+                )
+            cached_num_epochs = self._get_num_epochs(num_tokens_per_epoch, cached_num_samples)
+            if cached_num_epochs != num_epochs:
+                continue
+            cached_separate_final_epoch = self._get_separate_final_epoch(
+                num_tokens_per_epoch, cached_num_epochs, cached_num_samples
+            )
+            if cached_separate_final_epoch != separate_final_epoch:
+                continue
+
+            log_single_rank(
+                logger,
+                logging.INFO,
+                f"Reuse the {type(self).__name__} {self.index_split.name} indices from {cached_unique_description_hash}",
+            )
+            for index_suffix in index_suffixes:
+                with atomic_write_path(get_path_to(index_suffix)) as path:
+                    try:
+                        os.link(get_cached_path_to(index_suffix), path)
+                    except OSError:
+                        shutil.copyfile(get_cached_path_to(index_suffix), path)
+            with atomic_write_path(get_path_to("description.txt")) as path:
+                with open(path, "wt") as writer:
+                    writer.write(self.unique_description)
+            return True
+
+        return False
+
+    def _get_index_suffixes(self) -> List[str]:
+        """Get the cache file suffixes of the indices, which depend on the cache format
+
+        Returns:
+            List[str]: The cache file suffixes
+        """
+        if self.config.consolidate_cached_indices:
+            return ["indices.bin"]
+        return ["document_index.npy", "sample_index.npy", "shuffle_index.npy"]
+
     def _get_num_tokens_per_epoch(self) -> int:
         """Calculate the number of tokens in a single epoch
 
         Returns:
-            int: The number of tokens in a single epoch
+            int: The number of tokens in a single epoch, counting documents truncated to the sample
+            length when packing sequences
         """
+        if self.config.sequence_packing is not None:
+            return int(
+                numpy.minimum(
+                    self.dataset.sequence_lengths[self.indices],
+                    self.config.sequence_length + self.config.add_extra_token_to_sequence,
+                ).sum(dtype=numpy.int64)
+            )
         return int(numpy.sum(self.dataset.sequence_lengths[self.indices]))
 
-    def _get_num_epochs(self, num_tokens_per_epoch: int) -> int:
+    def _get_num_epochs(self, num_tokens_per_epoch: int, num_samples: Optional[int]) -> int:
         """Calculate the number of epochs
 
         Args:
             num_tokens_per_epoch (int): The number of tokens in a single epoch
 
+            num_samples (Optional[int]): The number of samples to draw, None for a single epoch
+
         Returns:
             int: The number of epochs
         """
         num_epochs = 1
         num_tokens = num_tokens_per_epoch
-        if self.num_samples is None:
+        if num_samples is None:
             return num_epochs
         else:
             num_tokens_requested = (
-                self.num_samples * self.config.sequence_length
+                num_samples * self.config.sequence_length
             ) + self.config.add_extra_token_to_sequence
             while num_tokens < num_tokens_requested:
                 num_epochs += 1
                 num_tokens += num_tokens_per_epoch
         return num_epochs
 
+    def _get_separate_final_epoch(
+        self, num_tokens_per_epoch: int, num_epochs: int, num_samples: Optional[int]
+    ) -> bool:
+        """Calculate whether to exclude the final epoch from the global shuffle
+
+        Args:
+            num_tokens_per_epoch (int): The number of tokens in a single epoch
+
+            num_epochs (int): The number of epochs
+
+            num_samples (Optional[int]): The number of samples to draw, None for a single epoch
+
+        Returns:
+            bool: Whether to separate the final epoch
+        """
+        if num_epochs == 1:
+            return False
+
+        sequence_length = self.config.sequence_length
+
+        # Get the number of samples for the last epoch
+        num_samples_sans_final_epoch = (
+            (num_epochs - 1) * num_tokens_per_epoch - self.config.add_extra_token_to_sequence
+        ) // sequence_length
+        num_samples_from_final_epoch = num_samples - num_samples_sans_final_epoch
+        num_samples_per_epoch = (
+            num_tokens_per_epoch - self.config.add_extra_token_to_sequence
+        ) // sequence_length
+
+        # num_samples_from_final_epoch should be non-negative
+        assert num_samples_from_final_epoch >= 0
+
+        # num_samples_from_final_epoch should not exceed max value
+        assert num_samples_from_final_epoch <= num_samples_per_epoch + 1
+
+        # Separate the final epoch if it falls below the threshold
+        threshold = 0.80
+        separate_final_epoch = num_samples_from_final_epoch < int(threshold * num_samples_per_epoch)
+
+        log_single_rank(
+            logger, logging.DEBUG, f"> num_samples_from_final_epoch: {num_samples_from_final_epoch}"
+        )
+        log_single_rank(logger, logging.DEBUG, f"> threshold: {threshold}")
+        log_single_rank(logger, logging.DEBUG, f"> num_samples_per_epoch: {num_samples_per_epoch}")
+
+        return separate_final_epoch
+
 
 def _build_document_index(
     documents: numpy.ndarray,
@@ -646,13 +1136,6 @@ def _get_ltor_masks_and_position_ids(
     """
     seq_length = data.numel()
 
-    if create_attention_mask:
-        attention_mask = torch.tril(
-            torch.ones((seq_length, seq_length), device=data.device)
-        ).unsqueeze(0)
-    else:
-        attention_mask = None
-
     # Loss mask.
     loss_mask = torch.ones(seq_length, dtype=torch.float, device=data.device)
     if eod_mask_loss:
@@ -660,36 +1143,147 @@ def _get_ltor_masks_and_position_ids(
 
     # Position ids.
     position_ids = torch.arange(seq_length, dtype=torch.long, device=data.device)
-    # We need to clone as the ids will be modifed based on batch index.
+
+    if reset_position_ids or (reset_attention_mask and create_attention_mask):
+        document_start_ids = _get_document_start_ids(data, eod_token)
+
+    # Reset positions.
     if reset_position_ids:
-        position_ids = position_ids.clone()
-
-    if reset_position_ids or reset_attention_mask:
-        # Find indices where EOD token is.
-        eod_index = position_ids[data == eod_token]
-        # Detach indices from positions if going to modify positions.
-        if reset_position_ids:
-            eod_index = eod_index.clone()
-
-        # Loop through EOD indices:
-        prev_index = 0
-        for j in range(eod_index.numel()):
-            i = eod_index[j]
-            # Mask attention loss.
-            if reset_attention_mask and attention_mask is not None:
-                attention_mask[0, (i + 1) :, : (i + 1)] = 0
-            # Reset positions.
-            if reset_position_ids:
-                position_ids[(i + 1) :] -= i + 1 - prev_index
-                prev_index = i + 1
-
-    if attention_mask is not None:
-        # Convert attention mask to binary:
-        attention_mask = attention_mask < 0.5
+        position_ids = position_ids - document_start_ids
+
+    if create_attention_mask:
+        if reset_attention_mask:
+            # Every token attends to the tokens in [document start, token] of its own document
+            column_ids = torch.arange(seq_length, dtype=torch.long, device=data.device)
+            attention_mask = column_ids.unsqueeze(0) >= document_start_ids.unsqueeze(1)
+            attention_mask.tril_()
+        else:
+            attention_mask = torch.ones(
+                (seq_length, seq_length), dtype=torch.bool, device=data.device
+            ).tril_()
+        # Convert attention mask to binary, True where attention is masked:
+        attention_mask = attention_mask.logical_not_().unsqueeze(0)
+    else:
+        attention_mask = None
 
     return attention_mask, loss_mask, position_ids
 
 
+def _get_document_start_ids(data: torch.Tensor, eod_token: int) -> torch.Tensor:
+    """Get the position of the first token of the document of every token
+
+    A document starts at the beginning of the sequence and after every EOD.
+
+    Args:
+        data (torch.Tensor): The data tenor that holds the tokens from the dataset
+
+        eod_token (int): ID of the token to that is considered the EOD
+
+    Returns:
+        torch.Tensor: The document start positions
+    """
+    seq_length = data.numel()
+    document_start_ids = torch.zeros(seq_length, dtype=torch.long, device=data.device)
+    document_start_ids[1:] = torch.arange(1, seq_length, dtype=torch.long, device=data.device)
+    document_start_ids[1:].masked_fill_(data[:-1] != eod_token, 0)
+    return torch.cummax(document_start_ids, dim=0).values
+
+
+def _get_packed_masks_and_position_ids(
+    data: torch.Tensor,
+    document_lengths: numpy.ndarray,
+    eod_token: int,
+    eod_mask_loss: bool,
+    create_attention_mask: bool,
+) -> Tuple[Optional[torch.Tensor], torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Build masks, position ids, and cu_seqlens for a sample of packed whole documents
+
+    The document boundaries come from the packing rather than from the EOD tokens, and the
+    padding after the last document counts as a document of its own. No token attends across a
+    boundary, and no token is trained to predict the first token of the next document.
+
+    Args:
+        data (torch.Tensor): The data tenor that holds the tokens from the dataset
+
+        document_lengths (numpy.ndarray): The lengths of the documents in the sample, in order
+
+        eod_token (int): ID of the token to that is considered the EOD
+
+        eod_mask_loss (bool): Switch to enable the EOD mask loss
+
+        create_attention_mask (bool): Switch to enable the attention masks generation
+
+    Returns:
+        Optional[torch.Tensor]: Attention mask needed to be used for Attention
+
+        torch.Tensor: The mask used for loss value during training
+
+        torch.Tensor: The position ID's of the token
+
+        torch.Tensor: The document boundaries, padded with -1 to len(data) + 1 entries
+    """
+    seq_length = data.numel()
+
+    # The document starts within the sequence, the padding included
+    document_ends = numpy.cumsum(document_lengths, dtype=numpy.int64)
+    document_starts = numpy.concatenate([[0], document_ends[document_ends < seq_length]])
+    document_starts = torch.from_numpy(numpy.unique(document_starts)).to(data.device)
+    num_documents = document_starts.numel()
+
+    cu_seqlens = torch.full((seq_length + 1,), -1, dtype=torch.int32, device=data.device)
+    cu_seqlens[:num_documents] = document_starts
+    cu_seqlens[num_documents] = seq_length
+
+    document_start_ids = torch.zeros(seq_length, dtype=torch.long, device=data.device)
+    document_start_ids[document_starts] = document_starts
+    document_start_ids = torch.cummax(document_start_ids, dim=0).values
+
+    # Position ids.
+    position_ids = torch.arange(seq_length, dtype=torch.long, device=data.device)
+    position_ids = position_ids - document_start_ids
+
+    # Loss mask.
+    loss_mask = torch.ones(seq_length, dtype=torch.float, device=data.device)
+    if eod_mask_loss:
+        loss_mask[data == eod_token] = 0.0
+    loss_mask[document_starts[1:] - 1] = 0.0
+
+    if create_attention_mask:
+        # Every token attends to the tokens in [document start, token] of its own document
+        column_ids = torch.arange(seq_length, dtype=torch.long, device=data.device)
+        attention_mask = column_ids.unsqueeze(0) >= document_start_ids.unsqueeze(1)
+        attention_mask.tril_()
+        # Convert attention mask to binary, True where attention is masked:
+        attention_mask = attention_mask.logical_not_().unsqueeze(0)
+    else:
+        attention_mask = None
+
+    return attention_mask, loss_mask, position_ids, cu_seqlens
+
+
+def _get_cu_seqlens(data: torch.Tensor, eod_token: int) -> torch.Tensor:
+    """Get the cumulative sequence lengths of the documents in the sample
+
+    A document ends after every EOD and at the end of the sequence.
+
+    Args:
+        data (torch.Tensor): The data tenor that holds the tokens from the dataset
+
+        eod_token (int): ID of the token to that is considered the EOD
+
+    Returns:
+        torch.Tensor: The document boundaries [0, ..., len(data)], padded with -1 to len(data) + 1 entries
+    """
+    seq_length = data.numel()
+    document_end_ids = torch.nonzero(data[:-1] == eod_token).squeeze(1) + 1
+    num_documents = document_end_ids.numel() + 1
+    cu_seqlens = torch.full((seq_length + 1,), -1, dtype=torch.int32, device=data.device)
+    cu_seqlens[0] = 0
+    cu_seqlens[1:num_documents] = document_end_ids
+    cu_seqlens[num_documents] = seq_length
+    return cu_seqlens
+
+
 class MockGPTLowLevelDataset:
 
     seed: int = 0
@@ -718,6 +1312,16 @@ class MockGPTLowLevelDataset:
             length = self.sequence_lengths[idx] - offset
         return self[idx][offset : offset + length]
 
+    def get_segments(
+        self, idx: numpy.ndarray, offset: numpy.ndarray, length: numpy.ndarray
+    ) -> numpy.ndarray:
+        if len(idx) == 0:
+            return numpy.empty(0, dtype=numpy.int64)
+        return numpy.concatenate([self.get(*segment) for segment in zip(idx, offset, length)])
+
+    def prefetch(self, idx: numpy.ndarray) -> None:
+        pass
+
 
 class MockGPTDataset(GPTDataset):
     """The mock GPT dataset
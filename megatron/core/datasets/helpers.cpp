@@ -3,6 +3,7 @@
 /* Helper methods for fast index mapping builds */
 
 #include <algorithm>
+#include <functional>
 #include <iostream>
 #include <limits>
 #include <math.h>
@@ -11,6 +12,8 @@
 #include <pybind11/pybind11.h>
 #include <pybind11/numpy.h>
 #include <random>
+#include <thread>
+#include <vector>
 
 namespace py = pybind11;
 using namespace std;
@@ -239,6 +242,163 @@ py::array build_sample_idx(const py::array_t<int32_t> &sizes_,
                    free_when_done);                          // numpy array references
 }
 
+template <typename DocSize>
+py::array build_sample_idx_parallel(const py::array_t<DocSize> &sizes_,
+                                    const py::array_t<int32_t> &doc_idx_,
+                                    const int32_t seq_length,
+                                    const int32_t num_epochs,
+                                    const int64_t tokens_per_epoch,
+                                    const bool drop_last_partial_sequence = true,
+                                    const int add_extra_token_to_sequence = 1,
+                                    const int32_t num_threads = 0)
+{
+  /* Multithreaded build_sample_idx for int32 or int64 document sizes.
+
+     Sample k starts at the global token position p = k * seq_length of the
+     1-D flattened document stream. Let cum[j] be the number of tokens in the
+     documents doc_idx[0], ..., doc_idx[j - 1]. build_sample_idx records the
+     first j such that cum[j] <= p < cum[j + 1] when it adds an extra token to
+     each sequence, or the first j such that cum[j] < p <= cum[j + 1] when it
+     does not, together with the offset p - cum[j]. A sample which needs more
+     tokens than remain records the final document at its size less the extra
+     token.
+
+     The documents are divided into one contiguous range per thread. In a
+     first pass each thread sums the tokens in its range; in a second pass
+     each thread walks its range from the prefix sum of the preceding ranges
+     and records the samples which start in each of its documents. The
+     samples left over after the last range are those which run out of
+     tokens. Every
+     sample is recorded by exactly one thread, so no synchronization is
+     needed and the result is identical to build_sample_idx.*/
+
+  // Consistency checks.
+  if (seq_length <= 1 || num_epochs <= 0 || tokens_per_epoch <= 1)
+  {
+    throw std::invalid_argument("build_sample_idx_parallel: invalid sequence length, epochs or tokens");
+  }
+
+  const DocSize *sizes = sizes_.data();
+  const int32_t *doc_idx = doc_idx_.data();
+  const int64_t num_docs = doc_idx_.shape(0);
+  const int64_t extra = add_extra_token_to_sequence;
+
+  // Mapping and it's length (1D).
+  const int64_t num_tokens = static_cast<int64_t>(num_epochs) * tokens_per_epoch - extra;
+  int64_t num_samples = 0;
+  if (drop_last_partial_sequence == true)
+  {
+    num_samples = num_tokens / seq_length;
+  }
+  else
+  {
+    num_samples = (num_tokens + seq_length - 1) / seq_length;
+  }
+  int64_t *sample_idx = new int64_t[2 * (num_samples + 1)];
+
+  // Start with first document and no offset.
+  sample_idx[0] = 0;
+  sample_idx[1] = 0;
+
+  int64_t threads = num_threads > 0 ? num_threads : std::max(1u, std::thread::hardware_concurrency());
+  // Do not pay the thread start-up cost for small inputs.
+  threads = std::max<int64_t>(1, std::min<int64_t>(threads, num_docs / 65536));
+
+  {
+    py::gil_scoped_release release;
+
+    std::vector<int64_t> range_beg(threads + 1);
+    for (int64_t t = 0; t <= threads; ++t)
+    {
+      range_beg[t] = num_docs * t / threads;
+    }
+
+    // First pass: the number of tokens in each document range.
+    std::vector<int64_t> range_tokens(threads + 1, 0);
+    auto sum_range = [&](int64_t t)
+    {
+      int64_t total = 0;
+      for (int64_t j = range_beg[t]; j < range_beg[t + 1]; ++j)
+      {
+        total += sizes[doc_idx[j]];
+      }
+      range_tokens[t + 1] = total;
+    };
+
+    // Second pass: record the samples which start in each document.
+    std::vector<int64_t> range_cum(threads + 1, 0);
+    std::vector<int64_t> range_next_sample(threads, 0);
+    auto fill_range = [&](int64_t t)
+    {
+      int64_t cum = range_cum[t];
+      // The first sample which starts in this range and its start position.
+      int64_t k = std::max<int64_t>(1, extra ? (cum + seq_length - 1) / seq_length : cum / seq_length + 1);
+      int64_t position = k * seq_length;
+      for (int64_t j = range_beg[t]; j < range_beg[t + 1] && k <= num_samples; ++j)
+      {
+        // With the extra token, the samples with cum <= position < next_cum.
+        // Without, the samples with cum < position <= next_cum.
+        const int64_t next_cum = cum + sizes[doc_idx[j]];
+        while (position < next_cum + 1 - extra && k <= num_samples)
+        {
+          sample_idx[2 * k] = j;
+          sample_idx[2 * k + 1] = position - cum;
+          ++k;
+          position += seq_length;
+        }
+        cum = next_cum;
+      }
+      range_next_sample[t] = k;
+    };
+
+    auto run = [&](const std::function<void(int64_t)> &work)
+    {
+      std::vector<std::thread> workers;
+      for (int64_t t = 1; t < threads; ++t)
+      {
+        workers.emplace_back(work, t);
+      }
+      work(0);
+      for (auto &worker : workers)
+      {
+        worker.join();
+      }
+    };
+
+    // A single range starts at the first token, so it needs no first pass.
+    if (threads > 1)
+    {
+      run(sum_range);
+    }
+    for (int64_t t = 0; t < threads; ++t)
+    {
+      range_cum[t + 1] = range_cum[t] + range_tokens[t + 1];
+    }
+    run(fill_range);
+
+    // The samples which need more tokens than remain end with the last document.
+    const int64_t last_doc_size = num_docs > 0 ? sizes[doc_idx[num_docs - 1]] : 0;
+    for (int64_t k = range_next_sample[threads - 1]; k <= num_samples; ++k)
+    {
+      sample_idx[2 * k] = num_docs - 1;
+      sample_idx[2 * k + 1] = last_doc_size - extra;
+    }
+  }
+
+  // Method to deallocate memory.
+  py::capsule free_when_done(sample_idx, [](void *mem_)
+                             {
+	int64_t *mem = reinterpret_cast<int64_t*>(mem_);
+	delete[] mem; });
+
+  // Return the numpy array.
+  const auto byte_size = sizeof(int64_t);
+  return py::array(std::vector<int64_t>{num_samples + 1, 2}, // shape
+                   {2 * byte_size, byte_size},               // C-style contiguous strides
+                   sample_idx,                               // the data pointer
+                   free_when_done);                          // numpy array references
+}
+
 inline int32_t get_target_sample_len(const int32_t short_seq_ratio,
                                      const int32_t max_length,
                                      std::mt19937 &rand32_gen)
@@ -829,11 +989,167 @@ py::array build_blocks_mapping(const py::array_t<int64_t> &docs_,
   }
 }
 
+template <typename DocSize>
+py::tuple build_packed_sample_idx(const py::array_t<DocSize> &sizes_,
+                                  const py::array_t<int32_t> &doc_idx_,
+                                  const int64_t capacity,
+                                  const bool best_fit = false)
+{
+  /* Pack whole documents into samples of at most capacity tokens.
+
+     The documents of doc_idx, each truncated to capacity tokens, are taken
+     in order of decreasing size, ties in order of appearance, and every
+     document goes into a sample which has room for it, opening a new sample
+     when none does. First-fit-decreasing picks the earliest opened sample
+     with room: a segment tree over the samples' remaining room finds it in
+     logarithmic time. Best-fit picks the sample with the least room which
+     is still enough, ties the earliest opened, from an ordered set.
+
+     Returns the document index reordered so that the documents of every
+     sample are contiguous, in the order they were packed, and the sample
+     index of the position in it at which every sample starts, followed by
+     the number of documents.*/
+
+  if (capacity <= 0)
+  {
+    throw std::invalid_argument("build_packed_sample_idx: invalid capacity");
+  }
+
+  const DocSize *sizes = sizes_.data();
+  const int32_t *doc_idx = doc_idx_.data();
+  const int64_t num_docs = doc_idx_.shape(0);
+
+  int32_t *packed_doc_idx = new int32_t[num_docs];
+  int64_t num_samples = 0;
+  std::vector<int64_t> sample_beg;
+
+  {
+    py::gil_scoped_release release;
+
+    std::vector<int64_t> order(num_docs);
+    std::vector<int64_t> doc_size(num_docs);
+    for (int64_t j = 0; j < num_docs; ++j)
+    {
+      order[j] = j;
+      doc_size[j] = std::min<int64_t>(sizes[doc_idx[j]], capacity);
+    }
+    std::stable_sort(order.begin(), order.end(), [&](int64_t a, int64_t b)
+                     { return doc_size[a] > doc_size[b]; });
+
+    // The sample of every document.
+    std::vector<int64_t> doc_sample(num_docs);
+
+    if (best_fit)
+    {
+      // The (remaining room, sample) pairs of the open samples.
+      std::set<std::pair<int64_t, int64_t>> room;
+      for (const int64_t j : order)
+      {
+        auto it = room.lower_bound(std::make_pair(doc_size[j], static_cast<int64_t>(0)));
+        int64_t sample;
+        int64_t remaining;
+        if (it == room.end())
+        {
+          sample = num_samples++;
+          remaining = capacity;
+        }
+        else
+        {
+          sample = it->second;
+          remaining = it->first;
+          room.erase(it);
+        }
+        remaining -= doc_size[j];
+        if (remaining > 0)
+        {
+          room.insert(std::make_pair(remaining, sample));
+        }
+        doc_sample[j] = sample;
+      }
+    }
+    else
+    {
+      // A segment tree of the maximum remaining room over the samples, with
+      // the samples not yet opened at full capacity.
+      int64_t leaves = 1;
+      while (leaves < std::max<int64_t>(num_docs, 1))
+      {
+        leaves *= 2;
+      }
+      std::vector<int64_t> tree(2 * leaves, capacity);
+      for (const int64_t j : order)
+      {
+        // Descend to the leftmost sample with enough room. There is always
+        // one, as a sample not yet opened has the full capacity.
+        int64_t node = 1;
+        while (node < leaves)
+        {
+          node = tree[2 * node] >= doc_size[j] ? 2 * node : 2 * node + 1;
+        }
+        const int64_t sample = node - leaves;
+        num_samples = std::max(num_samples, sample + 1);
+        tree[node] -= doc_size[j];
+        for (node /= 2; node >= 1; node /= 2)
+        {
+          tree[node] = std::max(tree[2 * node], tree[2 * node + 1]);
+        }
+        doc_sample[j] = sample;
+      }
+    }
+
+    // Lay out the samples contiguously, each in packing order.
+    sample_beg.assign(num_samples + 1, 0);
+    for (int64_t j = 0; j < num_docs; ++j)
+    {
+      ++sample_beg[doc_sample[j] + 1];
+    }
+    for (int64_t k = 0; k < num_samples; ++k)
+    {
+      sample_beg[k + 1] += sample_beg[k];
+    }
+    std::vector<int64_t> cursor(sample_beg.begin(), sample_beg.end() - 1);
+    for (const int64_t j : order)
+    {
+      packed_doc_idx[cursor[doc_sample[j]]++] = doc_idx[j];
+    }
+  }
+
+  int64_t *sample_idx = new int64_t[num_samples + 1];
+  std::copy(sample_beg.begin(), sample_beg.end(), sample_idx);
+
+  // Methods to deallocate memory.
+  py::capsule free_doc_idx(packed_doc_idx, [](void *mem_)
+                           {
+	int32_t *mem = reinterpret_cast<int32_t*>(mem_);
+	delete[] mem; });
+  py::capsule free_sample_idx(sample_idx, [](void *mem_)
+                              {
+	int64_t *mem = reinterpret_cast<int64_t*>(mem_);
+	delete[] mem; });
+
+  // Return the numpy arrays.
+  return py::make_tuple(
+      py::array(std::vector<int64_t>{num_docs}, {sizeof(int32_t)}, packed_doc_idx, free_doc_idx),
+      py::array(std::vector<int64_t>{num_samples + 1}, {sizeof(int64_t)}, sample_idx, free_sample_idx));
+}
+
 PYBIND11_MODULE(helpers, m)
 {
   m.def("build_mapping", &build_mapping);
   m.def("build_blocks_mapping", &build_blocks_mapping);
   m.def("build_sample_idx", &build_sample_idx);
+  m.def("build_sample_idx_parallel", &build_sample_idx_parallel<int32_t>,
+        py::arg("sizes"), py::arg("doc_idx"), py::arg("seq_length"), py::arg("num_epochs"),
+        py::arg("tokens_per_epoch"), py::arg("drop_last_partial_sequence") = true,
+        py::arg("add_extra_token_to_sequence") = 1, py::arg("num_threads") = 0);
+  m.def("build_sample_idx_parallel", &build_sample_idx_parallel<int64_t>,
+        py::arg("sizes"), py::arg("doc_idx"), py::arg("seq_length"), py::arg("num_epochs"),
+        py::arg("tokens_per_epoch"), py::arg("drop_last_partial_sequence") = true,
+        py::arg("add_extra_token_to_sequence") = 1, py::arg("num_threads") = 0);
+  m.def("build_packed_sample_idx", &build_packed_sample_idx<int32_t>,
+        py::arg("sizes"), py::arg("doc_idx"), py::arg("capacity"), py::arg("best_fit") = false);
+  m.def("build_packed_sample_idx", &build_packed_sample_idx<int64_t>,
+        py::arg("sizes"), py::arg("doc_idx"), py::arg("capacity"), py::arg("best_fit") = false);
   m.def("build_blending_indices", &build_blending_indices);
   m.def("build_exhaustive_blending_indices", &build_exhaustive_blending_indices);
 }
@@ -5,17 +5,21 @@
 
 # Essentially re-written in entirety
 
+import json
 import logging
 import os
 import shutil
 import struct
+import threading
 import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import Enum
 from functools import lru_cache
 from itertools import accumulate
 from types import TracebackType
-from typing import List, Optional, Tuple, Type, Union
+from typing import Dict, List, Optional, Tuple, Type, Union
 
 try:
     import boto3
@@ -37,6 +41,8 @@ logger = logging.getLogger(__name__)
 
 _INDEX_HEADER = b"MMIDIDX\x00\x00"
 
+_COPY_CHUNK_NBYTES = 1024 * 1024 * 1024
+
 
 class DType(Enum):
     """The NumPy data type Enum for writing/reading the IndexedDataset indices"""
@@ -109,19 +115,90 @@ class DType(Enum):
         else:
             return numpy.int32
 
+    @staticmethod
+    def optimal_token_nbytes(cardinality: Optional[int]) -> Optional[int]:
+        """Get the number of bytes to pack each token of a vocabulary of a certain cardinality into
+
+        Args:
+            cardinality (Optional[int]): The number of tokens in the vocabulary
+
+        Returns:
+            Optional[int]: The number of bytes per packed token, or None when packing would not
+            save space over the dtype from DType.optimal_dtype
+        """
+        if cardinality is None:
+            return None
+        token_nbytes = (max(cardinality - 1, 1).bit_length() + 7) // 8
+        if token_nbytes < DType.size(DType.optimal_dtype(cardinality)):
+            return token_nbytes
+        return None
+
+
+def _pack_tokens(tokens: numpy.ndarray, token_nbytes: int) -> numpy.ndarray:
+    """Pack tokens into their `token_nbytes` low-order bytes, little-endian
+
+    Args:
+        tokens (numpy.ndarray): The tokens, all non-negative and less than 2 ** (8 * token_nbytes)
+
+        token_nbytes (int): The number of bytes per packed token
+
+    Returns:
+        numpy.ndarray: The packed tokens, as a flat uint8 array
+    """
+    tokens = numpy.ascontiguousarray(tokens)
+    if tokens.size > 0:
+        assert tokens.min() >= 0 and int(tokens.max()) >> (8 * token_nbytes) == 0
+    little_endian = tokens.astype(tokens.dtype.newbyteorder("<"), copy=False)
+    unpacked = little_endian.view(numpy.uint8).reshape(tokens.size, tokens.dtype.itemsize)
+    return numpy.ascontiguousarray(unpacked[:, :token_nbytes]).reshape(-1)
+
+
+def _unpack_tokens(
+    buffer: numpy.ndarray, dtype: Type[numpy.number], token_nbytes: int
+) -> numpy.ndarray:
+    """Unpack tokens packed by `_pack_tokens`
+
+    Args:
+        buffer (numpy.ndarray): The packed tokens, as a flat uint8 array
+
+        dtype (Type[numpy.number]): The dtype of the unpacked tokens
+
+        token_nbytes (int): The number of bytes per packed token
+
+    Returns:
+        numpy.ndarray: The unpacked tokens
+    """
+    dtype = numpy.dtype(dtype)
+    count = len(buffer) // token_nbytes
+    unpacked = numpy.zeros((count, dtype.itemsize), dtype=numpy.uint8)
+    unpacked[:, :token_nbytes] = numpy.asarray(buffer, dtype=numpy.uint8).reshape(
+        count, token_nbytes
+    )
+    return unpacked.view(dtype.newbyteorder("<")).reshape(count).astype(dtype, copy=False)
+
 
 class _IndexWriter(object):
     """Object class to write the index (.idx) file
 
+    An index of packed tokens, see `IndexedDatasetBuilder`, is written as version 2, which adds
+    the number of bytes per packed token after the dtype code. Any other index is written as
+    version 1.
+
     Args:
         idx_path (str): The path to the index file
 
         dtype (Type[numpy.number]): The dtype of the index file
+
+        token_nbytes (Optional[int]): The number of bytes per packed token, or None when the tokens
+        are not packed. Defaults to None.
     """
 
-    def __init__(self, idx_path: str, dtype: Type[numpy.number]) -> None:
+    def __init__(
+        self, idx_path: str, dtype: Type[numpy.number], token_nbytes: Optional[int] = None
+    ) -> None:
         self.idx_path = idx_path
         self.dtype = dtype
+        self.token_nbytes = token_nbytes if token_nbytes is not None else DType.size(dtype)
 
     def __enter__(self) -> "_IndexWriter":
         """Enter the context introduced by the 'with' keyword
@@ -132,10 +209,14 @@ class _IndexWriter(object):
         self.idx_writer = open(self.idx_path, "wb")
         # fixed, vestigial practice
         self.idx_writer.write(_INDEX_HEADER)
-        # fixed, vestigial practice
-        self.idx_writer.write(struct.pack("<Q", 1))
+        packed = self.token_nbytes != DType.size(self.dtype)
+        # the version
+        self.idx_writer.write(struct.pack("<Q", 2 if packed else 1))
         # the numeric code for the dtype
         self.idx_writer.write(struct.pack("<B", DType.code_from_dtype(self.dtype)))
+        # the number of bytes per packed token
+        if packed:
+            self.idx_writer.write(struct.pack("<B", self.token_nbytes))
         return self
 
     def __exit__(
@@ -203,22 +284,65 @@ class _IndexWriter(object):
             self.idx_writer.write(sequence_modes.tobytes(order='C'))
             del sequence_modes
 
-    def _sequence_pointers(self, sequence_lengths: List[int]) -> List[int]:
+    def write_concatenated(self, indices: List["_IndexReader"]) -> None:
+        """Write the index (.idx) file of the concatenation of several datasets
+
+        The sections are streamed one source index at a time, so the merged index is never held
+        in memory.
+
+        Args:
+            indices (List[_IndexReader]): The index of each dataset, in order
+        """
+        multimodal = indices[0].sequence_modes is not None
+        assert all((index.sequence_modes is not None) == multimodal for index in indices)
+
+        # the number of sequences in the dataset
+        sequence_count = sum(index.sequence_count for index in indices)
+        self.idx_writer.write(struct.pack("<Q", sequence_count))
+
+        # the number of documents in the dataset, where all but the first leading 0 are dropped
+        document_count = 1 + sum(index.document_count - 1 for index in indices)
+        self.idx_writer.write(struct.pack("<Q", document_count))
+
+        # the number of tokens per sequence
+        for index in indices:
+            self.idx_writer.write(index.sequence_lengths.tobytes(order="C"))
+
+        # the byte offsets for all sequences
+        offset = 0
+        for index in indices:
+            sequence_pointers = self._sequence_pointers(index.sequence_lengths) + offset
+            self.idx_writer.write(sequence_pointers.tobytes(order="C"))
+            if len(sequence_pointers) > 0:
+                offset = int(sequence_pointers[-1]) + int(index.sequence_lengths[-1]) * (
+                    self.token_nbytes
+                )
+
+        # the sequence indices marking the end of each document
+        self.idx_writer.write(numpy.zeros(1, dtype=numpy.int64).tobytes(order="C"))
+        offset = 0
+        for index in indices:
+            self.idx_writer.write((index.document_indices[1:] + offset).tobytes(order="C"))
+            offset += index.sequence_count
+
+        # the mode per sequence
+        if multimodal:
+            for index in indices:
+                self.idx_writer.write(index.sequence_modes.tobytes(order='C'))
+
+    def _sequence_pointers(
+        self, sequence_lengths: Union[List[int], numpy.ndarray]
+    ) -> numpy.ndarray:
         """Build the sequence pointers per the sequence lengths and dtype size
 
         Args:
-            sequence_lengths (List[int]): The length of each sequence
+            sequence_lengths (Union[List[int], numpy.ndarray]): The length of each sequence
 
         Returns:
-            List[int]: The pointer to the beginning of each sequence
+            numpy.ndarray: The pointer to the beginning of each sequence
         """
-        itemsize = DType.size(self.dtype)
-        curr_ptr = 0
-        list_ptr = []
-        for length in sequence_lengths:
-            list_ptr.append(curr_ptr)
-            curr_ptr += length * itemsize
-        return list_ptr
+        sequence_nbytes = numpy.asarray(sequence_lengths, dtype=numpy.int64) * self.token_nbytes
+        return numpy.cumsum(sequence_nbytes) - sequence_nbytes
 
 
 class _IndexReader(object):
@@ -239,12 +363,18 @@ class _IndexReader(object):
             assert header == _INDEX_HEADER, f"bad header, cannot read: {idx_path}"
 
             version = struct.unpack("<Q", stream.read(8))[0]
-            assert version == 1, f"bad version, cannot read: {idx_path}"
+            assert version in (1, 2), f"bad version, cannot read: {idx_path}"
 
             code = struct.unpack("<B", stream.read(1))[0]
             self.dtype = DType.dtype_from_code(code)
             self.dtype_size = DType.size(self.dtype)
 
+            # the number of bytes per token in the data file, fewer than the dtype size if packed
+            self.token_nbytes = self.dtype_size
+            if version == 2:
+                self.token_nbytes = struct.unpack("<B", stream.read(1))[0]
+            self.packed = self.token_nbytes != self.dtype_size
+
             self.sequence_count = struct.unpack("<Q", stream.read(8))[0]
             self.document_count = struct.unpack("<Q", stream.read(8))[0]
 
@@ -341,9 +471,116 @@ class _IndexReader(object):
         )
 
 
+class _MMapPool(object):
+    """A process-wide pool of read-only data (.bin) file mappings shared by all IndexedDatasets
+
+    Mappings are created lazily, on the first read from a data file, and keyed by the real path of
+    the file, so datasets and virtual datasets which share a data file also share its mapping. When
+    the pool holds more than `capacity` mappings, it evicts the least recently used ones. Eviction
+    only drops the pool's reference: the mapping is unmapped once no array read from it is alive.
+
+    Args:
+        capacity (Optional[int]): The maximum number of mappings to hold, or None for no limit
+    """
+
+    def __init__(self, capacity: Optional[int] = None) -> None:
+        self._capacity = None
+        self._mappings: OrderedDict[str, memoryview] = OrderedDict()
+        self._lock = threading.Lock()
+        self._statistics = {"opened": 0, "evicted": 0, "hits": 0}
+        self.set_capacity(capacity)
+
+    def get(self, key: str) -> memoryview:
+        """Get the mapping of a data file, mapping it on first use or after its eviction
+
+        Args:
+            key (str): The real path to the data file, see `os.path.realpath`
+
+        Returns:
+            memoryview: The mapping
+        """
+        with self._lock:
+            mapping = self._mappings.get(key)
+            if mapping is not None:
+                self._mappings.move_to_end(key)
+                self._statistics["hits"] += 1
+                return mapping
+            mapping = memoryview(numpy.memmap(key, mode="r", order="C"))
+            self._mappings[key] = mapping
+            self._statistics["opened"] += 1
+            self._evict()
+        return mapping
+
+    def set_capacity(self, capacity: Optional[int]) -> None:
+        """Set the maximum number of mappings to hold, evicting mappings as needed
+
+        Args:
+            capacity (Optional[int]): The maximum number of mappings to hold, or None for no limit
+        """
+        assert capacity is None or capacity > 0, "the mmap pool capacity must be positive"
+        with self._lock:
+            self._capacity = capacity
+            self._evict()
+
+    def get_statistics(self) -> Dict[str, int]:
+        """Get the pool counters
+
+        Returns:
+            Dict[str, int]: The number of mappings opened, evicted, and currently held, and the
+            number of reads served by a held mapping
+        """
+        with self._lock:
+            statistics = dict(self._statistics)
+            statistics["open"] = len(self._mappings)
+        return statistics
+
+    def clear(self) -> None:
+        """Drop every mapping and reset the counters"""
+        with self._lock:
+            self._mappings.clear()
+            self._statistics = dict.fromkeys(self._statistics, 0)
+
+    def _evict(self) -> None:
+        """Evict the least recently used mappings down to the capacity, with the lock held"""
+        while self._capacity is not None and len(self._mappings) > self._capacity:
+            self._mappings.popitem(last=False)
+            self._statistics["evicted"] += 1
+
+    def _reset_lock(self) -> None:
+        """Replace the lock in a forked child, in case the fork happened while it was held"""
+        self._lock = threading.Lock()
+
+
+_MMAP_POOL = _MMapPool()
+
+os.register_at_fork(after_in_child=_MMAP_POOL._reset_lock)
+
+
+def set_mmap_pool_capacity(capacity: Optional[int]) -> None:
+    """Set the maximum number of data (.bin) file mappings held by this process
+
+    Args:
+        capacity (Optional[int]): The maximum number of mappings to hold, or None for no limit
+    """
+    _MMAP_POOL.set_capacity(capacity)
+
+
+def get_mmap_pool_statistics() -> Dict[str, int]:
+    """Get the data (.bin) file mapping counters of this process
+
+    Returns:
+        Dict[str, int]: The number of mappings opened, evicted, and currently held, and the number
+        of reads served by a held mapping
+    """
+    return _MMAP_POOL.get_statistics()
+
+
 class _BinReader(ABC):
     """Abstract class to read the data (.bin) file"""
 
+    # Whether `prefetch` hints speed up the reads, so that callers only compute them if they do
+    benefits_from_prefetch = False
+
     @abstractmethod
     def read(self, dtype: Type[numpy.number], count: int, offset: int) -> numpy.ndarray:
         """Read bytes into a numpy array.
@@ -360,17 +597,61 @@ class _BinReader(ABC):
         """
         pass
 
+    def read_segments(
+        self, dtype: Type[numpy.number], counts: numpy.ndarray, offsets: numpy.ndarray
+    ) -> numpy.ndarray:
+        """Read several spans of bytes into a single numpy array.
+
+        The default implementation issues one `read` per span. Subclasses which can address the
+        whole data file at once should override this method with a vectorized gather.
+
+        Args:
+            dtype (Type[numpy.number]): Data-type of the returned array.
+
+            counts (numpy.ndarray): Number of items to read, per span.
+
+            offsets (numpy.ndarray): Start reading from these offsets (in bytes), per span.
+
+        Returns:
+            numpy.ndarray: An array with `sum(counts)` items and data-type `dtype` constructed from concatenating the spans in order.
+        """
+        if len(counts) == 0:
+            return numpy.empty(0, dtype=dtype)
+        return numpy.concatenate(
+            [
+                self.read(dtype=dtype, count=int(count), offset=int(offset))
+                for count, offset in zip(counts, offsets)
+            ]
+        )
+
+    def prefetch(self, offsets: numpy.ndarray, sizes: numpy.ndarray) -> None:
+        """Hint that a set of byte spans will be read soon.
+
+        The default implementation does nothing. Subclasses which read from high latency storage
+        may override this method to start fetching the spans in the background.
+
+        Args:
+            offsets (numpy.ndarray): The span start offsets (in bytes), in order of upcoming use.
+
+            sizes (numpy.ndarray): The span sizes (in bytes).
+        """
+        pass
+
 
 class _MMapBinReader(_BinReader):
     """A _BinReader that memory maps the data (.bin) file
 
+    The mapping is taken from the process-wide pool on every read, so the file is only mapped once
+    it is first read and may be unmapped again while idle, see `_MMapPool`.
+
     Args:
         bin_path (str): bin_path (str): The path to the data (.bin) file.
     """
 
     def __init__(self, bin_path: str) -> None:
-        self._bin_buffer_mmap = numpy.memmap(bin_path, mode="r", order="C")
-        self._bin_buffer = memoryview(self._bin_buffer_mmap)
+        self._bin_path = bin_path
+        # The pool key, resolved once as os.path.realpath is slow compared to a read
+        self._bin_real_path = os.path.realpath(bin_path)
 
     def read(self, dtype: Type[numpy.number], count: int, offset: int) -> numpy.ndarray:
         """Read bytes into a numpy array.
@@ -385,13 +666,38 @@ class _MMapBinReader(_BinReader):
         Returns:
             numpy.ndarray: An array with `count` items and data-type `dtype` constructed from reading bytes from the data file starting at `offset`.
         """
-        return numpy.frombuffer(self._bin_buffer, dtype=dtype, count=count, offset=offset)
+        return numpy.frombuffer(
+            _MMAP_POOL.get(self._bin_real_path), dtype=dtype, count=count, offset=offset
+        )
 
-    def __del__(self) -> None:
-        """Clean up the object."""
-        if self._bin_buffer_mmap is not None:
-            self._bin_buffer_mmap._mmap.close()
-        del self._bin_buffer_mmap
+    def read_segments(
+        self, dtype: Type[numpy.number], counts: numpy.ndarray, offsets: numpy.ndarray
+    ) -> numpy.ndarray:
+        """Read several spans of bytes into a single numpy array with one vectorized gather.
+
+        Args:
+            dtype (Type[numpy.number]): Data-type of the returned array.
+
+            counts (numpy.ndarray): Number of items to read, per span.
+
+            offsets (numpy.ndarray): Start reading from these offsets (in bytes), per span. Each offset must be a multiple of the dtype size.
+
+        Returns:
+            numpy.ndarray: An array with `sum(counts)` items and data-type `dtype` constructed from concatenating the spans in order.
+        """
+        itemsize = DType.size(dtype)
+        counts = numpy.asarray(counts, dtype=numpy.int64)
+        offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        assert numpy.all(offsets % itemsize == 0)
+        total = int(counts.sum())
+        if total == 0:
+            return numpy.empty(0, dtype=dtype)
+        bin_buffer = _MMAP_POOL.get(self._bin_real_path)
+        buffer = numpy.frombuffer(bin_buffer, dtype=dtype, count=len(bin_buffer) // itemsize)
+        # The item index of every requested item: the span start shifted by the item's position
+        # within the span, i.e. its position in the output minus the output position of its span
+        span_starts = offsets // itemsize - (numpy.cumsum(counts) - counts)
+        return buffer[numpy.repeat(span_starts, counts) + numpy.arange(total, dtype=numpy.int64)]
 
 
 class _FileBinReader(_BinReader):
@@ -424,46 +730,314 @@ class _FileBinReader(_BinReader):
         return sequence
 
 
+class _VirtualBinReader(_BinReader):
+    """A _BinReader that reads from the concatenation of several data (.bin) files
+
+    The virtual data file is described by a JSON manifest, see `merge_indexed_datasets`, which
+    lists the data files and the number of bytes each one contributes.
+
+    Args:
+        vbin_path (str): The path to the virtual data (.vbin) file.
+
+        mmap (bool): Whether to mmap the data files or use file pointers.
+    """
+
+    def __init__(self, vbin_path: str, mmap: bool) -> None:
+        segments = _read_virtual_bin(vbin_path)
+        self._readers = [
+            _MMapBinReader(bin_path) if mmap else _FileBinReader(bin_path)
+            for bin_path, _ in segments
+        ]
+        self._offsets = numpy.cumsum([0] + [nbytes for _, nbytes in segments], dtype=numpy.int64)
+
+    def read(self, dtype: Type[numpy.number], count: int, offset: int) -> numpy.ndarray:
+        """Read bytes into a numpy array.
+
+        Args:
+            dtype (Type[numpy.number]): Data-type of the returned array.
+
+            count (int): Number of items to read.
+
+            offset (int): Start reading from this offset (in bytes).
+
+        Returns:
+            numpy.ndarray: An array with `count` items and data-type `dtype` constructed from reading bytes from the data file starting at `offset`.
+        """
+        if count == 0:
+            return numpy.empty(0, dtype=dtype)
+        itemsize = DType.size(dtype)
+        i = int(numpy.searchsorted(self._offsets, offset, side="right")) - 1
+        if offset + count * itemsize <= self._offsets[i + 1]:
+            return self._readers[i].read(dtype, count, offset - int(self._offsets[i]))
+        # The span crosses into the next data files
+        parts = []
+        while count > 0:
+            part_count = min(count, (int(self._offsets[i + 1]) - offset) // itemsize)
+            parts.append(self._readers[i].read(dtype, part_count, offset - int(self._offsets[i])))
+            count -= part_count
+            offset += part_count * itemsize
+            i += 1
+        return numpy.concatenate(parts)
+
+    def read_segments(
+        self, dtype: Type[numpy.number], counts: numpy.ndarray, offsets: numpy.ndarray
+    ) -> numpy.ndarray:
+        """Read several spans of bytes into a single numpy array with one call per data file.
+
+        Args:
+            dtype (Type[numpy.number]): Data-type of the returned array.
+
+            counts (numpy.ndarray): Number of items to read, per span.
+
+            offsets (numpy.ndarray): Start reading from these offsets (in bytes), per span.
+
+        Returns:
+            numpy.ndarray: An array with `sum(counts)` items and data-type `dtype` constructed from concatenating the spans in order.
+        """
+        counts = numpy.asarray(counts, dtype=numpy.int64)
+        offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        file_ids = numpy.minimum(
+            numpy.searchsorted(self._offsets, offsets, side="right") - 1, len(self._readers) - 1
+        )
+        if numpy.any(offsets + counts * DType.size(dtype) > self._offsets[file_ids + 1]):
+            # Some span crosses into the next data files
+            return super().read_segments(dtype, counts, offsets)
+
+        sequence = numpy.empty(int(counts.sum()), dtype=dtype)
+        starts = numpy.cumsum(counts) - counts
+        for file_id in numpy.unique(file_ids):
+            mask = file_ids == file_id
+            file_counts = counts[mask]
+            # The output position of every item read from this data file
+            positions = numpy.repeat(
+                starts[mask] - (numpy.cumsum(file_counts) - file_counts), file_counts
+            ) + numpy.arange(file_counts.sum(), dtype=numpy.int64)
+            sequence[positions] = self._readers[file_id].read_segments(
+                dtype, file_counts, offsets[mask] - self._offsets[file_id]
+            )
+        return sequence
+
+
 class _S3BinReader(_BinReader):
     """A _BinReader that reads from the data (.bin) file from S3
 
+    The S3 object is divided into blocks of `bin_chunk_nbytes` bytes, indexed from 0. Blocks are
+    downloaded with ranged GET requests and kept in a bounded LRU cache. Requests for contiguous
+    missing blocks are coalesced into a single GET, and independent GETs are issued concurrently
+    from a thread pool, so a batch of reads or a prefetch of the upcoming reads costs roughly one
+    round trip rather than one round trip per block.
+
     Args:
         bin_path (str): bin_path (str): The path to the data (.bin) file.
 
-        bin_chunk_nbytes (int, optional): If not None, then maintain an in-memory cache to speed up calls to the `read` method. Furthermore, on a cache miss, download this number of bytes to refresh the cache. Otherwise (None), do not maintain an in-memory cache. A class that inherits from _BinReader may not implement caching in which case it should assert that `bin_chunk_nbytes` is None at initialization.
+        bin_chunk_nbytes (int): The number of bytes in each cached block.
+
+        bin_cache_nchunks (int): The maximum number of blocks held in the cache. Defaults to 1.
+
+        bin_prefetch_threads (int): The number of threads used to download blocks. Defaults to 4.
     """
 
-    def __init__(self, bin_path: str, bin_chunk_nbytes: int) -> None:
+    benefits_from_prefetch = True
+
+    def __init__(
+        self,
+        bin_path: str,
+        bin_chunk_nbytes: int,
+        bin_cache_nchunks: int = 1,
+        bin_prefetch_threads: int = 4,
+    ) -> None:
         assert bin_chunk_nbytes > 0
+        assert bin_cache_nchunks > 0
+        assert bin_prefetch_threads > 0
         self._client = boto3.client("s3")
         self._s3_bucket, self._s3_key = parse_s3_path(bin_path)
-        self._cache = None
-        self._cache_bytes_start = None
-        self._cache_bytes_end = None
-        self._cache_nbytes = bin_chunk_nbytes
-
-    def _extract_from_cache(self, offset: int, size: int) -> bytes:
-        """Extract `size` bytes starting at `offset` bytes into the cache"""
-        start = offset - self._cache_bytes_start
-        assert start >= 0
-        end = start + size
-        assert end <= len(self._cache)
-        return self._cache[start:end]
+        self._chunk_nbytes = bin_chunk_nbytes
+        self._cache_nchunks = bin_cache_nchunks
+        self._num_threads = bin_prefetch_threads
+        self._cache: OrderedDict[int, memoryview] = OrderedDict()
+        self._pending: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = os.getpid()
+        self._statistics = {
+            "hits": 0,
+            "prefetch_hits": 0,
+            "misses": 0,
+            "requests": 0,
+            "bytes": 0,
+            "latency": 0.0,
+            "max_latency": 0.0,
+        }
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Get the download thread pool, recreating it and the lock after a fork
+
+        Returns:
+            ThreadPoolExecutor: The download thread pool
+        """
+        if self._pid != os.getpid():
+            # Threads do not survive a fork, e.g. into a DataLoader worker
+            self._pid = os.getpid()
+            self._lock = threading.Lock()
+            self._pending = {}
+            self._executor = None
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._num_threads)
+        return self._executor
+
+    def _get_chunk_ids(self, offsets: numpy.ndarray, sizes: numpy.ndarray) -> List[int]:
+        """Get the ordered, unique ids of the blocks which cover a set of byte spans
+
+        Args:
+            offsets (numpy.ndarray): The span start offsets (in bytes)
+
+            sizes (numpy.ndarray): The span sizes (in bytes)
+
+        Returns:
+            List[int]: The block ids
+        """
+        chunk_ids = []
+        for offset, size in zip(offsets.tolist(), sizes.tolist()):
+            if size > 0:
+                chunk_ids.extend(
+                    range(
+                        offset // self._chunk_nbytes, (offset + size - 1) // self._chunk_nbytes + 1
+                    )
+                )
+        return list(dict.fromkeys(chunk_ids))
+
+    def _fetch(self, first: int, last: int) -> Dict[int, memoryview]:
+        """Download the contiguous blocks [first, last] with a single GET and cache them
+
+        Args:
+            first (int): The first block id
+
+            last (int): The last block id, inclusive
+
+        Returns:
+            Dict[int, memoryview]: The downloaded blocks by id
+        """
+        try:
+            t_beg = time.perf_counter()
+            body = self._client.get_object(
+                Bucket=self._s3_bucket,
+                Key=self._s3_key,
+                # Subtract 1, because the end of Range is inclusive.
+                Range=f'bytes={first * self._chunk_nbytes}-{(last + 1) * self._chunk_nbytes - 1}',
+            )['Body'].read()
+            latency = time.perf_counter() - t_beg
+            body = memoryview(body)
+            chunks = {
+                chunk_id: body[
+                    (chunk_id - first)
+                    * self._chunk_nbytes : (chunk_id - first + 1)
+                    * self._chunk_nbytes
+                ]
+                for chunk_id in range(first, last + 1)
+            }
+            with self._lock:
+                self._statistics["requests"] += 1
+                self._statistics["bytes"] += len(body)
+                self._statistics["latency"] += latency
+                self._statistics["max_latency"] = max(self._statistics["max_latency"], latency)
+                for chunk_id, chunk in chunks.items():
+                    self._cache[chunk_id] = chunk
+                    self._cache.move_to_end(chunk_id)
+                while len(self._cache) > self._cache_nchunks:
+                    self._cache.popitem(last=False)
+            return chunks
+        finally:
+            with self._lock:
+                for chunk_id in range(first, last + 1):
+                    self._pending.pop(chunk_id, None)
+
+    def _submit(self, chunk_ids: List[int]) -> Dict[int, Future]:
+        """Schedule the download of blocks, coalescing runs of contiguous ids. Call with the lock.
+
+        Args:
+            chunk_ids (List[int]): The ids of the blocks, neither cached nor pending
+
+        Returns:
+            Dict[int, Future]: The download future of every block by id
+        """
+        futures = {}
+        executor = self._executor
+        chunk_ids = sorted(chunk_ids)
+        i = 0
+        while i < len(chunk_ids):
+            j = i
+            while j + 1 < len(chunk_ids) and chunk_ids[j + 1] == chunk_ids[j] + 1:
+                j += 1
+            future = executor.submit(self._fetch, chunk_ids[i], chunk_ids[j])
+            for chunk_id in chunk_ids[i : j + 1]:
+                self._pending[chunk_id] = future
+                futures[chunk_id] = future
+            i = j + 1
+        return futures
+
+    def _get_chunks(self, chunk_ids: List[int]) -> Dict[int, memoryview]:
+        """Get blocks from the cache, from pending prefetches, or by downloading them
+
+        Args:
+            chunk_ids (List[int]): The block ids
+
+        Returns:
+            Dict[int, memoryview]: The blocks by id
+        """
+        self._get_executor()
+        chunks = {}
+        futures = {}
+        missing = []
+        with self._lock:
+            for chunk_id in chunk_ids:
+                if chunk_id in self._cache:
+                    self._cache.move_to_end(chunk_id)
+                    chunks[chunk_id] = self._cache[chunk_id]
+                    self._statistics["hits"] += 1
+                elif chunk_id in self._pending:
+                    futures[chunk_id] = self._pending[chunk_id]
+                    self._statistics["prefetch_hits"] += 1
+                else:
+                    missing.append(chunk_id)
+                    self._statistics["misses"] += 1
+            futures.update(self._submit(missing))
+        for chunk_id, future in futures.items():
+            chunks[chunk_id] = future.result()[chunk_id]
+        return chunks
+
+    def _extract(self, chunks: Dict[int, memoryview], offset: int, size: int) -> memoryview:
+        """Extract `size` bytes starting at `offset` bytes into the object from a set of blocks
+
+        Args:
+            chunks (Dict[int, memoryview]): The blocks which cover the span, by id
+
+            offset (int): The span start offset (in bytes)
+
+            size (int): The span size (in bytes)
+
+        Returns:
+            memoryview: The span
+        """
+        first = offset // self._chunk_nbytes
+        last = (offset + size - 1) // self._chunk_nbytes
+        start = offset - first * self._chunk_nbytes
+        if first == last:
+            span = chunks[first][start : start + size]
+        else:
+            span = memoryview(
+                b"".join(chunks[chunk_id] for chunk_id in range(first, last + 1))[
+                    start : start + size
+                ]
+            )
+        assert len(span) == size
+        return span
 
     def read(self, dtype: Type[numpy.number], count: int, offset: int) -> numpy.ndarray:
         """Read bytes into a numpy array.
 
-        Let `size` be the `count` * `DType.size(dtype)`. If the requested span of bytes [`offset`,
-        `offset` + `size`) is covered by the in-memory cache maintained by this class, then this
-        function extracts the requested span from that cache and returns it. Otherwise, this
-        function first refreshes the cache and then extracts the requested span from the refreshed
-        cache and returns it.
-
-        The cache is refreshed based on `offset` and `size`. In particular, we divide all the bytes
-        in an S3 object into blocks, where each block contains `bin_chunk_nbytes` bytes. We assign
-        each block an index starting from 0. We take the block with index (`offset` //
-        `bin_chunk_nbytes`) to refresh the cache. If this new block still does not cover the
-        requested span, we extend it just enough to include `offset` + `size`.
+        Let `size` be the `count` * `DType.size(dtype)`. The blocks which cover the requested span
+        of bytes [`offset`, `offset` + `size`) are taken from the cache or from a pending prefetch
+        where possible and downloaded otherwise.
 
         Args:
             dtype (Type[numpy.number]): Data-type of the returned array.
@@ -476,30 +1050,81 @@ class _S3BinReader(_BinReader):
             numpy.ndarray: An array with `count` items and data-type `dtype` constructed from reading bytes from the data file starting at `offset`.
         """
         size = count * DType.size(dtype)
-        if (
-            self._cache is not None
-            and offset >= self._cache_bytes_start
-            and offset + size <= self._cache_bytes_end
-        ):
-            return numpy.frombuffer(self._extract_from_cache(offset, size), dtype=dtype)
-
-        bytes_start = (offset // self._cache_nbytes) * self._cache_nbytes
-        assert bytes_start >= 0
-        assert offset >= bytes_start
-        bytes_end = max(bytes_start + self._cache_nbytes, offset + size)
-        assert bytes_end >= 1
-        self._cache = self._client.get_object(
-            Bucket=self._s3_bucket,
-            Key=self._s3_key,
-            # Subtract 1, because the end of Range is inclusive.
-            Range=f'bytes={bytes_start}-{bytes_end-1}',
-        )['Body'].read()
-        self._cache_bytes_start = bytes_start
-        self._cache_bytes_end = bytes_end
-        return numpy.frombuffer(self._extract_from_cache(offset, size), dtype=dtype)
+        if size == 0:
+            return numpy.empty(0, dtype=dtype)
+        chunk_ids = self._get_chunk_ids(numpy.array([offset]), numpy.array([size]))
+        chunks = self._get_chunks(chunk_ids)
+        return numpy.frombuffer(self._extract(chunks, offset, size), dtype=dtype)
+
+    def read_segments(
+        self, dtype: Type[numpy.number], counts: numpy.ndarray, offsets: numpy.ndarray
+    ) -> numpy.ndarray:
+        """Read several spans of bytes into a single numpy array.
+
+        The blocks which cover all of the spans are gathered at once, so the missing blocks are
+        downloaded with coalesced, concurrent requests.
+
+        Args:
+            dtype (Type[numpy.number]): Data-type of the returned array.
+
+            counts (numpy.ndarray): Number of items to read, per span.
+
+            offsets (numpy.ndarray): Start reading from these offsets (in bytes), per span.
+
+        Returns:
+            numpy.ndarray: An array with `sum(counts)` items and data-type `dtype` constructed from concatenating the spans in order.
+        """
+        counts = numpy.asarray(counts, dtype=numpy.int64)
+        offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        sizes = counts * DType.size(dtype)
+        chunks = self._get_chunks(self._get_chunk_ids(offsets, sizes))
+        spans = [
+            self._extract(chunks, offset, size)
+            for offset, size in zip(offsets.tolist(), sizes.tolist())
+            if size > 0
+        ]
+        return numpy.frombuffer(b"".join(spans), dtype=dtype)
+
+    def prefetch(self, offsets: numpy.ndarray, sizes: numpy.ndarray) -> None:
+        """Schedule the download of the blocks which cover a set of upcoming byte spans
+
+        At most `bin_cache_nchunks` blocks are scheduled, in order of first use, so that the
+        prefetched blocks do not evict one another before they are read.
+
+        Args:
+            offsets (numpy.ndarray): The span start offsets (in bytes), in order of upcoming use
+
+            sizes (numpy.ndarray): The span sizes (in bytes)
+        """
+        self._get_executor()
+        chunk_ids = self._get_chunk_ids(
+            numpy.asarray(offsets, dtype=numpy.int64), numpy.asarray(sizes, dtype=numpy.int64)
+        )
+        with self._lock:
+            missing = [
+                chunk_id
+                for chunk_id in chunk_ids[: self._cache_nchunks]
+                if chunk_id not in self._cache and chunk_id not in self._pending
+            ]
+            self._submit(missing)
+
+    def get_statistics(self) -> Dict[str, float]:
+        """Get the cache and request counters
+
+        Returns:
+            Dict[str, float]: The number of block hits, prefetch hits (blocks which were still being
+            downloaded when read), and misses, the number of GET requests and bytes downloaded, and
+            the total, mean, and max request latency in seconds
+        """
+        with self._lock:
+            statistics = dict(self._statistics)
+        statistics["mean_latency"] = statistics["latency"] / max(statistics["requests"], 1)
+        return statistics
 
     def __del__(self) -> None:
         """Clean up the object"""
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False)
         self._client.close()
 
 
@@ -558,20 +1183,28 @@ class IndexedDataset(torch.utils.data.Dataset):
         """
         idx_path = get_idx_path(path_prefix)
         bin_path = get_bin_path(path_prefix)
+        vbin_path = get_virtual_bin_path(path_prefix)
         if s3_config is None:
-            assert os.path.exists(idx_path) and os.path.exists(
-                bin_path
+            assert os.path.exists(idx_path) and (
+                os.path.exists(bin_path) or os.path.exists(vbin_path)
             ), f"One or both of the .idx and .bin files cannot be found at the path prefix {path_prefix}"
         self.path_prefix = path_prefix
         self.multimodal = multimodal
         self.mmap = mmap
         self.s3_config = s3_config
-        if mmap:
+        if not s3_config and not os.path.exists(bin_path):
+            self.bin_reader = _VirtualBinReader(vbin_path, mmap)
+        elif mmap:
             assert not s3_config
             self.bin_reader = _MMapBinReader(bin_path)
         elif s3_config:
             assert not mmap
-            self.bin_reader = _S3BinReader(bin_path, s3_config.bin_chunk_nbytes)
+            self.bin_reader = _S3BinReader(
+                bin_path,
+                s3_config.bin_chunk_nbytes,
+                s3_config.bin_cache_nchunks,
+                s3_config.bin_prefetch_threads,
+            )
             idx_path = os.path.join(
                 s3_config.path_to_idx_cache, os.path.basename(get_idx_path(path_prefix))
             )
@@ -627,9 +1260,7 @@ class IndexedDataset(torch.utils.data.Dataset):
         """
         if isinstance(idx, (int, numpy.integer)):
             sequence_pointer, sequence_length, sequence_mode = self.index[idx]
-            sequence = self.bin_reader.read(
-                dtype=self.index.dtype, count=sequence_length, offset=sequence_pointer
-            )
+            sequence = self._read(count=sequence_length, offset=sequence_pointer)
             return (sequence, sequence_mode) if sequence_mode is not None else sequence
         elif isinstance(idx, slice):
             start, stop, step = idx.indices(len(self))
@@ -639,11 +1270,7 @@ class IndexedDataset(torch.utils.data.Dataset):
             sequence_modes = self.index.sequence_modes[idx] if self.multimodal else None
             sequence_offsets = list(accumulate(sequence_lengths))
             sequences = numpy.split(
-                self.bin_reader.read(
-                    dtype=self.index.dtype,
-                    count=sum(sequence_lengths),
-                    offset=self.index.sequence_pointers[start],
-                ),
+                self._read(count=sum(sequence_lengths), offset=self.index.sequence_pointers[start]),
                 sequence_offsets[:-1],
             )
             return (sequences, sequence_modes) if sequence_modes is not None else sequences
@@ -669,12 +1296,84 @@ class IndexedDataset(torch.utils.data.Dataset):
         sequence_pointer, sequence_length, sequence_mode = self.index[idx]
         if length is None:
             length = sequence_length - offset
-        sequence_pointer += offset * DType.size(self.index.dtype)
-        sequence = self.bin_reader.read(
-            dtype=self.index.dtype, count=length, offset=sequence_pointer
-        )
+        sequence_pointer += offset * self.index.token_nbytes
+        sequence = self._read(count=length, offset=sequence_pointer)
         return (sequence, sequence_mode) if sequence_mode is not None else sequence
 
+    def get_segments(
+        self, idx: numpy.ndarray, offset: numpy.ndarray, length: numpy.ndarray
+    ) -> numpy.ndarray:
+        """Retrieve portions of several items from the dataset, concatenated in order
+
+        get_segments(idx, offset, length) is the same as the concatenation of get(idx[i],
+        offset[i], length[i]) for all i, but reads the spans with a single bin reader call. The
+        sequence modes, if any, are not returned.
+
+        Args:
+            idx (numpy.ndarray): The indices into the dataset
+
+            offset (numpy.ndarray): The integer token offsets in the sequences
+
+            length (numpy.ndarray): The number of tokens to grab from the sequences
+
+        Returns:
+            numpy.ndarray: The concatenated sequence tokens
+        """
+        idx = numpy.asarray(idx, dtype=numpy.int64)
+        offset = numpy.asarray(offset, dtype=numpy.int64)
+        length = numpy.asarray(length, dtype=numpy.int64)
+        sequence_pointers = self.index.sequence_pointers[idx] + offset * self.index.token_nbytes
+        if not self.index.packed:
+            return self.bin_reader.read_segments(
+                dtype=self.index.dtype, counts=length, offsets=sequence_pointers
+            )
+        buffer = self.bin_reader.read_segments(
+            dtype=numpy.uint8, counts=length * self.index.token_nbytes, offsets=sequence_pointers
+        )
+        return _unpack_tokens(buffer, self.index.dtype, self.index.token_nbytes)
+
+    @property
+    def benefits_from_prefetch(self) -> bool:
+        """Whether `prefetch` hints speed up the reads, e.g. when streaming from S3
+
+        Returns:
+            bool: Whether the bin reader acts on the hints
+        """
+        return self.bin_reader.benefits_from_prefetch
+
+    def prefetch(self, idx: numpy.ndarray) -> None:
+        """Hint that the sequences at the given indices will be read soon
+
+        The bin reader may start fetching the sequences in the background, e.g. when streaming
+        from S3. The hint is a no-op for local data.
+
+        Args:
+            idx (numpy.ndarray): The indices into the dataset, in order of upcoming use
+        """
+        idx = numpy.asarray(idx, dtype=numpy.int64)
+        self.bin_reader.prefetch(
+            self.index.sequence_pointers[idx],
+            self.index.sequence_lengths[idx].astype(numpy.int64) * self.index.token_nbytes,
+        )
+
+    def _read(self, count: int, offset: int) -> numpy.ndarray:
+        """Read tokens from the data file, unpacking them if packed
+
+        Args:
+            count (int): The number of tokens to read
+
+            offset (int): The byte offset in the data file
+
+        Returns:
+            numpy.ndarray: The tokens
+        """
+        if not self.index.packed:
+            return self.bin_reader.read(dtype=self.index.dtype, count=count, offset=offset)
+        buffer = self.bin_reader.read(
+            dtype=numpy.uint8, count=count * self.index.token_nbytes, offset=offset
+        )
+        return _unpack_tokens(buffer, self.index.dtype, self.index.token_nbytes)
+
     @property
     def sequence_lengths(self) -> numpy.ndarray:
         """Get the sequence lengths
@@ -737,28 +1436,41 @@ class IndexedDataset(torch.utils.data.Dataset):
             return object_exists(s3_client, get_idx_path(path_prefix)) and object_exists(
                 s3_client, get_bin_path(path_prefix)
             )
-        return os.path.exists(get_idx_path(path_prefix)) and os.path.exists(
-            get_bin_path(path_prefix)
+        return os.path.exists(get_idx_path(path_prefix)) and (
+            os.path.exists(get_bin_path(path_prefix))
+            or os.path.exists(get_virtual_bin_path(path_prefix))
         )
 
 
 class IndexedDatasetBuilder(object):
     """Builder class for the IndexedDataset class
 
+    Tokens may be packed into fewer bytes than the dtype size, e.g. 3 bytes for a vocabulary of
+    up to 2 ** 24 tokens in place of the 4 bytes of numpy.int32, see DType.optimal_token_nbytes.
+    IndexedDataset unpacks them back to the dtype on read.
+
     Args:
         bin_path (str): The path to the data (.bin) file
 
         dtype (Type[numpy.number], optional): The dtype of the index file. Defaults to numpy.int32.
 
         multimodal (bool, optional): Whether the dataset is multimodal. Defaults to False.
+
+        token_nbytes (Optional[int], optional): The number of bytes to pack each token into, or None to store the tokens as the dtype. Defaults to None.
     """
 
     def __init__(
-        self, bin_path: str, dtype: Type[numpy.number] = numpy.int32, multimodal: bool = False
+        self,
+        bin_path: str,
+        dtype: Type[numpy.number] = numpy.int32,
+        multimodal: bool = False,
+        token_nbytes: Optional[int] = None,
     ) -> None:
         self.data_file = open(bin_path, "wb")
         self.dtype = dtype
         self.multimodal = multimodal
+        self.token_nbytes = token_nbytes if token_nbytes is not None else DType.size(dtype)
+        assert 0 < self.token_nbytes <= DType.size(dtype)
 
         self.sequence_lengths = []
         self.document_indices = [0]
@@ -773,7 +1485,7 @@ class IndexedDatasetBuilder(object):
             mode (int, optional): The mode for the item. Defaults to 0.
         """
         np_array = numpy.array(tensor.numpy(), dtype=self.dtype)
-        self.data_file.write(np_array.tobytes(order="C"))
+        self._write(np_array)
         self.sequence_lengths.append(np_array.size)
         if self.multimodal:
             self.sequence_modes.append(mode)
@@ -791,7 +1503,7 @@ class IndexedDatasetBuilder(object):
             modes (Optional[List[int]], optional): The modes for each item in the document. Defaults to None.
         """
         np_array = numpy.array(tensor, dtype=self.dtype)
-        self.data_file.write(np_array.tobytes(order="C"))
+        self._write(np_array)
         self.sequence_lengths.extend(lengths)
         self.document_indices.append(len(self.sequence_lengths))
         if self.multimodal:
@@ -801,6 +1513,78 @@ class IndexedDatasetBuilder(object):
         """Finalize the document, for use with IndexedDatasetBuilder.add_item"""
         self.document_indices.append(len(self.sequence_lengths))
 
+    def add_packed_documents(
+        self,
+        tokens: numpy.ndarray,
+        lengths: numpy.ndarray,
+        document_lengths: numpy.ndarray,
+        modes: Optional[numpy.ndarray] = None,
+    ) -> None:
+        """Add several documents to the dataset with a single write
+
+        Args:
+            tokens (numpy.ndarray): The concatenated items of all of the documents
+
+            lengths (numpy.ndarray): The length of each item
+
+            document_lengths (numpy.ndarray): The number of items in each document
+
+            modes (Optional[numpy.ndarray], optional): The mode of each item. Defaults to None.
+        """
+        self._write(numpy.ascontiguousarray(tokens, dtype=self.dtype))
+        offset = len(self.sequence_lengths)
+        self.sequence_lengths.extend(numpy.asarray(lengths).tolist())
+        self.document_indices.extend((offset + numpy.cumsum(document_lengths)).tolist())
+        if self.multimodal:
+            self.sequence_modes.extend(
+                numpy.asarray(modes).tolist() if modes is not None else [0] * len(lengths)
+            )
+
+    @classmethod
+    def resume(
+        cls,
+        bin_path: str,
+        nbytes: int,
+        sequence_lengths: List[int],
+        document_indices: List[int],
+        dtype: Type[numpy.number] = numpy.int32,
+        token_nbytes: Optional[int] = None,
+    ) -> "IndexedDatasetBuilder":
+        """Reopen a partially built dataset to continue building it
+
+        The data (.bin) file is truncated to the given size, which discards anything written after
+        the state was recorded.
+
+        Args:
+            bin_path (str): The path to the data (.bin) file
+
+            nbytes (int): The number of bytes of the data file to keep
+
+            sequence_lengths (List[int]): The length of each sequence kept
+
+            document_indices (List[int]): The document indices kept, starting with 0
+
+            dtype (Type[numpy.number], optional): The dtype of the index file. Defaults to numpy.int32.
+
+            token_nbytes (Optional[int], optional): The number of bytes per packed token, or None if the tokens are not packed. Defaults to None.
+
+        Returns:
+            IndexedDatasetBuilder: The builder
+        """
+        token_nbytes = token_nbytes if token_nbytes is not None else DType.size(dtype)
+        assert nbytes == sum(sequence_lengths) * token_nbytes
+        with open(bin_path, "r+b") as stream:
+            stream.truncate(nbytes)
+        builder = cls.__new__(cls)
+        builder.data_file = open(bin_path, "ab")
+        builder.dtype = dtype
+        builder.token_nbytes = token_nbytes
+        builder.multimodal = False
+        builder.sequence_lengths = list(sequence_lengths)
+        builder.document_indices = list(document_indices)
+        builder.sequence_modes = None
+        return builder
+
     def add_index(self, path_prefix: str) -> None:
         """Add an entire IndexedDataset to the dataset
 
@@ -810,6 +1594,7 @@ class IndexedDatasetBuilder(object):
         # Concatenate index
         index = _IndexReader(get_idx_path(path_prefix), multimodal=self.multimodal)
         assert index.dtype == self.dtype
+        assert index.token_nbytes == self.token_nbytes
 
         offset = len(self.sequence_lengths)
         self.sequence_lengths.extend(index.sequence_lengths)
@@ -829,9 +1614,20 @@ class IndexedDatasetBuilder(object):
             idx_path (str): The path to the index file
         """
         self.data_file.close()
-        with _IndexWriter(idx_path, self.dtype) as writer:
+        with _IndexWriter(idx_path, self.dtype, self.token_nbytes) as writer:
             writer.write(self.sequence_lengths, self.sequence_modes, self.document_indices)
 
+    def _write(self, np_array: numpy.ndarray) -> None:
+        """Write tokens to the data file, packing them if packed
+
+        Args:
+            np_array (numpy.ndarray): The tokens, of the builder dtype
+        """
+        if self.token_nbytes == DType.size(self.dtype):
+            self.data_file.write(memoryview(numpy.ascontiguousarray(np_array)).cast("B"))
+        else:
+            self.data_file.write(memoryview(_pack_tokens(np_array, self.token_nbytes)))
+
 
 def get_idx_path(path_prefix: str) -> str:
     """Get the path to the index file from the prefix
@@ -855,3 +1651,178 @@ def get_bin_path(path_prefix: str) -> str:
         str: The path to the data file
     """
     return path_prefix + ".bin"
+
+
+def get_virtual_bin_path(path_prefix: str) -> str:
+    """Get the path to the virtual data file from the prefix
+
+    Args:
+        path_prefix (str): The prefix
+
+    Returns:
+        str: The path to the virtual data file
+    """
+    return path_prefix + ".vbin"
+
+
+def _read_virtual_bin(vbin_path: str) -> List[Tuple[str, int]]:
+    """Read the manifest of a virtual data (.vbin) file
+
+    Args:
+        vbin_path (str): The path to the virtual data file
+
+    Returns:
+        List[Tuple[str, int]]: The path to and the number of bytes of each data file, in order
+    """
+    with open(vbin_path, "rt") as stream:
+        manifest = json.load(stream)
+    directory = os.path.dirname(os.path.abspath(vbin_path))
+    return [
+        (os.path.join(directory, bin_path), nbytes)
+        for bin_path, nbytes in zip(manifest["bin_paths"], manifest["nbytes"])
+    ]
+
+
+def _get_bin_segments(path_prefix: str, nbytes: int) -> List[Tuple[str, int]]:
+    """Get the data files which make up the data of a dataset
+
+    Args:
+        path_prefix (str): The index (.idx) and data (.bin or .vbin) prefix
+
+        nbytes (int): The number of bytes of data per the index
+
+    Returns:
+        List[Tuple[str, int]]: The path to and the number of bytes of each data file, in order
+    """
+    bin_path = get_bin_path(path_prefix)
+    if os.path.exists(bin_path):
+        assert os.path.getsize(bin_path) >= nbytes, f"{bin_path} is smaller than its index"
+        return [(os.path.abspath(bin_path), nbytes)]
+    segments = _read_virtual_bin(get_virtual_bin_path(path_prefix))
+    assert sum(segment_nbytes for _, segment_nbytes in segments) == nbytes
+    return segments
+
+
+def _copy_file_range(
+    src_path: str, dst_path: str, count: int, src_offset: int, dst_offset: int
+) -> None:
+    """Copy a byte range between files in the kernel where possible
+
+    The copy uses os.copy_file_range, which may share extents on filesystems that support it, and
+    falls back to os.sendfile and then to positional reads and writes.
+
+    Args:
+        src_path (str): The source file
+
+        dst_path (str): The destination file, which must exist
+
+        count (int): The number of bytes to copy
+
+        src_offset (int): The source offset (in bytes)
+
+        dst_offset (int): The destination offset (in bytes)
+    """
+    src_fd = os.open(src_path, os.O_RDONLY)
+    dst_fd = os.open(dst_path, os.O_WRONLY)
+    try:
+        methods = ["copy_file_range", "sendfile", "pwrite"]
+        while count > 0:
+            size = min(count, _COPY_CHUNK_NBYTES)
+            try:
+                if methods[0] == "copy_file_range":
+                    copied = os.copy_file_range(src_fd, dst_fd, size, src_offset, dst_offset)
+                elif methods[0] == "sendfile":
+                    os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+                    copied = os.sendfile(dst_fd, src_fd, src_offset, size)
+                else:
+                    copied = os.pwrite(dst_fd, os.pread(src_fd, size, src_offset), dst_offset)
+            except (AttributeError, OSError):
+                if len(methods) == 1:
+                    raise
+                methods.pop(0)
+                continue
+            if copied == 0:
+                raise EOFError(f"Unexpected end of {src_path} at offset {src_offset}")
+            count -= copied
+            src_offset += copied
+            dst_offset += copied
+    finally:
+        os.close(src_fd)
+        os.close(dst_fd)
+
+
+def merge_indexed_datasets(
+    path_prefixes: List[str],
+    output_prefix: str,
+    multimodal: bool = False,
+    virtual: bool = False,
+    num_workers: int = 8,
+) -> None:
+    """Merge several IndexedDatasets into one
+
+    The merged index (.idx) file is computed from the source indices with vectorized arithmetic and
+    streamed to disk. The merged data is either
+
+        -- a data (.bin) file, into which the source data files are copied in parallel, in
+           `_COPY_CHUNK_NBYTES` pieces, by `num_workers` threads which copy in the kernel, or
+        -- a virtual data (.vbin) file, a JSON manifest which references the source data files
+           without copying them and which IndexedDataset reads in place of a data file
+
+    Args:
+        path_prefixes (List[str]): The index (.idx) and data (.bin or .vbin) prefixes, in order
+
+        output_prefix (str): The merged index (.idx) and data (.bin or .vbin) prefix
+
+        multimodal (bool): Whether the datasets are multimodal. Defaults to False.
+
+        virtual (bool): Whether to write a virtual data file. Defaults to False.
+
+        num_workers (int): The number of copy threads. Defaults to 8.
+    """
+    assert len(path_prefixes) > 0
+    indices = [_IndexReader(get_idx_path(path_prefix), multimodal) for path_prefix in path_prefixes]
+    dtype = indices[0].dtype
+    token_nbytes = indices[0].token_nbytes
+    assert all(index.dtype == dtype for index in indices)
+    assert all(index.token_nbytes == token_nbytes for index in indices)
+
+    segments = []
+    for path_prefix, index in zip(path_prefixes, indices):
+        nbytes = int(index.sequence_lengths.sum(dtype=numpy.int64)) * token_nbytes
+        segments.extend(_get_bin_segments(path_prefix, nbytes))
+
+    if virtual:
+        assert not os.path.exists(
+            get_bin_path(output_prefix)
+        ), f"{get_bin_path(output_prefix)} would take precedence over the virtual data file"
+        vbin_path = get_virtual_bin_path(output_prefix)
+        directory = os.path.dirname(os.path.abspath(vbin_path))
+        manifest = {
+            "bin_paths": [os.path.relpath(bin_path, directory) for bin_path, _ in segments],
+            "nbytes": [nbytes for _, nbytes in segments],
+        }
+        with open(vbin_path, "wt") as stream:
+            json.dump(manifest, stream, indent=4)
+    else:
+        bin_path = get_bin_path(output_prefix)
+        offsets = numpy.cumsum([0] + [nbytes for _, nbytes in segments]).tolist()
+        with open(bin_path, "wb") as stream:
+            stream.truncate(offsets[-1])
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = [
+                executor.submit(
+                    _copy_file_range,
+                    segment_path,
+                    bin_path,
+                    min(_COPY_CHUNK_NBYTES, nbytes - start),
+                    start,
+                    offset + start,
+                )
+                for (segment_path, nbytes), offset in zip(segments, offsets)
+                for start in range(0, nbytes, _COPY_CHUNK_NBYTES)
+            ]
+            for future in futures:
+                future.result()
+
+    with _IndexWriter(get_idx_path(output_prefix), dtype, token_nbytes) as writer:
+        writer.write_concatenated(indices)
@@ -0,0 +1,201 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+"""A consolidated, page-aligned file format for the cached dataset indices
+
+An indices file holds a set of named numpy arrays, e.g. the document, sample, and shuffle indices
+of a GPTDataset, in a single file. The layout is
+
+    header: _INDICES_HEADER, version (<Q), section count (<Q)
+    section table: for every section
+        name length (<Q), name (utf-8), dtype length (<Q), dtype (numpy dtype.str, ascii),
+        ndim (<Q), shape (<Q * ndim), offset (<Q), nbytes (<Q)
+    sections: the raw array bytes, each section starting on a _PAGE_SIZE boundary
+
+Every process maps a given indices file once, read-only, and hands out array views onto that
+mapping, so the pages are read from storage only on first access and are shared through the page
+cache by all of the ranks on a node.
+"""
+
+import logging
+import os
+import struct
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+_INDICES_HEADER = b"MMIDCAT\x00\x00"
+
+_INDICES_VERSION = 1
+
+_PAGE_SIZE = 4096
+
+_SHARED_MAPPINGS: Dict[str, numpy.memmap] = {}
+
+_SHARED_MAPPINGS_LOCK = threading.Lock()
+
+
+def _align(offset: int) -> int:
+    """Round an offset up to the next page boundary
+
+    Args:
+        offset (int): The offset
+
+    Returns:
+        int: The page-aligned offset
+    """
+    return (offset + _PAGE_SIZE - 1) // _PAGE_SIZE * _PAGE_SIZE
+
+
+def _get_shared_mapping(path: str) -> numpy.memmap:
+    """Get the read-only mapping of an indices file, creating it on first use in this process
+
+    Args:
+        path (str): The path to the indices file
+
+    Returns:
+        numpy.memmap: The mapping
+    """
+    key = os.path.realpath(path)
+    with _SHARED_MAPPINGS_LOCK:
+        mapping = _SHARED_MAPPINGS.get(key)
+        if mapping is None:
+            mapping = numpy.memmap(key, dtype=numpy.uint8, mode="r")
+            _SHARED_MAPPINGS[key] = mapping
+    return mapping
+
+
+def write_indices_file(path: str, sections: Dict[str, numpy.ndarray]) -> None:
+    """Write a set of named arrays to an indices file
+
+    Args:
+        path (str): The path to the indices file
+
+        sections (Dict[str, numpy.ndarray]): The arrays to write, by name
+    """
+    sections = {name: numpy.ascontiguousarray(array) for name, array in sections.items()}
+
+    table = []
+    for name, array in sections.items():
+        name_bytes = name.encode("utf-8")
+        dtype_bytes = array.dtype.str.encode("ascii")
+        table.append(
+            struct.pack("<Q", len(name_bytes))
+            + name_bytes
+            + struct.pack("<Q", len(dtype_bytes))
+            + dtype_bytes
+            + struct.pack(f"<Q{array.ndim}Q", array.ndim, *array.shape)
+        )
+
+    # Each table entry is followed by its offset and nbytes
+    header_size = len(_INDICES_HEADER) + struct.calcsize("<QQ")
+    header_size += sum(len(entry) + struct.calcsize("<QQ") for entry in table)
+
+    offsets = []
+    offset = _align(header_size)
+    for array in sections.values():
+        offsets.append(offset)
+        offset = _align(offset + array.nbytes)
+
+    with open(path, "wb") as stream:
+        stream.write(_INDICES_HEADER)
+        stream.write(struct.pack("<QQ", _INDICES_VERSION, len(sections)))
+        for entry, offset, array in zip(table, offsets, sections.values()):
+            stream.write(entry)
+            stream.write(struct.pack("<QQ", offset, array.nbytes))
+        for offset, array in zip(offsets, sections.values()):
+            stream.seek(offset)
+            stream.write(memoryview(array.reshape(-1).view(numpy.uint8)))
+        stream.truncate(_align(stream.tell()))
+
+
+class IndicesFile(object):
+    """A lazily mapped, read-only view of an indices file
+
+    Nothing is read from the file until the first section is requested. All IndicesFile objects
+    for the same file in a process share a single mapping.
+
+    Args:
+        path (str): The path to the indices file
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._sections: Optional[Dict[str, Tuple[numpy.dtype, Tuple[int, ...], int]]] = None
+
+    def _load_section_table(
+        self, mapping: numpy.memmap
+    ) -> Dict[str, Tuple[numpy.dtype, Tuple[int, ...], int]]:
+        """Parse the header and the section table
+
+        Args:
+            mapping (numpy.memmap): The mapping of the indices file
+
+        Returns:
+            Dict[str, Tuple[numpy.dtype, Tuple[int, ...], int]]: The dtype, shape, and offset of
+            every section, by name
+        """
+        buffer = memoryview(mapping)
+
+        cursor = len(_INDICES_HEADER)
+        header = bytes(buffer[:cursor])
+        assert header == _INDICES_HEADER, f"bad header, cannot read: {self.path}"
+
+        def unpack(fmt: str) -> Tuple[int, ...]:
+            nonlocal cursor
+            values = struct.unpack_from(fmt, buffer, cursor)
+            cursor += struct.calcsize(fmt)
+            return values
+
+        def unpack_bytes() -> bytes:
+            nonlocal cursor
+            (length,) = unpack("<Q")
+            value = bytes(buffer[cursor : cursor + length])
+            cursor += length
+            return value
+
+        version, count = unpack("<QQ")
+        assert version == _INDICES_VERSION, f"bad version, cannot read: {self.path}"
+
+        sections = {}
+        for _ in range(count):
+            name = unpack_bytes().decode("utf-8")
+            dtype = numpy.dtype(unpack_bytes().decode("ascii"))
+            (ndim,) = unpack("<Q")
+            shape = unpack(f"<{ndim}Q")
+            offset, nbytes = unpack("<QQ")
+            assert offset % _PAGE_SIZE == 0
+            assert nbytes == dtype.itemsize * int(numpy.prod(shape, dtype=numpy.int64))
+            sections[name] = (dtype, shape, offset)
+        return sections
+
+    def __contains__(self, name: str) -> bool:
+        """Return whether the file holds a section
+
+        Args:
+            name (str): The section name
+
+        Returns:
+            bool: Whether the section exists
+        """
+        if self._sections is None:
+            self._sections = self._load_section_table(_get_shared_mapping(self.path))
+        return name in self._sections
+
+    def __getitem__(self, name: str) -> numpy.ndarray:
+        """Get a read-only view of a section
+
+        Args:
+            name (str): The section name
+
+        Returns:
+            numpy.ndarray: The section array, backed by the shared mapping
+        """
+        mapping = _get_shared_mapping(self.path)
+        if self._sections is None:
+            self._sections = self._load_section_table(mapping)
+        dtype, shape, offset = self._sections[name]
+        count = int(numpy.prod(shape, dtype=numpy.int64))
+        return numpy.frombuffer(mapping, dtype=dtype, count=count, offset=offset).reshape(shape)
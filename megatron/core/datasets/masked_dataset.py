@@ -227,45 +227,68 @@ class MaskedWordPieceDataset(MegatronDataset):
 
     def _create_masked_lm_predictions(
         self,
-        token_ids: List[int],
+        token_ids: Union[List[int], numpy.ndarray],
         target_sequence_length: int,
         numpy_random_state: numpy.random.RandomState,
-    ) -> Tuple[List[int], List[int], List[int], List[int], List[Tuple[List[int], List[int]]]]:
+    ) -> Tuple[
+        numpy.ndarray,
+        numpy.ndarray,
+        numpy.ndarray,
+        numpy.ndarray,
+        List[Tuple[numpy.ndarray, numpy.ndarray]],
+    ]:
         """Creates the predictions for the masked LM objective
 
+        The word boundaries, the masking candidates and their N-grams are computed with array
+        operations. Only the choice of N-grams, which consumes the random state one candidate at a
+        time, is sequential, and it draws from the random state in the same order as always, so a
+        given seed produces the same predictions.
+
         Args:
-            token_ids (List[int]): The token ids
+            token_ids (Union[List[int], numpy.ndarray]): The token ids
             target_sequence_length (int): The target sequence length
             numpy_random_state (numpy.random.RandomState): The NumPy random state
 
         Returns:
-            Tuple[List[int], List[int], List[int], List[int], List[Tuple[List[int], List[int]]]]:
+            Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray, List[Tuple[numpy.ndarray, numpy.ndarray]]]:
                 1. masked_token_ids -> The masked sequence
                 2. masked_positions -> The indices for the masked token ids
                 3. masked_labels    -> The original token ids for the masked token ids
                 4. boundaries       -> The sentence and word boundaries for the sequence
                 4. masked_spans     -> The masked positions and labels with N-gram info intact
         """
+        token_ids = numpy.asarray(token_ids, dtype=numpy.int64)
+
         # Build the token sentence and word boundaries and the masking candidates
         # e.g. [cls, id, ##id, ##id, id, ##id, sep, id, ##id, sep]
         #    -> boundaries: [1, 1, 0, 0, 1, 0, 1, 1, 0, 1]
         #    -> candidates with whole word masking: [[1, 2, 3], [4, 5], [7, 8]]
         #    -> candidates sans whole word masking: [[1], [2], [3], [4], [5], [7], [8]]
-        boundaries = []
-        candidates = []
-        for i, token_id in enumerate(token_ids):
-            if token_id == self.config.tokenizer.cls or token_id == self.config.tokenizer.sep:
-                boundaries.append(1)
-            else:
-                if not self.config.tokenizer.inv_vocab[token_id].startswith("##"):
-                    boundaries.append(1)
-                    candidates.append([i])
-                else:
-                    boundaries.append(0)
-                    if self.config.masking_do_full_word and len(candidates) > 0:
-                        candidates[-1].append(i)
-                    else:
-                        candidates.append([i])
+        # The candidates are stored flat, candidate c being
+        # candidate_positions[candidate_offsets[c] : candidate_offsets[c + 1]]
+        is_special = (token_ids == self.config.tokenizer.cls) | (
+            token_ids == self.config.tokenizer.sep
+        )
+        is_subword = self._get_subword_lookup()[token_ids] & ~is_special
+        boundaries = (~is_subword).astype(numpy.int64)
+        candidate_positions = numpy.flatnonzero(~is_special)
+        is_candidate_start = ~is_subword[candidate_positions]
+        if not self.config.masking_do_full_word:
+            is_candidate_start[:] = True
+        if len(candidate_positions) > 0:
+            is_candidate_start[0] = True
+        candidate_offsets = numpy.append(
+            numpy.flatnonzero(is_candidate_start), len(candidate_positions)
+        )
+        n_candidates = len(candidate_offsets) - 1
+
+        def get_ngram_indices(candidate_idx: int, n: int) -> numpy.ndarray:
+            """The token positions of the N-gram of candidates starting at candidate_idx"""
+            return candidate_positions[
+                candidate_offsets[candidate_idx] : candidate_offsets[
+                    min(candidate_idx + n, n_candidates)
+                ]
+            ]
 
         n_maskings = min(
             self.config.masking_probability * target_sequence_length,
@@ -282,30 +305,23 @@ class MaskedWordPieceDataset(MegatronDataset):
         if self.config.masking_use_longer_ngrams:
             nprobs = nprobs[::-1]
 
-        # Create a nested list of depth 3
-        #   layer 1: the candidate dimension
-        #   layer 2: the N-gram dimension
-        #   layer 3: the token dimension
-        candidate_ngrams = [
-            [candidates[idx : idx + n] for n in ngram_nvals] for idx in range(len(candidates))
-        ]
-        numpy_random_state.shuffle(candidate_ngrams)
+        # Every candidate has an N-gram for each N, some of which may be cut short by the end of
+        # the sequence
+        n_ngrams = len(ngram_nvals)
 
-        masked_token_ids = list(token_ids)
-        masked_positions_and_labels = []
-        masked_spans = []
-        masked_indices = set()
-        for candidate_idx in range(len(candidate_ngrams)):
-            n_ngrams = len(candidate_ngrams[candidate_idx])
+        # Shuffle the candidates, which draws from the random state as shuffling a list would
+        candidate_order = numpy.arange(n_candidates)
+        numpy_random_state.shuffle(candidate_order)
 
+        masked_token_ids = token_ids.copy()
+        is_masked = numpy.zeros(len(token_ids), dtype=bool)
+        masked_spans = []
+        n_masked = 0
+        for candidate_idx in candidate_order:
             # Stop when we hit our desired number of maskings
-            if len(masked_positions_and_labels) >= n_maskings:
+            if n_masked >= n_maskings:
                 break
 
-            # Do nothing for candidates with no ngrams
-            if not candidate_ngrams[candidate_idx]:
-                continue
-
             # Choose the initial value of N
             if self.config.masking_use_geometric_distribution:
                 # Sample N from a geometric distribution with p = 0.2 and clip
@@ -318,10 +334,10 @@ class MaskedWordPieceDataset(MegatronDataset):
                 n = numpy_random_state.choice(ngram_nvals[:n_ngrams], p=p)
 
             while True:
-                ngram_indices = sum(candidate_ngrams[candidate_idx][n - 1], [])
+                ngram_indices = get_ngram_indices(candidate_idx, n)
                 n = n - 1
                 # Success: masking this N-gram puts us below the desired number of maskings
-                if n_maskings >= len(masked_positions_and_labels) + len(ngram_indices):
+                if n_maskings >= n_masked + len(ngram_indices):
                     skip_candidate = False
                     break
                 # Failure: no N-grams remain for this candidate
@@ -334,48 +350,44 @@ class MaskedWordPieceDataset(MegatronDataset):
                 continue
 
             # Do nothing for candidate indices which have already been masked
-            if any(map(lambda idx: idx in masked_indices, ngram_indices)):
+            if is_masked[ngram_indices].any():
                 continue
 
             # Mask the tokens and record their original positions and values
-            for index in ngram_indices:
-                masked_indices.add(index)
-                mask = self._get_token_mask(numpy_random_state)
-                if mask is None:
-                    masked_token_ids[index] = token_ids[index]
-                else:
-                    masked_token_ids[index] = mask
-                masked_positions_and_labels.append((index, token_ids[index]))
+            is_masked[ngram_indices] = True
+            masks = self._get_token_masks(len(ngram_indices), numpy_random_state)
+            masked_token_ids[ngram_indices] = numpy.where(
+                masks >= 0, masks, token_ids[ngram_indices]
+            )
+            n_masked += len(ngram_indices)
+
+            masked_spans.append((ngram_indices, token_ids[ngram_indices]))
 
-            masked_spans.append((ngram_indices, [token_ids[index] for index in ngram_indices]))
+        assert n_masked <= n_maskings
 
-        assert len(masked_positions_and_labels) <= n_maskings
+        masked_positions = numpy.flatnonzero(is_masked)
+        masked_labels = token_ids[masked_positions]
 
-        numpy_random_state.shuffle(candidate_ngrams)
+        numpy_random_state.shuffle(candidate_order)
 
         if self.config.masking_do_permutation:
 
             n_swappings = n_maskings
 
-            permuted_indices = set()
-            for candidate_idx in range(len(candidate_ngrams)):
-                n_ngrams = len(candidate_ngrams[candidate_idx])
-
-                if len(permuted_indices) >= n_swappings:
+            is_permuted = numpy.zeros(len(token_ids), dtype=bool)
+            n_permuted = 0
+            for candidate_idx in candidate_order:
+                if n_permuted >= n_swappings:
                     break
 
-                # Do nothing for candidates with no ngrams
-                if not candidate_ngrams[candidate_idx]:
-                    continue
-
                 p = nprobs[:n_ngrams] / nprobs[:n_ngrams].sum(keepdims=True)
                 n = numpy.random.choice(ngram_nvals[:n_ngrams], p=p)
 
                 while True:
-                    ngram_indices = sum(candidate_ngrams[candidate_idx][n - 1], [])
+                    ngram_indices = get_ngram_indices(candidate_idx, n)
                     n = n - 1
                     # Success: swapping this N-gram puts us below the desired number of swappings
-                    if n_swappings >= len(permuted_indices) + len(ngram_indices):
+                    if n_swappings >= n_permuted + len(ngram_indices):
                         skip_candidate = False
                         break
                     # Failure: no N-grams remain for this candidate
@@ -388,36 +400,62 @@ class MaskedWordPieceDataset(MegatronDataset):
                     continue
 
                 # Do nothing for candidate indices which have already been masked or permuted
-                if any(
-                    map(lambda idx: idx in masked_indices or idx in permuted_indices, ngram_indices)
-                ):
+                if (is_masked[ngram_indices] | is_permuted[ngram_indices]).any():
                     continue
 
-                for index in ngram_indices:
-                    permuted_indices.add(index)
+                is_permuted[ngram_indices] = True
+                n_permuted += len(ngram_indices)
 
-            assert len(permuted_indices) <= n_swappings
+            assert n_permuted <= n_swappings
 
-            permuted_indices = sorted(permuted_indices)
-            permuted_indices_copy = list(permuted_indices)
+            permuted_indices = numpy.flatnonzero(is_permuted)
+            permuted_indices_copy = permuted_indices.copy()
             numpy_random_state.shuffle(permuted_indices_copy)
-            masked_token_ids_copy = list(masked_token_ids)
+            masked_token_ids_copy = masked_token_ids.copy()
 
-            for idx, idx_copy in zip(permuted_indices, permuted_indices_copy):
-                masked_token_ids[idx] = masked_token_ids_copy[idx_copy]
-                masked_positions_and_labels.append((idx, masked_token_ids_copy[idx]))
+            masked_token_ids[permuted_indices] = masked_token_ids_copy[permuted_indices_copy]
 
-        masked_positions_and_labels = sorted(masked_positions_and_labels, key=lambda x: x[0])
-        masked_positions = []
-        masked_labels = []
-        for position, label in masked_positions_and_labels:
-            masked_positions.append(position)
-            masked_labels.append(label)
+            # The masked and permuted positions are disjoint
+            masked_positions = numpy.concatenate([masked_positions, permuted_indices])
+            masked_labels = numpy.concatenate(
+                [masked_labels, masked_token_ids_copy[permuted_indices]]
+            )
+            order = numpy.argsort(masked_positions, kind="stable")
+            masked_positions = masked_positions[order]
+            masked_labels = masked_labels[order]
 
         masked_spans = sorted(masked_spans, key=lambda x: x[0][0])
 
         return masked_token_ids, masked_positions, masked_labels, boundaries, masked_spans
 
+    def _get_subword_lookup(self) -> numpy.ndarray:
+        """Get whether each token id in the vocabulary is a WordPiece continuation, i.e. "##"
+
+        Returns:
+            numpy.ndarray: The boolean lookup table, indexed by token id
+        """
+        if getattr(self, "_subword_lookup", None) is None:
+            inv_vocab = self.config.tokenizer.inv_vocab
+            self._subword_lookup = numpy.zeros(max(inv_vocab) + 1, dtype=bool)
+            for token_id, token in inv_vocab.items():
+                self._subword_lookup[token_id] = token.startswith("##")
+        return self._subword_lookup
+
+    def _get_token_masks(
+        self, n_tokens: int, numpy_random_state: numpy.random.RandomState
+    ) -> numpy.ndarray:
+        """Get the replacement token ids for a number of masked tokens
+
+        Args:
+            n_tokens (int): The number of masked tokens
+            numpy_random_state (RandomState): The NumPy random state
+
+        Returns:
+            numpy.ndarray: The replacement token id per token, or -1 where the token is kept
+        """
+        masks = [self._get_token_mask(numpy_random_state) for _ in range(n_tokens)]
+        return numpy.array([-1 if mask is None else mask for mask in masks], dtype=numpy.int64)
+
     @abstractmethod
     def _get_token_mask(self, numpy_random_state: numpy.random.RandomState) -> Optional[int]:
         pass
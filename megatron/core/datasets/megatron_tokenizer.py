@@ -2,7 +2,7 @@
 import json
 from abc import ABC, abstractmethod
 from collections import OrderedDict
-from typing import Any
+from typing import Any, List
 
 import numpy
 
@@ -43,6 +43,20 @@ class MegatronTokenizer(ABC):
         """
         pass
 
+    def tokenize_batch(self, texts: List[str]) -> List[numpy.ndarray]:
+        """Convert a batch of texts to embedding ids
+
+        Subclasses whose backend can encode many texts at once, e.g. in native threads, should
+        override this method. The default implementation tokenizes the texts one at a time.
+
+        Args:
+            texts (List[str]): The texts to convert
+
+        Returns:
+            List[numpy.ndarray]: The converted embedding ids, one sequence per text
+        """
+        return [self.tokenize(text) for text in texts]
+
     def detokenize(self, ids: numpy.ndarray) -> str:
         """Convert embedding ids to text
 
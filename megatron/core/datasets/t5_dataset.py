@@ -1,6 +1,5 @@
 # Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
 
-from collections import deque
 from dataclasses import dataclass, field
 from typing import Dict, List, Optional, Union
 
@@ -96,16 +95,16 @@ class T5MaskedWordPieceDataset(MaskedWordPieceDataset):
             Dict[str, Union[int, numpy.ndarray]]: The
         """
         idx_beg, idx_end, target_sequence_length = self.sample_index[idx]
-        sample = [self.dataset[i] for i in range(idx_beg, idx_end)]
+        sample = self.dataset[idx_beg:idx_end]
 
         numpy_random_state = numpy.random.RandomState(seed=(self.config.random_seed + idx) % 2**32)
 
         assert target_sequence_length <= self.config.sequence_length
 
-        # Flatten the sample into a list of tokens
-        tokens = [token for sentence in sample for token in sentence]
+        # Flatten the sample into an array of tokens
+        tokens = numpy.concatenate([numpy.zeros(0, dtype=numpy.int64), *sample])
 
-        # Truncate the list of tokens to a desired length
+        # Truncate the array of tokens to a desired length
         truncated = len(tokens) > target_sequence_length
         tokens = tokens[:target_sequence_length]
 
@@ -115,31 +114,24 @@ class T5MaskedWordPieceDataset(MaskedWordPieceDataset):
         )
 
         # Prepare the encoder input and decoder input and output
-        sentinels = deque(self.config.tokenizer.additional_special_tokens_ids)
+        sentinels = numpy.array(
+            self.config.tokenizer.additional_special_tokens_ids[: len(masked_spans)],
+            dtype=numpy.int64,
+        )
+        assert len(sentinels) == len(masked_spans), "not enough sentinel tokens"
         encoder_input = []
-        decoder_input = [self.config.tokenizer.bos]
         decoder_output = []
         idx_beg = 0
-        for indices, labels in masked_spans:
-            sentinel = sentinels.popleft()
-
-            # set the end index
-            idx_end = indices[0]
-
-            encoder_input.extend(tokens[idx_beg:idx_end])
-            encoder_input.append(sentinel)
-
-            decoder_input.append(sentinel)
-            decoder_input.extend(labels)
-
-            decoder_output.append(sentinel)
-            decoder_output.extend(labels)
-
-            # set the start index
+        for sentinel, (indices, labels) in zip(sentinels[:, None], masked_spans):
+            encoder_input += [tokens[idx_beg : indices[0]], sentinel]
+            decoder_output += [sentinel, labels]
             idx_beg = indices[-1] + 1
-
-        encoder_input.extend(tokens[idx_beg:])
-        decoder_output.append(self.config.tokenizer.eos)
+        encoder_input.append(tokens[idx_beg:])
+        encoder_input = numpy.concatenate(encoder_input).astype(numpy.int64, copy=False)
+        decoder_output = numpy.concatenate([*decoder_output, [self.config.tokenizer.eos]]).astype(
+            numpy.int64, copy=False
+        )
+        decoder_input = numpy.concatenate([[self.config.tokenizer.bos], decoder_output[:-1]])
 
         # Pad the sequences and convert to NumPy
         length_toks_encoder = len(encoder_input)
@@ -149,12 +141,10 @@ class T5MaskedWordPieceDataset(MaskedWordPieceDataset):
         assert length_pads_encoder >= 0
         assert length_pads_decoder >= 0
 
-        encoder_input = numpy.array(encoder_input, dtype=numpy.int64)
         encoder_input = numpy.pad(
             encoder_input, (0, length_pads_encoder), constant_values=self.config.tokenizer.pad
         )
 
-        decoder_input = numpy.array(decoder_input, dtype=numpy.int64)
         decoder_input = numpy.pad(
             decoder_input, (0, length_pads_decoder), constant_values=self.config.tokenizer.pad
         )
@@ -166,7 +156,6 @@ class T5MaskedWordPieceDataset(MaskedWordPieceDataset):
         mask_decoder = mask_decoder * self._make_history_mask(decoder_input)
 
         # Mask the labels
-        decoder_output = numpy.array(decoder_output, dtype=numpy.int64)
         decoder_output = numpy.pad(decoder_output, (0, length_pads_decoder), constant_values=-1)
 
         # Get the loss mask
@@ -226,3 +215,19 @@ class T5MaskedWordPieceDataset(MaskedWordPieceDataset):
             int: The mask token id
         """
         return self.config.tokenizer.mask
+
+    def _get_token_masks(
+        self, n_tokens: int, numpy_random_state: numpy.random.RandomState
+    ) -> numpy.ndarray:
+        """Inherited method implementation
+
+        Replace every token id with the mask token id, without drawing from the random state.
+
+        Args:
+            n_tokens (int): The number of masked tokens
+            numpy_random_state (RandomState): The NumPy random state
+
+        Returns:
+            numpy.ndarray: The mask token id per token
+        """
+        return numpy.full(n_tokens, self.config.tokenizer.mask, dtype=numpy.int64)
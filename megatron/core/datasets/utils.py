@@ -1,8 +1,12 @@
 # Copyright (c) 2022, NVIDIA CORPORATION. All rights reserved.
 
 import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
 from enum import Enum
-from typing import List, Optional, Tuple
+from typing import Iterator, List, Optional, Tuple
 
 import numpy
 import torch
@@ -31,6 +35,32 @@ def compile_helpers():
         sys.exit(1)
 
 
+@contextmanager
+def atomic_write_path(path: str) -> Iterator[str]:
+    """Get a temporary path to write to in place of the given path
+
+    The temporary path is moved to the given path once the context exits without an exception, so
+    other processes never observe a partially written file at the given path. The temporary path
+    keeps the file extension of the given path.
+
+    Args:
+        path (str): The path to the file to write
+
+    Yields:
+        str: The temporary path to write to
+    """
+    dirname, basename = os.path.split(path)
+    path_tmp = os.path.join(
+        dirname, f".{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}-{basename}"
+    )
+    try:
+        yield path_tmp
+        os.replace(path_tmp, path)
+    finally:
+        if os.path.exists(path_tmp):
+            os.remove(path_tmp)
+
+
 def normalize(weights: List[float]) -> List[float]:
     """Do non-exponentiated normalization
 
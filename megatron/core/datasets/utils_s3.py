@@ -24,12 +24,20 @@ class S3Config(NamedTuple):
         path_to_idx_cache (str): The local directory where we will store the index (.idx) file
 
         bin_chunk_nbytes (int): If the number of bytes is too small, then we send a request to S3 at each call of the `read` method in _S3BinReader, which is slow, because each request has a fixed cost independent of the size of the byte range requested. If the number of bytes is too large, then we only rarely have to send requests to S3, but it takes a lot of time to complete the request when we do, which can block training. We've found that 256 * 1024 * 1024 (i.e., 256 MiB) has worked well (though we have not put that much effort into tuning it), so we default to it.
+
+        bin_cache_nchunks (int): The number of `bin_chunk_nbytes` blocks to keep in an in-memory LRU cache. With more than one block, reads of recently used blocks and reads prefetched through `IndexedDataset.prefetch` are served without a request to S3. Missing blocks are downloaded with coalesced ranged requests. Each block costs `bin_chunk_nbytes` bytes of host memory per reader, so we default to a single block.
+
+        bin_prefetch_threads (int): The number of threads which download blocks concurrently.
     """
 
     path_to_idx_cache: str
 
     bin_chunk_nbytes: int = 256 * 1024 * 1024
 
+    bin_cache_nchunks: int = 1
+
+    bin_prefetch_threads: int = 4
+
 
 class S3Client(Protocol):
     """The protocol which all s3 clients should abide by"""
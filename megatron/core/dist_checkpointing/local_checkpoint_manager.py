@@ -0,0 +1,310 @@
+# Copyright (c) 2024, NVIDIA CORPORATION.  All rights reserved.
+
+""" Node-local non-persistent checkpoints, replicated to peer ranks on other nodes."""
+
+import io
+import logging
+import os
+import re
+from functools import partial
+from pathlib import Path
+from time import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+
+from .core import CheckpointingException
+from .strategies.async_utils import AsyncRequest
+
+logger = logging.getLogger(__name__)
+
+_LOCAL_CKPT_PATTERN = re.compile(r'^iter_(\d+)_(\d+)_local\.pt$')
+
+
+def _get_rank() -> int:
+    return torch.distributed.get_rank() if torch.distributed.is_initialized() else 0
+
+
+def _get_world_size() -> int:
+    return torch.distributed.get_world_size() if torch.distributed.is_initialized() else 1
+
+
+def _exchange_payloads(
+    send: Dict[int, torch.Tensor],
+    recv_from: List[int],
+    group: Optional[torch.distributed.ProcessGroup],
+) -> Dict[int, torch.Tensor]:
+    """Exchanges byte tensors point-to-point: the sizes first, then the payloads.
+
+    Must be called on all ranks, with sends and receives that match across ranks.
+
+    Args:
+        send (Dict[int, torch.Tensor]): uint8 CPU tensors to send, by destination rank
+        recv_from (List[int]): ranks to receive a payload from
+        group (ProcessGroup, optional): a gloo process group, so the payloads are exchanged
+            from host memory
+
+    Returns:
+        Dict[int, torch.Tensor]: uint8 CPU tensors received, by source rank
+    """
+    sizes = {src: torch.empty(1, dtype=torch.int64) for src in recv_from}
+    works = [
+        torch.distributed.isend(torch.tensor([payload.numel()], dtype=torch.int64), dst, group)
+        for dst, payload in send.items()
+    ]
+    works += [torch.distributed.irecv(size, src, group) for src, size in sizes.items()]
+    for work in works:
+        work.wait()
+
+    received = {
+        src: torch.empty(int(size.item()), dtype=torch.uint8) for src, size in sizes.items()
+    }
+    works = [torch.distributed.isend(payload, dst, group) for dst, payload in send.items()]
+    works += [torch.distributed.irecv(payload, src, group) for src, payload in received.items()]
+    for work in works:
+        work.wait()
+    return received
+
+
+class LocalCheckpointManager:
+    """Saves and loads non-persistent checkpoints on node-local storage, e.g. an SSD or /dev/shm.
+
+    Each rank serializes its tensor-aware state dict (see `prepare_state_dict_for_save`) to
+    `local_ckpt_dir`, and sends it to `replication_factor` peer ranks which store it in their own
+    `local_ckpt_dir` too. Peers are `replication_jump` ranks apart, so with one rank per GPU and
+    `replication_jump` equal to the number of GPUs per node, every replica lands on another node
+    and the checkpoint survives the loss of up to `replication_factor` nodes.
+
+    A checkpoint iteration can be loaded if the shard of every rank is held by some rank. Each rank
+    reads its own shard from local storage if it can, and otherwise receives it from a rank which
+    holds a replica. Only the latest iteration is kept: the files of older iterations are removed
+    once a save has completed on all ranks.
+
+    Args:
+        local_ckpt_dir (Union[str, Path]): the node-local checkpoint directory. It may be shared
+            by the ranks of a node.
+        replication_factor (int): the number of peer ranks to replicate each shard to.
+            Defaults to 0, i.e. no replication.
+        replication_jump (int, optional): the rank distance between peers. Defaults to the
+            number of ranks per node, as given by the LOCAL_WORLD_SIZE environment variable, or
+            else the number of visible GPUs.
+
+    The shards are exchanged over a gloo process group created by the constructor, so they never
+    go through GPU memory. The constructor must therefore be called on all ranks.
+    """
+
+    def __init__(
+        self,
+        local_ckpt_dir: Union[str, Path],
+        replication_factor: int = 0,
+        replication_jump: Optional[int] = None,
+    ):
+        if replication_jump is None:
+            replication_jump = int(
+                os.environ.get('LOCAL_WORLD_SIZE', max(torch.cuda.device_count(), 1))
+            )
+        assert replication_factor >= 0 and replication_jump > 0
+        self.local_ckpt_dir = Path(local_ckpt_dir)
+        self.replication_factor = replication_factor
+        self.replication_jump = replication_jump
+        self.latest_iteration = -1
+        self.local_ckpt_path: Optional[Path] = None
+        self.group: Optional[torch.distributed.ProcessGroup] = None
+        if torch.distributed.is_initialized():
+            self.group = torch.distributed.new_group(backend='gloo')
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The async writes pickle the manager to a persistent worker process,
+        # which doesn't communicate and can't unpickle a process group
+        state = self.__dict__.copy()
+        state['group'] = None
+        return state
+
+    def _get_shard_path(self, iteration: int, owner: int) -> Path:
+        return self.local_ckpt_dir / f'iter_{iteration:07d}_{owner}_local.pt'
+
+    def _get_replication_shifts(self) -> List[int]:
+        """Rank shifts to the peers, skipping shifts which wrap around to the rank itself."""
+        world_size = _get_world_size()
+        shifts = []
+        for i in range(1, self.replication_factor + 1):
+            shift = i * self.replication_jump % world_size
+            if shift != 0 and shift not in shifts:
+                shifts.append(shift)
+        return shifts
+
+    def _get_replication_peers(self) -> Tuple[List[int], List[int]]:
+        """Returns the ranks this rank replicates its shard to, and receives replicas from."""
+        rank, world_size = _get_rank(), _get_world_size()
+        shifts = self._get_replication_shifts()
+        return (
+            [(rank + shift) % world_size for shift in shifts],
+            [(rank - shift) % world_size for shift in shifts],
+        )
+
+    def _find_local_shards(self) -> Dict[int, List[int]]:
+        """Returns the shard owners of every iteration found in the local checkpoint directory."""
+        shards = {}
+        if self.local_ckpt_dir.is_dir():
+            for path in self.local_ckpt_dir.iterdir():
+                match = _LOCAL_CKPT_PATTERN.match(path.name)
+                if match is not None:
+                    shards.setdefault(int(match.group(1)), []).append(int(match.group(2)))
+        return shards
+
+    def _gather_shards(self) -> List[Dict[int, List[int]]]:
+        """Returns the shard owners of every iteration found by every rank."""
+        shards = self._find_local_shards()
+        if not torch.distributed.is_initialized():
+            return [shards]
+        all_shards = [None] * _get_world_size()
+        torch.distributed.all_gather_object(all_shards, shards, group=self.group)
+        return all_shards
+
+    def get_latest_checkpoint_iteration(self) -> int:
+        """Returns the latest iteration whose shards are all held by some rank, or -1 if none is.
+
+        The result is cached; reset `latest_iteration` to -1 to search again.
+        Must be called on all ranks.
+        """
+        if self.latest_iteration != -1:
+            return self.latest_iteration
+
+        world_size = _get_world_size()
+        owners_per_iteration = {}
+        for shards in self._gather_shards():
+            for iteration, owners in shards.items():
+                owners_per_iteration.setdefault(iteration, set()).update(owners)
+        complete = [
+            iteration
+            for iteration, owners in owners_per_iteration.items()
+            if owners >= set(range(world_size))
+        ]
+        self.latest_iteration = max(complete, default=-1)
+        if self.latest_iteration != -1:
+            self.local_ckpt_path = self._get_shard_path(self.latest_iteration, _get_rank())
+        return self.latest_iteration
+
+    def save(
+        self, state_dict: Dict[str, Any], iteration: int, is_async: bool = False
+    ) -> Optional[AsyncRequest]:
+        """Saves this rank's shard locally and replicates it to the peer ranks.
+
+        The shard is serialized and replicated synchronously; only the file writes are deferred
+        in case of an async save. Must be called on all ranks.
+
+        Args:
+            state_dict (Dict[str, Any]): the tensor-aware state dict of this rank, with its
+                tensors on the CPU
+            iteration (int): the training iteration
+            is_async (bool): if True, returns a request which writes the files in the background.
+                Otherwise, writes them before returning. Defaults to False.
+
+        Returns:
+            Optional[AsyncRequest]: the request writing the files if `is_async`, else None
+        """
+        start = time()
+        if torch.cuda.is_available():
+            # The tensors may have been copied to the CPU with non_blocking=True
+            torch.cuda.synchronize()
+        buffer = io.BytesIO()
+        torch.save(state_dict, buffer)
+        payload = torch.frombuffer(buffer.getbuffer(), dtype=torch.uint8)
+
+        send_to, recv_from = self._get_replication_peers()
+        shards = {_get_rank(): payload}
+        if torch.distributed.is_initialized() and (send_to or recv_from):
+            shards.update(
+                _exchange_payloads({dst: payload for dst in send_to}, recv_from, self.group)
+            )
+        logger.debug(
+            f'rank: {_get_rank()}, took {time() - start:.2f}s to serialize and replicate'
+            f' the local checkpoint of iteration {iteration}'
+        )
+
+        finalize_fn = partial(self._finalize_save, iteration, list(shards))
+        if is_async:
+            # The payload views the serialization buffer, which a persistent async worker would
+            # get moved to shared memory, so hand it a tensor of its own
+            shards[_get_rank()] = payload.clone()
+            return AsyncRequest(self._write_shards, (iteration, shards), [finalize_fn])
+        self._write_shards(iteration, shards)
+        if torch.distributed.is_initialized():
+            torch.distributed.barrier(group=self.group)
+        finalize_fn()
+        return None
+
+    def _write_shards(self, iteration: int, shards: Dict[int, torch.Tensor]) -> None:
+        """Writes shards atomically, each to a temporary file which is then renamed."""
+        self.local_ckpt_dir.mkdir(parents=True, exist_ok=True)
+        for owner, payload in shards.items():
+            path = self._get_shard_path(iteration, owner)
+            path_tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+            with open(path_tmp, 'wb') as f:
+                f.write(payload.numpy())
+            os.replace(path_tmp, path)
+
+    def _finalize_save(self, iteration: int, owners: List[int]) -> None:
+        """Records the saved iteration and removes the files of other iterations, once the
+        save has completed on all ranks."""
+        for path in self.local_ckpt_dir.iterdir():
+            match = _LOCAL_CKPT_PATTERN.match(path.name)
+            if match is not None and int(match.group(2)) in owners:
+                if int(match.group(1)) != iteration:
+                    path.unlink(missing_ok=True)
+        self.latest_iteration = iteration
+        self.local_ckpt_path = self._get_shard_path(iteration, _get_rank())
+
+    def _read_shard(self, iteration: int, owner: int) -> torch.Tensor:
+        return torch.from_numpy(np.fromfile(self._get_shard_path(iteration, owner), dtype=np.uint8))
+
+    def load(self) -> Tuple[Dict[str, Any], str]:
+        """Loads this rank's shard of the latest checkpoint, from local storage or a peer.
+
+        Must be called on all ranks.
+
+        Returns:
+            Tuple[Dict[str, Any], str]: the tensor-aware state dict of this rank, and the path
+                of its shard
+        """
+        iteration = self.get_latest_checkpoint_iteration()
+        if iteration == -1:
+            raise CheckpointingException(f'No local checkpoint found in {self.local_ckpt_dir}')
+        rank, world_size = _get_rank(), _get_world_size()
+
+        # The rank to read each shard from: the owner if it holds it, else the lowest rank
+        holders = {}
+        for holder, shards in enumerate(self._gather_shards()):
+            for owner in shards.get(iteration, []):
+                if owner not in holders or owner == holder:
+                    holders[owner] = holder
+        missing = set(range(world_size)) - set(holders)
+        if missing:
+            raise CheckpointingException(
+                f'The shards of ranks {sorted(missing)} of the local checkpoint of iteration'
+                f' {iteration} are not available anymore'
+            )
+
+        send = {
+            owner: self._read_shard(iteration, owner)
+            for owner, holder in holders.items()
+            if holder == rank and owner != rank
+        }
+        if holders[rank] == rank:
+            payload = self._read_shard(iteration, rank)
+        if torch.distributed.is_initialized():
+            received = _exchange_payloads(
+                send, [] if holders[rank] == rank else [holders[rank]], self.group
+            )
+            if holders[rank] != rank:
+                payload = received[holders[rank]]
+                logger.info(
+                    f'rank: {rank}, restored the local checkpoint shard of iteration {iteration}'
+                    f' from the replica of rank {holders[rank]}'
+                )
+
+        state_dict = torch.load(
+            io.BytesIO(memoryview(payload.numpy())), map_location='cpu', weights_only=False
+        )
+        return state_dict, str(self._get_shard_path(iteration, rank))
@@ -0,0 +1,158 @@
+# Copyright (c) 2024, NVIDIA CORPORATION.  All rights reserved.
+
+""" Wall time and bytes of the checkpoint save phases. """
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Deque, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+_ACTIVE_PROFILER: Optional['CheckpointProfiler'] = None
+
+
+class CheckpointProfiler:
+    """Records the wall time and the bytes of the checkpoint save phases.
+
+    While active, i.e. inside its `with` block, the profiler records the phases of every save
+    of the process with the torch_dist format:
+    - plan: local and global save planning
+    - metadata_exchange: exchange of the save plans and of the write results between ranks
+    - d2h: copy of the tensors to the host staging buffers, with the bytes copied
+    - write: write of a checkpoint file by a writer process, with the bytes written
+    - fsync: fsync of a checkpoint file by a writer process
+    - finalize: write of the checkpoint metadata by the coordinator rank
+    - save_distribution: distribution of the save across the ranks, with the fully parallel
+      save strategy wrapper
+    The write and fsync phases run in the writer processes, and are recorded once the save is
+    finalized. Functions timed with `two_stage.timed` are recorded as phases too.
+
+    Any code can add its own phases with `profile_phase` and `record_phase`,
+    which are no-ops while no profiler is active.
+
+    The totals of every phase cover all the records, but only the last `max_records` records are
+    kept, so a profiler active for a whole training run has a bounded size.
+
+    Args:
+        max_records (int): number of the most recent records to keep. Defaults to 1000.
+    """
+
+    def __init__(self, max_records: int = 1000):
+        self._lock = threading.Lock()
+        self._records: Deque[Dict[str, Any]] = deque(maxlen=max_records)
+        self._phases: Dict[str, Dict[str, Any]] = {}
+
+    def __enter__(self) -> 'CheckpointProfiler':
+        global _ACTIVE_PROFILER
+        assert _ACTIVE_PROFILER is None, 'another CheckpointProfiler is already active'
+        _ACTIVE_PROFILER = self
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        global _ACTIVE_PROFILER
+        _ACTIVE_PROFILER = None
+
+    def record(self, name: str, seconds: float, nbytes: int = 0, **fields: Any) -> None:
+        """Records a phase timed by the caller.
+
+        Args:
+            name (str): name of the phase
+            seconds (float): wall time of the phase
+            nbytes (int): bytes processed by the phase. Defaults to 0.
+            **fields: additional fields of the record, e.g. the index of a writer process
+        """
+        self._add({'phase': name, 'seconds': seconds, 'bytes': nbytes, **fields})
+
+    @contextmanager
+    def phase(self, name: str, **fields: Any) -> Iterator[Dict[str, Any]]:
+        """Times a phase.
+
+        Args:
+            name (str): name of the phase
+            **fields: additional fields of the record
+
+        Yields:
+            Dict[str, Any]: the record of the phase, whose 'bytes' the caller may set
+        """
+        record = {'phase': name, 'bytes': 0, **fields}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            self._add(record)
+
+    def _add(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._records.append(record)
+            phase = self._phases.setdefault(
+                record['phase'], {'count': 0, 'seconds': 0.0, 'max': 0.0, 'bytes': 0}
+            )
+            phase['count'] += 1
+            phase['seconds'] += record['seconds']
+            phase['max'] = max(phase['max'], record['seconds'])
+            phase['bytes'] += record['bytes']
+
+    def reset(self) -> None:
+        """Drops the records and the phase totals."""
+        with self._lock:
+            self._records.clear()
+            self._phases = {}
+
+    def report(self) -> Dict[str, Any]:
+        """Summarizes the records.
+
+        Returns:
+            Dict[str, Any]: the count, total and max seconds, bytes and bytes per second of every
+                phase name, and the most recent records in order of completion
+        """
+        with self._lock:
+            records = [dict(record) for record in self._records]
+            phases = {name: dict(phase) for name, phase in self._phases.items()}
+        for phase in phases.values():
+            phase['bytes_per_second'] = (
+                phase['bytes'] / phase['seconds'] if phase['bytes'] and phase['seconds'] else None
+            )
+        return {'phases': phases, 'records': records}
+
+    def save(self, path: str) -> None:
+        """Writes the report to a JSON file, atomically.
+
+        Args:
+            path (str): path to the file
+        """
+        dirname, basename = os.path.split(path)
+        path_tmp = os.path.join(dirname, f'.{basename}.{os.getpid()}.tmp')
+        try:
+            with open(path_tmp, 'w') as f:
+                json.dump(self.report(), f, indent=4)
+            os.replace(path_tmp, path)
+        finally:
+            if os.path.exists(path_tmp):
+                os.remove(path_tmp)
+        logger.debug(f'Wrote the checkpoint profile to {path}')
+
+
+def get_checkpoint_profiler() -> Optional[CheckpointProfiler]:
+    """Returns the active checkpoint profiler, or None."""
+    return _ACTIVE_PROFILER
+
+
+def profile_phase(name: str, **fields: Any) -> ContextManager[Dict[str, Any]]:
+    """Times a phase with the active profiler, if any, see `CheckpointProfiler.phase`."""
+    profiler = _ACTIVE_PROFILER
+    if profiler is None:
+        return nullcontext({})
+    return profiler.phase(name, **fields)
+
+
+def record_phase(name: str, seconds: float, nbytes: int = 0, **fields: Any) -> None:
+    """Records a phase with the active profiler, if any, see `CheckpointProfiler.record`."""
+    profiler = _ACTIVE_PROFILER
+    if profiler is not None:
+        profiler.record(name, seconds, nbytes, **fields)
@@ -4,10 +4,13 @@
 This module provides an async utilities which allow to start
 a checkpoint save process in the background.
 """
+import atexit
 import logging
+import queue
+import traceback
 from collections import deque
 from time import time
-from typing import Callable, List, NamedTuple, Optional, Tuple
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
 import torch
 from torch import multiprocessing as mp
@@ -120,7 +123,7 @@ class DistributedAsyncCaller:
                 if `blocking` is True), False if at least one rank is still active.
         """
         # The following takes the same overhead as torch.distributed.barrier (single integer all-reduce)
-        is_alive = int(self.process.is_alive()) if self.process is not None else 0
+        is_alive = int(self._is_alive())
         ten = torch.tensor([is_alive], dtype=torch.int, device=torch.cuda.current_device())
         logger.debug(
             f"rank: {torch.distributed.get_rank()}, DistributedAsyncCaller is_alive: {is_alive}"
@@ -129,17 +132,207 @@ class DistributedAsyncCaller:
         if ten[0] > 0 and not blocking:
             return False
         else:
-            if self.process is not None:
-                logger.debug(f"rank: {torch.distributed.get_rank()}, joining self.process")
-                self.process.join()
-                self.process = None
+            if self.start_time is not None:
+                logger.debug(f"rank: {torch.distributed.get_rank()}, joining the async call")
+                self._join()
 
                 logger.debug(
-                    f"DistributedAsyncCaller: Async process join finished after {time() - self.start_time:.2f}s from forking"
+                    f"{type(self).__name__}: Async call join finished after {time() - self.start_time:.2f}s from scheduling"
                 )
                 self.start_time = None
             return True
 
+    def _is_alive(self) -> bool:
+        """Whether the current async call is still running on this rank."""
+        return self.process is not None and self.process.is_alive()
+
+    def _join(self) -> None:
+        """Waits for the current async call to finish on this rank."""
+        self.process.join()
+        self.process = None
+
+
+# Number of PersistentAsyncWorkers running in this process
+_num_persistent_workers = 0
+
+
+def persistent_async_worker_in_use() -> bool:
+    """Whether async calls of this process may be run in a `PersistentAsyncWorker`.
+
+    The args of those calls are passed through shared memory, which the async checkpoint
+    staging buffers are then allocated in (see `FileSystemWriterAsync.prepare_write_data`).
+    """
+    return _num_persistent_workers > 0
+
+
+def _persistent_worker_loop(job_queue: mp.SimpleQueue, done_queue: mp.Queue) -> None:
+    """Runs the async calls received from `job_queue` one by one, until it receives None.
+
+    Reports each call's id to `done_queue` once it is done, along with the formatted
+    traceback if it raised (or None).
+    """
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        call_id, async_fn, async_fn_args = job
+        # Drop the references to the call's data as soon as it is done
+        del job
+        try:
+            async_fn(*async_fn_args)
+            error = None
+        except Exception:
+            error = traceback.format_exc()
+        del async_fn, async_fn_args
+        done_queue.put((call_id, error))
+
+
+class PersistentAsyncWorker:
+    """A long-lived process which runs async calls one after another.
+
+    Forking a process for each async call (see `DistributedAsyncCaller`) takes time proportional
+    to the memory of the training process, as its page tables are copied, and the copy-on-write
+    faults which follow slow training down. Instead, the worker is spawned once and receives
+    each call through a queue. Tensors in the call args are passed through shared memory
+    (tensors already in shared memory, like the async checkpoint staging buffers, without
+    a copy), so the async function must only read data passed in its args, and the function
+    itself must be picklable.
+
+    The worker exits on `close`, or else at interpreter exit.
+    """
+
+    def __init__(self):
+        ctx = mp.get_context('spawn')
+        # The calls are pickled synchronously by `submit`, so pickling errors are raised there
+        self.job_queue = ctx.SimpleQueue()
+        self.done_queue = ctx.Queue()
+        self.process = ctx.Process(
+            target=_persistent_worker_loop, args=(self.job_queue, self.done_queue)
+        )
+        start = time()
+        self.process.start()
+        logger.debug(f"PersistentAsyncWorker: took {time() - start:.2f}s to start the worker")
+        global _num_persistent_workers
+        _num_persistent_workers += 1
+        self.closed = False
+        self.num_submitted = 0
+        self.done_calls: Dict[int, Optional[str]] = {}
+        atexit.register(self.close)
+
+    def submit(self, async_fn: Callable, async_fn_args: Tuple) -> int:
+        """Sends an async call to the worker.
+
+        Args:
+            async_fn (Callable): async function to call
+            async_fn_args (Tuple): async function args
+
+        Returns:
+            int: id of the call, to check it with `is_done` and `wait`
+        """
+        if not self.process.is_alive():
+            raise RuntimeError(
+                f'The persistent async worker is not running (exit code: {self.process.exitcode})'
+            )
+        call_id = self.num_submitted
+        self.num_submitted += 1
+        self.job_queue.put((call_id, async_fn, async_fn_args))
+        return call_id
+
+    def _collect(self, timeout: Optional[float] = None) -> None:
+        """Records the calls reported as done, waiting up to `timeout` for the first one."""
+        try:
+            call_id, error = self.done_queue.get(timeout=timeout)
+            self.done_calls[call_id] = error
+            while True:
+                call_id, error = self.done_queue.get_nowait()
+                self.done_calls[call_id] = error
+        except queue.Empty:
+            pass
+
+    def is_done(self, call_id: int) -> bool:
+        """Checks whether a call is done, or will never be as the worker is gone.
+
+        Args:
+            call_id (int): id of the call, as returned by `submit`
+
+        Returns:
+            bool: True if `wait` would return or raise without waiting
+        """
+        self._collect(timeout=0)
+        return call_id in self.done_calls or not self.process.is_alive()
+
+    def wait(self, call_id: int) -> None:
+        """Waits for a call to finish.
+
+        Args:
+            call_id (int): id of the call, as returned by `submit`
+
+        Raises:
+            RuntimeError: if the call raised an exception, or the worker exited before finishing it
+        """
+        while call_id not in self.done_calls:
+            is_alive = self.process.is_alive()
+            self._collect(timeout=1.0)
+            if call_id not in self.done_calls and not is_alive:
+                raise RuntimeError(
+                    f'The persistent async worker exited with code {self.process.exitcode}'
+                    f' before finishing async call {call_id}'
+                )
+        error = self.done_calls[call_id]
+        if error is not None:
+            raise RuntimeError(f'Async call {call_id} failed in the persistent worker:\n{error}')
+
+    def close(self) -> None:
+        """Stops the worker once it has run all the calls submitted so far."""
+        atexit.unregister(self.close)
+        if self.process.is_alive():
+            self.job_queue.put(None)
+        self.process.join()
+        if not self.closed:
+            global _num_persistent_workers
+            _num_persistent_workers -= 1
+            self.closed = True
+
+
+class PersistentAsyncCaller(DistributedAsyncCaller):
+    """DistributedAsyncCaller which runs its async call in a `PersistentAsyncWorker`.
+
+    Args:
+        worker (PersistentAsyncWorker): the worker process to run the call in
+    """
+
+    def __init__(self, worker: PersistentAsyncWorker):
+        super().__init__()
+        self.worker = worker
+        self.call_id: Optional[int] = None
+
+    def schedule_async_call(self, async_fn: Optional[Callable], save_args: Tuple) -> None:
+        """Send `async_fn` to the persistent worker.
+
+        This method must be called on all ranks.
+
+        Args:
+            async_fn (Callable, optional): async function to call. If None,
+                nothing will be sent to the worker.
+            save_args (Tuple): async function args.
+        """
+        if async_fn is None:
+            return  # nothing to do
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        self.start_time = time()
+        self.call_id = self.worker.submit(async_fn, save_args)
+        logger.debug(
+            f"rank: {torch.distributed.get_rank()}, takes {time() - self.start_time} to schedule async ckpt "
+        )
+
+    def _is_alive(self) -> bool:
+        return self.call_id is not None and not self.worker.is_done(self.call_id)
+
+    def _join(self) -> None:
+        call_id, self.call_id = self.call_id, None
+        self.worker.wait(call_id)
+
 
 class _ActiveAsyncRequest(NamedTuple):
     """Helper to represent an active async call.
@@ -161,11 +354,19 @@ class AsyncCallsQueue:
 
     Allows adding a new async call with `schedule_async_request` and finalizing
     active calls with `maybe_finalize_async_calls`.
+
+    Args:
+        persistent (bool, optional): if True, runs the async calls one after another in
+            a `PersistentAsyncWorker` started right away, instead of forking a process
+            for each call. Defaults to False.
     """
 
-    def __init__(self):
+    def __init__(self, persistent: bool = False):
         self.async_calls: deque[_ActiveAsyncRequest] = deque([])
         self.call_idx: int = -1
+        self.persistent_worker: Optional[PersistentAsyncWorker] = (
+            PersistentAsyncWorker() if persistent else None
+        )
 
     def schedule_async_request(self, async_request: AsyncRequest) -> int:
         """Start a new async call and add it to a queue of active async calls.
@@ -180,7 +381,10 @@ class AsyncCallsQueue:
                 This can help the user keep track of the async calls.
         """
         self.call_idx += 1
-        async_caller = DistributedAsyncCaller()
+        if self.persistent_worker is not None:
+            async_caller = PersistentAsyncCaller(self.persistent_worker)
+        else:
+            async_caller = DistributedAsyncCaller()
         async_request = async_request.freeze()
         async_caller.schedule_async_call(async_request.async_fn, async_request.async_fn_args)
         self.async_calls.append(_ActiveAsyncRequest(self.call_idx, async_caller, async_request))
@@ -220,5 +424,8 @@ class AsyncCallsQueue:
         return len(self.async_calls)
 
     def close(self):
-        """Finalize all calls upon closing."""
+        """Finalize all calls upon closing, and stop the persistent worker if any."""
         self.maybe_finalize_async_calls(blocking=True)
+        if self.persistent_worker is not None:
+            self.persistent_worker.close()
+            self.persistent_worker = None
@@ -0,0 +1,335 @@
+# Copyright (c) 2024, NVIDIA CORPORATION.  All rights reserved.
+
+""" Compression of the tensor items of PyT Distributed checkpoints.
+
+Each tensor item is compressed on its own, so any item can still be read without the others.
+A compressed item is the serialized tensor (as written by `torch.save`), byte-shuffled and
+compressed, prefixed with a header recording the codec and the uncompressed length. The checkpoint
+metadata records the offset and (compressed) length of each item as usual.
+
+Byte shuffling groups the i-th bytes of all elements together, e.g. the exponent bytes of
+floating point values, which makes optimizer states like fp32 exp_avg and exp_avg_sq compress
+much better.
+
+Compressed checkpoints must be read with `CompressedFileSystemReader`, as the Megatron load
+strategies do. With PyTorch versions whose checkpoint metadata has transform descriptors, the
+compressed items are marked with the `megatron.compressed` descriptor, so a plain
+`FileSystemReader` fails with an "Unknown extension" error on them. With older versions,
+a plain reader fails to `torch.load` them.
+"""
+
+import dataclasses
+import io
+import logging
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, Callable, Deque, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+from torch.distributed.checkpoint import FileSystemReader
+from torch.distributed.checkpoint.filesystem import _StorageInfo
+from torch.distributed.checkpoint.planner import LoadPlan, LoadPlanner
+from torch.futures import Future as TorchFuture
+
+from ..core import CheckpointingException
+
+try:
+    from torch.distributed.checkpoint._extension import ExtensionRegistry, StreamTransformExtension
+
+    HAVE_TRANSFORM_DESCRIPTORS = 'transform_descriptors' in {
+        field.name for field in dataclasses.fields(_StorageInfo)
+    }
+except ImportError:
+    HAVE_TRANSFORM_DESCRIPTORS = False
+
+try:
+    import zstandard
+
+    HAVE_ZSTD = True
+except ImportError:
+    HAVE_ZSTD = False
+
+try:
+    import lz4.frame
+
+    HAVE_LZ4 = True
+except ImportError:
+    HAVE_LZ4 = False
+
+logger = logging.getLogger(__name__)
+
+# Serialized tensors are zip archives starting with b'PK', so the magic can't be confused with them
+_MAGIC = b'\x93MCORECZ'
+# magic, codec id, shuffle element size, uncompressed length
+_HEADER = struct.Struct('<8sBBQ')
+# Transform descriptor name of the compressed items in the checkpoint metadata
+_COMPRESSION_EXTENSION_NAME = 'megatron.compressed'
+
+
+class _Codec(NamedTuple):
+    codec_id: int
+    compress: Callable[[memoryview, Optional[int]], bytes]
+    decompress: Callable[[memoryview, int], bytes]
+
+
+def _zstd_compress(data: memoryview, level: Optional[int]) -> bytes:
+    return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+
+
+def _zstd_decompress(data: memoryview, length: int) -> bytes:
+    return zstandard.ZstdDecompressor().decompress(data, max_output_size=length)
+
+
+_CODECS = {
+    'zlib': _Codec(
+        1,
+        lambda data, level: zlib.compress(data, 1 if level is None else level),
+        lambda data, length: zlib.decompress(data, bufsize=length),
+    ),
+    'zstd': _Codec(2, _zstd_compress, _zstd_decompress),
+    'lz4': _Codec(
+        3,
+        lambda data, level: lz4.frame.compress(data, compression_level=level or 0),
+        lambda data, length: lz4.frame.decompress(data),
+    ),
+}
+_CODECS_BY_ID = {codec.codec_id: name for name, codec in _CODECS.items()}
+_CODEC_AVAILABLE = {'zlib': True, 'zstd': HAVE_ZSTD, 'lz4': HAVE_LZ4}
+_CODEC_PACKAGES = {'zstd': 'zstandard', 'lz4': 'lz4'}
+
+CHECKPOINT_CODECS = tuple(_CODECS)
+
+
+def _get_codec(name: str) -> _Codec:
+    if name not in _CODECS:
+        raise CheckpointingException(
+            f'Unknown checkpoint compression codec {name}, expected one of {CHECKPOINT_CODECS}'
+        )
+    if not _CODEC_AVAILABLE[name]:
+        raise CheckpointingException(
+            f'Checkpoint compression codec {name} requires the `{_CODEC_PACKAGES[name]}` package'
+        )
+    return _CODECS[name]
+
+
+def validate_compression(codec: Optional[str]) -> None:
+    """Checks that a codec is known and available.
+
+    Args:
+        codec (str, optional): codec name, or None for no compression
+    """
+    if codec is not None:
+        _get_codec(codec)
+
+
+def _shuffle(data: np.ndarray, element_size: int) -> np.ndarray:
+    """Groups the i-th bytes of the elements together, leaving the trailing bytes as they are."""
+    if element_size == 1:
+        return data
+    size = len(data) // element_size * element_size
+    shuffled = np.empty_like(data)
+    shuffled[:size] = data[:size].reshape(-1, element_size).T.reshape(-1)
+    shuffled[size:] = data[size:]
+    return shuffled
+
+
+def _unshuffle(data: np.ndarray, element_size: int) -> np.ndarray:
+    if element_size == 1:
+        return data
+    size = len(data) // element_size * element_size
+    unshuffled = np.empty_like(data)
+    unshuffled[:size] = data[:size].reshape(element_size, -1).T.reshape(-1)
+    unshuffled[size:] = data[size:]
+    return unshuffled
+
+
+def compress_item(
+    data: Union[bytes, memoryview], codec: str, level: Optional[int] = None, element_size: int = 1
+) -> Union[bytes, memoryview]:
+    """Compresses a serialized item.
+
+    Args:
+        data (bytes or memoryview): the serialized item
+        codec (str): codec name, one of CHECKPOINT_CODECS
+        level (int, optional): codec compression level. Defaults to a fast level of the codec.
+        element_size (int): element size of the tensor, to byte-shuffle the data with.
+            Defaults to 1 (no shuffling).
+
+    Returns:
+        bytes or memoryview: the compressed item, or `data` itself if it doesn't compress
+    """
+    compressor = _get_codec(codec)
+    array = np.frombuffer(data, dtype=np.uint8)
+    compressed = compressor.compress(_shuffle(array, element_size).data, level)
+    if _HEADER.size + len(compressed) >= len(array):
+        return data
+    header = _HEADER.pack(_MAGIC, compressor.codec_id, element_size, len(array))
+    return header + compressed
+
+
+def decompress_item(data: Union[bytes, memoryview]) -> Union[bytes, memoryview]:
+    """Decompresses an item compressed with `compress_item`.
+
+    Args:
+        data (bytes or memoryview): the item as stored
+
+    Returns:
+        bytes or memoryview: the serialized item, or `data` itself if it isn't compressed
+    """
+    if len(data) < _HEADER.size or bytes(data[: len(_MAGIC)]) != _MAGIC:
+        return data
+    _, codec_id, element_size, length = _HEADER.unpack(bytes(data[: _HEADER.size]))
+    decompressed = _get_codec(_CODECS_BY_ID[codec_id]).decompress(
+        memoryview(data)[_HEADER.size :], length
+    )
+    if len(decompressed) != length:
+        raise CheckpointingException(
+            f'Corrupted checkpoint item: decompressed {len(decompressed)} bytes, expected {length}'
+        )
+    return _unshuffle(np.frombuffer(decompressed, dtype=np.uint8), element_size).data
+
+
+def mark_compressed(storage_info: _StorageInfo) -> _StorageInfo:
+    """Marks the storage info of a compressed item in the checkpoint metadata.
+
+    A no-op with PyTorch versions without transform descriptors.
+
+    Args:
+        storage_info (_StorageInfo): storage info of the item
+
+    Returns:
+        _StorageInfo: the storage info with the compression transform descriptor
+    """
+    if not HAVE_TRANSFORM_DESCRIPTORS:
+        return storage_info
+    return dataclasses.replace(
+        storage_info, transform_descriptors=[_CompressedItemExtension().get_descriptor()]
+    )
+
+
+def is_marked_compressed(storage_info: _StorageInfo) -> bool:
+    """Whether the storage info was marked with `mark_compressed`."""
+    return any(
+        descriptor.partition('/')[0] == _COMPRESSION_EXTENSION_NAME
+        for descriptor in getattr(storage_info, 'transform_descriptors', None) or ()
+    )
+
+
+if HAVE_TRANSFORM_DESCRIPTORS:
+
+    class _CompressedItemExtension(StreamTransformExtension):
+        """Transform descriptor of the compressed items.
+
+        Items are compressed by the writer processes of the async save, not through the
+        transforms of the torch writer, so only the load transform is implemented. It
+        decompresses the items which `CompressedFileSystemReader._slice_file` didn't already.
+        """
+
+        @staticmethod
+        def registry_name() -> str:
+            return _COMPRESSION_EXTENSION_NAME
+
+        @staticmethod
+        def from_descriptor(version: str) -> '_CompressedItemExtension':
+            if version != '1':
+                raise ValueError(f'Unknown {_COMPRESSION_EXTENSION_NAME} version {version}')
+            return _CompressedItemExtension()
+
+        def get_descriptor(self) -> str:
+            return f'{self.registry_name()}/1'
+
+        def transform_to(self, output: IO[bytes]) -> IO[bytes]:
+            raise NotImplementedError('items are compressed with `compress_item`')
+
+        def transform_from(self, input: IO[bytes]) -> IO[bytes]:
+            start = input.tell()
+            magic = input.read(len(_MAGIC))
+            input.seek(start)
+            if magic != _MAGIC:
+                return input
+            return io.BytesIO(decompress_item(input.read()))
+
+
+class CompressedFileSystemReader(FileSystemReader):
+    """FileSystemReader which decompresses the compressed items, and reads items in parallel.
+
+    Reads of uncompressed items are served as usual. Items are read (and decompressed) by
+    `thread_count` threads ahead of their consumption by the regular `read_data` loop, up to
+    `2 * thread_count` items at a time to bound the memory.
+
+    The items are served through `FileSystemReader._slice_file`, which is private to PyTorch.
+    Without it, the reads are no longer parallel, but the compressed items are still decompressed
+    by the registered `megatron.compressed` transform, with PyTorch versions which have them.
+
+    Args:
+        path (Union[str, Path]): checkpoint directory
+        thread_count (int): number of reading threads. Defaults to 1.
+    """
+
+    def __init__(self, path: Union[str, Path], thread_count: int = 1):
+        if HAVE_TRANSFORM_DESCRIPTORS:
+            extension_registry = ExtensionRegistry()
+            extension_registry.register(_CompressedItemExtension)
+            super().__init__(path, _extension_registry=extension_registry)
+        else:
+            super().__init__(path)
+        self.thread_count = thread_count
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._prefetch_queue: Deque[Tuple[str, int, int]] = deque()
+        self._prefetched: Dict[Tuple[str, int, int], List[Future]] = {}
+
+    def _read_item(self, key: Tuple[str, int, int]) -> Union[bytes, memoryview]:
+        relative_path, offset, length = key
+        with open(Path(self.path) / relative_path, 'rb') as f:
+            f.seek(offset)
+            return decompress_item(f.read(length))
+
+    def _prefetch(self) -> None:
+        while self._prefetch_queue and sum(map(len, self._prefetched.values())) < max(
+            2 * self.thread_count, 1
+        ):
+            key = self._prefetch_queue.popleft()
+            self._prefetched.setdefault(key, []).append(self._executor.submit(self._read_item, key))
+
+    def read_data(self, plan: LoadPlan, planner: LoadPlanner) -> TorchFuture[None]:
+        # Items are consumed file by file, in plan order within each file
+        per_file: Dict[str, List[_StorageInfo]] = {}
+        for read_item in plan.items:
+            item_md = self.storage_data[read_item.storage_index]
+            per_file.setdefault(item_md.relative_path, []).append(item_md)
+        self._prefetch_queue = deque(
+            (item_md.relative_path, item_md.offset, item_md.length)
+            for items_md in per_file.values()
+            for item_md in items_md
+        )
+        self._prefetched = {}
+        with ThreadPoolExecutor(max_workers=max(self.thread_count, 1)) as self._executor:
+            self._prefetch()
+            try:
+                return super().read_data(plan, planner)
+            finally:
+                for futures in self._prefetched.values():
+                    for future in futures:
+                        future.cancel()
+                self._prefetch_queue.clear()
+                self._prefetched = {}
+                self._executor = None
+
+    def _slice_file(self, file, sinfo: _StorageInfo) -> io.BytesIO:
+        key = (sinfo.relative_path, sinfo.offset, sinfo.length)
+        futures = self._prefetched.get(key)
+        if futures:
+            data = futures.pop(0).result()
+            if not futures:
+                del self._prefetched[key]
+        else:
+            if self._prefetch_queue and self._prefetch_queue[0] == key:
+                self._prefetch_queue.popleft()
+            file.seek(sinfo.offset)
+            data = decompress_item(file.read(sinfo.length))
+        if self._executor is not None:
+            self._prefetch()
+        return io.BytesIO(data)
@@ -1,7 +1,10 @@
 # Copyright (c) 2023, NVIDIA CORPORATION.  All rights reserved.
 
 """ Storage writer for PyT Distributed format allowing asynchronous save. """
+import dataclasses
 import gc
+import hashlib
+import io
 import logging
 import os
 import queue
@@ -9,24 +12,100 @@ from contextlib import contextmanager
 from itertools import chain
 from pathlib import Path
 from time import time
-from typing import Callable, Dict, List, Optional, Tuple, Union
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
 
 import psutil
 import torch
 from torch import multiprocessing as mp
 from torch.distributed.checkpoint import FileSystemWriter
-from torch.distributed.checkpoint.filesystem import DEFAULT_SUFFIX, _StoragePrefix, _write_item
+from torch.distributed.checkpoint.filesystem import (
+    DEFAULT_SUFFIX,
+    _StorageInfo,
+    _StoragePrefix,
+    _write_item,
+)
+from torch.distributed.checkpoint.metadata import MetadataIndex
 from torch.distributed.checkpoint.planner import SavePlan, SavePlanner, WriteItem, WriteItemType
 from torch.distributed.checkpoint.storage import WriteResult
 from torch.futures import Future
 
+from ..profiler import record_phase
+from .async_utils import persistent_async_worker_in_use
+from .compression import compress_item, is_marked_compressed, mark_compressed, validate_compression
+
 logger = logging.getLogger(__name__)
 
 WriteBucket = Tuple[Path, str, Tuple[list, list]]  # represents writes to a single file
+WriteTimings = List[Tuple[str, float, int]]  # phase name, seconds and bytes of a writer process
 
 _results_queue = None
 
 
+class ChunkRecord(NamedTuple):
+    """Digest and storage location of a tensor chunk saved by a delta save.
+
+    Args:
+        digest (str): digest of the chunk dtype, shape and data
+        path (str): absolute path of the file holding the chunk
+        offset (int): offset of the chunk in the file
+        length (int): length of the chunk in the file
+        compressed (bool): whether the chunk is marked as compressed in the checkpoint metadata
+    """
+
+    digest: str
+    path: str
+    offset: int
+    length: int
+    compressed: bool = False
+
+
+@dataclasses.dataclass
+class _DigestStorageInfo(_StorageInfo):
+    """Storage info of a delta saved chunk, carrying its digest back from the writer processes.
+
+    Replaced with a plain `_StorageInfo` before it goes into the checkpoint metadata.
+    """
+
+    digest: Optional[str] = None
+
+
+def _write_tensor_item(
+    stream: io.IOBase,
+    tensor: torch.Tensor,
+    write_item: WriteItem,
+    storage_key: str,
+    compression: Optional[Tuple[str, Optional[int]]],
+) -> WriteResult:
+    """Writes a tensor item as `_write_item` does, compressing it if `compression` is given.
+
+    Compressed items are marked as such in the checkpoint metadata (see `mark_compressed`).
+    """
+    if compression is None:
+        return _write_item(stream, tensor, write_item, storage_key)
+    buffer = io.BytesIO()
+    torch.save(tensor, buffer)
+    serialized = buffer.getbuffer()
+    data = compress_item(serialized, *compression, element_size=tensor.element_size())
+    offset = stream.tell()
+    stream.write(data)
+    storage_data = _StorageInfo(storage_key, offset, len(data))
+    if data is not serialized:
+        storage_data = mark_compressed(storage_data)
+    return WriteResult(index=write_item.index, size_in_bytes=len(data), storage_data=storage_data)
+
+
+def _chunk_key(index: MetadataIndex) -> tuple:
+    """Identifies a tensor chunk across saves."""
+    return index.fqn, tuple(index.offset or ())
+
+
+def _tensor_digest(tensor: torch.Tensor) -> str:
+    """Content digest of a contiguous CPU tensor, covering its dtype and shape."""
+    digest = hashlib.blake2b(f'{tensor.dtype}{tuple(tensor.shape)}'.encode(), digest_size=16)
+    digest.update(tensor.reshape(-1).view(torch.uint8).numpy())
+    return digest.hexdigest()
+
+
 def _get_write_results_queue():
     global _results_queue
     if _results_queue is None:
@@ -35,6 +114,94 @@ def _get_write_results_queue():
     return _results_queue
 
 
+class _StagingPool:
+    """Reusable host buffers to stage the tensors of async checkpoint saves.
+
+    Buffers are keyed by the write item they stage, so the first save allocates one buffer per
+    tensor of its plan and the following saves with the same plan reuse them, instead of
+    allocating the full state dict size on the host for every save. Each buffer has its own
+    storage, as `torch.save` writes out the whole storage of a view.
+
+    Buffers are pinned (if CUDA is available) so the D2H copies into them are asynchronous.
+    Buffers for a persistent async worker process (see `PersistentAsyncCaller`) are allocated in
+    shared memory instead, so they are handed to the worker without a copy, and page-locked with
+    `cudaHostRegister`. Shared memory is only used then, as /dev/shm is often small.
+
+    Buffers are handed out by `acquire` and returned by `release` once the writes which read them
+    are finished, so buffers still being written by an unfinalized save are never overwritten.
+    """
+
+    def __init__(self):
+        self._free: Dict[tuple, torch.Tensor] = {}
+        self.allocated_bytes = 0
+
+    def acquire(
+        self, key: tuple, tensor: torch.Tensor, shared_memory: bool = False
+    ) -> torch.Tensor:
+        """Get a free host buffer with the shape and dtype of a tensor.
+
+        Args:
+            key (tuple): stable identifier of the write item across saves
+            tensor (torch.Tensor): the tensor to be staged
+            shared_memory (bool): whether to get a buffer in shared memory. Defaults to False.
+
+        Returns (torch.Tensor): the host buffer, allocated if there is no free one for the key
+        """
+        key = (key, tuple(tensor.shape), tensor.dtype, shared_memory)
+        buffer = self._free.pop(key, None)
+        if buffer is None:
+            pin_memory = torch.cuda.is_available()
+            if shared_memory:
+                buffer = torch.empty(tensor.shape, dtype=tensor.dtype).share_memory_()
+                nbytes = buffer.numel() * buffer.element_size()
+                if pin_memory and nbytes > 0:
+                    torch.cuda.check_error(
+                        torch.cuda.cudart().cudaHostRegister(buffer.data_ptr(), nbytes, 0)
+                    )
+            else:
+                buffer = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=pin_memory)
+            self.allocated_bytes += buffer.numel() * buffer.element_size()
+        return buffer
+
+    def release(self, buffers: Dict[tuple, torch.Tensor]) -> None:
+        """Return host buffers to the pool.
+
+        Args:
+            buffers (Dict[tuple, torch.Tensor]): the buffers, by the key they were acquired with
+        """
+        for key, buffer in buffers.items():
+            key = (key, tuple(buffer.shape), buffer.dtype, buffer.is_shared())
+            if key in self._free:
+                # Two concurrent saves staged this item, keep a single buffer for it
+                self._free_buffer(buffer)
+            else:
+                self._free[key] = buffer
+
+    def clear(self) -> None:
+        """Free all the buffers which are not in use."""
+        for buffer in self._free.values():
+            self._free_buffer(buffer)
+        self._free.clear()
+
+    def _free_buffer(self, buffer: torch.Tensor) -> None:
+        nbytes = buffer.numel() * buffer.element_size()
+        if buffer.is_shared() and torch.cuda.is_available() and nbytes > 0:
+            torch.cuda.check_error(torch.cuda.cudart().cudaHostUnregister(buffer.data_ptr()))
+        self.allocated_bytes -= nbytes
+
+
+_staging_pool = _StagingPool()
+
+_copy_stream = None
+
+
+def _get_copy_stream() -> torch.cuda.Stream:
+    global _copy_stream
+    if _copy_stream is None:
+        _copy_stream = torch.cuda.Stream()
+    return _copy_stream
+
+
 @contextmanager
 def _disable_gc():
     """Temporarily disables GC."""
@@ -67,23 +234,69 @@ class FileSystemWriterAsync(FileSystemWriter):
 
     Currently, it's assumed that a separate writer is created for each ckpt save
     (intermediate state is stored as writer attributes).
+
+    Delta saves: if `base_chunks` is given, the writer processes compute the digest of every
+    tensor chunk, and skip writing the chunks whose digest equals that of the same chunk
+    (same fqn and offset) in `base_chunks`, i.e. which are unchanged since the save `base_chunks`
+    comes from. The metadata of a skipped chunk points to the file of the earlier checkpoint
+    holding it, with a path relative to this checkpoint, which the regular FileSystemReader
+    resolves. The records of all the chunks of this save are then in `saved_chunks`, to be
+    the `base_chunks` of the next save.
+
+    Compression: if `compression` is given, the writer processes compress each tensor item
+    on its own (see the `compression` module), which `CompressedFileSystemReader` decompresses.
+
+    Args:
+        base_chunks (Dict[tuple, ChunkRecord], optional): records of the chunks of an earlier
+            save, by `_chunk_key`, enabling a delta save. Defaults to None (full save).
+        compression (str, optional): codec to compress the tensor items with, one of
+            `CHECKPOINT_CODECS`. Defaults to None (no compression).
+        compression_level (int, optional): codec compression level. Defaults to a fast level.
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        base_chunks: Optional[Dict[tuple, ChunkRecord]] = None,
+        compression: Optional[str] = None,
+        compression_level: Optional[int] = None,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         if not self.single_file_per_rank:
             raise NotImplementedError(
                 'single_file_per_rank flag not supported for FileSystemWriterAsync'
             )
+        validate_compression(compression)
+        self.compression = None if compression is None else (compression, compression_level)
+
+        if base_chunks is not None:
+            # Chunks in this directory would be overwritten by the save
+            checkpoint_dir = os.path.abspath(self.path)
+            base_chunks = {
+                key: record
+                for key, record in base_chunks.items()
+                if os.path.dirname(record.path) != checkpoint_dir
+            }
+        self.base_chunks = base_chunks
+        self.saved_chunks: Optional[Dict[tuple, ChunkRecord]] = None
 
         # Intermediate state between preparation and finalization
         self.write_buckets: Optional[List[WriteBucket]] = None
         self.results_queue: Optional[mp.Queue] = None
+        self.staging_buffers: Dict[tuple, torch.Tensor] = {}
 
     def prepare_write_data(self, plan: SavePlan, planner: SavePlanner) -> None:
         """
         First stage of async saving. Copy data to CPU and plan the local saving.
 
+        The device tensors are copied to reusable pinned host buffers (see `_StagingPool`) on a
+        side stream, one bucket at a time, so the copies of a bucket overlap with resolving and
+        serializing the next ones. Host tensors are copied too only for a persistent async
+        worker, as forked writer processes see a snapshot of them anyway. This method returns once the copies are done,
+        which is the only part of the save training has to wait for to keep the checkpoint
+        consistent.
+
         Args:
             plan (SavePlan): save plan generated by the PyT Distributed compatible planner
             planner (SavePlanner): save planner used to resolve the bytes and tensor data
@@ -98,7 +311,6 @@ class FileSystemWriterAsync(FileSystemWriter):
 
         start = time()
         # move tensors from GPU to CPU before starting async writing
-        # We do D2H synchronously for now
         file_count = 0
 
         def gen_file():
@@ -107,6 +319,11 @@ class FileSystemWriterAsync(FileSystemWriter):
             file_count += 1
             return file_name
 
+        copy_stream = _get_copy_stream() if torch.cuda.is_available() else None
+        # The persistent async worker gets the tensors through shared memory
+        shared_memory = persistent_async_worker_in_use()
+        staged_bytes = 0
+
         # Prepare bytes / tensor data in each bucket, which will be assigned to each writer process
         self.write_buckets = []
         for bucket in item_buckets:
@@ -116,15 +333,37 @@ class FileSystemWriterAsync(FileSystemWriter):
                 if item.type == WriteItemType.BYTE_IO
             ]
             tensor_data = [
-                (item, planner.resolve_data(item).detach().to("cpu", non_blocking=True))
+                (item, planner.resolve_data(item).detach())
                 for item in bucket
                 if item.type != WriteItemType.BYTE_IO
             ]
+            if any(tensor.device.type != 'cpu' for _, tensor in tensor_data):
+                # Copy after the kernels which produced the tensors, e.g. in resolve_data
+                copy_stream.wait_stream(torch.cuda.current_stream())
+            for i, (item, tensor) in enumerate(tensor_data):
+                if tensor.device.type == 'cpu' and not shared_memory:
+                    # Forked writers see a copy-on-write snapshot of host tensors
+                    continue
+                key = (item.index.fqn, tuple(item.index.offset or ()), item.index.index)
+                buffer = _staging_pool.acquire(key, tensor, shared_memory)
+                self.staging_buffers[key] = buffer
+                if tensor.device.type == 'cpu':
+                    # Snapshot host tensors for the persistent worker, as training may update
+                    # them during the save
+                    buffer.copy_(tensor)
+                else:
+                    with torch.cuda.stream(copy_stream):
+                        buffer.copy_(tensor, non_blocking=True)
+                        tensor.record_stream(copy_stream)
+                staged_bytes += buffer.numel() * buffer.element_size()
+                tensor_data[i] = (item, buffer)
             if len(bytes_data) > 0 or len(tensor_data) > 0:
                 file_name = gen_file()
                 self.write_buckets.append(
                     (self.path / file_name, file_name, (bytes_data, tensor_data))
                 )
+        if copy_stream is not None:
+            copy_stream.synchronize()
 
         # Check if there is anything to write on this rank
         if len(self.write_buckets) > 0:
@@ -136,7 +375,11 @@ class FileSystemWriterAsync(FileSystemWriter):
         else:
             self.results_queue = None
         end = time()
-        logger.debug(f"D2H and push, time: {end - start}")
+        record_phase('d2h', end - start, staged_bytes)
+        logger.debug(
+            f"D2H of {staged_bytes / 2**30:.2f} GiB and push, time: {end - start},"
+            f" staging pool: {_staging_pool.allocated_bytes / 2**30:.2f} GiB"
+        )
 
     def get_save_function_and_args(self) -> Tuple[Optional[Callable], Tuple]:
         """
@@ -149,12 +392,25 @@ class FileSystemWriterAsync(FileSystemWriter):
         """
         if not self.write_buckets:
             return None, ()
-        return (self.write_preloaded_data_multiproc, (self.write_buckets, self.results_queue))
+        return (
+            self.write_preloaded_data_multiproc,
+            (
+                self.write_buckets,
+                self.results_queue,
+                torch.distributed.get_rank(),
+                self.base_chunks,
+                self.compression,
+            ),
+        )
 
     @staticmethod
     @_disable_gc()
     def write_preloaded_data_multiproc(
-        write_buckets: List[WriteBucket], global_results_queue: mp.Queue
+        write_buckets: List[WriteBucket],
+        global_results_queue: mp.Queue,
+        rank: int,
+        base_chunks: Optional[Dict[tuple, ChunkRecord]] = None,
+        compression: Optional[Tuple[str, Optional[int]]] = None,
     ) -> None:
         """
         Performs saving data to storage with multiple processes.
@@ -165,8 +421,10 @@ class FileSystemWriterAsync(FileSystemWriter):
         - count_queue - small queue to mark worker as completed
 
         Using just one queue disallowed proper exception handling.
+        The timings of the workers are sent along with their results.
 
-        This method is meant to be run in a forked subprocess.
+        This method is meant to be run in a forked subprocess or in a persistent worker process,
+        which has no process group, hence the rank for logging is passed in.
         Triggering GC during execution leads to CUDA errors
         (cleaning up tensors owned by the parent process).
         To prevent this, we disable the GC explicitly for this function with _disable_gc.
@@ -174,11 +432,17 @@ class FileSystemWriterAsync(FileSystemWriter):
         Args:
             write_buckets (List[WriteBucket]): write plan
             global_results_queue (mp.Queue): mp.Queue to collect Dict[List[WriteResults]] (or an Exception)
-                from parallel write processes to the main training process
+                and the Dict[WriteTimings] from parallel write processes to the main training process
+            rank (int): global rank of the training process, for logging
+            base_chunks (Dict[tuple, ChunkRecord], optional): chunks of an earlier save
+                for a delta save, see FileSystemWriterAsync. Defaults to None (full save).
+            compression (Tuple[str, Optional[int]], optional): codec and level to compress
+                the tensor items with. Defaults to None (no compression).
         Returns: None
         """
         w_start = time()
         write_results_or_exc: Union[dict, Exception] = dict()
+        write_timings: Dict[int, WriteTimings] = {}
         ctx = mp.get_context('fork')
         local_results_queue = ctx.Queue()
         count_queue = ctx.JoinableQueue()
@@ -189,7 +453,15 @@ class FileSystemWriterAsync(FileSystemWriter):
                 p_list.append(
                     ctx.Process(
                         target=FileSystemWriterAsync.write_preloaded_data,
-                        args=(i, write_bucket, local_results_queue, count_queue, True),
+                        args=(
+                            i,
+                            write_bucket,
+                            local_results_queue,
+                            count_queue,
+                            True,
+                            base_chunks,
+                            compression,
+                        ),
                     )
                 )
             except Exception as e:
@@ -208,13 +480,14 @@ class FileSystemWriterAsync(FileSystemWriter):
             # At this point, all workers completed, so the queue should have exactly `len(write_buckets)` items
             for proc_idx in range(len(write_buckets)):
                 try:
-                    local_proc_idx, local_results_or_exc = local_results_queue.get()
+                    local_proc_idx, local_results_or_exc, local_timings = local_results_queue.get()
                 except queue.Empty:
                     write_results_or_exc = RuntimeError(
                         f'Unexpected empty `local_results_queue` (got only {proc_idx}/{len(write_buckets)} items)'
                     )
                     break
                 else:
+                    write_timings[local_proc_idx] = local_timings
                     if isinstance(local_results_or_exc, Exception):
                         err_msg = f"Local process {local_proc_idx} encountered an error: {local_results_or_exc}"
                         logger.error(err_msg)
@@ -227,12 +500,10 @@ class FileSystemWriterAsync(FileSystemWriter):
 
             logger.debug('FileSystemWriterAsync: collected worker results successfully')
 
-        global_results_queue.put(write_results_or_exc)
+        global_results_queue.put((write_results_or_exc, write_timings))
 
         w_end = time()
-        logger.debug(
-            f"{w_end}, rank: {torch.distributed.get_rank()}, write(sync,parallel): {w_end - w_start}"
-        )
+        logger.debug(f"{w_end}, rank: {rank}, write(sync,parallel): {w_end - w_start}")
 
     @staticmethod
     @_disable_gc()
@@ -242,6 +513,8 @@ class FileSystemWriterAsync(FileSystemWriter):
         results_queue: mp.SimpleQueue,
         count_queue: mp.JoinableQueue,
         use_fsync: bool,
+        base_chunks: Optional[Dict[tuple, ChunkRecord]] = None,
+        compression: Optional[Tuple[str, Optional[int]]] = None,
     ) -> None:
         """
         Performs actual data saving to storage.
@@ -252,27 +525,67 @@ class FileSystemWriterAsync(FileSystemWriter):
             results_queue (mp.Queue): queue to return the write results to the proxy checkpoint process.
             count_queue (mp.JoinableQueue): queue to marks worker task as completed
             use_fsync (bool): if True, calls os.fsync at the end of saving
+            base_chunks (Dict[tuple, ChunkRecord], optional): chunks of an earlier save
+                for a delta save, see FileSystemWriterAsync. Defaults to None (full save).
+            compression (Tuple[str, Optional[int]], optional): codec and level to compress
+                the tensor items with. Defaults to None (no compression).
 
-        Returns: None, the write result are put into the `queue`
+        Returns: None, the write result and the write timings are put into the `queue`
         """
         mem_before = _process_memory()
 
         local_results = []
+        local_timings: WriteTimings = []
         try:
             file_name, storage_key, (bytes_data, tensor_data) = write_bucket
+            write_start = time()
             with open(file_name, "wb") as stream:
                 for write_item, data in bytes_data:
                     local_results.append(_write_item(stream, data, write_item, storage_key))
 
                 for write_item, tensor in tensor_data:
                     assert tensor.is_cpu
-                    local_results.append(_write_item(stream, tensor, write_item, storage_key))
-
+                    if base_chunks is None:
+                        local_results.append(
+                            _write_tensor_item(stream, tensor, write_item, storage_key, compression)
+                        )
+                        continue
+                    digest = _tensor_digest(tensor)
+                    base_chunk = base_chunks.get(_chunk_key(write_item.index))
+                    if base_chunk is not None and base_chunk.digest == digest:
+                        # Unchanged since the base save, refer to its data instead of writing it
+                        storage_data = _DigestStorageInfo(
+                            os.path.relpath(base_chunk.path, os.path.dirname(file_name)),
+                            base_chunk.offset,
+                            base_chunk.length,
+                            digest=digest,
+                        )
+                        if base_chunk.compressed:
+                            storage_data = mark_compressed(storage_data)
+                        write_result = WriteResult(
+                            index=write_item.index,
+                            size_in_bytes=base_chunk.length,
+                            storage_data=storage_data,
+                        )
+                    else:
+                        write_result = _write_tensor_item(
+                            stream, tensor, write_item, storage_key, compression
+                        )
+                        storage_data = _DigestStorageInfo(
+                            **vars(write_result.storage_data), digest=digest
+                        )
+                        write_result = dataclasses.replace(write_result, storage_data=storage_data)
+                    local_results.append(write_result)
+
+                stream.flush()
+                local_timings.append(('write', time() - write_start, stream.tell()))
                 if use_fsync:
+                    fsync_start = time()
                     os.fsync(stream.fileno())
-            local_output = (local_proc_idx, local_results)
+                    local_timings.append(('fsync', time() - fsync_start, 0))
+            local_output = (local_proc_idx, local_results, local_timings)
         except Exception as e:
-            local_output = (local_proc_idx, e)
+            local_output = (local_proc_idx, e, local_timings)
 
         results_queue.put(local_output)
         # Signal this process is done.
@@ -296,13 +609,20 @@ class FileSystemWriterAsync(FileSystemWriter):
         """
         assert self.write_buckets is not None
 
+        # The writer processes are done with the staged data
+        _staging_pool.release(self.staging_buffers)
+        self.staging_buffers = {}
+
         if self.results_queue is None:
-            write_results_or_exc = {}
+            write_results_or_exc, write_timings = {}, {}
         else:
             try:
-                write_results_or_exc = self.results_queue.get_nowait()
+                write_results_or_exc, write_timings = self.results_queue.get_nowait()
             except queue.Empty:
                 raise RuntimeError(f'results_queue should not be empty')
+        for local_proc_idx, local_timings in write_timings.items():
+            for name, seconds, nbytes in local_timings:
+                record_phase(name, seconds, nbytes, writer=local_proc_idx)
 
         if isinstance(write_results_or_exc, Exception):
             raise RuntimeError(f'Worker failure: {write_results_or_exc}') from write_results_or_exc
@@ -312,7 +632,49 @@ class FileSystemWriterAsync(FileSystemWriter):
                 f'Incomplete worker results (expected {len(self.write_buckets)}, got {len(write_results)}.'
                 f' This probably indicates a worker failure.'
             )
-        return list(chain.from_iterable(write_results.values()))
+        write_results = list(chain.from_iterable(write_results.values()))
+        if self.base_chunks is not None:
+            write_results = self._record_saved_chunks(write_results)
+        return write_results
+
+    def _record_saved_chunks(self, write_results: List[WriteResult]) -> List[WriteResult]:
+        """Records the chunks of a delta save in `self.saved_chunks`.
+
+        Args:
+            write_results (List[WriteResult]): write results of a delta save
+
+        Returns (List[WriteResult]): the write results with the digests stripped
+            from their storage info
+        """
+        self.saved_chunks = {}
+        results = []
+        referenced_bytes = 0
+        for write_result in write_results:
+            storage_data = write_result.storage_data
+            if isinstance(storage_data, _DigestStorageInfo):
+                path = os.path.abspath(os.path.join(self.path, storage_data.relative_path))
+                self.saved_chunks[_chunk_key(write_result.index)] = ChunkRecord(
+                    storage_data.digest,
+                    path,
+                    storage_data.offset,
+                    storage_data.length,
+                    is_marked_compressed(storage_data),
+                )
+                if os.path.dirname(path) != os.path.abspath(self.path):
+                    referenced_bytes += storage_data.length
+                storage_data = _StorageInfo(
+                    **{
+                        field.name: getattr(storage_data, field.name)
+                        for field in dataclasses.fields(_StorageInfo)
+                    }
+                )
+                write_result = dataclasses.replace(write_result, storage_data=storage_data)
+            results.append(write_result)
+        logger.debug(
+            f"Delta save: {referenced_bytes / 2**30:.2f} GiB of {len(self.saved_chunks)} chunks"
+            f" referenced from earlier checkpoints instead of written"
+        )
+        return results
 
 
 def _split_by_size_and_type(bins: int, items: List[WriteItem]) -> List[List[WriteItem]]:
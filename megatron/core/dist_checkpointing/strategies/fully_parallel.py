@@ -21,6 +21,7 @@ from megatron.core.dist_checkpointing.exchange_utils import (
     exchange_by_distribution,
 )
 from megatron.core.dist_checkpointing.mapping import ShardedStateDict, StateDict, is_main_replica
+from megatron.core.dist_checkpointing.profiler import record_phase
 from megatron.core.dist_checkpointing.strategies.base import (
     AsyncSaveShardedStrategy,
     LoadShardedStrategy,
@@ -120,6 +121,7 @@ class FullyParallelSaveStrategyWrapper(AsyncSaveShardedStrategy):
             self.cached_distribution = precomputed_distribution
         end = time()
         logger.debug(f"parallel save sharding, time: {end - start}")
+        record_phase('save_distribution', end - start)
 
     @property
     def can_handle_sharded_objects(self):
@@ -14,6 +14,8 @@ from torch.distributed.checkpoint.metadata import STATE_DICT_TYPE, Metadata
 from torch.distributed.checkpoint.planner import SavePlan, SavePlanner
 from torch.distributed.checkpoint.utils import _DistWrapper, _get_failure_dict
 
+from ..profiler import profile_phase, record_phase
+
 if TYPE_CHECKING:
     from .filesystem_async import FileSystemWriterAsync
 
@@ -80,9 +82,12 @@ def save_state_dict_async_plan(
     global_metadata = None
     logger.debug(f"rank: {rank}, starting state dict save")
     local_plan = cached_local_plan
+    # Time spent planning, the rest of the planning time is spent exchanging the plans
+    planning_time = 0.0
 
     def local_step():
-        nonlocal local_plan
+        nonlocal local_plan, planning_time
+        start = time()
         assert planner is not None
         # PyTorch 2.4 introduced additional `metadata` argument,
         # we have to reference `is_coordinator` args by name
@@ -91,13 +96,16 @@ def save_state_dict_async_plan(
         if not validated_cache_reuse and local_plan is None:
             local_plan = planner.create_local_plan()
         local_plan = storage_writer.prepare_local_plan(local_plan)
+        planning_time += time() - start
         return local_plan
 
     def global_step(all_local_plans):
-        nonlocal global_metadata
+        nonlocal global_metadata, planning_time
+        start = time()
         assert planner is not None
         all_local_plans, global_metadata = planner.create_global_plan(all_local_plans)
         all_local_plans = storage_writer.prepare_global_plan(all_local_plans)
+        planning_time += time() - start
         return all_local_plans
 
     # Execute local and global planning
@@ -108,9 +116,13 @@ def save_state_dict_async_plan(
         central_plan = cached_central_plan
     else:
         central_plan = dist_wrapper.reduce_scatter("plan", local_step, global_step)
+    start_finish = time()
     central_plan = planner.finish_plan(central_plan)
     end_plan = time()
+    planning_time += end_plan - start_finish
     logger.debug(f"rank: {rank}, plan time: {end_plan - start_plan}")
+    record_phase('plan', planning_time)
+    record_phase('metadata_exchange', end_plan - start_plan - planning_time)
     # Prepare async writing of tensors.
     # The `storage_writer` will store the information about tensors it needs to save
     start = time()
@@ -145,7 +157,8 @@ def save_state_dict_async_finalize(
 
     # Gather the write results that will be saved to the metadata file.
     gather_start = time()
-    all_results = dist_wrapper.gather_object(write_results)
+    with profile_phase('metadata_exchange'):
+        all_results = dist_wrapper.gather_object(write_results)
     gather_end = time()
     logger.debug(f"{gather_end}, {torch.distributed.get_rank()}, gather: {gather_end-gather_start}")
 
@@ -155,7 +168,8 @@ def save_state_dict_async_finalize(
         if len(node_failures) == 0:
             assert global_metadata is not None
             write_start = time()
-            storage_writer.finish(global_metadata, all_results)
+            with profile_phase('finalize'):
+                storage_writer.finish(global_metadata, all_results)
             write_end = time()
             logger.debug(f"{write_end}, metadata_write: {write_end - write_start}")
         else:
@@ -2,12 +2,13 @@
 
 """ Strategies using PyTorch distributed.checkpoint as an underlying format. """
 import io
+import os
 from collections import ChainMap, defaultdict
 from dataclasses import dataclass
 from itertools import product
 from logging import getLogger
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Tuple, Union, cast
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union, cast
 
 import torch
 from packaging.version import Version as PkgVersion
@@ -50,7 +51,8 @@ from .base import (
     StrategyAction,
     register_default_strategy,
 )
-from .filesystem_async import FileSystemWriterAsync
+from .compression import CompressedFileSystemReader
+from .filesystem_async import ChunkRecord, FileSystemWriterAsync
 from .resharding import (
     TensorReformulationMetadata,
     apply_nd_flattened_tensors_reformulation,
@@ -583,6 +585,9 @@ class TorchDistSaveShardedStrategy(AsyncSaveShardedStrategy):
         keep_only_main_replica: bool = True,
         thread_count: int = 2,
         cached_metadata: bool = False,
+        delta_save: bool = False,
+        compression: Optional[str] = None,
+        compression_level: Optional[int] = None,
     ):
         """Adds parameters specific to PyT Distributed format
         Args:
@@ -595,6 +600,15 @@ class TorchDistSaveShardedStrategy(AsyncSaveShardedStrategy):
                 Affects the number of files in the checkpoint (saving ranks * num_threads).
             cached_metadata (bool, optional): Enables using cached global metadata to avoid
                 gathering local metadata every checkpointing invocation
+            delta_save (bool, optional): Enables delta saves: tensor chunks unchanged since
+                the previous save with this strategy are not written again, the checkpoint
+                refers to the files of the earlier checkpoint holding them instead
+                (see FileSystemWriterAsync). The earlier checkpoints must then be kept as long
+                as the checkpoints referring to them, see `get_delta_references`.
+            compression (str, optional): codec to compress the tensor items with, one of
+                `CHECKPOINT_CODECS`. Defaults to None (no compression).
+            compression_level (int, optional): compression level of the codec.
+                Defaults to a fast level of the codec.
         """
         super().__init__(backend, version)
         self.keep_only_main_replica = keep_only_main_replica
@@ -614,6 +628,13 @@ class TorchDistSaveShardedStrategy(AsyncSaveShardedStrategy):
         self.validated_cache_reuse: bool = False
         # The knob to enable cached metadata communication in saving
         self.use_cached_ckpt_structure: bool = cached_metadata
+        # The knob to enable delta saves
+        self.delta_save: bool = delta_save
+        # Records of the chunks of the latest finalized save, base of the next delta save
+        self.saved_chunks: Dict[tuple, ChunkRecord] = {}
+        # Compression codec and level of the tensor items
+        self.compression: Optional[str] = compression
+        self.compression_level: Optional[int] = compression_level
 
     def async_save(
         self, sharded_state_dict: ShardedStateDict, checkpoint_dir: Path
@@ -634,7 +655,13 @@ class TorchDistSaveShardedStrategy(AsyncSaveShardedStrategy):
         )
         pyt_state_dict = mcore_to_pyt_state_dict(sharded_state_dict, False)
         # Use PyT saving mechanism
-        writer = FileSystemWriterAsync(checkpoint_dir, thread_count=self.thread_count)
+        writer = FileSystemWriterAsync(
+            checkpoint_dir,
+            thread_count=self.thread_count,
+            base_chunks=self.saved_chunks if self.delta_save else None,
+            compression=self.compression,
+            compression_level=self.compression_level,
+        )
         # This should be set differently if we run in a smaller process group than the default
         coordinator = 0
         # Try twice to validate the generated `central_plan` is the same across iterations
@@ -684,6 +711,8 @@ class TorchDistSaveShardedStrategy(AsyncSaveShardedStrategy):
         def finalize_fn():
             save_state_dict_async_finalize(*save_state_dict_ret)
             torch.distributed.barrier()
+            if writer.saved_chunks is not None:
+                self.saved_chunks = writer.saved_chunks
 
         return AsyncRequest(save_fn, save_args, [finalize_fn])
 
@@ -691,6 +720,27 @@ class TorchDistSaveShardedStrategy(AsyncSaveShardedStrategy):
         return True
 
 
+def get_delta_references(checkpoint_dir: Path) -> Set[Path]:
+    """Returns the files of other checkpoints a delta saved checkpoint refers to.
+
+    Those files must not be removed while the checkpoint is in use.
+
+    Args:
+        checkpoint_dir (Path): checkpoint directory
+
+    Returns:
+        Set[Path]: the referenced files, empty if the checkpoint is self-contained
+    """
+    checkpoint_dir = Path(checkpoint_dir)
+    storage_data = FileSystemReader(checkpoint_dir).read_metadata().storage_data
+    references = set()
+    for storage_info in storage_data.values():
+        path = Path(os.path.normpath(checkpoint_dir / storage_info.relative_path))
+        if path.parent != Path(os.path.normpath(checkpoint_dir)):
+            references.add(path)
+    return references
+
+
 def get_reformulation_metadata(
     sharded_state_dict: ShardedStateDict, checkpoint_dir: Path
 ) -> Dict[str, TensorReformulationMetadata]:
@@ -727,7 +777,20 @@ def get_reformulation_metadata(
 
 
 class TorchDistLoadShardedStrategy(LoadShardedStrategy):
-    """Basic load strategy for the PyT Distributed format."""
+    """Basic load strategy for the PyT Distributed format.
+
+    Compressed tensor items (see `TorchDistSaveShardedStrategy`) are decompressed on load,
+    by `thread_count` reading threads.
+    """
+
+    def __init__(self, thread_count: int = 2):
+        """
+        Args:
+            thread_count (int, optional): threads reading and decompressing the tensor items.
+                Defaults to 2.
+        """
+        super().__init__()
+        self.thread_count = thread_count
 
     def load(self, sharded_state_dict: ShardedStateDict, checkpoint_dir: Path) -> StateDict:
         """Translates MCore ShardedTensors to PyT ShardedTensors & loads from PyT Distributed fmt.
@@ -759,7 +822,7 @@ class TorchDistLoadShardedStrategy(LoadShardedStrategy):
         # Load PyT Distributed format
         checkpoint.load_state_dict(
             pyt_state_dict,
-            FileSystemReader(checkpoint_dir),
+            CompressedFileSystemReader(checkpoint_dir, self.thread_count),
             planner=MCoreLoadPlanner(
                 shapes_validation_sharded_tensors=flexible_shape_sharded_tensors
             ),
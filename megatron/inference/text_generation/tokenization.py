@@ -109,11 +109,9 @@ def _tokenize_prompts_and_batch(prompts, tokens_to_generate, add_BOS):
         eod_token = tokenizer.eos_id
     else:
         raise AttributeError('No eod token found in Tokenizer')
+    prompts_tokens = [list(prompt_tokens) for prompt_tokens in tokenizer.tokenize_batch(prompts)]
     if add_BOS:
-        prompts_tokens = [[eod_token] + tokenizer.tokenize(prompt)
-                          for prompt in prompts]
-    else:
-        prompts_tokens = [tokenizer.tokenize(prompt) for prompt in prompts]
+        prompts_tokens = [[eod_token] + prompt_tokens for prompt_tokens in prompts_tokens]
 
     # Now we have a list of list of tokens which each list has a different
     # size. We want to extend this list to:
@@ -3,7 +3,10 @@
 """Dataloaders."""
 
 
+import collections
+import queue
 import random
+import threading
 import torch
 import numpy as np
 from torch.utils.data import Dataset
@@ -43,18 +46,162 @@ def build_pretraining_data_loader(dataset, consumed_samples):
         raise Exception('{} dataloader type is not supported.'.format(
                 args.dataloader_type))
 
+    # Hint the dataset at the batch each worker reads next, e.g. to stream it from S3 while the
+    # current one is in use. A dataloader worker reads every num_workers-th batch. The hints are
+    # only computed for datasets which benefit from them, e.g. not for local memory mapped data.
+    if getattr(dataset, 'benefits_from_prefetch', False):
+        batch_sampler.prefetch_lookahead = max(args.num_workers, 1)
+
     # Torch dataloader.
-    return torch.utils.data.DataLoader(dataset,
-                                       batch_sampler=batch_sampler,
-                                       num_workers=args.num_workers,
-                                       pin_memory=True,
-                                       persistent_workers=True if args.num_workers > 0 else False,
-                                       )
+    dataloader = torch.utils.data.DataLoader(dataset,
+                                             batch_sampler=batch_sampler,
+                                             num_workers=args.num_workers,
+                                             pin_memory=True,
+                                             persistent_workers=True if args.num_workers > 0 else False,
+                                             )
+
+    if args.stateful_dataloader:
+        return StatefulDataLoader(dataloader,
+                                  cyclic=args.dataloader_type == 'cyclic',
+                                  prefetch_microbatches=args.dataloader_prefetch_microbatches)
+    return dataloader
+
+
+class StatefulDataLoader:
+    """An iterator over a Megatron sampler based dataloader which tracks its exact cursor.
+
+    The batch sampler runs ahead of training by however many batches the workers and the
+    prefetch queue hold, so its own consumed_samples is not a resumable position. This iterator
+    counts the micro-batches actually handed out and reports that cursor through save_state,
+    which save_dataloader_state checkpoints next to the model.
+
+    A background thread keeps up to prefetch_microbatches micro-batches ready from the moment
+    start is called, so a resumed run can fill its queue, and warm the page cache, while the
+    model checkpoint is still loading.
+
+    Args:
+        dataloader (torch.utils.data.DataLoader): The dataloader over a MegatronPretrainingSampler
+            or MegatronPretrainingRandomSampler
+
+        cyclic (bool): Whether to restart the dataloader when it is exhausted
+
+        prefetch_microbatches (int, optional): The number of micro-batches to keep ready. Defaults
+            to the number of micro-batches in a global batch.
+    """
+
+    _END = object()
+
+    def __init__(self, dataloader, cyclic=False, prefetch_microbatches=None):
+        self.dataloader = dataloader
+        self.batch_sampler = dataloader.batch_sampler
+        assert isinstance(self.batch_sampler,
+                          (MegatronPretrainingSampler, MegatronPretrainingRandomSampler)), \
+            'unsupported batch sampler: {}'.format(type(self.batch_sampler).__name__)
+        self.cyclic = cyclic
+        if prefetch_microbatches is None:
+            from megatron.core.num_microbatches_calculator import get_num_microbatches
+            prefetch_microbatches = get_num_microbatches()
+        self.consumed_samples = self.batch_sampler.consumed_samples
+        self._queue = queue.Queue(maxsize=max(prefetch_microbatches, 1))
+        self._thread = None
+        self._closed = threading.Event()
+
+    def _put(self, item):
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _prefetch(self):
+        try:
+            while True:
+                for batch in self.dataloader:
+                    if not self._put(batch):
+                        return
+                if not self.cyclic:
+                    break
+            self._put(self._END)
+        except BaseException as e:
+            self._put(e)
+
+    def start(self):
+        """Start prefetching from the cursor, if not already started."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._prefetch, daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        """Stop prefetching and release the dataloader workers."""
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.dataloader = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.start()
+        batch = self._queue.get()
+        if batch is self._END:
+            # Keep raising StopIteration on subsequent calls
+            self._queue.put(self._END)
+            raise StopIteration
+        if isinstance(batch, BaseException):
+            raise batch
+        self.consumed_samples += self.batch_sampler.micro_batch_times_data_parallel_size
+        return batch
+
+    def save_state(self):
+        """Get the cursor of this data parallel rank.
+
+        Returns:
+            dict: The samples consumed across the data parallel ranks, and the sampler geometry it
+            is valid for
+        """
+        return {
+            'sampler': type(self.batch_sampler).__name__,
+            'consumed_samples': self.consumed_samples,
+            'total_samples': self.batch_sampler.total_samples,
+            'micro_batch_times_data_parallel_size':
+                self.batch_sampler.micro_batch_times_data_parallel_size,
+        }
+
+
+class BatchWithUpcoming(list):
+    """The indices of a batch, with the indices of an upcoming batch as a prefetch hint.
+
+    Datasets with a prefetch method, e.g. GPTDataset, pass the upcoming indices to it when they
+    get such a batch through __getitems__.
+    """
+
+    def __init__(self, indices, upcoming):
+        super().__init__(indices)
+        self.upcoming = upcoming
+
+
+def _with_upcoming(batches, lookahead):
+    """Yield every batch with the indices of the batch lookahead batches later, if lookahead."""
+    if not lookahead:
+        yield from batches
+        return
+    pending = collections.deque()
+    for batch in batches:
+        pending.append(batch)
+        if len(pending) > lookahead:
+            yield BatchWithUpcoming(pending.popleft(), batch)
+    while pending:
+        yield BatchWithUpcoming(pending.popleft(), [])
+
 
 class MegatronPretrainingSampler:
 
     def __init__(self, total_samples, consumed_samples, micro_batch_size,
-                 data_parallel_rank, data_parallel_size, drop_last=True):
+                 data_parallel_rank, data_parallel_size, drop_last=True, prefetch_lookahead=0):
         # Keep a copy of input params for later use.
         self.total_samples = total_samples
         self.consumed_samples = consumed_samples
@@ -63,6 +210,7 @@ class MegatronPretrainingSampler:
         self.micro_batch_times_data_parallel_size = \
             self.micro_batch_size * data_parallel_size
         self.drop_last = drop_last
+        self.prefetch_lookahead = prefetch_lookahead
 
         # Sanity checks.
         assert self.total_samples > 0, \
@@ -85,6 +233,9 @@ class MegatronPretrainingSampler:
         return start_idx, end_idx
 
     def __iter__(self):
+        return _with_upcoming(self._iter_batches(), self.prefetch_lookahead)
+
+    def _iter_batches(self):
         batch = []
         # Last batch will be dropped if drop_last is not set False
         for idx in range(self.consumed_samples, self.total_samples):
@@ -125,7 +276,7 @@ class RandomSeedDataset(Dataset):
 class MegatronPretrainingRandomSampler:
 
     def __init__(self, dataset, total_samples, consumed_samples, micro_batch_size,
-                 data_parallel_rank, data_parallel_size, data_sharding):
+                 data_parallel_rank, data_parallel_size, data_sharding, prefetch_lookahead=0):
         # Keep a copy of input params for later use.
         self.dataset = dataset
         self.total_samples = total_samples
@@ -134,6 +285,7 @@ class MegatronPretrainingRandomSampler:
         self.data_parallel_rank = data_parallel_rank
         self.data_parallel_size = data_parallel_size
         self.data_sharding = data_sharding
+        self.prefetch_lookahead = prefetch_lookahead
         self.micro_batch_times_data_parallel_size = \
             self.micro_batch_size * data_parallel_size
         self.last_batch_size = \
@@ -152,6 +304,9 @@ class MegatronPretrainingRandomSampler:
         return self.total_samples
 
     def __iter__(self):
+        return _with_upcoming(self._iter_batches(), self.prefetch_lookahead)
+
+    def _iter_batches(self):
         active_total_samples = self.total_samples - self.last_batch_size
         self.epoch = self.consumed_samples // active_total_samples
         current_epoch_samples = self.consumed_samples % active_total_samples
@@ -156,8 +156,15 @@ def load_retro_args(args):
 def validate_args(args, defaults={}):
 
     # Temporary
-    assert args.non_persistent_ckpt_type in ['global', None], \
-        'Currently only global checkpoints are supported'
+    assert args.non_persistent_ckpt_type in ['global', 'local', None], \
+        'Currently only global and local checkpoints are supported'
+    if args.non_persistent_ckpt_type == 'local':
+        assert args.non_persistent_local_ckpt_dir is not None, \
+            '--non-persistent-local-ckpt-dir is required for local non-persistent checkpoints'
+    if args.ckpt_delta_save:
+        assert args.non_persistent_ckpt_type != 'global', \
+            '--ckpt-delta-save is not supported with global non-persistent checkpoints,' \
+            ' which are removed while later checkpoints may refer to them'
 
     # Load saved args from Retro (if applicable).
     load_retro_args(args)
@@ -346,9 +353,18 @@ def validate_args(args, defaults={}):
 
     if args.dataloader_type is None:
         args.dataloader_type = 'single'
+    if args.stateful_dataloader:
+        assert args.dataloader_type in ['single', 'cyclic'], \
+            '--stateful-dataloader requires the single or cyclic dataloader type'
 
     # data
     assert args.num_dataset_builder_threads > 0
+    assert args.num_dataset_builder_processes > 0
+    if args.sequence_packing is not None:
+        # The cu_seqlens of the packed samples are not passed to the model, so the documents of
+        # a packed sample are kept apart by the attention masks built in the dataloader
+        assert args.create_attention_mask_in_dataloader, \
+            '--sequence-packing requires the attention masks to be created in the dataloader'
 
     # Consumed tokens.
     args.consumed_train_samples = 0
@@ -1394,7 +1410,8 @@ def _add_checkpointing_args(parser):
                        choices=['global', 'local', 'in_memory', None],
                        help='Type of non-persistent model checkpoints. '
                            '"global" - Saved as a standard checkpoint (e.g., on Lustre) with old checkpoints being removed. '
-                           '"local" - [TBD] Each rank saves a portion of the checkpoint locally (e.g., on SSD/ramdisk). '
+                           '"local" - Each rank saves a portion of the checkpoint locally (e.g., on SSD/ramdisk), '
+                           'replicated to peer ranks on other nodes, see --non-persistent-local-ckpt-replication. '
                            '"in_memory" - [TBD] A special kind of local checkpoint that avoids serialization. '
                            'None - No non-persistent checkpointing (default option).')
     group.add_argument('--non-persistent-global-ckpt-dir', type=str, default=None,
@@ -1404,6 +1421,13 @@ def _add_checkpointing_args(parser):
     group.add_argument('--non-persistent-local-ckpt-algo', type=str, default='fully_parallel',
                        choices=['fully_parallel', 'atomic'],
                        help='Algorithm for local non-persistent checkpointing.')
+    group.add_argument('--non-persistent-local-ckpt-replication', type=int, default=1,
+                       help='Number of peer ranks to which each rank replicates its local '
+                       'non-persistent checkpoint, so that it survives the loss of as many nodes.')
+    group.add_argument('--non-persistent-local-ckpt-replication-jump', type=int, default=None,
+                       help='Rank distance between replication peers. Defaults to the number of '
+                       'ranks per node (LOCAL_WORLD_SIZE, else the number of GPUs), which places '
+                       'every replica on another node.')
     group.add_argument('--finetune', action='store_true',
                        help='Load model for finetuning. Do not load optimizer '
                        'or rng state from checkpoint and set iteration to 0. '
@@ -1459,6 +1483,31 @@ def _add_checkpointing_args(parser):
     group.add_argument('--async-save', action='store_true', default=None,
                        help='Apply async checkpointing save. Currently works only with'
                             '`torch_dist` distributed checkpoint format.')
+    group.add_argument('--use-persistent-ckpt-worker', action='store_true',
+                       help='Run async checkpoint saves in a worker process started'
+                            ' once at initialization, instead of forking the training'
+                            ' process for every save.')
+    group.add_argument('--ckpt-delta-save', action='store_true',
+                       help='Only write the tensor shards which changed since the'
+                            ' previous checkpoint save, the new checkpoint refers to'
+                            ' the unchanged ones in earlier checkpoints. Those must be'
+                            ' kept as long as the checkpoints referring to them.'
+                            ' Applies to the `torch_dist` checkpoint format.')
+    group.add_argument('--ckpt-compression', type=str, default=None,
+                       choices=['zlib', 'zstd', 'lz4'],
+                       help='Compress every tensor shard of the checkpoint with this codec.'
+                            ' zstd and lz4 require the `zstandard` and `lz4` packages.'
+                            ' Compressed checkpoints are decompressed transparently on load.'
+                            ' Applies to the `torch_dist` checkpoint format.')
+    group.add_argument('--ckpt-compression-level', type=int, default=None,
+                       help='Compression level of --ckpt-compression. Defaults to a fast'
+                            ' level of the codec.')
+    group.add_argument('--ckpt-profile-path', type=str, default=None,
+                       help='Path to a JSON file to which to write the wall time and'
+                            ' bytes of every checkpoint save phase: plan, metadata'
+                            ' exchange, D2H, write, fsync and finalize. Rewritten by'
+                            ' rank 0 after every save. Applies to the `torch_dist`'
+                            ' checkpoint format.')
     group.add_argument('--ckpt-fully-parallel-load', action='store_true',
                        help='Apply full load parallelization across DP for'
                             ' distributed checkpoints.')
@@ -1642,6 +1691,10 @@ def _add_data_args(parser):
                        'oversampling done to ensure fulfillment of the requested number of '
                        'samples. Use this option if prompted. Defaults to False for backward '
                        'comparability in the data sample order.')
+    group.add_argument('--closed-form-blending', action='store_true',
+                       help='Compute the blended dataset indices on the fly, in closed form, '
+                       'rather than build and cache them. The blend then takes memory in the '
+                       'number of datasets only, but draws samples in a different order.')
     group.add_argument('--split', type=str, default=None,
                        help='Comma-separated list of proportions for training,'
                        ' validation, and test split. For example the split '
@@ -1658,9 +1711,25 @@ def _add_data_args(parser):
                        'Follows the same pattern rules as --data-path.')
     group.add_argument('--data-cache-path', default=None,
                        help='Path to a directory to hold cached index files.')
+    group.add_argument('--consolidate-cached-indices', action='store_true',
+                       help='Cache the indices of each dataset in a single page-aligned file '
+                       'which every rank maps lazily and read-only, rather than in one .npy '
+                       'file per index.')
     group.add_argument('--no-mmap-bin-files', action='store_false',
                        help='Disable mmap-ing of .bin files.',
                        dest='mmap_bin_files')
+    group.add_argument('--mmap-pool-capacity', type=int, default=None,
+                       help='Maximum number of .bin file mappings each process holds at once. '
+                       'Mappings are shared across datasets, created on first read, and the '
+                       'least recently used ones are unmapped beyond this limit. '
+                       'Defaults to no limit.')
+    group.add_argument('--data-profile-path', type=str, default=None,
+                       help='Path to a JSON file to which to write the wall time of every '
+                       'dataset building phase, per dataset and split, and the sample '
+                       'throughput of the train dataset. Written by rank 0.')
+    group.add_argument('--data-profile-num-samples', type=int, default=1024,
+                       help='Number of train samples to read to measure the sample throughput '
+                       'for --data-profile-path.')
     group.add_argument('--mock-data', action='store_true',
                        help='Skip data loading and validation and opt for artificial '
                        'generation of mock data when an implementation is available.')
@@ -1692,6 +1761,13 @@ def _add_data_args(parser):
                        help='Probability of producing a short sequence.')
     group.add_argument('--num-workers', type=int, default=2,
                        help="Dataloader number of workers.")
+    group.add_argument('--stateful-dataloader', action='store_true',
+                       help='Checkpoint the exact cursor of the single or cyclic dataloader with '
+                       'each checkpoint, and on resume rebuild the dataloader from it before the '
+                       'model is loaded so that it prefetches while the checkpoint loads.')
+    group.add_argument('--dataloader-prefetch-microbatches', type=int, default=None,
+                       help='Number of micro-batches the stateful dataloader keeps ready. '
+                       'Defaults to the number of micro-batches per global batch.')
     group.add_argument('--tokenizer-type', type=str,
                        default=None,
                        choices=['BertWordPieceLowerCase',
@@ -1719,11 +1795,27 @@ def _add_data_args(parser):
                        'end-of-document token.')
     group.add_argument('--eod-mask-loss', action='store_true',
                        help='Mask loss for the end of document tokens.')
+    group.add_argument('--sequence-packing', type=str, default=None,
+                       choices=['first-fit-decreasing', 'best-fit'],
+                       help='Pack whole documents into the GPT samples with the given bin packing '
+                       'algorithm, rather than concatenate documents across sample boundaries. '
+                       'Packed samples come with per-document position ids and attention masks, '
+                       'so they require the attention masks to be created in the dataloader.')
+    group.add_argument('--use-document-keep-masks', action='store_true',
+                       help='Drop the GPT documents which are excluded by the document keep mask '
+                       'next to each dataset, as written by tools/deduplicate_dataset.py.')
     group.add_argument('--no-create-attention-mask-in-dataloader', action='store_false',
                        help='If set, do not create attention_masks in dataloader.',
                        dest='create_attention_mask_in_dataloader')
+    group.add_argument('--coalesced-batch-broadcast', action='store_true',
+                       help='Broadcast each micro-batch to the tensor parallel ranks with a single '
+                       'collective on a reused buffer, rather than one collective per field. '
+                       'The position ids are built locally unless --reset-position-ids is set.')
     group.add_argument('--num-dataset-builder-threads', type=int, default=1,
                        help='Number of parallel threads per rank for dataset builder')
+    group.add_argument('--num-dataset-builder-processes', type=int, default=1,
+                       help='Number of parallel processes used to build and cache the '
+                       'dataset indices of a blend')
     group.add_argument('--s3-cache-path', type=str, default=None,
                        help='Path to cache index files when using s3 dataloader')
     return parser
@@ -16,6 +16,17 @@ logger = logging.getLogger(__name__)
 _async_calls_queue = AsyncCallsQueue()
 
 
+def init_persistent_async_worker():
+    """ Start the persistent worker process which will run the async saves.
+
+    Starting it once, early in training, avoids forking the training process
+    for every async save.
+    """
+    global _async_calls_queue
+    assert _async_calls_queue.get_num_unfinalized_calls() == 0
+    _async_calls_queue = AsyncCallsQueue(persistent=True)
+
+
 def schedule_async_save(async_request: AsyncRequest):
     """ Schedule the async save request.
 
@@ -25,13 +36,15 @@ def schedule_async_save(async_request: AsyncRequest):
     _async_calls_queue.schedule_async_request(async_request)
 
 
-def maybe_finalize_async_save(blocking: bool = False):
+def maybe_finalize_async_save(blocking: bool = False, terminate: bool = False):
     """ Finalizes active async save calls.
 
     Args:
         blocking (bool, optional): if True, will wait until all active requests
             are done. Otherwise, finalizes only the async request that already
             finished. Defaults to False.
+        terminate (bool, optional): if True, finalizes all active requests and
+            stops the persistent worker, if any. Defaults to False.
     """
     args = get_args()
     if not args.async_save:
@@ -40,4 +53,7 @@ def maybe_finalize_async_save(blocking: bool = False):
     if blocking and _async_calls_queue.get_num_unfinalized_calls() > 0:
         print_rank_0('Unfinalized async checkpoint saves. Finalizing them synchronously now.')
 
-    _async_calls_queue.maybe_finalize_async_calls(blocking)
+    if terminate:
+        _async_calls_queue.close()
+    else:
+        _async_calls_queue.maybe_finalize_async_calls(blocking)
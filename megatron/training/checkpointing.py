@@ -313,11 +313,13 @@ def save_checkpoint(iteration, model, optimizer, opt_param_scheduler, num_floati
     the checkpoint will be saved with special functionality for removing old checkpoints.
     There are several types of non-persistent checkpoints:
     "global" - Saved as a standard checkpoint (e.g., on Lustre) with old checkpoints being removed.
-    "local" - [TBD] Each rank saves a portion of the checkpoint locally (e.g., on SSD/ramdisk).
+    "local" - Each rank saves a portion of the checkpoint locally (e.g., on SSD/ramdisk),
+              replicated to peer ranks on other nodes.
     "in_memory" - [TBD] A special kind of local checkpoint that avoids serialization.
 
-    Dataloader checkpoint is only saved if the dataloader supports it. Currently this applies only
-    to the Megatron Energon dataloader (multimodal) and not the built-in Megatron dataloader (text-only).
+    Dataloader checkpoint is only saved if the dataloader supports it. This applies to the Megatron
+    Energon dataloader (multimodal), and to the built-in Megatron dataloader (text-only) when
+    --stateful-dataloader is set.
     """
     start_ckpt = time()
     args = get_args()
@@ -345,7 +347,6 @@ def save_checkpoint(iteration, model, optimizer, opt_param_scheduler, num_floati
                 save_dir, leave_ckpt_num=1, do_async=args.async_save
             )
         elif args.non_persistent_ckpt_type == 'local':
-            raise RuntimeError('LocalCheckpointManagers are not yet integrated')
             ckpt_type = CheckpointType.LOCAL
             save_dir = checkpointing_context['local_checkpoint_manager'].local_ckpt_dir
         else:
@@ -364,8 +365,12 @@ def save_checkpoint(iteration, model, optimizer, opt_param_scheduler, num_floati
     checkpoint_name = get_checkpoint_name(save_dir, iteration, release=False, pipeline_parallel=pipeline_parallel,
         tensor_rank=tensor_rank, pipeline_rank=pipeline_rank, expert_parallel=expert_parallel, expert_rank=expert_rank, return_base_dir=return_base_dir)
 
-    # Save dataloader state if the dataloader supports it (currently only Megatron Energon).
-    save_dataloader_state(train_data_iterator, iteration, getattr(args, "dataloader_save", None))
+    # Save dataloader state if the dataloader supports it (Megatron Energon, or the built-in
+    # dataloader with --stateful-dataloader).
+    dataloader_save_path = getattr(args, "dataloader_save", None)
+    if dataloader_save_path is None and args.stateful_dataloader:
+        dataloader_save_path = save_dir
+    save_dataloader_state(train_data_iterator, iteration, dataloader_save_path)
 
     # Save distributed optimizer's custom parameter state.
     if (
@@ -425,6 +430,11 @@ def save_checkpoint(iteration, model, optimizer, opt_param_scheduler, num_floati
                 save_strategy = get_default_save_sharded_strategy(args.ckpt_format)
                 if args.ckpt_assume_constant_structure and args.ckpt_format == 'torch_dist':
                     save_strategy.use_cached_ckpt_structure = args.ckpt_assume_constant_structure
+                if args.ckpt_delta_save and args.ckpt_format == 'torch_dist':
+                    save_strategy.delta_save = args.ckpt_delta_save
+                if args.ckpt_compression is not None and args.ckpt_format == 'torch_dist':
+                    save_strategy.compression = args.ckpt_compression
+                    save_strategy.compression_level = args.ckpt_compression_level
                 if args.ckpt_fully_parallel_save:
                     save_strategy = FullyParallelSaveStrategyWrapper(save_strategy, mpu.get_data_parallel_group(with_context_parallel=True),
                                                                      args.ckpt_assume_constant_structure)
@@ -541,24 +551,34 @@ def cleanup_old_non_persistent_checkpoint(save_dir, leave_ckpt_num=1, do_async=F
 def save_dataloader_state(train_iterator, iteration, dataloader_save_path):
     """Saves dataloader state if the dataloader supports it.
 
-    Currently, this is only used by Megatron Energon dataloader (multimodal) to store its state at a
-    specific iteration. The Megatron built-in dataloader (text-only) creates index files upfront
-    to track its state.
+    This is used by the Megatron Energon dataloader (multimodal) to store its state at a specific
+    iteration, and by the Megatron built-in dataloader (text-only) with --stateful-dataloader to
+    store its exact cursor, so that a resumed run can rebuild it before the model is loaded.
 
     If the provided dataloader has `save_state` method, then it is called to save the state.
-    Otherwise, no state is saved.
+    Otherwise, no state is saved. With virtual pipeline parallelism, the dataloader is a list with
+    one per model chunk, of which the first one with a `save_state` method is saved.
 
     Args:
-        train_iterator (iterable): Train dataloader.
+        train_iterator (iterable): Train dataloader, or a list of them.
         iteration (int): Current iteration.
         dataloader_save_path (str): Path where the dataloader state is saved.
     """
+    # With virtual pipeline parallelism, only the first model chunk of the first stage consumes
+    # the data, so the first stateful dataloader has the cursor to resume from.
+    if isinstance(train_iterator, list):
+        train_iterator = next(
+            (it for it in train_iterator if hasattr(it, "save_state")),
+            next((it for it in train_iterator if it is not None), None))
+
     # If no dataloader or saving path is provided, then exit early.
     if train_iterator is None or dataloader_save_path is None:
         return
 
     # If dataloader doesn't support saving state, exit early.
     if not hasattr(train_iterator, "save_state"):
+        logger.warning(f"The train dataloader {type(train_iterator).__name__} does not support "
+                       "save_state, not saving the dataloader state")
         return
 
     # Save dataloader state for each data parallel rank only once.
@@ -583,9 +603,44 @@ def save_dataloader_state(train_iterator, iteration, dataloader_save_path):
 
     dataloader_save_dict = {}
     dataloader_save_dict['dataloader_state_dict'] = train_dataloader_state_dict
+    dataloader_save_dict['iteration'] = iteration
+    dataloader_save_dict['consumed_valid_samples'] = get_args().consumed_valid_samples
     torch.save(dataloader_save_dict, data_state_save_path)
 
 
+def load_dataloader_state(dataloader_load_path):
+    """Loads the dataloader state saved with the latest checkpoint, ahead of the checkpoint itself.
+
+    The result is agreed upon by all ranks: unless every data parallel rank finds its state, no
+    rank gets one.
+
+    Args:
+        dataloader_load_path (str): Path where the dataloader state was saved.
+
+    Returns:
+        Optional[dict]: The dataloader state, with the iteration and the consumed validation
+        samples at which it was saved, or None.
+    """
+    dataloader_save_dict = None
+    tracker_filename = get_checkpoint_tracker_filename(dataloader_load_path)
+    if os.path.isfile(tracker_filename):
+        iteration, release = read_metadata(tracker_filename)
+        data_state_load_path = get_checkpoint_name(
+            dataloader_load_path, iteration,
+            basename=f'train_dataloader_dprank{mpu.get_data_parallel_rank():03d}.pt'
+        )
+        if not release and os.path.isfile(data_state_load_path):
+            dataloader_save_dict = torch.load(data_state_load_path, map_location='cpu')
+            if 'iteration' not in dataloader_save_dict:
+                dataloader_save_dict = None
+
+    found = torch.tensor([int(dataloader_save_dict is not None)], dtype=torch.long, device='cuda')
+    torch.distributed.all_reduce(found, op=torch.distributed.ReduceOp.MIN)
+    if not found.item():
+        return None
+    return dataloader_save_dict
+
+
 def generate_state_dict(args, model, optimizer, opt_param_scheduler,
                         rng_state, use_dist_ckpt=False, iteration=None,
                         optim_sd_kwargs=None):
@@ -707,7 +762,6 @@ def _get_non_persistent_iteration(non_persistent_global_dir, args, checkpointing
             print_rank_0('    will not load any non-persistent checkpoint')
         return iteration
     elif args.non_persistent_ckpt_type == "local":
-        raise RuntimeError('LocalCheckpointManagers are not yet integrated')
         return checkpointing_context['local_checkpoint_manager'].get_latest_checkpoint_iteration()
     else:
         assert False, 'Please use local or global non-persistent checkpoints' \
@@ -735,7 +789,10 @@ def _load_non_persistent_base_checkpoint(
             non_persistent_global_dir, args, rank0, sharded_state_dict, non_persistent_iteration, False
         )
     elif args.non_persistent_ckpt_type == "local":
-        raise RuntimeError('LocalCheckpointManagers are not yet integrated')
+        if not rank0:
+            print_rank_0(
+                f'Loading from a local non-persistent checkpoint (non-persistent iter {non_persistent_iteration})'
+            )
         intermediate_state_dict, checkpoint_name = checkpointing_context[
             'local_checkpoint_manager'
         ].load()
@@ -23,6 +23,7 @@ import json
 import logging
 import os
 import regex as re
+from collections import OrderedDict
 from io import open
 
 try:
@@ -49,6 +50,8 @@ PRETRAINED_VOCAB_POSITIONAL_EMBEDDINGS_SIZE_MAP = {
 VOCAB_NAME = 'vocab.json'
 MERGES_NAME = 'merges.txt'
 SPECIAL_TOKENS_NAME = 'special_tokens.txt'
+# Number of pre-tokenized words whose BPE merges are kept in the LRU cache
+BPE_CACHE_SIZE = 2 ** 16
 
 
 @lru_cache()
@@ -154,7 +157,7 @@ class GPT2Tokenizer(object):
         return tokenizer
 
     def __init__(self, vocab_file, merges_file, errors='replace',
-                 special_tokens=None, max_len=None):
+                 special_tokens=None, max_len=None, cache_size=BPE_CACHE_SIZE):
         self.max_len = max_len if max_len is not None else int(1e12)
         self.encoder = json.load(open(vocab_file))
         self.decoder = {v: k for k, v in self.encoder.items()}
@@ -164,7 +167,9 @@ class GPT2Tokenizer(object):
         bpe_data = open(merges_file, encoding='utf-8').read().split('\n')[1:-1]
         bpe_merges = [tuple(merge.split()) for merge in bpe_data]
         self.bpe_ranks = dict(zip(bpe_merges, range(len(bpe_merges))))
-        self.cache = {}
+        # Bounded so that long-running processes do not grow without limit on open-ended text
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
 
         # Should haved added re.IGNORECASE so BPE merges can happen for
         # capitalized versions of contractions
@@ -193,8 +198,10 @@ class GPT2Tokenizer(object):
         logger.info("Special tokens {}".format(self.special_tokens))
 
     def bpe(self, token):
-        if token in self.cache:
-            return self.cache[token]
+        word = self.cache.get(token)
+        if word is not None:
+            self.cache.move_to_end(token)
+            return word
         word = tuple(token)
         pairs = get_pairs(word)
 
@@ -230,7 +237,10 @@ class GPT2Tokenizer(object):
             else:
                 pairs = get_pairs(word)
         word = ' '.join(word)
-        self.cache[token] = word
+        if self.cache_size > 0:
+            self.cache[token] = word
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
         return word
 
     def tokenize(self, text):
@@ -280,6 +290,10 @@ class GPT2Tokenizer(object):
     def encode(self, text):
         return self.convert_tokens_to_ids(self.tokenize(text))
 
+    def encode_batch(self, texts):
+        """ Encode a list of strings, sharing the BPE cache across the batch. """
+        return [self.encode(text) for text in texts]
+
     def decode(self, tokens):
         text = ''.join([self.decoder[token] for token in tokens])
         text = bytearray([self.byte_decoder[c] for c in text]).decode('utf-8', errors=self.errors)
@@ -128,6 +128,10 @@ class _HuggingFaceTokenizer(MegatronTokenizer):
     def tokenize(self, text, **kwargs):
         return self._tokenizer(text, **kwargs).input_ids
 
+    def tokenize_batch(self, texts, **kwargs):
+        # Fast tokenizers encode a batch in parallel across native threads
+        return self._tokenizer(list(texts), **kwargs).input_ids
+
     def detokenize(self, token_ids, **kwargs):
         return self._tokenizer.decode(token_ids, **kwargs)
 
@@ -310,6 +314,9 @@ class _GPT2BPETokenizer(MegatronTokenizer):
     def tokenize(self, text):
         return self.tokenizer.encode(text)
 
+    def tokenize_batch(self, texts):
+        return self.tokenizer.encode_batch(texts)
+
     def detokenize(self, token_ids):
         return self.tokenizer.decode(token_ids)
 
@@ -504,6 +511,9 @@ class _GPTSentencePieceTokenizer(_SentencePieceTokenizer):
     def tokenize(self, text):
         return self.tokenizer.encode_as_ids(text)
 
+    def tokenize_batch(self, texts):
+        return self.tokenizer.encode_as_ids(list(texts))
+
     def detokenize(self, ids):
         return self.tokenizer.decode_ids(ids)
 
@@ -554,6 +564,11 @@ class _Llama2Tokenizer(_SentencePieceTokenizer):
             t = t + [self.eos_id]
         return t
 
+    def tokenize_batch(self, texts, bos=True, eos=False):
+        prefix = [self.bos_id] if bos else []
+        suffix = [self.eos_id] if eos else []
+        return [prefix + t + suffix for t in self.tokenizer.encode(list(texts))]
+
     def detokenize(self, ids):
         return self.tokenizer.decode_ids(ids)
 
@@ -723,6 +738,15 @@ class CustomTikTokenizer(MegatronTokenizer):
 
         return tokens
 
+    def tokenize_batch(
+        self, texts: List[str], bos: bool = False, eos: bool = False
+    ) -> List[List[int]]:
+        prefix = [self.bos] if bos else []
+        suffix = [self.eos] if eos else []
+        return [
+            [*prefix, *tokens, *suffix] for tokens in self._model.encode_ordinary_batch(list(texts))
+        ]
+
     def detokenize(self, tokens: List[int]) -> str:
         return self._model.decode(tokens)
 
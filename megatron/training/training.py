@@ -3,6 +3,7 @@
 """Pretrain utilities."""
 
 import dataclasses
+from contextlib import nullcontext
 from datetime import datetime
 import functools
 import gc
@@ -29,16 +30,20 @@ from megatron.core.utils import (
 from megatron.training.checkpointing import load_checkpoint
 from megatron.training.checkpointing import save_checkpoint
 from megatron.training.checkpointing import checkpoint_exists
+from megatron.training.checkpointing import load_dataloader_state
 from megatron.legacy.model import Float16Module
 from megatron.core.distributed import DistributedDataParallelConfig
 from megatron.core.distributed import DistributedDataParallel as DDP
 from megatron.core.distributed import finalize_model_grads
+from megatron.core.datasets.data_profiler import DataProfiler
+from megatron.core.dist_checkpointing.profiler import CheckpointProfiler, get_checkpoint_profiler
+from megatron.core.dist_checkpointing.local_checkpoint_manager import LocalCheckpointManager
 from megatron.core.enums import ModelType
 from megatron.core.optimizer import get_megatron_optimizer, OptimizerConfig
 from megatron.training.initialize import initialize_megatron
 from megatron.training.initialize import write_args_to_tensorboard
 from megatron.training.initialize import set_jit_fusion_options
-from megatron.legacy.data.data_samplers import build_pretraining_data_loader
+from megatron.legacy.data.data_samplers import StatefulDataLoader, build_pretraining_data_loader
 from megatron.core.optimizer_param_scheduler import OptimizerParamScheduler
 from megatron.core.transformer.moe import upcycling_utils
 from megatron.core.transformer.moe.moe_utils import track_moe_metrics
@@ -54,7 +59,7 @@ from megatron.core.num_microbatches_calculator import (
     get_num_microbatches,
     update_num_microbatches)
 
-from .async_utils import maybe_finalize_async_save
+from .async_utils import init_persistent_async_worker, maybe_finalize_async_save
 from .utils import (
     calc_params_l2_norm,
     check_adlr_autoresume_termination,
@@ -284,17 +289,46 @@ def pretrain(
     # Track E2E metrics on pretrain start
     one_logger_utils.on_pretrain_start()
 
+    # Start the async checkpoint worker before the model is allocated.
+    if args.async_save and args.use_persistent_ckpt_worker:
+        init_persistent_async_worker()
+
     # Context used for persisting some state between checkpoint saves.
     if args.non_persistent_ckpt_type == 'local':
-        raise RuntimeError('LocalCheckpointManagers are not yet integrated')
         checkpointing_context = {
-            'local_checkpoint_manager': BasicLocalCheckpointManager(
-                args.non_persistent_local_ckpt_dir
+            'local_checkpoint_manager': LocalCheckpointManager(
+                args.non_persistent_local_ckpt_dir,
+                replication_factor=args.non_persistent_local_ckpt_replication,
+                replication_jump=args.non_persistent_local_ckpt_replication_jump,
             )
         }
     else:
         checkpointing_context = {}
 
+    # When resuming a stateful dataloader, build the data iterators from the saved cursor before
+    # the model, so that the dataloader prefetches while the checkpoint loads.
+    data_iterators = None
+    data_cursor = None
+    if args.stateful_dataloader and args.load is not None:
+        dataloader_state = load_dataloader_state(
+            getattr(args, "dataloader_save", None) or args.load)
+        if dataloader_state is not None:
+            args.iteration = dataloader_state['iteration']
+            args.consumed_train_samples = \
+                dataloader_state['dataloader_state_dict']['consumed_samples']
+            args.consumed_valid_samples = dataloader_state['consumed_valid_samples']
+            data_cursor = (args.iteration, args.consumed_train_samples,
+                           args.consumed_valid_samples)
+            print_rank_0('> building dataloaders at iteration {}, consumed train samples {}, '
+                         'ahead of the checkpoint load ...'.format(*data_cursor[:2]))
+            app_metrics['app_build_dataiters_start_time'] = one_logger_utils.get_timestamp_in_ms()
+            data_iterators = build_data_iterators(train_valid_test_dataset_provider)
+            app_metrics['app_build_dataiters_finish_time'] = one_logger_utils.get_timestamp_in_ms()
+            # The checkpoint load expects to set these itself
+            args.iteration = 0
+            args.consumed_train_samples = 0
+            args.consumed_valid_samples = 0
+
     # Model, optimizer, and learning rate.
     timers('model-and-optimizer-setup', log_level=0).start(barrier=True)
     app_metrics['app_build_optimizer_start_time'] = one_logger_utils.get_timestamp_in_ms()
@@ -307,28 +341,29 @@ def pretrain(
     app_metrics['app_build_optimizer_finish_time'] = one_logger_utils.get_timestamp_in_ms()
     config = get_model_config(model[0])
 
+    # Fall back to rebuilding the dataloaders if the checkpoint disagrees with the saved cursor.
+    if data_cursor is not None:
+        mismatch = torch.tensor(
+            [int(data_cursor != (args.iteration, args.consumed_train_samples,
+                                 args.consumed_valid_samples))],
+            dtype=torch.long, device='cuda')
+        torch.distributed.all_reduce(mismatch, op=torch.distributed.ReduceOp.MAX)
+        if mismatch.item():
+            print_rank_0('WARNING: the dataloader state does not match the checkpoint, '
+                         'rebuilding the dataloaders')
+            for data_iterator in data_iterators:
+                for chunk_iterator in (data_iterator if isinstance(data_iterator, list)
+                                       else [data_iterator]):
+                    if isinstance(chunk_iterator, StatefulDataLoader):
+                        chunk_iterator.close()
+            data_iterators = None
+
     # Data stuff.
-    app_metrics['app_build_dataiters_start_time'] = one_logger_utils.get_timestamp_in_ms()
-    timers('train/valid/test-data-iterators-setup', log_level=0).start(
-        barrier=True)
-    if args.virtual_pipeline_model_parallel_size is not None:
-        train_data_iterator = []
-        valid_data_iterator = []
-        test_data_iterator = []
-        for i in range(len(model)):
-            mpu.set_virtual_pipeline_model_parallel_rank(i)
-            iterators = build_train_valid_test_data_iterators(
-                train_valid_test_dataset_provider)
-            train_data_iterator.append(iterators[0])
-            valid_data_iterator.append(iterators[1])
-            test_data_iterator.append(iterators[2])
-    else:
-        train_data_iterator, valid_data_iterator, test_data_iterator \
-            = build_train_valid_test_data_iterators(
-                train_valid_test_dataset_provider)
-    timers('train/valid/test-data-iterators-setup').stop()
-    print_datetime('after dataloaders are built')
-    app_metrics['app_build_dataiters_finish_time'] = one_logger_utils.get_timestamp_in_ms()
+    if data_iterators is None:
+        app_metrics['app_build_dataiters_start_time'] = one_logger_utils.get_timestamp_in_ms()
+        data_iterators = build_data_iterators(train_valid_test_dataset_provider)
+        app_metrics['app_build_dataiters_finish_time'] = one_logger_utils.get_timestamp_in_ms()
+    train_data_iterator, valid_data_iterator, test_data_iterator = data_iterators
 
     # Track if training is enabled. Can only be done once args.do_train is assigned after dataloader is built.
     one_logger_utils.track_config_flags(args.train_iters, args.skip_train, args.do_train,
@@ -348,61 +383,65 @@ def pretrain(
     one_logger = get_one_logger()
     one_logger and one_logger.log_metrics(app_metrics)
 
-    if not args.skip_train:
-        print_rank_0('training ...')
-
-        if args.dataloader_type == 'cyclic' and args.retro_project_dir:
-            assert args.retro_cyclic_train_iters is not None
-            args.train_iters = args.retro_cyclic_train_iters
-            print_rank_0("retro cyclic train iters : %d" % args.train_iters)
+    # Record the checkpoint save phases until the end of training.
+    ckpt_profiler = CheckpointProfiler() if args.ckpt_profile_path is not None else nullcontext()
+    with ckpt_profiler:
+        if not args.skip_train:
+            print_rank_0('training ...')
+
+            if args.dataloader_type == 'cyclic' and args.retro_project_dir:
+                assert args.retro_cyclic_train_iters is not None
+                args.train_iters = args.retro_cyclic_train_iters
+                print_rank_0("retro cyclic train iters : %d" % args.train_iters)
+
+            iteration = 0
+            if args.do_train and args.train_iters > 0:
+                iteration, num_floating_point_operations_so_far = train(
+                    forward_step_func,
+                    model, optimizer, opt_param_scheduler,
+                    train_data_iterator, valid_data_iterator,
+                    process_non_loss_data_func, config, checkpointing_context,
+                    non_loss_data_func)
+
+            print_datetime('after training is done')
+
+            if args.save and iteration != 0 and iteration % args.save_interval != 0:
+                save_checkpoint(iteration, model, optimizer, opt_param_scheduler,
+                                num_floating_point_operations_so_far, checkpointing_context,
+                                train_data_iterator=train_data_iterator,
+                                ft_client=ft_integration.get_rank_monitor_client(
+                                    ft_integration.StateMachineActions.SAVE_CHECKPOINT))
+
+            one_logger and one_logger.log_metrics({
+                'app_train_loop_finish_time': one_logger_utils.get_timestamp_in_ms()
+            })
 
-        iteration = 0
-        if args.do_train and args.train_iters > 0:
-            iteration, num_floating_point_operations_so_far = train(
-                forward_step_func,
-                model, optimizer, opt_param_scheduler,
-                train_data_iterator, valid_data_iterator,
-                process_non_loss_data_func, config, checkpointing_context,
-                non_loss_data_func)
-
-        print_datetime('after training is done')
+        else:
+            print_rank_0('skipping training (--skip-train is on) ...')
 
-        if args.save and iteration != 0 and iteration % args.save_interval != 0:
-            save_checkpoint(iteration, model, optimizer, opt_param_scheduler,
-                            num_floating_point_operations_so_far, checkpointing_context,
-                            train_data_iterator=train_data_iterator,
-                            ft_client=ft_integration.get_rank_monitor_client(
-                                ft_integration.StateMachineActions.SAVE_CHECKPOINT))
+            iteration = args.iteration
 
-        one_logger and one_logger.log_metrics({
-            'app_train_loop_finish_time': one_logger_utils.get_timestamp_in_ms()
-        })
+        if args.do_valid:
+            prefix = f'iteration {iteration} on validation set'
+            evaluate_and_print_results(prefix, forward_step_func,
+                                       valid_data_iterator, model,
+                                       iteration, process_non_loss_data_func, config,
+                                       verbose=True, write_to_tensorboard=not args.skip_train,
+                                       non_loss_data_func=non_loss_data_func)
 
-    else:
-        print_rank_0('skipping training (--skip-train is on) ...')
-
-        iteration = args.iteration
-
-    if args.do_valid:
-        prefix = f'iteration {iteration} on validation set'
-        evaluate_and_print_results(prefix, forward_step_func,
-                                   valid_data_iterator, model,
-                                   iteration, process_non_loss_data_func, config,
-                                   verbose=True, write_to_tensorboard=not args.skip_train,
-                                   non_loss_data_func=non_loss_data_func)
-
-    if args.do_test:
-        prefix = f'iteration {iteration} on test set'
-        evaluate_and_print_results(prefix, forward_step_func,
-                                   test_data_iterator, model,
-                                   iteration, process_non_loss_data_func, config,
-                                   verbose=True, write_to_tensorboard=not args.skip_train,
-                                   non_loss_data_func=non_loss_data_func)
+        if args.do_test:
+            prefix = f'iteration {iteration} on test set'
+            evaluate_and_print_results(prefix, forward_step_func,
+                                       test_data_iterator, model,
+                                       iteration, process_non_loss_data_func, config,
+                                       verbose=True, write_to_tensorboard=not args.skip_train,
+                                       non_loss_data_func=non_loss_data_func)
 
-    wandb_writer = get_wandb_writer()
-    if wandb_writer:
-        wandb_writer.finish()
-    maybe_finalize_async_save(blocking=True)
+        wandb_writer = get_wandb_writer()
+        if wandb_writer:
+            wandb_writer.finish()
+        maybe_finalize_async_save(blocking=True, terminate=True)
+        save_checkpoint_profile()
 
     one_logger and one_logger.log_metrics({
         'app_finish_time': one_logger_utils.get_timestamp_in_ms()
@@ -1065,6 +1104,18 @@ def compute_throughputs_and_append_to_progress_log(iteration,
                            f"Tokens (in billions): {tokens_so_far / 10**9:.2f}")
 
 
+def save_checkpoint_profile():
+    """Write the checkpoint save phases recorded so far, see --ckpt-profile-path.
+
+    The write phases of async saves are recorded once the saves are finalized."""
+    args = get_args()
+    ckpt_profiler = get_checkpoint_profiler()
+    if args.ckpt_profile_path is None or ckpt_profiler is None:
+        return
+    if torch.distributed.get_rank() == 0:
+        ckpt_profiler.save(args.ckpt_profile_path)
+
+
 def save_checkpoint_and_time(iteration, model, optimizer, opt_param_scheduler,
                              num_floating_point_operations_so_far, checkpointing_context,
                              non_persistent_ckpt=False, train_data_iterator=None):
@@ -1091,6 +1142,7 @@ def save_checkpoint_and_time(iteration, model, optimizer, opt_param_scheduler,
         optimizer.enable_pre_hook()
     timers(timer_key).stop(barrier=True)
     timers.log([timer_key])
+    save_checkpoint_profile()
     save_checkpoint_finish_time = timers('save-checkpoint').active_time()
 
     # Log E2E metrics after save-checkpoint
@@ -1690,8 +1742,19 @@ def build_train_valid_test_data_loaders(
     if is_distributed or mpu.get_tensor_model_parallel_rank() == 0:
 
         # Build datasets.
-        train_ds, valid_ds, test_ds = build_train_valid_test_datasets(
-            build_train_valid_test_datasets_provider)
+        if args.data_profile_path is not None:
+            with DataProfiler() as data_profiler:
+                train_ds, valid_ds, test_ds = build_train_valid_test_datasets(
+                    build_train_valid_test_datasets_provider)
+            if torch.distributed.get_rank() == 0:
+                if train_ds is not None and args.data_profile_num_samples > 0:
+                    data_profiler.measure_throughput(
+                        "train", train_ds, args.data_profile_num_samples,
+                        args.num_workers, args.micro_batch_size)
+                data_profiler.save(args.data_profile_path)
+        else:
+            train_ds, valid_ds, test_ds = build_train_valid_test_datasets(
+                build_train_valid_test_datasets_provider)
         # Build dataloders.
         train_dataloader = build_pretraining_data_loader(
             train_ds, args.consumed_train_samples)
@@ -1721,6 +1784,35 @@ def build_train_valid_test_data_loaders(
     return train_dataloader, valid_dataloader, test_dataloader
 
 
+def build_data_iterators(build_train_valid_test_datasets_provider):
+    """Build the data iterators, one set per virtual pipeline model chunk if applicable."""
+
+    args = get_args()
+    timers = get_timers()
+
+    timers('train/valid/test-data-iterators-setup', log_level=0).start(
+        barrier=True)
+    if args.virtual_pipeline_model_parallel_size is not None:
+        train_data_iterator = []
+        valid_data_iterator = []
+        test_data_iterator = []
+        for i in range(args.virtual_pipeline_model_parallel_size):
+            mpu.set_virtual_pipeline_model_parallel_rank(i)
+            iterators = build_train_valid_test_data_iterators(
+                build_train_valid_test_datasets_provider)
+            train_data_iterator.append(iterators[0])
+            valid_data_iterator.append(iterators[1])
+            test_data_iterator.append(iterators[2])
+    else:
+        train_data_iterator, valid_data_iterator, test_data_iterator \
+            = build_train_valid_test_data_iterators(
+                build_train_valid_test_datasets_provider)
+    timers('train/valid/test-data-iterators-setup').stop()
+    print_datetime('after dataloaders are built')
+
+    return train_data_iterator, valid_data_iterator, test_data_iterator
+
+
 def build_train_valid_test_data_iterators(
         build_train_valid_test_datasets_provider):
     """Build pretraining data iterators."""
@@ -1738,7 +1830,10 @@ def build_train_valid_test_data_iterators(
 
     def _get_iterator(dataloader_type, dataloader):
         """Return dataset iterator."""
-        if dataloader_type == "single":
+        if isinstance(dataloader, StatefulDataLoader):
+            # Handles cycling itself, and starts prefetching right away
+            return dataloader.start()
+        elif dataloader_type == "single":
             return iter(dataloader)
         elif dataloader_type == "cyclic":
             return iter(cyclic_iter(dataloader))
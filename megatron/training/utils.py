@@ -1,6 +1,7 @@
 # Copyright (c) 2022, NVIDIA CORPORATION. All rights reserved.
 
 """General utilities."""
+import math
 import os
 import sys
 from datetime import datetime
@@ -36,6 +37,7 @@ from megatron.training import (
 )
 from megatron.core import DistributedDataParallel as DDP
 from megatron.core import mpu
+from megatron.core.num_microbatches_calculator import get_num_microbatches
 from megatron.core.tensor_parallel import param_is_not_tensor_parallel_duplicate
 from megatron.legacy.model import Float16Module
 from megatron.legacy.model.module import param_is_not_shared
@@ -299,10 +301,167 @@ def append_to_progress_log(string, barrier=True):
                     f"# GPUs: {num_gpus}\t{string}\n")
 
 
+class CoalescedBatchBroadcaster:
+    """Broadcast the fields of a batch from the source rank of a group with a single collective
+
+    The fields are laid out back to back, each aligned to 16 bytes, in one flat byte buffer. The
+    source rank copies the batch into the buffer, one broadcast sends it, and every rank returns
+    views of the buffer which are shaped and typed as the fields. The buffers are allocated once
+    and reused in a ring, so the views of a batch stay valid until num_buffers more batches are
+    broadcast. The ring can be resized in place with resize.
+
+    Args:
+        fields (List[Tuple[str, torch.dtype, Tuple[int, ...]]]): The name, dtype and shape of each field
+
+        device (torch.device): The device of the buffers
+
+        num_buffers (int): The number of buffers in the ring
+    """
+
+    _ALIGNMENT = 16
+
+    def __init__(self, fields, device, num_buffers):
+        self.layout = []
+        nbytes = 0
+        for name, dtype, shape in fields:
+            field_nbytes = math.prod(shape) * torch.empty((), dtype=dtype).element_size()
+            self.layout.append((name, dtype, shape, nbytes, field_nbytes))
+            nbytes += -(-field_nbytes // self._ALIGNMENT) * self._ALIGNMENT
+        self.nbytes = nbytes
+        self.device = device
+        self.buffers = [
+            torch.empty(nbytes, dtype=torch.uint8, device=device) for _ in range(num_buffers)
+        ]
+        self.next_buffer = 0
+
+    def resize(self, num_buffers):
+        """Resize the ring, keeping the buffers of the most recent batches
+
+        Args:
+            num_buffers (int): The new number of buffers in the ring
+        """
+        if num_buffers == len(self.buffers):
+            return
+        # From the oldest buffer to the most recent one
+        buffers = self.buffers[self.next_buffer:] + self.buffers[:self.next_buffer]
+        if num_buffers < len(buffers):
+            buffers = buffers[len(buffers) - num_buffers:]
+        else:
+            buffers = [
+                torch.empty(self.nbytes, dtype=torch.uint8, device=self.device)
+                for _ in range(num_buffers - len(buffers))
+            ] + buffers
+        self.buffers = buffers
+        self.next_buffer = 0
+
+    def broadcast(self, batch, src, group):
+        """Broadcast a batch
+
+        Args:
+            batch (Optional[Dict[str, torch.Tensor]]): The batch on the source rank, None elsewhere
+
+            src (int): The global rank of the source rank
+
+            group (torch.distributed.ProcessGroup): The group
+
+        Returns:
+            Dict[str, torch.Tensor]: The fields of the batch, as views of the buffer
+        """
+        buffer = self.buffers[self.next_buffer]
+        self.next_buffer = (self.next_buffer + 1) % len(self.buffers)
+        views = {
+            name: buffer[offset:offset + field_nbytes].view(dtype).view(shape)
+            for name, dtype, shape, offset, field_nbytes in self.layout
+        }
+        if batch is not None:
+            for name, view in views.items():
+                view.copy_(batch[name], non_blocking=True)
+        torch.distributed.broadcast(buffer, src, group=group)
+        return views
+
+
+_BATCH_BROADCASTERS = {}
+
+
+def _get_num_batch_buffers(args, num_microbatches):
+    """The number of batch buffers to keep the batches of in-flight micro-batches valid
+
+    Every model chunk gets its batch, and the embedding keeps its inputs for the backward pass.
+    The interleaved 1F1B schedule runs up to vpp * pp + pp - 1 forward passes ahead of their
+    backward passes, and never more than the vpp * num_microbatches of an iteration.
+    """
+    vpp = args.virtual_pipeline_model_parallel_size or 1
+    pp = args.pipeline_model_parallel_size
+    return min(vpp * pp + pp - 1, vpp * num_microbatches) + 1
+
+
+_POSITION_IDS = {}
+
+
+def _get_batch_on_this_tp_rank_coalesced(data_iterator, args):
+    """get_batch_on_this_tp_rank with a single broadcast per micro-batch
+
+    See CoalescedBatchBroadcaster. The position ids are not broadcast unless they are reset at
+    document boundaries, as every rank can build them locally.
+    """
+    device = torch.cuda.current_device()
+    shape = (args.micro_batch_size, args.seq_length)
+    fields = {
+        'tokens': (torch.int64, shape),
+        'labels': (torch.int64, shape),
+        'loss_mask': (torch.float32, shape),
+        'attention_mask': (torch.bool, (args.micro_batch_size, 1, args.seq_length, args.seq_length)),
+        'position_ids': (torch.int64, shape),
+    }
+    if args.pipeline_model_parallel_size == 1:
+        names = ['tokens', 'labels', 'loss_mask', 'attention_mask', 'position_ids']
+    elif mpu.is_pipeline_first_stage():
+        names = ['tokens', 'attention_mask', 'position_ids']
+    elif mpu.is_pipeline_last_stage():
+        names = ['labels', 'loss_mask', 'attention_mask']
+    else:
+        names = []
+    if not args.create_attention_mask_in_dataloader:
+        names = [name for name in names if name != 'attention_mask']
+    # The position ids restart at every document with --reset-position-ids and --sequence-packing
+    derive_position_ids = (
+        'position_ids' in names and not args.reset_position_ids and args.sequence_packing is None)
+    if derive_position_ids:
+        names.remove('position_ids')
+
+    # Enough buffers for the micro-batches which may be in flight at once. Their number changes
+    # with the batch size rampup, so the ring is resized rather than replaced.
+    num_buffers = _get_num_batch_buffers(args, get_num_microbatches())
+    key = (tuple(names), shape)
+    if key not in _BATCH_BROADCASTERS:
+        # Free the buffers of a stale layout
+        _BATCH_BROADCASTERS.clear()
+        _BATCH_BROADCASTERS[key] = CoalescedBatchBroadcaster(
+            [(name, *fields[name]) for name in names], device, num_buffers)
+    _BATCH_BROADCASTERS[key].resize(num_buffers)
+
+    data = None
+    if mpu.get_tensor_model_parallel_rank() == 0 and data_iterator is not None:
+        data = next(data_iterator)
+    batch = dict.fromkeys(fields)
+    batch.update(_BATCH_BROADCASTERS[key].broadcast(
+        data, mpu.get_tensor_model_parallel_src_rank(), mpu.get_tensor_model_parallel_group()))
+
+    if derive_position_ids:
+        if shape not in _POSITION_IDS:
+            _POSITION_IDS[shape] = torch.arange(
+                args.seq_length, dtype=torch.int64, device=device).repeat(args.micro_batch_size, 1)
+        batch['position_ids'] = _POSITION_IDS[shape]
+    return batch
+
+
 def get_batch_on_this_tp_rank(data_iterator):
 
     args = get_args()
 
+    if args.coalesced_batch_broadcast:
+        return _get_batch_on_this_tp_rank_coalesced(data_iterator, args)
+
     def _broadcast(item):
        if item is not None:
            torch.distributed.broadcast(item, mpu.get_tensor_model_parallel_src_rank(), group=mpu.get_tensor_model_parallel_group())
@@ -215,14 +215,20 @@ def core_gpt_dataset_config_from_args(args):
             get_blend_from_list(args.test_data_path)
         ],
         renormalize_blend_weights=args.renormalize_blend_weights,
+        closed_form_blending=args.closed_form_blending,
         split=args.split,
         num_dataset_builder_threads=args.num_dataset_builder_threads,
+        num_dataset_builder_processes=args.num_dataset_builder_processes,
         path_to_cache=args.data_cache_path,
+        consolidate_cached_indices=args.consolidate_cached_indices,
         mmap_bin_files=args.mmap_bin_files,
+        mmap_pool_capacity=args.mmap_pool_capacity,
         tokenizer=tokenizer,
         reset_position_ids=args.reset_position_ids,
         reset_attention_mask=args.reset_attention_mask,
         eod_mask_loss=args.eod_mask_loss,
+        sequence_packing=args.sequence_packing,
+        use_document_keep_masks=args.use_document_keep_masks,
         create_attention_mask=args.create_attention_mask_in_dataloader,
         s3_cache_path = args.s3_cache_path
     )
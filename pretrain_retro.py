@@ -190,6 +190,7 @@ def train_valid_test_datasets_provider(train_valid_test_num_samples):
             get_blend_from_list(args.test_data_path)
         ],
         renormalize_blend_weights=args.renormalize_blend_weights,
+        closed_form_blending=args.closed_form_blending,
         split=args.split,
         split_preprocessing=retro_config.retro_split_preprocessing,
         path_to_cache=args.data_cache_path,
@@ -220,6 +220,7 @@ def train_valid_test_datasets_provider(train_val_test_num_samples: int):
             get_blend_from_list(args.test_data_path)
         ],
         renormalize_blend_weights=args.renormalize_blend_weights,
+        closed_form_blending=args.closed_form_blending,
         split=args.split,
         path_to_cache=args.data_cache_path,
         tokenizer=tokenizer,
@@ -99,7 +99,8 @@ setuptools.setup(
             "megatron.core.datasets.helpers",
             sources=["megatron/core/datasets/helpers.cpp"],
             language="c++",
-            extra_compile_args=extra_compile_args,
+            extra_compile_args=extra_compile_args + ["-pthread"],
+            extra_link_args=["-pthread"],
         )
     ],
     # Add in any packaged data.
@@ -6,6 +6,7 @@ from types import ModuleType, SimpleNamespace
 from typing import Any, Dict
 
 import nltk
+import numpy
 import pytest
 
 try:
@@ -19,10 +20,13 @@ except ModuleNotFoundError:
 
 from megatron.core.datasets.indexed_dataset import (
     IndexedDataset,
+    IndexedDatasetBuilder,
     S3Config,
     _FileBinReader,
     _MMapBinReader,
     _S3BinReader,
+    get_bin_path,
+    get_idx_path,
 )
 from megatron.core.datasets.utils_s3 import S3_PREFIX, S3Client
 from tests.unit_tests.data.test_preprocess_data import (
@@ -62,7 +66,8 @@ class _LocalClient(S3Client):
 
         with open(filename, mode='rb', buffering=0) as bin_buffer_file:
             bin_buffer_file.seek(_range_beg)
-            _bytes = bin_buffer_file.read(_range_end - _range_beg)
+            # Add 1, because the end of Range is inclusive.
+            _bytes = bin_buffer_file.read(_range_end - _range_beg + 1)
 
         response = {"Body": SimpleNamespace(read=lambda: _bytes)}
 
@@ -159,6 +164,81 @@ def test_bin_reader():
                 assert (indexed_dataset_s3[idx] == indexed_dataset_file[idx]).all()
                 assert (indexed_dataset_s3[idx] == indexed_dataset_mmap[idx]).all()
 
+            offsets = [
+                random.randint(0, indexed_dataset_mmap.sequence_lengths[idx] - 1) for idx in indices
+            ]
+            lengths = [
+                random.randint(0, indexed_dataset_mmap.sequence_lengths[idx] - offset)
+                for idx, offset in zip(indices, offsets)
+            ]
+            segments = numpy.concatenate(
+                [
+                    indexed_dataset_file.get(idx, offset=offset, length=length)
+                    for idx, offset, length in zip(indices, offsets, lengths)
+                ]
+            )
+            for indexed_dataset in [indexed_dataset_file, indexed_dataset_mmap, indexed_dataset_s3]:
+                assert (indexed_dataset.get_segments(indices, offsets, lengths) == segments).all()
+
+
+def test_s3_bin_reader_prefetch():
+    numpy.random.seed(0)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        prefix = os.path.join(temp_dir, "data")
+        builder = IndexedDatasetBuilder(get_bin_path(prefix), dtype=numpy.uint16)
+        for _ in range(1000):
+            length = numpy.random.randint(1, 200)
+            builder.add_document(numpy.random.randint(0, 60000, size=length), [length])
+        builder.finalize(get_idx_path(prefix))
+
+        path_to_s3_cache = os.path.join(temp_dir, "s3_cache")
+        os.mkdir(path_to_s3_cache)
+
+        indexed_dataset_mmap = IndexedDataset(prefix, multimodal=False, mmap=True)
+        indexed_dataset_s3 = IndexedDataset(
+            S3_PREFIX + prefix,
+            multimodal=False,
+            mmap=False,
+            s3_config=S3Config(
+                path_to_idx_cache=path_to_s3_cache,
+                bin_chunk_nbytes=1000,
+                bin_cache_nchunks=16,
+                bin_prefetch_threads=4,
+            ),
+        )
+        bin_reader = indexed_dataset_s3.bin_reader
+        # Only the S3 reads benefit from prefetch hints
+        assert indexed_dataset_s3.benefits_from_prefetch
+        assert not indexed_dataset_mmap.benefits_from_prefetch
+
+        indices = numpy.random.permutation(len(indexed_dataset_mmap))
+
+        # Blocking reads, some of which span several blocks
+        for idx in indices[:100]:
+            assert (indexed_dataset_s3[idx] == indexed_dataset_mmap[idx]).all()
+        statistics = bin_reader.get_statistics()
+        assert statistics["misses"] > 0
+        assert statistics["requests"] <= statistics["misses"]
+
+        # Prefetched reads
+        for i in range(100, len(indices), 8):
+            batch = indices[i : i + 8]
+            indexed_dataset_s3.prefetch(indices[i + 8 : i + 16])
+            offsets = numpy.zeros(len(batch), dtype=numpy.int64)
+            lengths = indexed_dataset_mmap.sequence_lengths[batch]
+            assert (
+                indexed_dataset_s3.get_segments(batch, offsets, lengths)
+                == indexed_dataset_mmap.get_segments(batch, offsets, lengths)
+            ).all()
+        prefetched_statistics = bin_reader.get_statistics()
+        assert (
+            prefetched_statistics["hits"] + prefetched_statistics["prefetch_hits"]
+            > statistics["hits"] + statistics["prefetch_hits"]
+        )
+        assert prefetched_statistics["mean_latency"] > 0
+
 
 if __name__ == "__main__":
     test_bin_reader()
+    test_s3_bin_reader_prefetch()
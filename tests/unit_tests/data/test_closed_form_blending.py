@@ -0,0 +1,62 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import numpy
+
+from megatron.core.datasets.blended_dataset import _ClosedFormBlendingIndex
+
+
+def _build_reference(weights, size):
+    """Sort enough of the keys of every dataset by (key, dataset id)"""
+    keys, dataset_ids, dataset_sample_ids = [], [], []
+    for dataset_id, weight in enumerate(weights):
+        sample_ids = numpy.arange(int(size * weight) + len(weights) + 2)
+        keys.append((sample_ids + 0.5) / weight)
+        dataset_ids.append(numpy.full(len(sample_ids), dataset_id))
+        dataset_sample_ids.append(sample_ids)
+    keys, dataset_ids, dataset_sample_ids = map(
+        numpy.concatenate, [keys, dataset_ids, dataset_sample_ids]
+    )
+    order = numpy.lexsort((dataset_ids, keys))[:size]
+    return dataset_ids[order], dataset_sample_ids[order]
+
+
+def test_closed_form_blending():
+    numpy.random.seed(0)
+
+    size = 10000
+    for num_datasets in [1, 2, 7, 64]:
+        for weights in [
+            numpy.random.rand(num_datasets) ** 4 + 1e-3,
+            numpy.ones(num_datasets),
+            numpy.arange(1, num_datasets + 1),
+        ]:
+            weights = (weights / weights.sum()).tolist()
+            index = _ClosedFormBlendingIndex(weights, size)
+
+            dataset_ids, dataset_sample_ids = index[numpy.arange(size)]
+            dataset_ids_reference, dataset_sample_ids_reference = _build_reference(weights, size)
+            assert numpy.array_equal(dataset_ids, dataset_ids_reference)
+            assert numpy.array_equal(dataset_sample_ids, dataset_sample_ids_reference)
+
+            # Every dataset draws its share of the samples
+            counts = index.get_sample_counts()
+            assert numpy.array_equal(counts, numpy.bincount(dataset_ids, minlength=num_datasets))
+            assert numpy.all(numpy.abs(counts - size * numpy.array(weights)) <= num_datasets)
+
+            # Scalar and out of order lookups
+            for idx in numpy.random.randint(0, size, size=16):
+                dataset_id, dataset_sample_id = index[int(idx)]
+                assert dataset_id == dataset_ids[idx]
+                assert dataset_sample_id == dataset_sample_ids[idx]
+            assert index[-1][0] == dataset_ids[-1]
+
+    # A blend far too large to materialize
+    index = _ClosedFormBlendingIndex([0.25, 0.75], 10**15)
+    counts = index.get_sample_counts()
+    assert numpy.array_equal(counts, [0.25 * 10**15, 0.75 * 10**15])
+    dataset_id, dataset_sample_id = index[10**15 - 1]
+    assert dataset_sample_id == counts[dataset_id] - 1
+
+
+if __name__ == "__main__":
+    test_closed_form_blending()
@@ -0,0 +1,82 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import os
+import tempfile
+
+import numpy
+
+from megatron.core.datasets.blended_megatron_dataset_builder import BlendedMegatronDatasetBuilder
+from megatron.core.datasets.data_profiler import DataProfiler, get_data_profiler
+from megatron.core.datasets.gpt_dataset import GPTDataset, GPTDatasetConfig
+from megatron.core.datasets.indexed_dataset import IndexedDatasetBuilder, get_bin_path, get_idx_path
+from megatron.core.datasets.utils import compile_helpers
+from megatron.training.tokenizer.tokenizer import _NullTokenizer
+
+
+def build_dataset(path_prefix, num_documents):
+    builder = IndexedDatasetBuilder(get_bin_path(path_prefix), dtype=numpy.uint16)
+    for _ in range(num_documents):
+        document = numpy.random.randint(0, 1000, size=numpy.random.randint(10, 100))
+        builder.add_document(document, [len(document)])
+    builder.finalize(get_idx_path(path_prefix))
+
+
+def test_data_profiler():
+    numpy.random.seed(0)
+    compile_helpers()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path_prefixes = [os.path.join(temp_dir, f"dataset_{i}") for i in range(2)]
+        for path_prefix in path_prefixes:
+            build_dataset(path_prefix, 100)
+
+        config = GPTDatasetConfig(
+            random_seed=1234,
+            sequence_length=32,
+            blend=([path_prefixes[0], path_prefixes[1]], [0.5, 0.5]),
+            split="9,1,0",
+            path_to_cache=os.path.join(temp_dir, "cache"),
+            reset_position_ids=False,
+            reset_attention_mask=False,
+            eod_mask_loss=False,
+            tokenizer=_NullTokenizer(vocab_size=1000),
+        )
+
+        reports = []
+        for _ in range(2):
+            with DataProfiler() as profiler:
+                assert get_data_profiler() is profiler
+                datasets = BlendedMegatronDatasetBuilder(
+                    GPTDataset, [100, 10, 0], lambda: True, config
+                ).build()
+            assert get_data_profiler() is None
+            reports.append(profiler.report())
+
+        # Every phase is timed per dataset and split, and the cache hits are recorded
+        for report, cache_hit in zip(reports, [False, True]):
+            assert report["phases"]["build_low_level_dataset"]["count"] == 2
+            assert report["phases"]["build_indices"]["count"] == 4
+            assert report["phases"]["build_blended_indices"]["count"] == 2
+            keys = set()
+            for record in report["records"]:
+                assert record["seconds"] >= 0
+                if record["phase"] != "build_low_level_dataset":
+                    assert record["cache_hit"] == cache_hit
+                    keys.add((record["dataset"], record["split"]))
+            assert keys == {
+                (path_prefixes[0], "train"),
+                (path_prefixes[0], "valid"),
+                (path_prefixes[1], "train"),
+                (path_prefixes[1], "valid"),
+                (None, "train"),
+                (None, "valid"),
+            }
+
+        throughput = profiler.measure_throughput("train", datasets[0], 20, batch_size=4)
+        assert throughput["num_samples"] == 20
+        assert throughput["first_batch_seconds"] <= throughput["seconds"]
+        assert profiler.report()["throughput"] == {"train": throughput}
+
+
+if __name__ == "__main__":
+    test_data_profiler()
@@ -0,0 +1,52 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+from types import SimpleNamespace
+
+import pytest
+
+# The data samplers can only be imported after megatron.training
+import megatron.training
+from megatron.legacy.data import data_samplers
+from megatron.legacy.data.data_samplers import (
+    MegatronPretrainingRandomSampler,
+    MegatronPretrainingSampler,
+)
+
+
+def test_sampler_prefetch_hints():
+    dataset = list(range(40))
+    for sampler_class, sampler_args in [
+        (MegatronPretrainingSampler, (40, 0, 4, 0, 2)),
+        (MegatronPretrainingRandomSampler, (dataset, 40, 0, 4, 0, 2, True)),
+    ]:
+        batches = list(sampler_class(*sampler_args))
+        hinted = list(sampler_class(*sampler_args, prefetch_lookahead=2))
+        assert hinted == batches
+        # Every batch hints at the next batch of the same dataloader worker, of two
+        assert [batch.upcoming for batch in hinted] == batches[2:] + [[], []]
+
+
+class _Dataset(list):
+    def __init__(self, benefits_from_prefetch):
+        super().__init__(range(40))
+        self.benefits_from_prefetch = benefits_from_prefetch
+
+    def prefetch(self, indices):
+        pass
+
+
+@pytest.mark.parametrize("benefits_from_prefetch", [False, True])
+def test_prefetch_lookahead_only_if_it_benefits(monkeypatch, benefits_from_prefetch):
+    args = SimpleNamespace(
+        dataloader_type="single", micro_batch_size=4, num_workers=0, stateful_dataloader=False
+    )
+    monkeypatch.setattr(data_samplers, "get_args", lambda: args)
+    monkeypatch.setattr(data_samplers.mpu, "get_data_parallel_rank", lambda: 0)
+    monkeypatch.setattr(data_samplers.mpu, "get_data_parallel_world_size", lambda: 2)
+
+    dataloader = data_samplers.build_pretraining_data_loader(_Dataset(benefits_from_prefetch), 0)
+    # Local memory mapped data gets no hints, and no per-batch lookahead
+    assert dataloader.batch_sampler.prefetch_lookahead == int(benefits_from_prefetch)
+    assert all(
+        hasattr(batch, "upcoming") == benefits_from_prefetch for batch in dataloader.batch_sampler
+    )
@@ -0,0 +1,132 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import os
+import tempfile
+
+import numpy
+
+from megatron.core.datasets.decontamination import (
+    DecontaminationConfig,
+    NgramIndex,
+    count_ngram_documents,
+    decontaminate_indexed_dataset,
+)
+from megatron.core.datasets.indexed_dataset import (
+    IndexedDataset,
+    IndexedDatasetBuilder,
+    get_bin_path,
+    get_idx_path,
+)
+
+
+def build_dataset(path_prefix, documents):
+    builder = IndexedDatasetBuilder(get_bin_path(path_prefix), dtype=numpy.uint16)
+    for sequences in documents:
+        builder.add_document(
+            numpy.concatenate(sequences), [len(sequence) for sequence in sequences]
+        )
+    builder.finalize(get_idx_path(path_prefix))
+
+
+def test_ngram_index():
+    config = DecontaminationConfig(min_ngram_size=3, max_ngram_size=5)
+    task = numpy.array([1, 2, 3, 4, 5, 6])
+    index = NgramIndex.build([task, numpy.array([7, 8, 9]), numpy.array([7, 8])], config)
+    assert sorted(index.hashes) == [3, 5]
+    assert len(index) == 2 + 1
+
+    tokens = numpy.array([0, 1, 2, 3, 4, 5, 7, 8, 9, 2, 3, 4, 5, 6])
+    window_ends = numpy.full(len(tokens), len(tokens))
+    matches = {length: starts.tolist() for length, starts, _ in index.match(tokens, window_ends)}
+    assert matches == {3: [6], 5: [1, 9]}
+
+    # Windows may not extend past their window end
+    window_ends[:9] = 9
+    matches = {length: starts.tolist() for length, starts, _ in index.match(tokens, window_ends)}
+    assert matches == {3: [6], 5: [1, 9]}
+    window_ends[:9] = 8
+    matches = {length: starts.tolist() for length, starts, _ in index.match(tokens, window_ends)}
+    assert matches == {5: [1, 9]}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "index.npz")
+        index.save(path)
+        loaded = NgramIndex.load(path)
+        assert loaded.hashes.keys() == index.hashes.keys()
+        for length in index.hashes:
+            assert numpy.array_equal(loaded.hashes[length], index.hashes[length])
+
+
+def test_decontaminate_indexed_dataset():
+    numpy.random.seed(0)
+
+    task = numpy.random.randint(1000, 2000, size=20, dtype=numpy.uint16)
+    common = numpy.random.randint(1000, 2000, size=13, dtype=numpy.uint16)
+
+    def random_tokens(size):
+        return numpy.random.randint(0, 1000, size=size, dtype=numpy.uint16)
+
+    documents = [
+        # Untouched, in two sequences
+        [random_tokens(100), random_tokens(50)],
+        # Cut in the middle into two pieces of 100 tokens
+        [numpy.concatenate([random_tokens(110), task[:13], random_tokens(110)])],
+        # Cut at the start, leaving a piece which is too short
+        [numpy.concatenate([task[5:18], random_tokens(15)])],
+        # Cut into too many pieces
+        [
+            numpy.concatenate(
+                [x for _ in range(4) for x in [random_tokens(50), task[3:16]]] + [random_tokens(50)]
+            )
+        ],
+        # Untouched, as the match spans two documents
+        [task[:6]],
+        [task[6:13]],
+    ]
+    documents += [[numpy.concatenate([random_tokens(10), common])] for _ in range(10)]
+
+    config = DecontaminationConfig(
+        min_ngram_size=8,
+        max_ngram_size=13,
+        remove_tokens_each_side=10,
+        min_piece_tokens=20,
+        max_pieces=4,
+        max_tokens_per_batch=64,
+    )
+    index = NgramIndex.build([task, common], config)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path_prefix = os.path.join(temp_dir, "train")
+        build_dataset(path_prefix, documents)
+
+        # The common n-gram occurs in too many documents to be evidence of contamination
+        counts = count_ngram_documents([path_prefix], index, config)
+        index = index.prune(counts, 10)
+        assert len(index) == len(task) - 13 + 1
+
+        for num_workers in [1, 2]:
+            config.num_workers = num_workers
+            output_prefix = os.path.join(temp_dir, f"output_{num_workers}")
+            statistics = decontaminate_indexed_dataset(path_prefix, output_prefix, index, config)
+            assert statistics["documents"] == len(documents)
+            assert statistics["cut_documents"] == 3
+            assert statistics["dropped_documents"] == 2
+            assert statistics["output_documents"] == len(documents) - 3 + 2
+
+            output = IndexedDataset(output_prefix)
+            assert numpy.array_equal(
+                output.document_indices, [0, 2, 3, 4, 5, 6] + list(range(7, 17))
+            )
+            assert numpy.array_equal(output[0], documents[0][0])
+            assert numpy.array_equal(output[1], documents[0][1])
+            assert numpy.array_equal(output[2], documents[1][0][:100])
+            assert numpy.array_equal(output[3], documents[1][0][-100:])
+            assert numpy.array_equal(output[4], task[:6])
+            assert numpy.array_equal(output[5], task[6:13])
+            for i in range(10):
+                assert numpy.array_equal(output[6 + i], documents[6 + i][0])
+
+
+if __name__ == "__main__":
+    test_ngram_index()
+    test_decontaminate_indexed_dataset()
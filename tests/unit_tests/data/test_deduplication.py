@@ -0,0 +1,141 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import os
+import tempfile
+
+import numpy
+import torch
+
+from megatron.core.datasets.deduplication import (
+    DeduplicationConfig,
+    MinHasher,
+    _find,
+    _union,
+    deduplicate_indexed_datasets,
+    get_document_keep_mask_path,
+    load_document_keep_mask,
+)
+from megatron.core.datasets.gpt_dataset import GPTDataset, GPTDatasetConfig
+from megatron.core.datasets.indexed_dataset import (
+    IndexedDataset,
+    IndexedDatasetBuilder,
+    get_bin_path,
+    get_idx_path,
+)
+from megatron.core.datasets.utils import Split, compile_helpers
+from megatron.training.tokenizer.tokenizer import _NullTokenizer
+
+
+def build_dataset(path_prefix, documents):
+    builder = IndexedDatasetBuilder(get_bin_path(path_prefix), dtype=numpy.uint16)
+    for document in documents:
+        # Split every document into two sequences to exercise the document index
+        split = len(document) // 2
+        builder.add_item(torch.from_numpy(document[:split]))
+        builder.add_item(torch.from_numpy(document[split:]))
+        builder.end_document()
+    builder.finalize(get_idx_path(path_prefix))
+
+
+def test_minhash_signatures():
+    config = DeduplicationConfig(ngram_size=3, num_bands=4, rows_per_band=2)
+    minhasher = MinHasher(config)
+
+    numpy.random.seed(0)
+    documents = [numpy.random.randint(0, 100, size=size) for size in [10, 1, 0, 3, 50, 2]]
+    tokens = numpy.concatenate(documents)
+    document_lengths = numpy.array([len(document) for document in documents])
+    shingles, num_shingles = minhasher.shingle(tokens, document_lengths)
+    assert num_shingles.tolist() == [8, 1, 0, 1, 48, 1]
+
+    # The shingles are the same whether a document is shingled alone or in a batch
+    offsets = numpy.concatenate(([0], numpy.cumsum(num_shingles)))
+    for i, document in enumerate(documents):
+        shingles_alone, _ = minhasher.shingle(document, numpy.array([len(document)]))
+        assert numpy.array_equal(shingles[offsets[i] : offsets[i + 1]], shingles_alone)
+
+    signatures = minhasher.signatures(shingles, num_shingles)
+    assert signatures.shape == (len(documents), config.num_permutations)
+    for i in range(len(documents)):
+        x = shingles[offsets[i] : offsets[i + 1]]
+        reference = [
+            min([((int(a) * int(s) + int(b)) % 2**64) >> 32 for s in x], default=2**32 - 1)
+            for a, b in zip(minhasher.a, minhasher.b)
+        ]
+        assert signatures[i].tolist() == reference
+
+    keys = minhasher.band_keys(signatures)
+    assert keys.shape == (len(documents), config.num_bands)
+    assert len(numpy.unique(keys[0])) == config.num_bands
+
+
+def test_union_find():
+    parent = numpy.arange(10, dtype=numpy.int64)
+    _union(parent, numpy.array([9, 3, 7, 5]), numpy.array([7, 4, 3, 8]))
+    roots = _find(parent, numpy.arange(10))
+    assert roots.tolist() == [0, 1, 2, 3, 3, 5, 6, 3, 5, 3]
+
+
+def test_deduplicate_indexed_datasets():
+    numpy.random.seed(0)
+
+    originals = [numpy.random.randint(0, 60000, size=256, dtype=numpy.uint16) for _ in range(64)]
+    near_duplicates = []
+    for original in originals[:16]:
+        near_duplicate = original.copy()
+        near_duplicate[numpy.random.randint(0, 256)] = numpy.random.randint(0, 60000)
+        near_duplicates.append(near_duplicate)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path_prefixes = [os.path.join(temp_dir, "first"), os.path.join(temp_dir, "second")]
+        build_dataset(path_prefixes[0], originals[:40] + [originals[0]])
+        build_dataset(path_prefixes[1], originals[40:] + near_duplicates)
+
+        for num_workers in [1, 2]:
+            config = DeduplicationConfig(
+                num_partitions=3, max_tokens_per_batch=1000, num_workers=num_workers
+            )
+            work_dir = os.path.join(temp_dir, "work")
+            keep_masks = deduplicate_indexed_datasets(path_prefixes, work_dir, config)
+            assert os.listdir(work_dir) == []
+
+            assert keep_masks[0].tolist() == [True] * 40 + [False]
+            assert keep_masks[1].tolist() == [True] * 24 + [False] * 16
+
+            for path_prefix, keep_mask in zip(path_prefixes, keep_masks):
+                assert os.path.exists(get_document_keep_mask_path(path_prefix))
+                keep, _ = load_document_keep_mask(path_prefix, len(keep_mask))
+                assert numpy.array_equal(keep, keep_mask)
+
+        # The GPTDataset drops both sequences of every duplicate document
+        compile_helpers()
+        indexed_dataset = IndexedDataset(path_prefixes[1])
+        hashes = []
+        for use_document_keep_masks in [False, True]:
+            config = GPTDatasetConfig(
+                random_seed=1234,
+                sequence_length=64,
+                split="1,0,0",
+                reset_position_ids=False,
+                reset_attention_mask=False,
+                eod_mask_loss=False,
+                use_document_keep_masks=use_document_keep_masks,
+                tokenizer=_NullTokenizer(vocab_size=60000),
+            )
+            dataset = GPTDataset(
+                indexed_dataset,
+                path_prefixes[1],
+                numpy.arange(len(indexed_dataset), dtype=numpy.int32),
+                None,
+                Split.train,
+                config,
+            )
+            hashes.append(dataset.unique_description_hash)
+        assert numpy.array_equal(dataset.indices, numpy.arange(48))
+        assert len(set(hashes)) == 2
+
+
+if __name__ == "__main__":
+    test_minhash_signatures()
+    test_union_find()
+    test_deduplicate_indexed_datasets()
@@ -9,7 +9,13 @@ import pytest
 import torch
 
 from megatron.core.datasets.blended_megatron_dataset_builder import BlendedMegatronDatasetBuilder
-from megatron.core.datasets.gpt_dataset import GPTDatasetConfig, MockGPTDataset
+from megatron.core.datasets.gpt_dataset import (
+    GPTDatasetConfig,
+    MockGPTDataset,
+    _get_cu_seqlens,
+    _get_ltor_masks_and_position_ids,
+    _get_packed_masks_and_position_ids,
+)
 from megatron.core.datasets.utils import compile_helpers
 from megatron.training.tokenizer.tokenizer import _NullTokenizer
 from tests.unit_tests.test_utilities import Utils
@@ -70,6 +76,25 @@ def test_mock_gpt_dataset():
     subset_1B = sample_N(datasets[0], N, randomize=True)
     assert not numpy.allclose(subset_1A, subset_1B)
 
+    # Check batched retrieval against single retrieval
+    indices = [random.randint(0, len(datasets[0]) - 1) for _ in range(N)] + [None]
+    for idx, sample in zip(indices, datasets[0].__getitems__(indices)):
+        sample_ref = datasets[0][idx]
+        assert sample.keys() == sample_ref.keys()
+        assert all(torch.equal(sample[key], sample_ref[key]) for key in sample)
+
+    # The mock data is in memory, so no sampler computes prefetch hints for it
+    assert not datasets[0].benefits_from_prefetch
+
+    # Check the prefetch of the upcoming batch hinted by a sampler, see BatchWithUpcoming
+    class BatchWithUpcoming(list):
+        upcoming = indices[2:4]
+
+    prefetched = []
+    datasets[0].prefetch = prefetched.append
+    datasets[0].__getitems__(BatchWithUpcoming(indices[:2]))
+    assert prefetched == [indices[2:4]]
+
     config = GPTDatasetConfig(
         random_seed=1234,
         sequence_length=1024,
@@ -108,5 +133,91 @@ def test_mock_gpt_dataset():
     assert not torch.any(sample['loss_mask'])
 
 
+def test_ltor_masks_and_position_ids():
+    eod = 0
+    data = torch.tensor([5, 6, eod, 7, eod, eod, 8, 9])
+
+    attention_mask, loss_mask, position_ids = _get_ltor_masks_and_position_ids(
+        data, eod, True, True, True, True
+    )
+
+    assert torch.equal(position_ids, torch.tensor([0, 1, 2, 0, 1, 0, 0, 1]))
+    assert torch.equal(loss_mask, (data != eod).float())
+
+    document_ids = torch.tensor([0, 0, 0, 1, 1, 2, 3, 3])
+    attend = torch.tril(document_ids.unsqueeze(0) == document_ids.unsqueeze(1))
+    assert torch.equal(attention_mask, ~attend.unsqueeze(0))
+
+    cu_seqlens = _get_cu_seqlens(data, eod)
+    assert torch.equal(cu_seqlens[:5], torch.tensor([0, 3, 5, 6, 8], dtype=torch.int32))
+    assert torch.all(cu_seqlens[5:] == -1)
+
+
+def test_packed_masks_and_position_ids():
+    eod = 0
+    data = torch.tensor([5, 6, eod, 7, 8, 9, -1, -1])
+
+    attention_mask, loss_mask, position_ids, cu_seqlens = _get_packed_masks_and_position_ids(
+        data, numpy.array([3, 1, 2]), eod, True, True
+    )
+
+    assert torch.equal(position_ids, torch.tensor([0, 1, 2, 0, 0, 1, 0, 1]))
+    # No loss on the EOD, nor on the last token of every document
+    assert torch.equal(loss_mask, torch.tensor([1, 1, 0, 0, 1, 0, 1, 1]).float())
+    assert torch.equal(cu_seqlens[:5], torch.tensor([0, 3, 4, 6, 8], dtype=torch.int32))
+    assert torch.all(cu_seqlens[5:] == -1)
+
+    document_ids = torch.tensor([0, 0, 0, 1, 2, 2, 3, 3])
+    attend = torch.tril(document_ids.unsqueeze(0) == document_ids.unsqueeze(1))
+    assert torch.equal(attention_mask, ~attend.unsqueeze(0))
+
+
+def test_packed_mock_gpt_dataset():
+    compile_helpers()
+
+    tokenizer = _NullTokenizer(vocab_size=_MOCK_VOCAB_SIZE)
+
+    for sequence_packing in ["first-fit-decreasing", "best-fit"]:
+        config = GPTDatasetConfig(
+            random_seed=1234,
+            sequence_length=1024,
+            split="990,9,1",
+            reset_position_ids=False,
+            reset_attention_mask=False,
+            eod_mask_loss=False,
+            create_attention_mask=False,
+            sequence_packing=sequence_packing,
+            tokenizer=tokenizer,
+        )
+
+        datasets = BlendedMegatronDatasetBuilder(
+            MockGPTDataset, [1000, None, None], lambda: True, config
+        ).build()
+        dataset = datasets[0]
+        assert len(dataset) >= 1000
+
+        # Every document of an epoch is packed, whole or truncated, exactly once
+        assert sorted(dataset.document_index) == sorted(dataset.indices)
+
+        num_tokens = 0
+        for idx in range(len(dataset)):
+            sample = dataset[idx]
+            cu_seqlens = sample["cu_seqlens"][sample["cu_seqlens"] >= 0]
+            for beg, end in zip(cu_seqlens[:-1].tolist(), cu_seqlens[1:].tolist()):
+                assert torch.equal(sample["position_ids"][beg:end], torch.arange(end - beg))
+            # The mock documents count up from 1 to their EOD, and the padding maps to 0
+            is_count = (sample["tokens"] != 0) & (sample["tokens"] != tokenizer.eod)
+            assert torch.equal(sample["tokens"][is_count], sample["position_ids"][is_count] + 1)
+            num_tokens += int((sample["tokens"] != 0).sum())
+        assert num_tokens / (len(dataset) * config.sequence_length) > 0.98
+
+        # Check batched retrieval against single retrieval
+        indices = [random.randint(0, len(dataset) - 1) for _ in range(10)] + [None]
+        for idx, sample in zip(indices, dataset.__getitems__(indices)):
+            sample_ref = dataset[idx]
+            assert sample.keys() == sample_ref.keys()
+            assert all(torch.equal(sample[key], sample_ref[key]) for key in sample)
+
+
 if __name__ == "__main__":
     test_mock_gpt_dataset()
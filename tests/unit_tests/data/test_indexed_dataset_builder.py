@@ -0,0 +1,150 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import filecmp
+import os
+import tempfile
+
+import numpy
+import torch
+
+from megatron.core.datasets.indexed_dataset import (
+    DType,
+    IndexedDataset,
+    IndexedDatasetBuilder,
+    get_bin_path,
+    get_idx_path,
+    merge_indexed_datasets,
+)
+
+
+def test_add_packed_documents_and_resume():
+    numpy.random.seed(0)
+
+    documents = [
+        [numpy.random.randint(0, 60000, size=numpy.random.randint(1, 32)) for _ in range(n)]
+        for n in numpy.random.randint(0, 4, size=100)
+    ]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Add one item at a time
+        path_prefix_reference = os.path.join(temp_dir, "reference")
+        builder = IndexedDatasetBuilder(get_bin_path(path_prefix_reference), dtype=numpy.uint16)
+        for document in documents:
+            builder.add_document(
+                torch.from_numpy(numpy.concatenate(document or [[]])), [len(s) for s in document]
+            )
+        builder.finalize(get_idx_path(path_prefix_reference))
+
+        def add_packed(builder, documents):
+            sequences = [sequence for document in documents for sequence in document]
+            builder.add_packed_documents(
+                numpy.concatenate(sequences),
+                numpy.array([len(sequence) for sequence in sequences]),
+                numpy.array([len(document) for document in documents]),
+            )
+
+        # Add the documents packed, then interrupt and resume halfway through
+        path_prefix_packed = os.path.join(temp_dir, "packed")
+        builder = IndexedDatasetBuilder(get_bin_path(path_prefix_packed), dtype=numpy.uint16)
+        add_packed(builder, documents[:50])
+        builder.data_file.flush()
+        state = (
+            builder.data_file.tell(),
+            list(builder.sequence_lengths),
+            list(builder.document_indices),
+        )
+        add_packed(builder, documents[50:60])
+        builder.data_file.close()
+
+        builder = IndexedDatasetBuilder.resume(
+            get_bin_path(path_prefix_packed), *state, dtype=numpy.uint16
+        )
+        add_packed(builder, documents[50:])
+        builder.finalize(get_idx_path(path_prefix_packed))
+
+        for get_path in [get_bin_path, get_idx_path]:
+            assert filecmp.cmp(
+                get_path(path_prefix_reference), get_path(path_prefix_packed), shallow=False
+            )
+        assert len(IndexedDataset(path_prefix_packed).document_indices) == len(documents) + 1
+
+
+def test_packed_tokens():
+    numpy.random.seed(0)
+
+    assert DType.optimal_token_nbytes(50000) is None
+    assert DType.optimal_token_nbytes(2**16) == 2
+    assert DType.optimal_token_nbytes(2**16 + 1) == 3
+    assert DType.optimal_token_nbytes(256000) == 3
+    assert DType.optimal_token_nbytes(2**24) == 3
+    assert DType.optimal_token_nbytes(2**24 + 1) is None
+
+    vocab_size = 256000
+    token_nbytes = DType.optimal_token_nbytes(vocab_size)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path_prefixes = {}
+        for packed in [False, True]:
+            for i in range(2):
+                path_prefix = os.path.join(temp_dir, f"{'packed' if packed else 'unpacked'}_{i}")
+                path_prefixes[packed, i] = path_prefix
+                numpy.random.seed(i)
+                builder = IndexedDatasetBuilder(
+                    get_bin_path(path_prefix),
+                    dtype=numpy.int32,
+                    token_nbytes=token_nbytes if packed else None,
+                )
+                for _ in range(100):
+                    length = numpy.random.randint(0, 64)
+                    builder.add_item(torch.from_numpy(numpy.random.randint(0, vocab_size, length)))
+                    builder.end_document()
+                builder.finalize(get_idx_path(path_prefix))
+
+        assert (
+            os.path.getsize(get_bin_path(path_prefixes[True, 0])) * 4
+            == os.path.getsize(get_bin_path(path_prefixes[False, 0])) * 3
+        )
+
+        for virtual in [False, True]:
+            for packed in [False, True]:
+                merge_indexed_datasets(
+                    [path_prefixes[packed, 0], path_prefixes[packed, 1]],
+                    os.path.join(temp_dir, f"merged_{packed}_{virtual}"),
+                    virtual=virtual,
+                )
+
+        for mmap in [True, False]:
+            for suffix in ["0", "merged_True_False", "merged_True_True"]:
+                if suffix == "0":
+                    unpacked = IndexedDataset(path_prefixes[False, 0], mmap=mmap)
+                    packed = IndexedDataset(path_prefixes[True, 0], mmap=mmap)
+                else:
+                    unpacked = IndexedDataset(
+                        os.path.join(temp_dir, suffix.replace("True_", "False_", 1)), mmap=mmap
+                    )
+                    packed = IndexedDataset(os.path.join(temp_dir, suffix), mmap=mmap)
+
+                assert packed.index.token_nbytes == token_nbytes
+                assert numpy.array_equal(packed.sequence_lengths, unpacked.sequence_lengths)
+                for idx in range(len(unpacked)):
+                    assert packed[idx].dtype == numpy.int32
+                    assert numpy.array_equal(packed[idx], unpacked[idx])
+                    offset = numpy.random.randint(0, unpacked.sequence_lengths[idx] + 1)
+                    assert numpy.array_equal(
+                        packed.get(idx, offset=offset), unpacked.get(idx, offset=offset)
+                    )
+                for sequence_packed, sequence_unpacked in zip(packed[3:97], unpacked[3:97]):
+                    assert numpy.array_equal(sequence_packed, sequence_unpacked)
+
+                idx = numpy.random.randint(0, len(unpacked), size=64)
+                offset = numpy.random.randint(0, 8, size=64) % (unpacked.sequence_lengths[idx] + 1)
+                length = unpacked.sequence_lengths[idx] - offset
+                assert numpy.array_equal(
+                    packed.get_segments(idx, offset, length),
+                    unpacked.get_segments(idx, offset, length),
+                )
+
+
+if __name__ == "__main__":
+    test_add_packed_documents_and_resume()
+    test_packed_tokens()
@@ -0,0 +1,43 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import os
+import tempfile
+
+import numpy
+
+from megatron.core.datasets.indices_file import _PAGE_SIZE, IndicesFile, write_indices_file
+
+
+def test_indices_file():
+    numpy.random.seed(0)
+
+    sections = {
+        "document_index": numpy.random.randint(0, 1000, size=12345, dtype=numpy.int32),
+        "sample_index": numpy.random.randint(0, 1000, size=(2049, 2), dtype=numpy.int32),
+        "shuffle_index": numpy.random.permutation(2048).astype(numpy.uint32),
+        "empty": numpy.zeros(0, dtype=numpy.int64),
+    }
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "indices.bin")
+        write_indices_file(path, sections)
+
+        assert os.path.getsize(path) % _PAGE_SIZE == 0
+
+        indices = IndicesFile(path)
+        for name, array in sections.items():
+            assert name in indices
+            assert indices[name].dtype == array.dtype
+            assert indices[name].shape == array.shape
+            assert numpy.array_equal(indices[name], array)
+            assert not indices[name].flags.writeable
+            assert indices[name].ctypes.data % _PAGE_SIZE == 0
+
+        assert "missing" not in indices
+
+        # All views onto the same file share one mapping
+        assert numpy.shares_memory(IndicesFile(path)["document_index"], indices["document_index"])
+
+
+if __name__ == "__main__":
+    test_indices_file()
@@ -0,0 +1,83 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import types
+
+import numpy
+
+from megatron.core.datasets.bert_dataset import BERTMaskedWordPieceDataset
+from megatron.core.datasets.t5_dataset import T5MaskedWordPieceDataset
+
+
+def _build_dataset(cls, masking_do_full_word, masking_do_permutation):
+    numpy_random_state = numpy.random.RandomState(0)
+    inv_vocab = {i: f"##{i}" if numpy_random_state.rand() < 0.4 else str(i) for i in range(6, 400)}
+    inv_vocab.update({i: f"[special_{i}]" for i in range(6)})
+    tokenizer = types.SimpleNamespace(
+        inv_vocab=inv_vocab, pad=0, cls=1, sep=2, mask=3, bos=4, eos=5
+    )
+    config = types.SimpleNamespace(
+        tokenizer=tokenizer,
+        masking_probability=0.3,
+        masking_max_ngram=3,
+        masking_do_full_word=masking_do_full_word,
+        masking_do_permutation=masking_do_permutation,
+        masking_use_longer_ngrams=False,
+        masking_use_geometric_distribution=False,
+    )
+    # Skip the index building in the constructor
+    dataset = object.__new__(cls)
+    dataset.config = config
+    dataset.token_lookup = list(inv_vocab.keys())
+    return dataset
+
+
+def test_create_masked_lm_predictions():
+    for cls in [BERTMaskedWordPieceDataset, T5MaskedWordPieceDataset]:
+        for masking_do_full_word in [True, False]:
+            for masking_do_permutation in [False, True]:
+                dataset = _build_dataset(cls, masking_do_full_word, masking_do_permutation)
+                tokenizer = dataset.config.tokenizer
+                is_subword = numpy.array(
+                    [tokenizer.inv_vocab[i].startswith("##") for i in range(400)]
+                )
+
+                for seed in range(32):
+                    numpy.random.seed(seed)
+                    numpy_random_state = numpy.random.RandomState(seed)
+                    token_ids = numpy_random_state.randint(6, 400, size=64)
+                    token_ids[[0, 31, 63]] = [tokenizer.cls, tokenizer.sep, tokenizer.sep]
+
+                    (
+                        masked_token_ids,
+                        masked_positions,
+                        masked_labels,
+                        boundaries,
+                        masked_spans,
+                    ) = dataset._create_masked_lm_predictions(token_ids, 64, numpy_random_state)
+
+                    is_special = numpy.isin(token_ids, [tokenizer.cls, tokenizer.sep])
+                    assert numpy.array_equal(boundaries, is_special | ~is_subword[token_ids])
+
+                    assert numpy.all(numpy.diff(masked_positions) > 0)
+                    assert not is_special[masked_positions].any()
+                    assert 0 < len(masked_positions) <= 2 * round(0.3 * 64)
+                    unchanged = numpy.ones(len(token_ids), dtype=bool)
+                    unchanged[masked_positions] = False
+                    assert numpy.array_equal(masked_token_ids[unchanged], token_ids[unchanged])
+
+                    for indices, labels in masked_spans:
+                        assert numpy.array_equal(token_ids[indices], labels)
+                        if masking_do_full_word:
+                            # A span never starts or ends within a word
+                            assert not is_subword[token_ids[indices[0]]] or indices[0] == 1
+                            after = indices[-1] + 1
+                            assert is_special[after] or not is_subword[token_ids[after]]
+
+                    if not masking_do_permutation:
+                        assert numpy.array_equal(masked_labels, token_ids[masked_positions])
+                        if cls is T5MaskedWordPieceDataset:
+                            assert (masked_token_ids[masked_positions] == tokenizer.mask).all()
+
+
+if __name__ == "__main__":
+    test_create_masked_lm_predictions()
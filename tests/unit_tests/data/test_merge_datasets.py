@@ -0,0 +1,122 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import filecmp
+import os
+import tempfile
+
+import numpy
+import torch
+
+from megatron.core.datasets.indexed_dataset import (
+    IndexedDataset,
+    IndexedDatasetBuilder,
+    get_bin_path,
+    get_idx_path,
+    merge_indexed_datasets,
+)
+
+
+def build_dataset(path_prefix, num_sequences, multimodal):
+    builder = IndexedDatasetBuilder(
+        get_bin_path(path_prefix), dtype=numpy.uint16, multimodal=multimodal
+    )
+    for _ in range(num_sequences):
+        sequence = torch.from_numpy(
+            numpy.random.randint(0, 60000, size=numpy.random.randint(1, 64))
+        )
+        if multimodal:
+            builder.add_item(sequence, mode=numpy.random.randint(0, 3))
+        else:
+            builder.add_item(sequence)
+        if numpy.random.rand() < 0.3:
+            builder.end_document()
+    builder.end_document()
+    builder.finalize(get_idx_path(path_prefix))
+
+
+def test_merge_indexed_datasets():
+    numpy.random.seed(0)
+
+    for multimodal in [False, True]:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path_prefixes = [os.path.join(temp_dir, f"input_{i}") for i in range(4)]
+            for path_prefix in path_prefixes:
+                build_dataset(path_prefix, numpy.random.randint(1, 200), multimodal)
+
+            # Merge with the builder
+            path_prefix_reference = os.path.join(temp_dir, "reference")
+            builder = IndexedDatasetBuilder(
+                get_bin_path(path_prefix_reference), dtype=numpy.uint16, multimodal=multimodal
+            )
+            for path_prefix in path_prefixes:
+                builder.add_index(path_prefix)
+            builder.finalize(get_idx_path(path_prefix_reference))
+
+            # Merge with parallel copies
+            path_prefix_merged = os.path.join(temp_dir, "merged")
+            merge_indexed_datasets(
+                path_prefixes, path_prefix_merged, multimodal=multimodal, num_workers=4
+            )
+            for get_path in [get_bin_path, get_idx_path]:
+                assert filecmp.cmp(
+                    get_path(path_prefix_reference), get_path(path_prefix_merged), shallow=False
+                )
+
+            # Merge virtually, in two steps
+            os.mkdir(os.path.join(temp_dir, "virtual"))
+            path_prefix_virtual = os.path.join(temp_dir, "virtual", "merged")
+            merge_indexed_datasets(
+                path_prefixes[:2], path_prefix_virtual + "_0", multimodal=multimodal, virtual=True
+            )
+            merge_indexed_datasets(
+                [path_prefix_virtual + "_0"] + path_prefixes[2:],
+                path_prefix_virtual,
+                multimodal=multimodal,
+                virtual=True,
+            )
+            assert not os.path.exists(get_bin_path(path_prefix_virtual))
+            assert IndexedDataset.exists(path_prefix_virtual)
+            assert filecmp.cmp(
+                get_idx_path(path_prefix_reference),
+                get_idx_path(path_prefix_virtual),
+                shallow=False,
+            )
+
+            dataset_reference = IndexedDataset(path_prefix_reference, multimodal=multimodal)
+            for mmap in [True, False]:
+                dataset_virtual = IndexedDataset(
+                    path_prefix_virtual, multimodal=multimodal, mmap=mmap
+                )
+                assert len(dataset_virtual) == len(dataset_reference)
+                for idx in range(len(dataset_reference)):
+                    if multimodal:
+                        sequence_reference, mode_reference = dataset_reference[idx]
+                        sequence_virtual, mode_virtual = dataset_virtual[idx]
+                        assert mode_virtual == mode_reference
+                    else:
+                        sequence_reference = dataset_reference[idx]
+                        sequence_virtual = dataset_virtual[idx]
+                    assert (sequence_virtual == sequence_reference).all()
+
+                # A slice which spans all of the data files
+                sequences_reference = dataset_reference[1 : len(dataset_reference) - 1]
+                sequences_virtual = dataset_virtual[1 : len(dataset_reference) - 1]
+                if multimodal:
+                    sequences_reference = sequences_reference[0]
+                    sequences_virtual = sequences_virtual[0]
+                for sequence_virtual, sequence_reference in zip(
+                    sequences_virtual, sequences_reference
+                ):
+                    assert (sequence_virtual == sequence_reference).all()
+
+                indices = numpy.random.randint(0, len(dataset_reference), size=64)
+                offsets = numpy.zeros(len(indices), dtype=numpy.int64)
+                lengths = dataset_reference.sequence_lengths[indices]
+                assert (
+                    dataset_virtual.get_segments(indices, offsets, lengths)
+                    == dataset_reference.get_segments(indices, offsets, lengths)
+                ).all()
+
+
+if __name__ == "__main__":
+    test_merge_indexed_datasets()
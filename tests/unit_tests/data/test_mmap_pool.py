@@ -0,0 +1,80 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import os
+import pickle
+import tempfile
+
+import numpy
+
+from megatron.core.datasets.indexed_dataset import (
+    _MMAP_POOL,
+    IndexedDataset,
+    IndexedDatasetBuilder,
+    get_bin_path,
+    get_idx_path,
+    get_mmap_pool_statistics,
+    merge_indexed_datasets,
+    set_mmap_pool_capacity,
+)
+
+
+def build_dataset(path_prefix, sequences):
+    builder = IndexedDatasetBuilder(get_bin_path(path_prefix), dtype=numpy.int32)
+    for sequence in sequences:
+        builder.add_document(sequence, [len(sequence)])
+    builder.finalize(get_idx_path(path_prefix))
+
+
+def test_mmap_pool():
+    numpy.random.seed(0)
+
+    _MMAP_POOL.clear()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path_prefixes = [os.path.join(temp_dir, f"dataset_{i}") for i in range(3)]
+        sequences = [
+            [numpy.random.randint(0, 1000, size=size, dtype=numpy.int32) for size in [5, 7, 3]]
+            for _ in path_prefixes
+        ]
+        for path_prefix, dataset_sequences in zip(path_prefixes, sequences):
+            build_dataset(path_prefix, dataset_sequences)
+
+        try:
+            set_mmap_pool_capacity(2)
+
+            # Nothing is mapped until the first read
+            datasets = [IndexedDataset(path_prefix) for path_prefix in path_prefixes]
+            assert get_mmap_pool_statistics()["opened"] == 0
+
+            first = datasets[0][1]
+            assert numpy.array_equal(datasets[0][0], sequences[0][0])
+            assert numpy.array_equal(datasets[1][2], sequences[1][2])
+            statistics = get_mmap_pool_statistics()
+            assert statistics == {"opened": 2, "evicted": 0, "hits": 1, "open": 2}
+
+            # The least recently used mapping is evicted, yet arrays read from it remain valid
+            assert numpy.array_equal(datasets[2][0], sequences[2][0])
+            assert numpy.array_equal(datasets[1][0], sequences[1][0])
+            assert numpy.array_equal(datasets[0][2], sequences[0][2])
+            statistics = get_mmap_pool_statistics()
+            assert statistics == {"opened": 4, "evicted": 2, "hits": 2, "open": 2}
+            assert numpy.array_equal(first, sequences[0][1])
+
+            # Un-pickled datasets, e.g. in DataLoader workers, and virtual datasets share mappings
+            copy = pickle.loads(pickle.dumps(datasets[1]))
+            assert numpy.array_equal(copy[1], sequences[1][1])
+            virtual_prefix = os.path.join(temp_dir, "virtual")
+            merge_indexed_datasets(path_prefixes[:2], virtual_prefix, virtual=True)
+            virtual = IndexedDataset(virtual_prefix)
+            assert numpy.array_equal(virtual[4], sequences[1][1])
+            statistics = get_mmap_pool_statistics()
+            assert statistics == {"opened": 4, "evicted": 2, "hits": 4, "open": 2}
+
+            set_mmap_pool_capacity(1)
+            assert get_mmap_pool_statistics()["open"] == 1
+        finally:
+            set_mmap_pool_capacity(None)
+            _MMAP_POOL.clear()
+
+
+if __name__ == "__main__":
+    test_mmap_pool()
@@ -1,11 +1,13 @@
 # Copyright (c) 2022, NVIDIA CORPORATION. All rights reserved.
 
+import argparse
 import json
 import os
 import sys
 import tempfile
 
 import nltk
+import numpy
 import pytest
 import requests
 
@@ -15,7 +17,7 @@ from megatron.training.tokenizer.gpt2_tokenization import (
     PRETRAINED_VOCAB_ARCHIVE_MAP,
 )
 from tools.merge_datasets import main as merge_main
-from tools.preprocess_data import Encoder
+from tools.preprocess_data import Encoder, PartitionCheckpoint
 from tools.preprocess_data import get_args as build_args
 from tools.preprocess_data import main as build_main
 
@@ -237,6 +239,48 @@ def test_preprocess_data_bert():
         do_test_preprocess_data(temp_dir, extra_args=bert_args)
 
 
+def test_partition_checkpoint_identity(tmp_path):
+    input_path = tmp_path / "input.jsonl"
+    input_path.write_text(json.dumps({"text": "1"}) + "\n")
+    output_prefix = str(tmp_path / "output")
+    args = argparse.Namespace(
+        json_keys=["text"], tokenizer_type="GPT2BPETokenizer", append_eod=False
+    )
+
+    def get_checkpoint(**changed_args):
+        identity = PartitionCheckpoint.get_identity(
+            argparse.Namespace(**{**vars(args), **changed_args}), input_path
+        )
+        return PartitionCheckpoint(
+            output_prefix,
+            {"text": output_prefix + "_text_document"},
+            numpy.uint16,
+            None,
+            0,
+            identity,
+        )
+
+    checkpoint = get_checkpoint()
+    builders, input_offset, _ = checkpoint.load()
+    assert input_offset == 0
+    checkpoint.save(builders, 10, 1)
+    builders["text"].data_file.close()
+
+    # The progress is resumed with the same input and arguments only
+    builders, input_offset, num_documents = get_checkpoint().load()
+    assert (input_offset, num_documents) == (10, 1)
+    builders["text"].data_file.close()
+    builders, input_offset, _ = get_checkpoint(append_eod=True).load()
+    assert input_offset == 0
+    assert not os.path.exists(output_prefix + ".progress.json")
+
+    checkpoint = get_checkpoint(append_eod=True)
+    checkpoint.finalize(builders)
+    assert checkpoint.is_done()
+    assert not get_checkpoint().is_done()
+    assert not os.path.exists(output_prefix + ".done")
+
+
 if __name__ == "__main__":
     test_preprocess_data_gpt()
     test_preprocess_data_bert()
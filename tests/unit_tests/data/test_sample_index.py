@@ -0,0 +1,125 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+##
+# Compile megatron.core.datasets.helpers dependencies before BlendedDataset import
+##
+
+import argparse
+import time
+
+import numpy
+
+from megatron.core.datasets.utils import compile_helpers
+
+
+def _build_inputs(num_documents, num_epochs, max_document_size, seed):
+    numpy_random_state = numpy.random.RandomState(seed)
+    sizes = numpy_random_state.randint(1, max_document_size, size=num_documents, dtype=numpy.int32)
+    document_index = numpy.concatenate(
+        [
+            numpy_random_state.permutation(num_documents).astype(numpy.int32)
+            for _ in range(num_epochs)
+        ]
+    )
+    return sizes, document_index
+
+
+def test_build_sample_idx_parallel():
+    compile_helpers()
+    from megatron.core.datasets import helpers
+
+    for num_documents, max_document_size, sequence_length in [
+        (1, 100, 7),
+        (1000, 50, 64),
+        (200000, 300, 257),
+    ]:
+        for num_epochs in [1, 3]:
+            sizes, document_index = _build_inputs(
+                num_documents, num_epochs, max_document_size, num_documents
+            )
+            tokens_per_epoch = int(sizes.sum())
+            for add_extra_token_to_sequence in [0, 1]:
+                args = (
+                    document_index,
+                    sequence_length,
+                    num_epochs,
+                    tokens_per_epoch,
+                    True,
+                    add_extra_token_to_sequence,
+                )
+                reference = helpers.build_sample_idx(sizes, *args)
+                for num_threads in [1, 4]:
+                    sample_index = helpers.build_sample_idx_parallel(sizes, *args, num_threads)
+                    assert sample_index.dtype == numpy.int64
+                    assert numpy.array_equal(sample_index, reference)
+
+                    sample_index = helpers.build_sample_idx_parallel(
+                        sizes.astype(numpy.int64), *args, num_threads
+                    )
+                    assert numpy.array_equal(sample_index, reference)
+
+    # The last partial sequence ends with the last document
+    sizes = numpy.array([5, 3, 4], dtype=numpy.int32)
+    document_index = numpy.array([0, 1, 2], dtype=numpy.int32)
+    assert numpy.array_equal(
+        helpers.build_sample_idx_parallel(sizes, document_index, 5, 1, 12, False, 1),
+        [[0, 0], [1, 0], [2, 2], [2, 3]],
+    )
+    assert numpy.array_equal(
+        helpers.build_sample_idx(sizes, document_index, 5, 1, 12, False, 1),
+        [[0, 0], [1, 0], [2, 2], [2, 3]],
+    )
+
+    # Document sizes beyond the int32 range
+    sizes = numpy.array([3 * 2**31, 2**31], dtype=numpy.int64)
+    document_index = numpy.array([0, 1], dtype=numpy.int32)
+    sample_index = helpers.build_sample_idx_parallel(
+        sizes, document_index, 2**30, 1, 2**33, True, 0
+    )
+    assert sample_index.shape == (8 + 1, 2)
+    assert numpy.array_equal(sample_index[6:], [[0, 6 * 2**30], [1, 2**30], [1, 2**31]])
+
+
+def benchmark_build_sample_idx(
+    num_documents, num_epochs, max_document_size, sequence_length, num_threads
+):
+    compile_helpers()
+    from megatron.core.datasets import helpers
+
+    sizes, document_index = _build_inputs(num_documents, num_epochs, max_document_size, 0)
+    tokens_per_epoch = int(sizes.sum())
+    args = (document_index, sequence_length, num_epochs, tokens_per_epoch, True, 1)
+
+    t_beg = time.time()
+    reference = helpers.build_sample_idx(sizes, *args)
+    t_end = time.time()
+    print(f"build_sample_idx: {t_end - t_beg:.2f} seconds")
+
+    for threads in num_threads:
+        t_beg = time.time()
+        sample_index = helpers.build_sample_idx_parallel(sizes, *args, threads)
+        t_end = time.time()
+        print(f"build_sample_idx_parallel, {threads} threads: {t_end - t_beg:.2f} seconds")
+        assert numpy.array_equal(sample_index, reference)
+        del sample_index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark build_sample_idx against build_sample_idx_parallel"
+    )
+    parser.add_argument("--num-documents", type=int, default=10**9)
+    parser.add_argument("--num-epochs", type=int, default=1)
+    parser.add_argument("--max-document-size", type=int, default=2048)
+    parser.add_argument("--sequence-length", type=int, default=4096)
+    parser.add_argument("--num-threads", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    test_build_sample_idx_parallel()
+    benchmark_build_sample_idx(
+        args.num_documents,
+        args.num_epochs,
+        args.max_document_size,
+        args.sequence_length,
+        args.num_threads,
+    )
@@ -6,26 +6,50 @@ import torch
 
 from megatron.core.dist_checkpointing import ShardedTensor, load, save
 from megatron.core.dist_checkpointing.dict_utils import diff
-from megatron.core.dist_checkpointing.strategies.async_utils import AsyncCallsQueue
-from megatron.core.dist_checkpointing.strategies.filesystem_async import FileSystemWriterAsync
+from megatron.core.dist_checkpointing.strategies.async_utils import (
+    AsyncCallsQueue,
+    PersistentAsyncWorker,
+    persistent_async_worker_in_use,
+)
+from megatron.core.dist_checkpointing.strategies.filesystem_async import (
+    FileSystemWriterAsync,
+    _staging_pool,
+    _StagingPool,
+)
 from megatron.core.dist_checkpointing.strategies.torch import TorchDistSaveShardedStrategy
 from tests.unit_tests.dist_checkpointing import TempNamedDir
 from tests.unit_tests.test_utilities import Utils
 
 
-def write_data_os_err_mock_fn(local_proc_idx, write_bucket, results_queue, count_queue, use_fsync):
+def write_data_os_err_mock_fn(
+    local_proc_idx,
+    write_bucket,
+    results_queue,
+    count_queue,
+    use_fsync,
+    base_chunks=None,
+    compression=None,
+):
     """Raises an error on worker #2 during storage save"""
     try:
         if local_proc_idx == 2:
             raise OSError('worker #2 critical failure')
-        output = (local_proc_idx, [])
+        output = (local_proc_idx, [], [])
     except Exception as e:
-        output = (local_proc_idx, e)
+        output = (local_proc_idx, e, [])
     results_queue.put(output)
     count_queue.get()
     count_queue.task_done()
 
 
+def save_tensor_fn(tensor, path):
+    torch.save(tensor.clone(), path)
+
+
+def raise_error_fn():
+    raise OSError('async call critical failure')
+
+
 class TestAsyncSave:
     def setup_method(self, method):
         pass
@@ -33,7 +57,8 @@ class TestAsyncSave:
     def teardown_method(self, method):
         Utils.destroy_model_parallel()
 
-    def test_async_is_equivalent_to_sync(self, tmp_path_dist_ckpt):
+    @pytest.mark.parametrize('persistent', [False, True])
+    def test_async_is_equivalent_to_sync(self, tmp_path_dist_ckpt, persistent):
         Utils.initialize_model_parallel(2, 4)
 
         sharded_state_dict = {
@@ -51,7 +76,7 @@ class TestAsyncSave:
             tmp_path_dist_ckpt / 'test_equivalence_sync'
         ) as sync_ckpt_dir:
             # async
-            async_calls = AsyncCallsQueue()
+            async_calls = AsyncCallsQueue(persistent=persistent)
             async_request = save(sharded_state_dict, async_ckpt_dir, async_sharded_save=True)
             async_calls.schedule_async_request(async_request)
 
@@ -59,7 +84,7 @@ class TestAsyncSave:
             save(sharded_state_dict, sync_ckpt_dir, async_sharded_save=False)
 
             # finalize async
-            async_calls.maybe_finalize_async_calls(blocking=True)
+            async_calls.close()
 
             # load and compare
             loaded_async_state_dict = load(sharded_state_dict, async_ckpt_dir)
@@ -69,6 +94,35 @@ class TestAsyncSave:
 
         Utils.destroy_model_parallel()
 
+    def test_staging_buffers_are_reused(self, tmp_path_dist_ckpt):
+        Utils.initialize_model_parallel(2, 4)
+
+        _staging_pool.clear()
+        sharded_state_dict = {
+            f'key{i}': ShardedTensor.from_rank_offsets(
+                f'key{i}_rank{Utils.rank}', torch.full((16, 8), float(i), device='cuda')
+            )
+            for i in range(4)
+        }
+        allocated_bytes = []
+        for step in range(2):
+            with TempNamedDir(tmp_path_dist_ckpt / f'test_staging_{step}') as ckpt_dir:
+                async_calls = AsyncCallsQueue()
+                async_request = save(sharded_state_dict, ckpt_dir, async_sharded_save=True)
+                # The staged copy is a snapshot: later updates are not saved
+                for sh_ten in sharded_state_dict.values():
+                    sh_ten.data.add_(100)
+                async_calls.schedule_async_request(async_request)
+                async_calls.maybe_finalize_async_calls(blocking=True)
+                allocated_bytes.append(_staging_pool.allocated_bytes)
+
+                loaded_state_dict = load(sharded_state_dict, ckpt_dir)
+                for key, sh_ten in sharded_state_dict.items():
+                    assert torch.equal(loaded_state_dict[key], sh_ten.data - 100)
+        assert allocated_bytes[0] == allocated_bytes[1] == 4 * 16 * 8 * 4
+
+        Utils.destroy_model_parallel()
+
     @pytest.mark.parametrize('async_save', [False, True])
     @pytest.mark.parametrize('worker_fn', [write_data_os_err_mock_fn])
     def test_errors_are_reported(self, tmp_path_dist_ckpt, async_save, worker_fn):
@@ -100,3 +154,64 @@ class TestAsyncSave:
                 FileSystemWriterAsync.write_preloaded_data = orig_fn
 
         Utils.destroy_model_parallel()
+
+
+def test_staging_pool():
+    pool = _StagingPool()
+    tensor = torch.ones(3, 5)
+    buffer = pool.acquire(('a',), tensor)
+    assert buffer.shape == tensor.shape and buffer.dtype == tensor.dtype
+    # A buffer in use is not handed out again
+    other = pool.acquire(('a',), tensor)
+    assert other.data_ptr() != buffer.data_ptr()
+    assert pool.allocated_bytes == 2 * 15 * 4
+
+    # Only buffers for a persistent async worker are in shared memory
+    assert not buffer.is_shared()
+    shared = pool.acquire(('a',), tensor, shared_memory=True)
+    assert shared.is_shared()
+    pool.release({('a',): shared})
+    assert pool.acquire(('a',), tensor, shared_memory=True).data_ptr() == shared.data_ptr()
+    pool.release({('a',): shared})
+    pool.clear()
+    assert pool.allocated_bytes == 2 * 15 * 4
+
+    pool.release({('a',): buffer})
+    pool.release({('a',): other})
+    assert pool.allocated_bytes == 15 * 4
+    assert pool.acquire(('a',), tensor).data_ptr() == buffer.data_ptr()
+    # Items with another shape or dtype get their own buffer
+    assert pool.acquire(('a',), torch.ones(3, 5, dtype=torch.int64)).dtype == torch.int64
+    assert pool.allocated_bytes == 15 * 4 + 15 * 8
+
+
+def test_persistent_async_worker(tmp_path):
+    assert not persistent_async_worker_in_use()
+    worker = PersistentAsyncWorker()
+    assert persistent_async_worker_in_use()
+    try:
+        tensor = torch.arange(10)
+        call_ids = [
+            worker.submit(save_tensor_fn, (tensor * i, tmp_path / f'tensor_{i}.pt'))
+            for i in range(3)
+        ]
+        # Later updates of the args do not affect the submitted calls
+        tensor.add_(100)
+        failed_call_id = worker.submit(raise_error_fn, ())
+
+        worker.wait(call_ids[1])
+        assert worker.is_done(call_ids[0])
+        for i, call_id in enumerate(call_ids):
+            worker.wait(call_id)
+            assert torch.equal(torch.load(tmp_path / f'tensor_{i}.pt'), torch.arange(10) * i)
+        with pytest.raises(RuntimeError, match='async call critical failure'):
+            worker.wait(failed_call_id)
+        # The worker survives the failure of a call
+        worker.wait(worker.submit(save_tensor_fn, (tensor, tmp_path / 'tensor_3.pt')))
+        assert torch.equal(torch.load(tmp_path / 'tensor_3.pt'), tensor)
+    finally:
+        worker.close()
+    assert not worker.process.is_alive()
+    assert not persistent_async_worker_in_use()
+    with pytest.raises(RuntimeError, match='not running'):
+        worker.submit(raise_error_fn, ())
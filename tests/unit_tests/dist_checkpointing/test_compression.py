@@ -0,0 +1,131 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import io
+import os
+from unittest import mock
+
+import pytest
+import torch
+from torch.distributed.checkpoint import FileSystemReader
+from torch.distributed.checkpoint.filesystem import _StorageInfo
+
+from megatron.core.dist_checkpointing import ShardedTensor, load, save
+from megatron.core.dist_checkpointing.core import CheckpointingException
+from megatron.core.dist_checkpointing.strategies.compression import (
+    HAVE_TRANSFORM_DESCRIPTORS,
+    CompressedFileSystemReader,
+    compress_item,
+    decompress_item,
+    is_marked_compressed,
+    mark_compressed,
+)
+from megatron.core.dist_checkpointing.strategies.torch import TorchDistSaveShardedStrategy
+from tests.unit_tests.dist_checkpointing import TempNamedDir
+from tests.unit_tests.test_utilities import Utils
+
+
+def _serialize(tensor):
+    buffer = io.BytesIO()
+    torch.save(tensor, buffer)
+    return buffer.getvalue()
+
+
+class TestCompressItem:
+    @pytest.mark.parametrize('element_size', [1, 2, 4])
+    def test_round_trip(self, element_size):
+        data = _serialize(torch.zeros(1000).add_(torch.arange(1000) % 7))
+        compressed = compress_item(data, 'zlib', element_size=element_size)
+        assert len(compressed) < len(data)
+        assert bytes(decompress_item(compressed)) == data
+
+    def test_incompressible_item_is_stored_as_is(self):
+        data = os.urandom(1000)
+        assert compress_item(data, 'zlib') is data
+        assert decompress_item(data) is data
+
+    def test_unknown_codec(self):
+        with pytest.raises(CheckpointingException):
+            compress_item(b'0' * 100, 'unknown')
+
+    @pytest.mark.skipif(
+        not HAVE_TRANSFORM_DESCRIPTORS, reason='requires the checkpoint transform descriptors'
+    )
+    def test_compressed_item_transform(self):
+        storage_info = _StorageInfo('__0_0.distcp', 0, 100)
+        assert not is_marked_compressed(storage_info)
+        assert is_marked_compressed(mark_compressed(storage_info))
+
+        data = _serialize(torch.zeros(1000))
+        compressed = compress_item(data, 'zlib', element_size=4)
+        transforms = CompressedFileSystemReader('.').transforms
+        for stored in [compressed, data]:
+            stream = transforms.transform_load_stream(
+                None, mark_compressed(storage_info).transform_descriptors, io.BytesIO(stored)
+            )
+            assert stream.read() == data
+
+
+class TestCompressedSave:
+    def setup_method(self, method):
+        pass
+
+    def teardown_method(self, method):
+        Utils.destroy_model_parallel()
+
+    def test_compressed_checkpoint_loads(self, tmp_path_dist_ckpt):
+        Utils.initialize_model_parallel(2, 4)
+
+        def get_sharded_state_dict(fill=None):
+            ten = torch.arange(4096, dtype=torch.float32).div_(64).floor_()
+            if fill is not None:
+                ten.fill_(fill)
+            return {
+                'sd_keyA': ShardedTensor.from_rank_offsets(
+                    'keyA', ten, (0, Utils.rank, Utils.world_size)
+                ),
+                'sd_keyB': ShardedTensor.from_rank_offsets(
+                    'keyB', ten.clone().view(64, 64), (1, Utils.rank, Utils.world_size)
+                ),
+            }
+
+        with TempNamedDir(
+            tmp_path_dist_ckpt / 'test_compressed_save_plain'
+        ) as plain_dir, TempNamedDir(
+            tmp_path_dist_ckpt / 'test_compressed_save_zlib'
+        ) as compressed_dir:
+            save(get_sharded_state_dict(), plain_dir, TorchDistSaveShardedStrategy('torch_dist', 1))
+            save(
+                get_sharded_state_dict(),
+                compressed_dir,
+                TorchDistSaveShardedStrategy('torch_dist', 1, compression='zlib'),
+            )
+
+            # Fails loudly if FileSystemReader stops serving the items through `_slice_file`,
+            # which CompressedFileSystemReader overrides to read them in parallel
+            with mock.patch.object(
+                CompressedFileSystemReader,
+                '_slice_file',
+                autospec=True,
+                side_effect=CompressedFileSystemReader._slice_file,
+            ) as slice_file:
+                loaded_state_dict = load(get_sharded_state_dict(fill=-1), compressed_dir)
+            assert slice_file.call_count == 2
+            expected_state_dict = get_sharded_state_dict()
+            for key in expected_state_dict:
+                assert torch.equal(loaded_state_dict[key], expected_state_dict[key].data)
+
+            def get_saved_bytes(ckpt_dir):
+                return sum(
+                    os.path.getsize(ckpt_dir / name)
+                    for name in os.listdir(ckpt_dir)
+                    if name.endswith('.distcp')
+                )
+
+            assert get_saved_bytes(compressed_dir) < get_saved_bytes(plain_dir)
+
+            storage_data = FileSystemReader(compressed_dir).read_metadata().storage_data
+            assert all(map(is_marked_compressed, storage_data.values())) == (
+                HAVE_TRANSFORM_DESCRIPTORS
+            )
+
+        Utils.destroy_model_parallel()
@@ -0,0 +1,87 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import os
+
+import torch
+
+from megatron.core.dist_checkpointing import ShardedTensor, load, save
+from megatron.core.dist_checkpointing.strategies.torch import (
+    TorchDistSaveShardedStrategy,
+    get_delta_references,
+)
+from tests.unit_tests.dist_checkpointing import TempNamedDir
+from tests.unit_tests.test_utilities import Utils
+
+
+class TestDeltaSave:
+    def setup_method(self, method):
+        pass
+
+    def teardown_method(self, method):
+        Utils.destroy_model_parallel()
+
+    def test_unchanged_shards_are_referenced(self, tmp_path_dist_ckpt):
+        Utils.initialize_model_parallel(2, 4)
+
+        frozen = torch.randn(64, 32)
+        trained = torch.randn(16, 8)
+
+        def get_sharded_state_dict():
+            return {
+                'frozen': ShardedTensor.from_rank_offsets(
+                    f'frozen_rank{Utils.rank}', frozen.clone()
+                ),
+                'trained': ShardedTensor.from_rank_offsets(
+                    f'trained_rank{Utils.rank}', trained.clone()
+                ),
+            }
+
+        save_strategy = TorchDistSaveShardedStrategy('torch_dist', 1, delta_save=True)
+        with TempNamedDir(tmp_path_dist_ckpt / 'test_delta_save') as root_dir:
+            ckpt_dirs = [root_dir / f'iter_{i}' for i in range(3)]
+            for ckpt_dir in ckpt_dirs:
+                if Utils.rank == 0:
+                    ckpt_dir.mkdir()
+                torch.distributed.barrier()
+                save(get_sharded_state_dict(), ckpt_dir, save_strategy)
+
+                loaded_state_dict = load(get_sharded_state_dict(), ckpt_dir)
+                assert torch.equal(loaded_state_dict['frozen'], frozen)
+                assert torch.equal(loaded_state_dict['trained'], trained)
+                trained.add_(1)
+
+            # Only the first checkpoint holds the frozen tensors, the later ones refer to it
+            assert get_delta_references(ckpt_dirs[0]) == set()
+            for ckpt_dir in ckpt_dirs[1:]:
+                references = get_delta_references(ckpt_dir)
+                assert references and all(path.parent == ckpt_dirs[0] for path in references)
+            saved_bytes = [
+                sum(
+                    os.path.getsize(ckpt_dir / name)
+                    for name in os.listdir(ckpt_dir)
+                    if name.endswith('.distcp')
+                )
+                for ckpt_dir in ckpt_dirs
+            ]
+            assert saved_bytes[1] == saved_bytes[2] < saved_bytes[0]
+
+        Utils.destroy_model_parallel()
+
+    def test_full_save_without_delta(self, tmp_path_dist_ckpt):
+        Utils.initialize_model_parallel(2, 4)
+
+        sharded_state_dict = {
+            'frozen': ShardedTensor.from_rank_offsets(f'frozen_rank{Utils.rank}', torch.ones(8, 4))
+        }
+        save_strategy = TorchDistSaveShardedStrategy('torch_dist', 1)
+        with TempNamedDir(tmp_path_dist_ckpt / 'test_full_save') as root_dir:
+            for i in range(2):
+                ckpt_dir = root_dir / f'iter_{i}'
+                if Utils.rank == 0:
+                    ckpt_dir.mkdir()
+                torch.distributed.barrier()
+                save(sharded_state_dict, ckpt_dir, save_strategy)
+                assert get_delta_references(ckpt_dir) == set()
+        assert save_strategy.saved_chunks == {}
+
+        Utils.destroy_model_parallel()
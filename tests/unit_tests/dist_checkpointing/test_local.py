@@ -11,6 +11,7 @@ import torch
 
 from megatron.core.dist_checkpointing import ShardedTensor
 from megatron.core.dist_checkpointing.dict_utils import diff
+from megatron.core.dist_checkpointing.local_checkpoint_manager import LocalCheckpointManager
 from megatron.core.dist_checkpointing.mapping import ShardedBase, ShardedTensorFactory
 from megatron.core.dist_checkpointing.state_dict_transformation import (
     prepare_state_dict_for_save,
@@ -131,7 +132,6 @@ class TestLocalCheckpointing:
     @pytest.mark.parametrize(('use_ramdisk'), [True, False])
     @pytest.mark.parametrize(('async_save'), [True, False])
     @pytest.mark.parametrize(('algo'), ['atomic', 'fully_parallel'])
-    @pytest.mark.skip(reason="BasicLocalCheckpointManager is not yet integrated")
     def test_basic_save_load_scenarios(
         self, tmp_path_dist_ckpt, tp, pp, use_ramdisk, async_save, algo
     ):
@@ -155,7 +155,7 @@ class TestLocalCheckpointing:
             mock_args.non_persistent_local_ckpt_algo = algo
             mock_args.async_save = async_save
             checkpointing_context = {
-                'local_checkpoint_manager': BasicLocalCheckpointManager(local_ckpt_dir)
+                'local_checkpoint_manager': LocalCheckpointManager(local_ckpt_dir)
             }
 
             save_checkpoint(
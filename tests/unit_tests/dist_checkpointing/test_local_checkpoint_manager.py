@@ -0,0 +1,102 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+import shutil
+import socket
+
+import torch
+
+from megatron.core.dist_checkpointing.local_checkpoint_manager import LocalCheckpointManager
+from megatron.core.dist_checkpointing.strategies.async_utils import PersistentAsyncWorker
+
+
+def _state_dict(rank, iteration):
+    return {
+        'raw_tensors': {('weight', rank): torch.full((4,), rank * 100.0 + iteration)},
+        'raw_objects': {},
+        'common': {'iteration': iteration},
+    }
+
+
+def _save_and_restore(rank, world_size, port, tmp_path):
+    torch.distributed.init_process_group(
+        "gloo", init_method=f"tcp://127.0.0.1:{port}", rank=rank, world_size=world_size
+    )
+    # Two "nodes" of two ranks each, each rank with its own local directory
+    local_ckpt_dirs = [tmp_path / f'rank_{i}' for i in range(world_size)]
+
+    def new_manager():
+        return LocalCheckpointManager(
+            local_ckpt_dirs[rank], replication_factor=1, replication_jump=2
+        )
+
+    # The shards are exchanged as CPU tensors over a gloo group of the manager, not the default one
+    p2p_calls = []
+    isend, irecv = torch.distributed.isend, torch.distributed.irecv
+
+    def record_p2p(p2p_fn):
+        def wrapper(tensor, peer, group=None, *args, **kwargs):
+            p2p_calls.append((tensor.device, group))
+            return p2p_fn(tensor, peer, group, *args, **kwargs)
+
+        return wrapper
+
+    torch.distributed.isend, torch.distributed.irecv = record_p2p(isend), record_p2p(irecv)
+
+    manager = new_manager()
+    assert manager.group is not None and manager.group != torch.distributed.group.WORLD
+    assert torch.distributed.get_backend(manager.group) == 'gloo'
+    assert manager.get_latest_checkpoint_iteration() == -1
+    manager.save(_state_dict(rank, 1), 1)
+    request = manager.save(_state_dict(rank, 2), 2, is_async=True)
+    request.execute_sync()
+    assert manager.latest_iteration == 2
+    assert p2p_calls and set(p2p_calls) == {(torch.device('cpu'), manager.group)}
+    torch.distributed.isend, torch.distributed.irecv = isend, irecv
+    # Or by a persistent worker process, which gets the shards through shared memory
+    request = manager.save(_state_dict(rank, 2), 2, is_async=True)
+    worker = PersistentAsyncWorker()
+    worker.wait(worker.submit(request.async_fn, request.async_fn_args))
+    worker.close()
+    torch.distributed.barrier()
+    for finalize_fn in request.finalize_fns:
+        finalize_fn()
+
+    # Only the latest iteration is kept, with a replica of the shard of the peer on the other node
+    peer = (rank + 2) % world_size
+    assert sorted(path.name for path in local_ckpt_dirs[rank].iterdir()) == sorted(
+        [f'iter_0000002_{rank}_local.pt', f'iter_0000002_{peer}_local.pt']
+    )
+
+    state_dict, checkpoint_name = new_manager().load()
+    assert checkpoint_name == str(manager.local_ckpt_path)
+    assert torch.equal(
+        state_dict['raw_tensors'][('weight', rank)], torch.full((4,), rank * 100.0 + 2)
+    )
+
+    # The first node is lost: its ranks restore their shards from the replicas on the second node
+    torch.distributed.barrier()
+    if rank in [0, 1]:
+        shutil.rmtree(local_ckpt_dirs[rank])
+    torch.distributed.barrier()
+    manager = new_manager()
+    assert manager.get_latest_checkpoint_iteration() == 2
+    state_dict, _ = manager.load()
+    assert state_dict['common'] == {'iteration': 2}
+    assert torch.equal(
+        state_dict['raw_tensors'][('weight', rank)], torch.full((4,), rank * 100.0 + 2)
+    )
+
+    # Both copies of the shard of rank 1 are lost: fall back to the global checkpoint
+    torch.distributed.barrier()
+    if rank == 3:
+        shutil.rmtree(local_ckpt_dirs[rank])
+    torch.distributed.barrier()
+    assert new_manager().get_latest_checkpoint_iteration() == -1
+
+    torch.distributed.destroy_process_group()
+
+
+def test_local_checkpoint_replication(tmp_path):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    torch.multiprocessing.spawn(_save_and_restore, args=(4, port, tmp_path), nprocs=4)
@@ -0,0 +1,91 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import json
+import os
+
+import torch
+
+from megatron.core.dist_checkpointing import ShardedTensor, save
+from megatron.core.dist_checkpointing.profiler import (
+    CheckpointProfiler,
+    get_checkpoint_profiler,
+    profile_phase,
+    record_phase,
+)
+from megatron.core.dist_checkpointing.strategies.torch import TorchDistSaveShardedStrategy
+from tests.unit_tests.dist_checkpointing import TempNamedDir
+from tests.unit_tests.test_utilities import Utils
+
+
+class TestCheckpointProfiler:
+    def setup_method(self, method):
+        pass
+
+    def teardown_method(self, method):
+        Utils.destroy_model_parallel()
+
+    def test_records_only_while_active(self):
+        record_phase('write', 1.0, 10)
+        with profile_phase('plan') as record:
+            assert record == {}
+        assert get_checkpoint_profiler() is None
+
+        with CheckpointProfiler() as profiler:
+            assert get_checkpoint_profiler() is profiler
+            record_phase('write', 1.0, 100, writer=0)
+            record_phase('write', 3.0, 200, writer=1)
+            with profile_phase('d2h') as record:
+                record['bytes'] = 64
+        assert get_checkpoint_profiler() is None
+        record_phase('write', 1.0, 10)
+
+        report = profiler.report()
+        assert [record['phase'] for record in report['records']] == ['write', 'write', 'd2h']
+        assert report['records'][1]['writer'] == 1
+        assert report['phases']['write'] == {
+            'count': 2,
+            'seconds': 4.0,
+            'max': 3.0,
+            'bytes': 300,
+            'bytes_per_second': 75.0,
+        }
+        assert report['phases']['d2h']['bytes'] == 64
+
+        profiler.reset()
+        assert profiler.report() == {'phases': {}, 'records': []}
+
+    def test_records_are_bounded(self, tmp_path):
+        with CheckpointProfiler(max_records=3) as profiler:
+            for i in range(10):
+                record_phase('write', float(i), 10)
+        report = profiler.report()
+        # The totals cover all the records, of which only the last ones are kept
+        assert [record['seconds'] for record in report['records']] == [7.0, 8.0, 9.0]
+        assert report['phases']['write']['count'] == 10
+        assert report['phases']['write']['bytes'] == 100
+
+        profiler.save(tmp_path / 'profile.json')
+        assert os.listdir(tmp_path) == ['profile.json']
+        with open(tmp_path / 'profile.json') as f:
+            assert json.load(f) == report
+
+    def test_save_phases_are_recorded(self, tmp_path_dist_ckpt):
+        Utils.initialize_model_parallel(2, 4)
+
+        sharded_state_dict = {
+            'sd_keyA': ShardedTensor.from_rank_offsets(
+                'keyA', torch.ones(16, 8), (0, Utils.rank, Utils.world_size)
+            )
+        }
+        with TempNamedDir(tmp_path_dist_ckpt / 'test_save_phases') as ckpt_dir:
+            with CheckpointProfiler() as profiler:
+                save(sharded_state_dict, ckpt_dir, TorchDistSaveShardedStrategy('torch_dist', 1))
+
+        phases = profiler.report()['phases']
+        for name in ['plan', 'metadata_exchange', 'd2h', 'write', 'fsync']:
+            assert name in phases, name
+        assert phases['d2h']['bytes'] == 16 * 8 * 4
+        assert phases['write']['bytes'] >= 16 * 8 * 4
+        assert ('finalize' in phases) == (Utils.rank == 0)
+
+        Utils.destroy_model_parallel()
@@ -1,13 +1,20 @@
+import argparse
 import base64
 import json
+import time
 from argparse import Namespace
 from pathlib import Path
 
+import numpy
 import pytest
 import requests
 
 from megatron.training import tokenizer
-from megatron.training.tokenizer.gpt2_tokenization import PRETRAINED_VOCAB_ARCHIVE_MAP
+from megatron.training.tokenizer.gpt2_tokenization import (
+    PRETRAINED_VOCAB_ARCHIVE_MAP,
+    GPT2Tokenizer,
+    bytes_to_unicode,
+)
 
 TOKENIZER_DIR = Path("~/data/tokenizers").expanduser()
 
@@ -191,3 +198,89 @@ def test_null_tokenizer():
         detok_str == test_string
     ), f"Detokenized string {detok_str} does not match original {test_string}"
     assert len(toks) == len(offsets), f"Tokenized string {toks} does not match original {offsets}"
+
+
+def test_null_tokenizer_batch():
+    args = Namespace(
+        tokenizer_type="NullTokenizer",
+        rank=0,
+        vocab_size=128000,
+        make_vocab_size_divisible_by=128,
+        tensor_model_parallel_size=8,
+    )
+    tok = tokenizer.build_tokenizer(args)
+    texts = ["1 23 456 789", "0", "5 5"]
+    assert tok.tokenize_batch(texts) == [tok.tokenize(text) for text in texts]
+
+
+def test_gpt2_bpe_cache(tmp_path):
+    vocab = {char: i for i, char in enumerate(bytes_to_unicode().values())}
+    merges = [("t", "h"), ("th", "e"), ("Ġ", "c"), ("Ġc", "a"), ("Ġca", "t")]
+    for first, second in merges:
+        vocab[first + second] = len(vocab)
+    vocab_file = tmp_path / "vocab.json"
+    merges_file = tmp_path / "merges.txt"
+    with open(vocab_file, "w", encoding="utf-8") as f:
+        json.dump(vocab, f)
+    with open(merges_file, "w", encoding="utf-8") as f:
+        f.write("#version: 0.2\n" + "".join(f"{a} {b}\n" for a, b in merges))
+
+    texts = ["the cat", "the dog", "a cat, the cat", "", "théâtre"]
+    reference = GPT2Tokenizer(vocab_file, merges_file, cache_size=0)
+    tok = GPT2Tokenizer(vocab_file, merges_file, cache_size=2)
+    assert tok.encode_batch(texts) == [reference.encode(text) for text in texts]
+    assert tok.encode("the cat") == [vocab["the"], vocab["Ġcat"]]
+    assert len(reference.cache) == 0
+    assert len(tok.cache) == 2
+
+    # The most recently used words are kept
+    tok.encode("the dog")
+    assert list(tok.cache) == ["the", "Ġdog"]
+
+
+def benchmark_tokenize_batch(specs, num_texts, batch_size):
+    words = ["the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog", "1234", "?"]
+    numpy_random_state = numpy.random.RandomState(0)
+    texts = [
+        " ".join(numpy_random_state.choice(words, size=numpy_random_state.randint(1, 512)))
+        for _ in range(num_texts)
+    ]
+    for args in specs:
+        tok = tokenizer.build_tokenizer(args)
+
+        t_beg = time.time()
+        num_tokens = sum(len(tok.tokenize(text)) for text in texts)
+        t_end = time.time()
+        print(f"{args.tokenizer_type} tokenize: {num_tokens / (t_end - t_beg):.0f} tokens/s")
+
+        t_beg = time.time()
+        num_tokens = sum(
+            len(ids)
+            for i in range(0, num_texts, batch_size)
+            for ids in tok.tokenize_batch(texts[i : i + batch_size])
+        )
+        t_end = time.time()
+        print(f"{args.tokenizer_type} tokenize_batch: {num_tokens / (t_end - t_beg):.0f} tokens/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark tokenize against tokenize_batch")
+    parser.add_argument("--vocab-file", type=str, default=None)
+    parser.add_argument("--merge-file", type=str, default=None)
+    parser.add_argument("--num-texts", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    benchmark_specs = specs()
+    if args.vocab_file is not None and args.merge_file is not None:
+        benchmark_specs.append(
+            Namespace(
+                rank=0,
+                make_vocab_size_divisible_by=128,
+                tensor_model_parallel_size=8,
+                tokenizer_type="GPT2BPETokenizer",
+                vocab_file=args.vocab_file,
+                merge_file=args.merge_file,
+            )
+        )
+    benchmark_tokenize_batch(benchmark_specs, args.num_texts, args.batch_size)
@@ -1,8 +1,15 @@
+import itertools
+import socket
 from types import SimpleNamespace
+from unittest.mock import ANY
+
+import pytest
+import torch
 
 from megatron.training.global_vars import set_args
 from megatron.training.tokenizer.tokenizer import _vocab_size_with_padding
 from megatron.training.training import build_train_valid_test_data_iterators
+from megatron.training.utils import CoalescedBatchBroadcaster
 from tests.unit_tests.test_utilities import Utils
 
 
@@ -66,3 +73,217 @@ class TestTraining:
 
     def teardown_method(self, method):
         Utils.destroy_model_parallel()
+
+
+def _broadcast_batches(rank, world_size, port):
+    torch.distributed.init_process_group(
+        "gloo", init_method=f"tcp://127.0.0.1:{port}", rank=rank, world_size=world_size
+    )
+    fields = [
+        ("tokens", torch.int64, (2, 7)),
+        ("loss_mask", torch.float32, (2, 7)),
+        ("attention_mask", torch.bool, (2, 1, 7, 7)),
+        ("position_ids", torch.int64, (2, 7)),
+    ]
+    broadcaster = CoalescedBatchBroadcaster(fields, torch.device("cpu"), num_buffers=2)
+
+    batches, received = [], []
+    for step in range(3):
+        generator = torch.Generator().manual_seed(step)
+        batch = {
+            "tokens": torch.randint(0, 1000, (2, 7), generator=generator),
+            "loss_mask": torch.rand((2, 7), generator=generator),
+            "attention_mask": torch.rand((2, 1, 7, 7), generator=generator) < 0.5,
+            "position_ids": torch.arange(7).repeat(2, 1),
+        }
+        batches.append(batch)
+        received.append(broadcaster.broadcast(batch if rank == 0 else None, 0, None))
+
+    for batch, views in zip(batches[1:], received[1:]):
+        for name, dtype, shape in fields:
+            assert views[name].dtype == dtype
+            assert views[name].shape == shape
+            assert torch.equal(views[name], batch[name])
+    # The ring of two buffers is reused by the third batch
+    assert received[0]["tokens"].data_ptr() == received[2]["tokens"].data_ptr()
+    assert received[0]["tokens"].data_ptr() != received[1]["tokens"].data_ptr()
+
+    torch.distributed.destroy_process_group()
+
+
+def test_coalesced_batch_broadcaster():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    torch.multiprocessing.spawn(_broadcast_batches, args=(2, port), nprocs=2)
+
+
+@pytest.mark.parametrize(
+    "reset_position_ids,sequence_packing", [(True, None), (False, "first-fit-decreasing")]
+)
+def test_coalesced_get_batch_keeps_in_flight_batches(
+    monkeypatch, reset_position_ids, sequence_packing
+):
+    from megatron.training import utils
+
+    # The first stage of an interleaved schedule, as its only tensor parallel rank
+    args = SimpleNamespace(
+        micro_batch_size=2,
+        seq_length=8,
+        pipeline_model_parallel_size=4,
+        virtual_pipeline_model_parallel_size=2,
+        create_attention_mask_in_dataloader=False,
+        # The per-document position ids of the dataset are broadcast rather than derived
+        reset_position_ids=reset_position_ids,
+        sequence_packing=sequence_packing,
+    )
+    num_microbatches = 16
+    monkeypatch.setattr(utils, "get_num_microbatches", lambda: num_microbatches)
+    monkeypatch.setattr(utils.torch.cuda, "current_device", lambda: "cpu")
+    monkeypatch.setattr(utils.torch.distributed, "broadcast", lambda *args, **kwargs: None)
+    monkeypatch.setattr(utils.mpu, "get_tensor_model_parallel_rank", lambda: 0)
+    monkeypatch.setattr(utils.mpu, "get_tensor_model_parallel_src_rank", lambda: 0)
+    monkeypatch.setattr(utils.mpu, "get_tensor_model_parallel_group", lambda: None)
+    monkeypatch.setattr(utils.mpu, "is_pipeline_first_stage", lambda: True)
+    monkeypatch.setattr(utils, "_BATCH_BROADCASTERS", {})
+
+    def batches():
+        for step in range(args.virtual_pipeline_model_parallel_size * num_microbatches):
+            yield {
+                "tokens": torch.full((2, 8), step),
+                "position_ids": torch.arange(8).repeat(2, 1) + step,
+            }
+
+    data_iterator = batches()
+    in_flight = args.virtual_pipeline_model_parallel_size * args.pipeline_model_parallel_size
+    in_flight += args.pipeline_model_parallel_size - 1
+    received = []
+    for step in range(args.virtual_pipeline_model_parallel_size * num_microbatches):
+        received.append(utils._get_batch_on_this_tp_rank_coalesced(data_iterator, args))
+        # The batches of the micro-batches still in flight are unchanged
+        for earlier_step, batch in enumerate(received[-in_flight:], max(step + 1 - in_flight, 0)):
+            assert torch.equal(batch["tokens"], torch.full((2, 8), earlier_step))
+            assert torch.equal(batch["position_ids"], torch.arange(8).repeat(2, 1) + earlier_step)
+    # More micro-batches went through than the ring holds
+    (broadcaster,) = utils._BATCH_BROADCASTERS.values()
+    assert in_flight < len(broadcaster.buffers) < len(received)
+
+
+def test_coalesced_get_batch_resizes_the_ring(monkeypatch):
+    from megatron.training import utils
+
+    args = SimpleNamespace(
+        micro_batch_size=2,
+        seq_length=8,
+        pipeline_model_parallel_size=4,
+        virtual_pipeline_model_parallel_size=None,
+        create_attention_mask_in_dataloader=True,
+        reset_position_ids=False,
+        sequence_packing=None,
+    )
+    num_microbatches = 1
+    monkeypatch.setattr(utils, "get_num_microbatches", lambda: num_microbatches)
+    monkeypatch.setattr(utils.torch.cuda, "current_device", lambda: "cpu")
+    monkeypatch.setattr(utils.torch.distributed, "broadcast", lambda *args, **kwargs: None)
+    monkeypatch.setattr(utils.mpu, "get_tensor_model_parallel_rank", lambda: 0)
+    monkeypatch.setattr(utils.mpu, "get_tensor_model_parallel_src_rank", lambda: 0)
+    monkeypatch.setattr(utils.mpu, "get_tensor_model_parallel_group", lambda: None)
+    monkeypatch.setattr(utils.mpu, "is_pipeline_first_stage", lambda: True)
+    monkeypatch.setattr(utils, "_BATCH_BROADCASTERS", {})
+
+    def batches():
+        for step in itertools.count():
+            yield {
+                "tokens": torch.full((2, 8), step),
+                "attention_mask": torch.ones(2, 1, 8, 8, dtype=torch.bool),
+            }
+
+    data_iterator = batches()
+    received = []
+    broadcaster = None
+    num_valid = 0
+    # A batch size rampup, then a drop of the number of micro-batches
+    for num_microbatches in [1, 2, 8, 16, 2]:
+        num_buffers = utils._get_num_batch_buffers(args, num_microbatches)
+        for _ in range(2 * num_buffers):
+            received.append(utils._get_batch_on_this_tp_rank_coalesced(data_iterator, args))
+            # The broadcaster and the buffers of the most recent batches are kept
+            assert list(utils._BATCH_BROADCASTERS.values()) == [broadcaster or ANY]
+            broadcaster = utils._BATCH_BROADCASTERS[(("tokens", "attention_mask"), (2, 8))]
+            assert len(broadcaster.buffers) == num_buffers
+            # The batches of the buffers added by a resize are valid once they are used
+            num_valid = min(num_valid + 1, num_buffers)
+            for step in range(len(received) - num_valid, len(received)):
+                assert torch.equal(received[step]["tokens"], torch.full((2, 8), step))
+
+
+def _build_stateful_dataloader(cyclic, consumed_samples):
+    # Imported here as the data samplers can only be imported after megatron.training
+    from megatron.legacy.data.data_samplers import (
+        MegatronPretrainingRandomSampler,
+        MegatronPretrainingSampler,
+        StatefulDataLoader,
+    )
+
+    dataset = list(range(100))
+    if cyclic:
+        batch_sampler = MegatronPretrainingRandomSampler(
+            dataset, len(dataset), consumed_samples, 4, 1, 2, data_sharding=True
+        )
+    else:
+        batch_sampler = MegatronPretrainingSampler(len(dataset), consumed_samples, 4, 1, 2)
+    dataloader = torch.utils.data.DataLoader(dataset, batch_sampler=batch_sampler)
+    return StatefulDataLoader(dataloader, cyclic=cyclic, prefetch_microbatches=3).start()
+
+
+def test_stateful_dataloader():
+    for cyclic in [False, True]:
+        reference = _build_stateful_dataloader(cyclic, 0)
+        batches = [next(reference).tolist() for _ in range(20 if cyclic else 12)]
+        if not cyclic:
+            # The last partial global batch is dropped
+            assert next(reference, None) is None
+
+        # Resume from the cursor of a prefetching loader, across an epoch when cyclic
+        for n in [0, 5, 11]:
+            interrupted = _build_stateful_dataloader(cyclic, 0)
+            for _ in range(n):
+                next(interrupted)
+            state = interrupted.save_state()
+            interrupted.close()
+            assert state["consumed_samples"] == n * 8
+
+            resumed = _build_stateful_dataloader(cyclic, state["consumed_samples"])
+            assert [next(resumed).tolist() for _ in range(len(batches) - n)] == batches[n:]
+            if not cyclic:
+                assert next(resumed, None) is None
+
+
+def test_save_dataloader_state_of_model_chunks(monkeypatch, tmp_path):
+    from megatron.training import checkpointing
+
+    # The first stage of an interleaved schedule, as its only data parallel rank
+    monkeypatch.setattr(
+        checkpointing, "get_args", lambda: SimpleNamespace(consumed_valid_samples=4)
+    )
+    monkeypatch.setattr(checkpointing.torch.distributed, "barrier", lambda *args, **kwargs: None)
+    monkeypatch.setattr(checkpointing.mpu, "is_pipeline_first_stage", lambda ignore_virtual: True)
+    monkeypatch.setattr(checkpointing.mpu, "get_tensor_model_parallel_rank", lambda: 0)
+    monkeypatch.setattr(checkpointing.mpu, "get_data_parallel_rank", lambda: 0)
+    monkeypatch.setattr(checkpointing.mpu, "get_data_parallel_group", lambda: None)
+    monkeypatch.setattr(checkpointing.mpu, "get_pipeline_model_parallel_world_size", lambda: 4)
+    monkeypatch.setattr(checkpointing.mpu, "get_pipeline_model_parallel_rank", lambda: 0)
+    monkeypatch.setattr(checkpointing.mpu, "get_expert_model_parallel_world_size", lambda: 1)
+    monkeypatch.setattr(checkpointing.mpu, "get_expert_model_parallel_rank", lambda: 0)
+
+    # Only the first model chunk consumes the data
+    train_data_iterator = [_build_stateful_dataloader(False, 0) for _ in range(2)]
+    for _ in range(3):
+        next(train_data_iterator[0])
+    checkpointing.save_dataloader_state(train_data_iterator, 7, str(tmp_path))
+    for iterator in train_data_iterator:
+        iterator.close()
+
+    state = torch.load(tmp_path / "iter_0000007/mp_rank_00_000/train_dataloader_dprank000.pt")
+    assert state["iteration"] == 7
+    assert state["dataloader_state_dict"]["consumed_samples"] == 3 * 8
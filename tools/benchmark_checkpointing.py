@@ -0,0 +1,342 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+import itertools
+import time
+
+import torch
+import torch.distributed as dist
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+)
+
+from megatron.core.dist_checkpointing import ShardedTensor, load, save
+from megatron.core.dist_checkpointing.core import CheckpointingException
+from megatron.core.dist_checkpointing.profiler import CheckpointProfiler
+from megatron.core.dist_checkpointing.serialization import get_default_load_sharded_strategy
+from megatron.core.dist_checkpointing.strategies.base import StrategyAction, get_default_strategy
+from megatron.core.dist_checkpointing.strategies.fully_parallel import (
+    FullyParallelLoadStrategyWrapper,
+    FullyParallelSaveStrategyWrapper,
+)
+from megatron.core.dist_checkpointing.strategies.torch import (
+    TorchDistLoadShardedStrategy,
+    TorchDistSaveShardedStrategy,
+)
+
+DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16, "float16": torch.float16}
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Save and load a synthetic sharded state dict with every checkpoint "
+        "strategy and configuration given, in processes on the CPU with gloo, and report "
+        "the wall time and bytes per second of every save phase as JSON"
+    )
+
+    group = parser.add_argument_group(title="state dict")
+    group.add_argument("--num-tensors", type=int, default=8, help="Number of tensors")
+    group.add_argument(
+        "--tensor-shape",
+        type=int,
+        nargs=2,
+        default=[4096, 1024],
+        metavar=("ROWS", "COLS"),
+        help="Global shape of every tensor",
+    )
+    group.add_argument("--dtype", type=str, default="float32", choices=list(DTYPES))
+    group.add_argument(
+        "--layout",
+        type=str,
+        default="sharded",
+        choices=["sharded", "replicated", "local"],
+        help="sharded: the rows of every tensor are split across the ranks, "
+        "replicated: every rank holds a replica of every tensor, "
+        "local: every rank holds tensors of its own",
+    )
+
+    group = parser.add_argument_group(title="strategies")
+    group.add_argument(
+        "--strategies",
+        type=str,
+        nargs="+",
+        default=["torch_dist", "zarr"],
+        help="Save strategy backends. Unavailable ones are reported as skipped",
+    )
+    group.add_argument(
+        "--thread-counts",
+        type=int,
+        nargs="+",
+        default=[2],
+        help="Writer processes per rank (and reader threads) to sweep, for torch_dist",
+    )
+    group.add_argument(
+        "--cached-metadata",
+        type=int,
+        nargs="+",
+        default=[0],
+        choices=[0, 1],
+        help="Whether to cache the save plans and metadata across iterations, for torch_dist, "
+        "and the save distribution of the fully parallel wrapper",
+    )
+    group.add_argument(
+        "--fully-parallel",
+        type=int,
+        nargs="+",
+        default=[0],
+        choices=[0, 1],
+        help="Whether to wrap the strategies to distribute the save and load of replicas. "
+        "The load is distributed only with GPUs, as the loaded tensors are exchanged on them",
+    )
+    group.add_argument(
+        "--iterations",
+        type=int,
+        default=2,
+        help="Number of saves and loads per configuration, into a new directory each",
+    )
+
+    group = parser.add_argument_group(title="processes")
+    group.add_argument(
+        "--nproc",
+        type=int,
+        default=2,
+        help="Number of processes to spawn, unless launched with torchrun",
+    )
+    group.add_argument(
+        "--master-port", type=int, default=29500, help="Port of the gloo process group"
+    )
+    group.add_argument(
+        "--ckpt-dir",
+        type=str,
+        default=None,
+        help="Directory to save the checkpoints to. Defaults to a temporary directory",
+    )
+
+    group = parser.add_argument_group(title="output")
+    group.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Path to the JSON report. Defaults to printing it",
+    )
+
+    return parser.parse_args()
+
+
+def get_sharded_state_dict(args, rank, world_size, empty=False):
+    """The synthetic state dict of a rank, or a template of it to load into if `empty`"""
+    rows, cols = args.tensor_shape
+    if args.layout == "sharded":
+        assert rows % world_size == 0, "the rows must be divisible by the number of ranks"
+        rows //= world_size
+    sharded_state_dict = {}
+    for i in range(args.num_tensors):
+        if empty:
+            tensor = torch.empty(rows, cols, dtype=DTYPES[args.dtype])
+        else:
+            # The replicas of a tensor must be equal
+            seed = i if args.layout == "replicated" else i * world_size + rank
+            generator = torch.Generator().manual_seed(seed)
+            tensor = torch.randn(rows, cols, generator=generator).to(DTYPES[args.dtype])
+        if args.layout == "sharded":
+            sh_ten = ShardedTensor.from_rank_offsets(f"tensor_{i}", tensor, (0, rank, world_size))
+        elif args.layout == "replicated":
+            sh_ten = ShardedTensor.from_rank_offsets(f"tensor_{i}", tensor, replica_id=rank)
+        else:
+            sh_ten = ShardedTensor.from_rank_offsets(f"tensor_{i}_rank{rank}", tensor)
+        sharded_state_dict[f"tensor_{i}"] = sh_ten
+    return sharded_state_dict
+
+
+def get_checkpoint_bytes(args, world_size):
+    """The bytes of the checkpointed data, without the replicas"""
+    rows, cols = args.tensor_shape
+    element_size = torch.tensor([], dtype=DTYPES[args.dtype]).element_size()
+    nbytes = args.num_tensors * rows * cols * element_size
+    return nbytes * world_size if args.layout == "local" else nbytes
+
+
+def get_configs(args):
+    for backend in args.strategies:
+        if backend == "torch_dist":
+            options = itertools.product(
+                args.thread_counts, args.cached_metadata, args.fully_parallel
+            )
+        else:
+            options = ((None, None, fully_parallel) for fully_parallel in args.fully_parallel)
+        for thread_count, cached_metadata, fully_parallel in options:
+            yield {
+                "strategy": backend,
+                "thread_count": thread_count,
+                "cached_metadata": None if cached_metadata is None else bool(cached_metadata),
+                "fully_parallel": bool(fully_parallel),
+            }
+
+
+def get_strategies(config):
+    if config["strategy"] == "torch_dist":
+        save_strategy = TorchDistSaveShardedStrategy(
+            "torch_dist",
+            1,
+            thread_count=config["thread_count"],
+            cached_metadata=config["cached_metadata"],
+        )
+        load_strategy = TorchDistLoadShardedStrategy(thread_count=config["thread_count"])
+    else:
+        save_strategy = get_default_strategy(StrategyAction.SAVE_SHARDED, config["strategy"], 1)
+        load_strategy = None
+    if config["fully_parallel"]:
+        save_strategy = FullyParallelSaveStrategyWrapper(
+            save_strategy, do_cache_distribution=bool(config["cached_metadata"])
+        )
+    return save_strategy, load_strategy
+
+
+def summarize_phases(phases_per_rank):
+    """Per phase: the max over the ranks of their total seconds, and the sum of their bytes"""
+    phases = {}
+    for rank_phases in phases_per_rank:
+        for name, phase in rank_phases.items():
+            summary = phases.setdefault(name, {"seconds": 0.0, "max": 0.0, "bytes": 0})
+            summary["seconds"] = max(summary["seconds"], phase["seconds"])
+            summary["max"] = max(summary["max"], phase["max"])
+            summary["bytes"] += phase["bytes"]
+    for summary in phases.values():
+        summary["bytes_per_second"] = (
+            summary["bytes"] / summary["seconds"]
+            if summary["bytes"] and summary["seconds"]
+            else None
+        )
+    return phases
+
+
+def timed_barrier(fn):
+    dist.barrier()
+    t_beg = time.perf_counter()
+    result = fn()
+    dist.barrier()
+    return result, time.perf_counter() - t_beg
+
+
+def run_config(args, config, root_dir, rank, world_size):
+    save_strategy, load_strategy = get_strategies(config)
+    sharded_state_dict = get_sharded_state_dict(args, rank, world_size)
+    checkpoint_bytes = get_checkpoint_bytes(args, world_size)
+
+    results = []
+    for iteration in range(args.iterations):
+        checkpoint_dir = os.path.join(root_dir, f"iter_{iteration}")
+        if rank == 0:
+            os.makedirs(checkpoint_dir)
+
+        with CheckpointProfiler() as profiler:
+            _, save_seconds = timed_barrier(
+                lambda: save(sharded_state_dict, checkpoint_dir, save_strategy)
+            )
+
+        def load_checkpoint():
+            strategy = load_strategy
+            if strategy is None:
+                strategy = get_default_load_sharded_strategy(checkpoint_dir)
+            if config["fully_parallel"] and torch.cuda.is_available():
+                strategy = FullyParallelLoadStrategyWrapper(strategy)
+            return load(
+                get_sharded_state_dict(args, rank, world_size, empty=True),
+                checkpoint_dir,
+                strategy,
+            )
+
+        loaded_state_dict, load_seconds = timed_barrier(load_checkpoint)
+        for key, sh_ten in sharded_state_dict.items():
+            assert torch.equal(loaded_state_dict[key], sh_ten.data), key
+
+        phases_per_rank = [None] * world_size
+        dist.all_gather_object(phases_per_rank, profiler.report()["phases"])
+        results.append(
+            {
+                **config,
+                "fully_parallel_load": config["fully_parallel"] and torch.cuda.is_available(),
+                "iteration": iteration,
+                "save_seconds": save_seconds,
+                "save_bytes_per_second": checkpoint_bytes / save_seconds,
+                "load_seconds": load_seconds,
+                "load_bytes_per_second": checkpoint_bytes / load_seconds,
+                "phases": summarize_phases(phases_per_rank),
+                "phases_per_rank": phases_per_rank,
+            }
+        )
+    return results
+
+
+def worker(rank, args, world_size):
+    if "RANK" not in os.environ:
+        dist.init_process_group(
+            "gloo",
+            init_method=f"tcp://127.0.0.1:{args.master_port}",
+            rank=rank,
+            world_size=world_size,
+        )
+    else:
+        dist.init_process_group("gloo")
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    logging.basicConfig(level=logging.INFO if rank == 0 else logging.WARNING)
+
+    ckpt_dir = [args.ckpt_dir]
+    if ckpt_dir[0] is None and rank == 0:
+        ckpt_dir = [tempfile.mkdtemp(prefix="benchmark_checkpointing_")]
+    dist.broadcast_object_list(ckpt_dir)
+    ckpt_dir = ckpt_dir[0]
+
+    report = {
+        "world_size": world_size,
+        "layout": args.layout,
+        "num_tensors": args.num_tensors,
+        "tensor_shape": args.tensor_shape,
+        "dtype": args.dtype,
+        "checkpoint_bytes": get_checkpoint_bytes(args, world_size),
+        "results": [],
+        "skipped": [],
+    }
+    for i, config in enumerate(get_configs(args)):
+        root_dir = os.path.join(ckpt_dir, f"config_{i}")
+        if rank == 0:
+            os.makedirs(root_dir, exist_ok=True)
+        try:
+            report["results"] += run_config(args, config, root_dir, rank, world_size)
+        except CheckpointingException as e:
+            report["skipped"].append({**config, "error": str(e)})
+        dist.barrier()
+        if rank == 0:
+            shutil.rmtree(root_dir, ignore_errors=True)
+            logging.info(f"Benchmarked {config}")
+
+    if rank == 0:
+        if args.ckpt_dir is None:
+            shutil.rmtree(ckpt_dir, ignore_errors=True)
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=4)
+        else:
+            print(json.dumps(report, indent=4))
+    dist.destroy_process_group()
+
+
+def main():
+    args = get_args()
+
+    if "RANK" in os.environ:
+        worker(int(os.environ["RANK"]), args, int(os.environ["WORLD_SIZE"]))
+    else:
+        torch.multiprocessing.spawn(worker, args=(args, args.nproc), nprocs=args.nproc)
+
+
+if __name__ == '__main__':
+
+    main()
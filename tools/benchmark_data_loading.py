@@ -0,0 +1,175 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import os
+import sys
+import json
+import logging
+import argparse
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+)
+
+from megatron.core.datasets.blended_dataset import BlendedDataset
+from megatron.core.datasets.blended_megatron_dataset_builder import BlendedMegatronDatasetBuilder
+from megatron.core.datasets.data_profiler import DataProfiler
+from megatron.core.datasets.gpt_dataset import GPTDataset, GPTDatasetConfig
+from megatron.core.datasets.utils import Split, compile_helpers, get_blend_from_list
+from megatron.training.tokenizer.tokenizer import _NullTokenizer
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Build a GPTDataset blend as pretraining would, time every building phase "
+        "per dataset and split, measure the sample throughput, and report it all as JSON"
+    )
+
+    group = parser.add_argument_group(title="input data")
+    group.add_argument(
+        "--data-path",
+        type=str,
+        nargs="+",
+        required=True,
+        help="The blend, as for pretraining: prefixes, optionally each preceded by its weight",
+    )
+    group.add_argument(
+        "--split",
+        type=str,
+        default="969,30,1",
+        help="Comma-separated proportions of the train, valid, and test splits",
+    )
+    group.add_argument(
+        "--num-samples",
+        type=int,
+        nargs=3,
+        default=[100000, 1000, 100],
+        metavar=("TRAIN", "VALID", "TEST"),
+        help="Number of samples to build the indices of, per split",
+    )
+    group.add_argument(
+        "--seq-length", type=int, default=2048, help="Number of tokens per sample"
+    )
+    group.add_argument(
+        "--vocab-size",
+        type=int,
+        default=2**17,
+        help="Vocabulary size of the null tokenizer which stands in for the real one",
+    )
+    group.add_argument("--seed", type=int, default=1234, help="Seed for the dataset indices")
+    group.add_argument(
+        "--data-cache-path",
+        type=str,
+        default=None,
+        help="Where to cache the dataset indices. Run twice to time both a cold and a warm cache",
+    )
+
+    group = parser.add_argument_group(title="data loading")
+    group.add_argument(
+        "--num-dataset-builder-threads", type=int, default=1, help="Number of builder threads"
+    )
+    group.add_argument(
+        "--no-mmap-bin-files",
+        action="store_false",
+        dest="mmap_bin_files",
+        help="Disable mmap-ing of .bin files",
+    )
+    group.add_argument(
+        "--mmap-pool-capacity",
+        type=int,
+        default=None,
+        help="Maximum number of .bin file mappings to hold at once",
+    )
+
+    group = parser.add_argument_group(title="throughput")
+    group.add_argument(
+        "--throughput-samples",
+        type=int,
+        default=1024,
+        help="Number of samples to read per throughput measurement, 0 to skip them",
+    )
+    group.add_argument(
+        "--num-workers",
+        type=int,
+        nargs="+",
+        default=[0, 2],
+        help="Numbers of DataLoader workers to measure the throughput with",
+    )
+    group.add_argument("--batch-size", type=int, default=4, help="Number of samples per batch")
+    group.add_argument(
+        "--per-dataset",
+        action="store_true",
+        help="Also measure the throughput of every dataset of the train blend on its own",
+    )
+
+    group = parser.add_argument_group(title="output")
+    group.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Path to the JSON report. Defaults to printing it",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    compile_helpers()
+
+    config = GPTDatasetConfig(
+        random_seed=args.seed,
+        sequence_length=args.seq_length,
+        blend=get_blend_from_list(args.data_path),
+        split=args.split,
+        path_to_cache=args.data_cache_path,
+        num_dataset_builder_threads=args.num_dataset_builder_threads,
+        mmap_bin_files=args.mmap_bin_files,
+        mmap_pool_capacity=args.mmap_pool_capacity,
+        reset_position_ids=False,
+        reset_attention_mask=False,
+        eod_mask_loss=False,
+        tokenizer=_NullTokenizer(vocab_size=args.vocab_size),
+    )
+
+    with DataProfiler() as profiler:
+        with profiler.phase("build"):
+            datasets = BlendedMegatronDatasetBuilder(
+                GPTDataset, args.num_samples, lambda: True, config
+            ).build()
+
+    if args.throughput_samples > 0:
+        for split, dataset in zip(Split, datasets):
+            if dataset is None or len(dataset) == 0:
+                continue
+            for num_workers in args.num_workers:
+                profiler.measure_throughput(
+                    f"{split.name}/workers_{num_workers}",
+                    dataset,
+                    args.throughput_samples,
+                    num_workers,
+                    args.batch_size,
+                )
+        train = datasets[Split.train.value]
+        if args.per_dataset and isinstance(train, BlendedDataset):
+            for dataset in train.datasets:
+                for num_workers in args.num_workers:
+                    profiler.measure_throughput(
+                        f"train/{dataset.dataset_path}/workers_{num_workers}",
+                        dataset,
+                        args.throughput_samples,
+                        num_workers,
+                        args.batch_size,
+                    )
+
+    if args.output is not None:
+        profiler.save(args.output)
+    else:
+        print(json.dumps(profiler.report(), indent=4))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,156 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import os
+import sys
+import logging
+import argparse
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+)
+
+from megatron.core.datasets.decontamination import (
+    DecontaminationConfig,
+    NgramIndex,
+    count_ngram_documents,
+    decontaminate_indexed_dataset,
+)
+from megatron.core.datasets.indexed_dataset import IndexedDataset
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Cut the n-grams of downstream task data out of a tokenized training "
+        "dataset, the token id counterpart of openwebtext/filter_ngrams.py"
+    )
+
+    group = parser.add_argument_group(title="input data")
+    group.add_argument(
+        "--input",
+        type=str,
+        required=True,
+        help="Path prefix of the training dataset to decontaminate",
+    )
+    group.add_argument(
+        "--task-prefixes",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Path prefixes of the task datasets, tokenized with preprocess_data.py and the "
+        "tokenizer of the training dataset. Every sequence is one task text",
+    )
+    group.add_argument(
+        "--load-index",
+        type=str,
+        default=None,
+        help="Load the n-gram index from this .npz file in place of building it",
+    )
+
+    group = parser.add_argument_group(title="output data")
+    group.add_argument(
+        "--output-prefix",
+        type=str,
+        default=None,
+        help="Path prefix of the decontaminated dataset",
+    )
+    group.add_argument(
+        "--save-index",
+        type=str,
+        default=None,
+        help="Save the pruned n-gram index to this .npz file",
+    )
+
+    group = parser.add_argument_group(title="n-grams")
+    group.add_argument(
+        "--max-ngram-size", type=int, default=13, help="Maximum size of ngram to use"
+    )
+    group.add_argument(
+        "--min-ngram-size", type=int, default=8, help="Minimum size of ngram to use"
+    )
+    group.add_argument(
+        "--key-threshold",
+        type=int,
+        default=10,
+        help="Ignore the n-grams which occur in at least this many training documents",
+    )
+    group.add_argument(
+        "--remove-tokens-each-side",
+        type=int,
+        default=50,
+        help="Number of tokens to remove on either side of every match",
+    )
+    group.add_argument(
+        "--filter-piece-len",
+        type=int,
+        default=50,
+        help="Remove any piece of a cut document below this number of tokens",
+    )
+    group.add_argument(
+        "--splits-count",
+        type=int,
+        default=10,
+        help="Remove any documents cut into more than this many pieces",
+    )
+
+    group = parser.add_argument_group(title="miscellaneous")
+    group.add_argument(
+        "--max-tokens-per-batch",
+        type=int,
+        default=2**22,
+        help="Number of tokens to read and hash at a time, per worker",
+    )
+    group.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes to scan the training dataset with"
+    )
+
+    args = parser.parse_args()
+
+    assert (args.task_prefixes is None) != (
+        args.load_index is None
+    ), "ERROR: provide exactly one of --task-prefixes and --load-index"
+
+    return args
+
+
+def main():
+    args = get_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    config = DecontaminationConfig(
+        min_ngram_size=args.min_ngram_size,
+        max_ngram_size=args.max_ngram_size,
+        remove_tokens_each_side=args.remove_tokens_each_side,
+        min_piece_tokens=args.filter_piece_len,
+        max_pieces=args.splits_count,
+        max_tokens_per_batch=args.max_tokens_per_batch,
+        num_workers=args.workers,
+    )
+
+    if args.load_index is None:
+        sequences = []
+        for task_prefix in args.task_prefixes:
+            task_dataset = IndexedDataset(task_prefix)
+            sequences.extend(task_dataset[i] for i in range(len(task_dataset)))
+        index = NgramIndex.build(sequences, config)
+        print(f" Entities in ngrams {len(index)}", flush=True)
+
+        counts = count_ngram_documents([args.input], index, config)
+        index = index.prune(counts, args.key_threshold)
+        print(f" Ngrams below threshold {len(index)}", flush=True)
+    else:
+        index = NgramIndex.load(args.load_index)
+
+    if args.save_index is not None:
+        index.save(args.save_index)
+
+    if args.output_prefix is not None:
+        decontaminate_indexed_dataset(args.input, args.output_prefix, index, config)
+
+
+if __name__ == '__main__':
+
+    main()
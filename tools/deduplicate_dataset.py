@@ -0,0 +1,112 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import os
+import sys
+import logging
+import argparse
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+)
+
+from megatron.core.datasets.deduplication import (
+    DeduplicationConfig,
+    deduplicate_indexed_datasets,
+)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Find the near-duplicate documents across IndexedDatasets with MinHash-LSH "
+        "and write a document keep mask next to each dataset, for --use-document-keep-masks"
+    )
+
+    group = parser.add_argument_group(title="input data")
+    group.add_argument(
+        "--input",
+        type=str,
+        nargs="+",
+        required=True,
+        help="Path prefixes of the datasets to deduplicate together. Of every cluster of "
+        "duplicates, the first document in the order of the prefixes is kept",
+    )
+
+    group = parser.add_argument_group(title="output data")
+    group.add_argument(
+        "--work-dir",
+        type=str,
+        required=True,
+        help="Directory for the temporary band tables, which take 16 bytes per band per document",
+    )
+
+    group = parser.add_argument_group(title="minhash")
+    group.add_argument(
+        "--ngram-size", type=int, default=5, help="Number of tokens per shingle"
+    )
+    group.add_argument(
+        "--num-bands", type=int, default=16, help="Number of LSH bands"
+    )
+    group.add_argument(
+        "--rows-per-band",
+        type=int,
+        default=8,
+        help="Number of MinHash values per LSH band. Pairs of documents are detected with "
+        "probability 1/2 at a Jaccard similarity of about (1 / num_bands) ** (1 / rows_per_band)",
+    )
+    group.add_argument(
+        "--seed", type=int, default=1234, help="Seed for the MinHash permutations"
+    )
+
+    group = parser.add_argument_group(title="miscellaneous")
+    group.add_argument(
+        "--num-partitions",
+        type=int,
+        default=64,
+        help="Number of band table partitions, each of which is sorted in memory on its own",
+    )
+    group.add_argument(
+        "--max-tokens-per-batch",
+        type=int,
+        default=2**22,
+        help="Number of tokens to read and shingle at a time, per worker",
+    )
+    group.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes to compute the signatures with"
+    )
+
+    args = parser.parse_args()
+
+    for prefix in args.input:
+        assert os.path.isfile(
+            prefix + ".idx"
+        ), f"ERROR: .idx file not provided for {prefix}"
+
+    return args
+
+
+def main():
+    args = get_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    deduplicate_indexed_datasets(
+        args.input,
+        args.work_dir,
+        DeduplicationConfig(
+            ngram_size=args.ngram_size,
+            num_bands=args.num_bands,
+            rows_per_band=args.rows_per_band,
+            num_partitions=args.num_partitions,
+            max_tokens_per_batch=args.max_tokens_per_batch,
+            num_workers=args.workers,
+            seed=args.seed,
+        ),
+    )
+
+
+if __name__ == '__main__':
+
+    main()
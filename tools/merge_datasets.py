@@ -7,12 +7,7 @@ sys.path.append(
     os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
 )
 
-from megatron.core.datasets.indexed_dataset import (
-    IndexedDataset,
-    IndexedDatasetBuilder,
-    get_bin_path,
-    get_idx_path,
-)
+from megatron.core.datasets.indexed_dataset import merge_indexed_datasets
 
 
 def get_args():
@@ -40,6 +35,18 @@ def get_args():
         action="store_true",
         help="Whether the datasets are assumed to be multimodal"
     )
+    group.add_argument(
+        "--virtual",
+        action="store_true",
+        help="Write a virtual .vbin file which references the input .bin files in place of "
+        "copying them into a merged .bin file"
+    )
+    group.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Number of threads to copy the input .bin files with"
+    )
 
     args = parser.parse_args()
 
@@ -67,25 +74,27 @@ def main():
         if not os.path.isfile(os.path.join(args.input, basename)):
             continue
 
-        ext_pair = ".bin" if ext == ".idx" else ".idx"
+        if ext not in [".bin", ".vbin", ".idx"]:
+            continue
+
+        assert os.path.isfile(
+            os.path.join(args.input, prefix) + ".idx"
+        ), f"ERROR: .idx file not provided for {os.path.join(args.input, prefix)}"
         assert os.path.isfile(
-            os.path.join(args.input, prefix) + ext_pair
-        ), f"ERROR: {ext_pair} file not provided for {os.path.join(args.input, prefix)}"
+            os.path.join(args.input, prefix) + ".bin"
+        ) or os.path.isfile(
+            os.path.join(args.input, prefix) + ".vbin"
+        ), f"ERROR: .bin file not provided for {os.path.join(args.input, prefix)}"
 
         prefixes.add(prefix)
 
-    builder = None
-    for prefix in sorted(prefixes):
-        if builder is None:
-            dataset = IndexedDataset(os.path.join(args.input, prefix), multimodal=args.multimodal)
-            builder = IndexedDatasetBuilder(
-                get_bin_path(args.output_prefix), dtype=dataset.index.dtype, multimodal=args.multimodal
-            )
-            del dataset
-
-        builder.add_index(os.path.join(args.input, prefix))
-
-    builder.finalize(get_idx_path(args.output_prefix))
+    merge_indexed_datasets(
+        [os.path.join(args.input, prefix) for prefix in sorted(prefixes)],
+        args.output_prefix,
+        multimodal=args.multimodal,
+        virtual=args.virtual,
+        num_workers=args.workers,
+    )
 
 
 if __name__ == '__main__':
@@ -11,6 +11,8 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
 import time
 import gzip
 import glob
+import itertools
+import threading
 import torch
 import numpy as np
 import multiprocessing
@@ -73,6 +75,8 @@ class Encoder(object):
         else:
             Encoder.splitter = IdentitySplitter()
 
+        Encoder.dtype = indexed_dataset.DType.optimal_dtype(Encoder.tokenizer.vocab_size)
+
     def split(self, json_line):
         data = json.loads(json_line)
         output = {}
@@ -107,6 +111,197 @@ class Encoder(object):
             lens[key] = sentence_lens
         return ids, lens, len(json_line)
 
+    def encode_chunk(self, chunk):
+        """Encode a chunk of documents into one packed buffer per key.
+
+        Returns, per key, the concatenated token ids in the output dtype, the length of each
+        sentence and the number of sentences in each document, together with the number of
+        documents, the number of input bytes and the time spent encoding.
+        """
+        start = time.time()
+        tokens = {key: [] for key in self.args.json_keys}
+        lens = {key: [] for key in self.args.json_keys}
+        doc_lens = {key: [] for key in self.args.json_keys}
+        bytes_processed = sum(len(json_line) for json_line in chunk)
+        docs = [json.loads(json_line) for json_line in chunk]
+        for key in self.args.json_keys:
+            # Tokenize every sentence of the chunk in one call so that the tokenizer can batch
+            doc_sentences = [doc[key] if isinstance(doc[key], list) else [doc[key]] for doc in docs]
+            sentence_ids = iter(Encoder.tokenizer.tokenize_batch(
+                [sentence for sentences in doc_sentences for sentence in sentences]))
+            for sentences in doc_sentences:
+                sentence_lens = []
+                for _ in sentences:
+                    ids = next(sentence_ids)
+                    if len(ids) > 0:
+                        tokens[key].extend(ids)
+                        sentence_lens.append(len(ids))
+                if len(sentence_lens) > 0 and self.args.append_eod:
+                    tokens[key].append(Encoder.tokenizer.eod)
+                    sentence_lens[-1] += 1
+                lens[key].extend(sentence_lens)
+                doc_lens[key].append(len(sentence_lens))
+        packed = {
+            key: (np.array(tokens[key], dtype=Encoder.dtype),
+                  np.array(lens[key], dtype=np.int32),
+                  np.array(doc_lens[key], dtype=np.int32))
+            for key in tokens.keys()
+        }
+        return packed, len(chunk), bytes_processed, time.time() - start
+
+
+class PartitionCheckpoint(object):
+    """Progress of a partition, recorded periodically so an interrupted run resumes from the last
+    checkpoint in place of restarting.
+
+    A checkpoint consists of append-only side files with the sequence lengths and document indices
+    written so far, and a progress file, replaced atomically, with the input offset and the sizes
+    of the .bin and side files at the checkpoint. On resume, the .bin and side files are truncated
+    to those sizes and the input is read from that offset. A finished partition leaves a .done
+    marker and is skipped, until the run removes the markers once it completes.
+
+    The progress file and the .done marker record the identity of the partition, i.e. its input
+    file, with its size and modification time, and the arguments which change the encoding. A
+    checkpoint of another identity is discarded.
+    """
+
+    # Arguments which change the encoding of a partition
+    IDENTITY_ARGS = ['json_keys', 'split_sentences', 'keep_newlines', 'lang', 'tokenizer_type',
+                     'tokenizer_model', 'vocab_file', 'vocab_size', 'merge_file', 'append_eod',
+                     'pack_tokens']
+
+    def __init__(self, output_prefix, key_prefixes, dtype, token_nbytes, interval, identity):
+        self.progress_path = output_prefix + ".progress.json"
+        self.done_path = self.get_done_path(output_prefix)
+        self.identity = identity
+        self.key_prefixes = key_prefixes
+        self.dtype = dtype
+        self.token_nbytes = token_nbytes
+        self.interval = interval
+        self.last_save = time.time()
+        self.saved = {}
+
+    @staticmethod
+    def get_done_path(output_prefix):
+        return output_prefix + ".done"
+
+    @classmethod
+    def get_identity(cls, args, input_file_name):
+        """Return the identity of the partition encoded from input_file_name with args."""
+        stat = os.stat(input_file_name)
+        identity = {
+            'input': os.path.abspath(input_file_name),
+            'input_size': stat.st_size,
+            'input_mtime': stat.st_mtime,
+            'args': {name: getattr(args, name, None) for name in cls.IDENTITY_ARGS},
+        }
+        # As read back from a checkpoint, e.g. with lists in place of tuples
+        return json.loads(json.dumps(identity))
+
+    def _read(self, path):
+        """Return the content of a progress file or .done marker, if it has our identity."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as fin:
+                state = json.load(fin)
+        except ValueError:
+            state = None
+        if state is None or state.get('identity') != self.identity:
+            print("Discarding", path, "of another input or arguments", file=sys.stderr)
+            os.remove(path)
+            return None
+        return state
+
+    def is_done(self):
+        return self._read(self.done_path) is not None
+
+    def load(self):
+        """Return the builders, the input offset and the number of documents processed."""
+        progress = self._read(self.progress_path)
+
+        builders = {}
+        for key, key_prefix in self.key_prefixes.items():
+            bin_path = indexed_dataset.get_bin_path(key_prefix)
+            if progress is None:
+                builders[key] = indexed_dataset.IndexedDatasetBuilder(
+                    bin_path, dtype=self.dtype, token_nbytes=self.token_nbytes)
+                num_sequences, num_documents = 0, 0
+                for suffix in ['.lengths.partial', '.documents.partial']:
+                    open(key_prefix + suffix, 'wb').close()
+            else:
+                num_sequences = progress['keys'][key]['num_sequences']
+                num_documents = progress['keys'][key]['num_documents']
+                lengths = np.fromfile(key_prefix + '.lengths.partial', dtype=np.int32,
+                                      count=num_sequences)
+                document_indices = np.fromfile(key_prefix + '.documents.partial', dtype=np.int64,
+                                               count=num_documents)
+                builders[key] = indexed_dataset.IndexedDatasetBuilder.resume(
+                    bin_path,
+                    progress['keys'][key]['nbytes'],
+                    lengths.tolist(),
+                    [0] + document_indices.tolist(),
+                    dtype=self.dtype,
+                    token_nbytes=self.token_nbytes,
+                )
+                with open(key_prefix + '.lengths.partial', 'r+b') as fout:
+                    fout.truncate(lengths.nbytes)
+                with open(key_prefix + '.documents.partial', 'r+b') as fout:
+                    fout.truncate(document_indices.nbytes)
+            self.saved[key] = (num_sequences, num_documents)
+
+        if progress is None:
+            return builders, 0, 0
+        print("Resuming from", self.progress_path, "at input offset", progress['input_offset'],
+              file=sys.stderr)
+        return builders, progress['input_offset'], progress['num_documents']
+
+    def save(self, builders, input_offset, num_documents):
+        progress = {'identity': self.identity, 'input_offset': input_offset,
+                    'num_documents': num_documents, 'keys': {}}
+        for key, builder in builders.items():
+            key_prefix = self.key_prefixes[key]
+            num_sequences, num_key_documents = self.saved[key]
+            builder.data_file.flush()
+            os.fsync(builder.data_file.fileno())
+            with open(key_prefix + '.lengths.partial', 'ab') as fout:
+                fout.write(np.array(builder.sequence_lengths[num_sequences:],
+                                    dtype=np.int32).tobytes())
+                fout.flush()
+                os.fsync(fout.fileno())
+            with open(key_prefix + '.documents.partial', 'ab') as fout:
+                fout.write(np.array(builder.document_indices[1 + num_key_documents:],
+                                    dtype=np.int64).tobytes())
+                fout.flush()
+                os.fsync(fout.fileno())
+            self.saved[key] = (len(builder.sequence_lengths), len(builder.document_indices) - 1)
+            progress['keys'][key] = {
+                'nbytes': builder.data_file.tell(),
+                'num_sequences': self.saved[key][0],
+                'num_documents': self.saved[key][1],
+            }
+        with open(self.progress_path + '.tmp', 'w') as fout:
+            json.dump(progress, fout)
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.replace(self.progress_path + '.tmp', self.progress_path)
+        self.last_save = time.time()
+
+    def maybe_save(self, builders, input_offset, num_documents):
+        if time.time() - self.last_save >= self.interval:
+            self.save(builders, input_offset, num_documents)
+
+    def finalize(self, builders):
+        for key, builder in builders.items():
+            builder.finalize(indexed_dataset.get_idx_path(self.key_prefixes[key]))
+        with open(self.done_path, 'w') as fout:
+            json.dump({'identity': self.identity}, fout)
+        for key_prefix in self.key_prefixes.values():
+            for suffix in ['.lengths.partial', '.documents.partial']:
+                os.remove(key_prefix + suffix)
+        if os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
+
 
 class Partition(object):
     def __init__(self, args, workers):
@@ -143,47 +338,109 @@ class Partition(object):
         fout.close()
 
 
+    def print_pipeline_stats(self, count, prev_count, proc_start, total_bytes_processed, stats):
+        if count // self.args.log_interval == prev_count // self.args.log_interval:
+            return
+        elapsed = time.time() - proc_start
+        mbs = total_bytes_processed/elapsed/1024/1024
+        print(f"Processed {count} documents",
+              f"({stats['encode_docs']/elapsed} docs/s, {mbs} MB/s).",
+              f"Read: {stats['read_bytes']/max(stats['read_time'], 1e-9)/1024/1024:.1f} MB/s,",
+              f"encode: {stats['encode_docs']/max(stats['encode_time'], 1e-9):.1f} docs/s/worker,",
+              f"write: {stats['write_bytes']/max(stats['write_time'], 1e-9)/1024/1024:.1f} MB/s,",
+              f"writer waited {stats['wait_time']:.1f} s for encoded chunks.",
+              file=sys.stderr)
+
     def process_json_file(self, file_name):
-        input_file_name, output_prefix = file_name
-        print("Opening", input_file_name)
-        fin = open(input_file_name, 'r', encoding='utf-8')
+        """Encode a partition with a pipeline of a chunked reader, a pool of encoder workers which
+        return packed buffers, and a writer which appends them to the .bin files in order.
 
-        startup_start = time.time()
-        encoder = Encoder(self.args)
-        tokenizer = build_tokenizer(self.args)
-        pool = multiprocessing.Pool(self.workers, initializer=encoder.initializer)
-        encoded_docs = pool.imap(encoder.encode, fin, 32)
+        At most --max-inflight-chunks chunks are read but not yet written, which bounds memory
+        when the writer falls behind. Progress is checkpointed every --checkpoint-interval seconds.
+        """
+        input_file_name, output_prefix = file_name
 
         level = "document"
         if self.args.split_sentences:
             level = "sentence"
 
-        output_bin_files = {}
-        output_idx_files = {}
-        builders = {}
-
-        for key in self.args.json_keys:
-            output_bin_files[key] = "{}_{}_{}.bin".format(output_prefix,
-                                                          key, level)
-            output_idx_files[key] = "{}_{}_{}.idx".format(output_prefix,
-                                                          key, level)
-            builders[key] = indexed_dataset.IndexedDatasetBuilder(
-                output_bin_files[key],
-                dtype=indexed_dataset.DType.optimal_dtype(tokenizer.vocab_size),
-            )
-
-        startup_end = time.time()
-        proc_start = time.time()
-        total_bytes_processed = 0
-        print("Time to startup:", startup_end - startup_start)
-        for i, (doc, sentence_lens, bytes_processed) in enumerate(encoded_docs, start=1):
-            total_bytes_processed += bytes_processed
-            for key in doc.keys():
-                builders[key].add_document(doc[key], sentence_lens[key])
-            self.print_processing_stats(i, proc_start, total_bytes_processed)
+        startup_start = time.time()
+        encoder = Encoder(self.args)
+        tokenizer = build_tokenizer(self.args)
+        key_prefixes = {
+            key: "{}_{}_{}".format(output_prefix, key, level) for key in self.args.json_keys
+        }
+        token_nbytes = None
+        if self.args.pack_tokens:
+            token_nbytes = indexed_dataset.DType.optimal_token_nbytes(tokenizer.vocab_size)
+        checkpoint = PartitionCheckpoint(output_prefix, key_prefixes,
+                                         indexed_dataset.DType.optimal_dtype(tokenizer.vocab_size),
+                                         token_nbytes, self.args.checkpoint_interval,
+                                         PartitionCheckpoint.get_identity(self.args,
+                                                                          input_file_name))
+        if checkpoint.is_done():
+            print("Skipping", input_file_name, "which is already processed")
+            return
+        print("Opening", input_file_name)
+        builders, input_offset, count = checkpoint.load()
+
+        fin = open(input_file_name, 'rb')
+        fin.seek(input_offset)
+
+        max_inflight_chunks = self.args.max_inflight_chunks or 4 * self.workers
+        inflight = threading.BoundedSemaphore(max_inflight_chunks)
+        stats = {'read_bytes': 0, 'read_time': 0.0, 'encode_docs': 0, 'encode_time': 0.0,
+                 'write_bytes': 0, 'write_time': 0.0, 'wait_time': 0.0}
+
+        def read_chunks():
+            while True:
+                # Backpressure: wait for the writer to retire a chunk
+                inflight.acquire()
+                read_start = time.time()
+                chunk = list(itertools.islice(fin, self.args.chunk_size))
+                stats['read_time'] += time.time() - read_start
+                stats['read_bytes'] += sum(len(line) for line in chunk)
+                if not chunk:
+                    inflight.release()
+                    return
+                yield chunk
 
-        fin.close()
-        builders[key].finalize(output_idx_files[key])
+        pool = multiprocessing.Pool(self.workers, initializer=encoder.initializer)
+        try:
+            encoded_chunks = pool.imap(encoder.encode_chunk, read_chunks())
+
+            startup_end = time.time()
+            proc_start = time.time()
+            total_bytes_processed = 0
+            print("Time to startup:", startup_end - startup_start)
+            while True:
+                wait_start = time.time()
+                try:
+                    packed, num_docs, bytes_processed, encode_time = next(encoded_chunks)
+                except StopIteration:
+                    break
+                stats['wait_time'] += time.time() - wait_start
+                stats['encode_docs'] += num_docs
+                stats['encode_time'] += encode_time
+
+                write_start = time.time()
+                for key, (tokens, lens, doc_lens) in packed.items():
+                    builders[key].add_packed_documents(tokens, lens, doc_lens)
+                    stats['write_bytes'] += tokens.nbytes
+                stats['write_time'] += time.time() - write_start
+                inflight.release()
+
+                input_offset += bytes_processed
+                total_bytes_processed += bytes_processed
+                count += num_docs
+                checkpoint.maybe_save(builders, input_offset, count)
+                self.print_pipeline_stats(count, count - num_docs, proc_start,
+                                          total_bytes_processed, stats)
+        finally:
+            pool.terminate()
+            fin.close()
+
+        checkpoint.finalize(builders)
 
 
 def get_args():
@@ -215,6 +472,9 @@ def get_args():
                        help='Path to the BPE merge file (if necessary).')
     group.add_argument('--append-eod', action='store_true',
                        help='Append an <eod> token to the end of a document.')
+    group.add_argument('--pack-tokens', action='store_true',
+                       help='Store each token in the fewest bytes which hold the vocabulary, e.g. '
+                            '3 bytes in place of 4 for vocabularies of 65500 to 2^24 tokens.')
     group.add_argument('--lang', type=str, default='english',
                        help='Language to use for NLTK-powered sentence splitting.')
     group = parser.add_argument_group(title='output data')
@@ -233,6 +493,14 @@ def get_args():
     group.add_argument('--keep-sequential-samples', action='store_true',
                        help='Ensure ordering of samples in .jsonl files is '
                             'preserved when using partitions>1.')
+    group.add_argument('--chunk-size', type=int, default=256,
+                       help='Number of documents per chunk sent to a worker process.')
+    group.add_argument('--max-inflight-chunks', type=int, default=None,
+                       help='Maximum number of chunks read but not yet written, per partition. '
+                            'Defaults to 4 times the number of workers per partition.')
+    group.add_argument('--checkpoint-interval', type=float, default=60,
+                       help='Interval in seconds between checkpoints of the progress of each '
+                            'partition. An interrupted run resumes from the last checkpoint.')
     args = parser.parse_args()
     args.keep_empty = False
 
@@ -267,6 +535,17 @@ def check_files_exist(in_ss_out_names, key, num_partitions):
     return True
 
 
+def remove_done_markers(in_ss_out_names, processes):
+    """Remove the .done markers of the partitions once the run completes."""
+    if any(p.exitcode != 0 for p in processes):
+        # Keep them to skip the finished partitions when the run is resumed
+        return
+    for name in in_ss_out_names:
+        done_path = PartitionCheckpoint.get_done_path(name['output_prefix'])
+        if os.path.exists(done_path):
+            os.remove(done_path)
+
+
 def main():
     args = get_args()
 
@@ -375,6 +654,7 @@ def main():
         p.join()
 
     if args.partitions == 1:
+        remove_done_markers(in_ss_out_names, processes)
         return
 
     # merge bin/idx partitions
@@ -382,27 +662,16 @@ def main():
     if args.split_sentences:
         level = "sentence"
 
-    output_bin_files = {}
-    output_idx_files = {}
-    builders = {}
-    tokenizer = build_tokenizer(args)
-
     for key in args.json_keys:
-        output_bin_files[key] = "{}_{}_{}.bin".format(args.output_prefix,
-                                                      key, level)
-        output_idx_files[key] = "{}_{}_{}.idx".format(args.output_prefix,
-                                                      key, level)
-        builders[key] = indexed_dataset.IndexedDatasetBuilder(
-            output_bin_files[key],
-            dtype=indexed_dataset.DType.optimal_dtype(tokenizer.vocab_size),
+        full_partition_output_prefixes = [
+            "{}_{}_{}".format(name['output_prefix'], key, level) for name in in_ss_out_names
+        ]
+        indexed_dataset.merge_indexed_datasets(
+            full_partition_output_prefixes,
+            "{}_{}_{}".format(args.output_prefix, key, level),
+            num_workers=args.workers,
         )
-
-        for name in in_ss_out_names:
-            parition_output_prefix = name['output_prefix']
-            full_partition_output_prefix = "{}_{}_{}".format(parition_output_prefix,
-                                                             key, level)
-            builders[key].add_index(full_partition_output_prefix)
-        builders[key].finalize(output_idx_files[key])
+    remove_done_markers(in_ss_out_names, processes)
 
 
 if __name__ == '__main__':